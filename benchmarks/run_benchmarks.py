@@ -0,0 +1,423 @@
+"""
+Benchmark suite for the optimization and pricing hot paths.
+For each case, the wall time and peak (Python) memory of building the MILP, solving it and extracting its outputs are
+measured on a synthetic REC, and stored in a JSON file so that different versions of the package can be compared.
+
+Usage:
+	python -m benchmarks.run_benchmarks --meters 10 --steps 24 --label baseline
+	python -m benchmarks.run_benchmarks --compare benchmarks/results/baseline_X.json benchmarks/results/new_Y.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timezone
+from loguru import logger
+from pulp import (
+	LpStatus,
+	value
+)
+
+from benchmarks.synthetic_rec import (
+	TARIFF_SHAPES,
+	generate_rec,
+	individual_backpacks
+)
+from rec_op_lem_prices.configs.configs import (
+	DT_FORMAT,
+	SOLVER
+)
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPBilateral import MatrixStageTwoMILPBilateral
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
+from rec_op_lem_prices.optimization.module.StageOneMILP import StageOneMILP
+from rec_op_lem_prices.optimization.module.StageTwoMILPBilateral import StageTwoMILPBilateral
+from rec_op_lem_prices.optimization.module.StageTwoMILPPool import StageTwoMILPPool
+from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import make_offer_book
+from rec_op_lem_prices.pricing_mechanisms.module.BatchPricingMechanisms import (
+	batch_compute_crossing_value,
+	batch_compute_mmr,
+	batch_compute_sdr,
+	split_offer_book
+)
+from rec_op_lem_prices.pricing_mechanisms_functions import (
+	loop_pre_bilateral_mmr,
+	loop_pre_pool_mmr
+)
+
+try:
+	import resource
+except ImportError:  # not available on Windows
+	resource = None
+
+
+CASES = ('stage_one', 'stage_two_pool', 'stage_two_bilateral', 'matrix_stage_two_pool', 'matrix_stage_two_bilateral',
+         'pricing', 'loop_pool', 'loop_bilateral')
+DEFAULT_CASES = ('stage_one', 'stage_two_pool', 'stage_two_bilateral', 'matrix_stage_two_pool',
+                 'matrix_stage_two_bilateral', 'pricing')  # the loops take much longer
+BENCH_TIMEOUT = 60  # seconds; the synthetic collective MILPs can take long to be proven optimal by CBC
+BENCH_MIPGAP = 0.01
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+REGRESSION_THRESHOLD = 1.10  # new / old ratio above which a phase is reported as a regression
+
+
+class _Phase:
+	"""
+	Context manager measuring the wall time and the peak Python memory allocated within a benchmark phase.
+	"""
+	def __init__(self, track_memory: bool):
+		self.track_memory = track_memory
+		self.time = None
+		self.peak_mb = None
+
+	def __enter__(self):
+		if self.track_memory:
+			tracemalloc.start()
+		self._start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.time = time.perf_counter() - self._start
+		if self.track_memory:
+			self.peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+			tracemalloc.stop()
+
+	def to_dict(self) -> dict:
+		return {'time': self.time, 'peak_mb': self.peak_mb}
+
+
+def _solver_peak_mb() -> float | None:
+	"""
+	Largest resident set size of all the (solver) child processes spawned so far
+	:return: peak memory in MB, or None if not available in the platform
+	"""
+	if resource is None:
+		return None
+	maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+	# ru_maxrss is given in bytes on macOS and in kilobytes elsewhere
+	return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 2 ** 10
+
+
+def _benchmark_milp(milp, track_memory: bool) -> dict:
+	"""
+	Times the three phases of a MILP instance: definition, solution and outputs' extraction
+	:param milp: a StageOneMILP, StageTwoMILPPool or StageTwoMILPBilateral instance
+	:param track_memory: if True, trace the peak Python memory of each phase
+	:return: dictionary with the metrics of each phase, the model's size and the solution status
+	"""
+	with _Phase(track_memory) as build:
+		getattr(milp, f'_{type(milp).__name__}__define_milp')()
+
+	with _Phase(track_memory) as solve:
+		milp.milp.solve()
+	milp.status = LpStatus[milp.milp.status]
+	milp.obj_value = value(milp.milp.objective)
+
+	with _Phase(track_memory) as extract:
+		outputs = milp.generate_outputs()
+
+	return {
+		'build': build.to_dict(),
+		'solve': solve.to_dict(),
+		'extract': extract.to_dict(),
+		'solver_peak_mb': _solver_peak_mb(),
+		'nr_variables': milp.milp.numVariables(),
+		'nr_constraints': milp.milp.numConstraints(),
+		'status': milp.status,
+		'outputs': outputs
+	}
+
+
+def _benchmark_matrix_milp(milp, track_memory: bool) -> dict:
+	"""
+	Same as "_benchmark_milp", for the array-based MILPs (solved in-process, so the solver's memory is Python's)
+	:param milp: a MatrixStageTwoMILPPool or MatrixStageTwoMILPBilateral instance
+	:param track_memory: if True, trace the peak Python memory of each phase
+	:return: dictionary with the metrics of each phase, the model's size and the solution status
+	"""
+	with _Phase(track_memory) as build:
+		getattr(milp, f'_{type(milp).__name__}__define_milp')()
+		arrays = milp.milp.to_arrays()
+
+	with _Phase(track_memory) as solve:
+		milp.milp.solve(milp.timeout, milp.mipgap)
+	milp.status = milp.milp.status
+	milp.obj_value = milp.milp.obj_value
+
+	with _Phase(track_memory) as extract:
+		outputs = milp.generate_outputs()
+
+	return {
+		'build': build.to_dict(),
+		'solve': solve.to_dict(),
+		'extract': extract.to_dict(),
+		'solver_peak_mb': None,
+		'nr_variables': arrays['A'].shape[1],
+		'nr_constraints': arrays['A'].shape[0],
+		'status': milp.status,
+		'outputs': outputs
+	}
+
+
+def _solve_stage_one(rec: dict, solver_params: dict) -> list[dict]:
+	"""
+	Solves the individual (stage 1) MILPs of all Meters of a REC, whose costs are required by the second stage
+	"""
+	stage_one_outputs = []
+	for backpack in individual_backpacks(rec):
+		stage_one = StageOneMILP(backpack, **solver_params)
+		stage_one.solve_milp()
+		stage_one_outputs.append(stage_one.generate_outputs())
+	return stage_one_outputs
+
+
+def _stage_two_backpack(rec: dict, stage_one_outputs: list[dict]) -> dict:
+	"""
+	Adds the inputs specific to the second stage (individual costs and LEM prices) to a REC backpack
+	"""
+	backpack = {**rec, 'l_lem': rec['l_market_sell'], 'second_stage': True}
+	backpack['meters'] = {
+		meter_id: {**meter_data, 'c_ind': outputs['c_ind']}
+		for (meter_id, meter_data), outputs in zip(rec['meters'].items(), stage_one_outputs)
+	}
+	return backpack
+
+
+def bench_stage_one(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	rec = generate_rec(market='pool', **params)
+	runs = [_benchmark_milp(StageOneMILP(backpack, **solver_params), track_memory)
+	        for backpack in individual_backpacks(rec)]
+	result = {
+		phase: {
+			'time': sum(run[phase]['time'] for run in runs),
+			'peak_mb': max(run[phase]['peak_mb'] for run in runs) if track_memory else None
+		} for phase in ('build', 'solve', 'extract')
+	}
+	result['solver_peak_mb'] = _solver_peak_mb()
+	result['nr_variables'] = sum(run['nr_variables'] for run in runs)
+	result['nr_constraints'] = sum(run['nr_constraints'] for run in runs)
+	result['status'] = sorted(set(run['status'] for run in runs))
+	return result
+
+
+def _bench_stage_two(params: dict, solver_params: dict, market: str, milp_class, track_memory: bool) -> dict:
+	rec = generate_rec(market=market, **params)
+	stage_one_outputs = _solve_stage_one(rec, solver_params)
+	milp = milp_class(_stage_two_backpack(rec, stage_one_outputs), **solver_params)
+	result = _benchmark_milp(milp, track_memory)
+	del result['outputs']
+	return result
+
+
+def _bench_matrix_stage_two(params: dict, solver_params: dict, market: str, milp_class, track_memory: bool) -> dict:
+	rec = generate_rec(market=market, **params)
+	stage_one_outputs = _solve_stage_one(rec, solver_params)
+	milp = milp_class(_stage_two_backpack(rec, stage_one_outputs), timeout=solver_params['timeout'],
+	                  mipgap=solver_params['mipgap'])
+	result = _benchmark_matrix_milp(milp, track_memory)
+	del result['outputs']
+	return result
+
+
+def bench_stage_two_pool(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_stage_two(params, solver_params, 'pool', StageTwoMILPPool, track_memory)
+
+
+def bench_stage_two_bilateral(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_stage_two(params, solver_params, 'bilateral', StageTwoMILPBilateral, track_memory)
+
+
+def bench_matrix_stage_two_pool(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_matrix_stage_two(params, solver_params, 'pool', MatrixStageTwoMILPPool, track_memory)
+
+
+def bench_matrix_stage_two_bilateral(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_matrix_stage_two(params, solver_params, 'bilateral', MatrixStageTwoMILPBilateral, track_memory)
+
+
+def bench_pricing(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	rec = generate_rec(market='pool', **params)
+	nr_sessions = len(rec['l_market_buy'])
+	meters = {
+		meter_id: {
+			'e_met': [c - g for c, g in zip(meter_data['e_c'], meter_data['e_g'])],
+			'l_buy': meter_data['l_buy'],
+			'l_sell': meter_data['l_sell']
+		} for meter_id, meter_data in rec['meters'].items()
+	}
+
+	with _Phase(track_memory) as build:
+		book = make_offer_book(meters, nr_sessions, rec['l_market_buy'], rec['l_market_sell'])
+		buys, sells = split_offer_book(book)
+
+	result = {'build': build.to_dict(), 'nr_offers': int(len(book['amount']))}
+	for name, pricing_func in (('mmr', batch_compute_mmr),
+	                           ('sdr', batch_compute_sdr),
+	                           ('crossing_value', batch_compute_crossing_value)):
+		with _Phase(track_memory) as solve:
+			prices = pricing_func(buys, sells, nr_sessions)
+		with _Phase(track_memory) as extract:
+			prices.tolist()
+		result[f'solve_{name}'] = solve.to_dict()
+		result[f'extract_{name}'] = extract.to_dict()
+
+	return result
+
+
+def _bench_loop(params: dict, solver_params: dict, market: str, loop_func, track_memory: bool) -> dict:
+	rec = generate_rec(market=market, **params)
+	with _Phase(track_memory) as total:
+		_, criterion, iterations, _ = loop_func(rec, solver=solver_params['solver'])
+	return {
+		'total': total.to_dict(),
+		'solver_peak_mb': _solver_peak_mb(),
+		'iterations': iterations,
+		'converged': criterion is not None
+	}
+
+
+def bench_loop_pool(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_loop(params, solver_params, 'pool', loop_pre_pool_mmr, track_memory)
+
+
+def bench_loop_bilateral(params: dict, solver_params: dict, track_memory: bool) -> dict:
+	return _bench_loop(params, solver_params, 'bilateral', loop_pre_bilateral_mmr, track_memory)
+
+
+BENCHMARKS = {
+	'stage_one': bench_stage_one,
+	'stage_two_pool': bench_stage_two_pool,
+	'stage_two_bilateral': bench_stage_two_bilateral,
+	'matrix_stage_two_pool': bench_matrix_stage_two_pool,
+	'matrix_stage_two_bilateral': bench_matrix_stage_two_bilateral,
+	'pricing': bench_pricing,
+	'loop_pool': bench_loop_pool,
+	'loop_bilateral': bench_loop_bilateral
+}
+
+
+def _git_commit() -> str | None:
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+		                      cwd=os.path.dirname(__file__), check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def run_benchmarks(params: dict, cases=DEFAULT_CASES, solver=SOLVER, timeout=BENCH_TIMEOUT, mipgap=BENCH_MIPGAP,
+                   track_memory=True) -> dict:
+	"""
+	Runs the selected benchmark cases on a synthetic REC
+	:param params: keyword arguments passed on to "generate_rec" (except "market")
+	:param cases: names of the cases to run, within CASES
+	:param solver: solver used in all MILPs
+	:param timeout: time limit of each MILP solve [s] (not applicable to the loops, which use the package's defaults)
+	:param mipgap: relative MIP gap of each MILP solve (not applicable to the loops)
+	:param track_memory: if True, trace the peak Python memory of each phase (slows down the phases being measured)
+	:return: dictionary with the run's metadata and the metrics of each case
+	"""
+	solver_params = {'solver': solver, 'timeout': timeout, 'mipgap': mipgap}
+	results = {
+		'metadata': {
+			'timestamp': datetime.now(timezone.utc).strftime(DT_FORMAT),
+			'git_commit': _git_commit(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'params': params,
+			'solver_params': solver_params,
+			'track_memory': track_memory
+		},
+		'cases': {}
+	}
+	for case in cases:
+		logger.info(f'Benchmarking "{case}"...')
+		results['cases'][case] = BENCHMARKS[case](params, solver_params, track_memory)
+		logger.info(f'Benchmarking "{case}"... DONE!')
+
+	return results
+
+
+def _flatten_times(case_results: dict) -> dict[str, float]:
+	return {phase: metrics['time'] for phase, metrics in case_results.items()
+	        if isinstance(metrics, dict) and 'time' in metrics}
+
+
+def compare_results(old: dict, new: dict, threshold=REGRESSION_THRESHOLD) -> list[str]:
+	"""
+	Compares the phase times of two benchmark runs
+	:param old: results of the reference run, as returned by "run_benchmarks"
+	:param new: results of the run being assessed
+	:param threshold: new / old time ratio above which a phase is flagged as a regression
+	:return: lines of the comparison report
+	"""
+	if old['metadata']['params'] != new['metadata']['params'] \
+			or old['metadata'].get('solver_params') != new['metadata'].get('solver_params'):
+		logger.warning('The runs being compared were generated with different parameters.')
+
+	lines = [f'{"case":<22}{"phase":<24}{"old [s]":>10}{"new [s]":>10}{"ratio":>8}']
+	for case, new_case in new['cases'].items():
+		old_times = _flatten_times(old['cases'].get(case, {}))
+		for phase, new_time in _flatten_times(new_case).items():
+			old_time = old_times.get(phase)
+			if old_time is None:
+				continue
+			ratio = new_time / old_time if old_time > 0 else float('inf')
+			flag = '  <-- regression' if ratio > threshold else ''
+			lines.append(f'{case:<22}{phase:<24}{old_time:>10.4f}{new_time:>10.4f}{ratio:>8.2f}{flag}')
+
+	return lines
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--meters', type=int, default=10, help='number of Meters in the REC')
+	parser.add_argument('--steps', type=int, default=24, help='number of time steps in the horizon')
+	parser.add_argument('--delta-t', type=float, default=1.0, help='time step duration [h]')
+	parser.add_argument('--pv-share', type=float, default=0.6, help='share of the Meters with PV')
+	parser.add_argument('--battery-share', type=float, default=0.3, help='share of the Meters with a battery')
+	parser.add_argument('--ev-share', type=float, default=0.2, help='share of the Meters with an EV (bilateral)')
+	parser.add_argument('--tariff', choices=TARIFF_SHAPES, default='tou', help='shape of the market tariffs')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic REC generator')
+	parser.add_argument('--cases', nargs='+', choices=CASES, default=list(DEFAULT_CASES),
+	                    help='cases to run (the "loop_*" ones are not run by default)')
+	parser.add_argument('--solver', default=SOLVER, help='solver used in the MILPs')
+	parser.add_argument('--timeout', type=float, default=BENCH_TIMEOUT, help='time limit of each MILP solve [s]')
+	parser.add_argument('--mipgap', type=float, default=BENCH_MIPGAP, help='relative MIP gap of each MILP solve')
+	parser.add_argument('--label', default='run', help='label prefixed to the results file name')
+	parser.add_argument('--output-dir', default=RESULTS_DIR, help='directory where the results are stored')
+	parser.add_argument('--no-memory', action='store_true', help='do not trace the peak Python memory')
+	parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two stored results files')
+	args = parser.parse_args(argv)
+
+	if args.compare:
+		with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+			print('\n'.join(compare_results(json.load(old_file), json.load(new_file))))
+		return
+
+	params = {
+		'nr_meters': args.meters,
+		'horizon': args.steps * args.delta_t,
+		'delta_t': args.delta_t,
+		'pv_share': args.pv_share,
+		'battery_share': args.battery_share,
+		'ev_share': args.ev_share,
+		'tariff': args.tariff,
+		'seed': args.seed
+	}
+	results = run_benchmarks(params, args.cases, args.solver, args.timeout, args.mipgap,
+	                         track_memory=not args.no_memory)
+
+	os.makedirs(args.output_dir, exist_ok=True)
+	timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+	path = os.path.join(args.output_dir, f'{args.label}_{timestamp}.json')
+	with open(path, 'w') as results_file:
+		json.dump(results, results_file, indent=2)
+	logger.info(f'Results stored in {path}')
+
+
+if __name__ == '__main__':
+	main()
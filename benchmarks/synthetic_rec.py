@@ -0,0 +1,168 @@
+"""
+Synthetic renewable energy community (REC) generator, used to benchmark the optimization and pricing functions
+on instances of arbitrary size.
+"""
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+
+
+TARIFF_SHAPES = ('flat', 'tou', 'dynamic')
+
+
+def _daily_hours(nr_steps: int, delta_t: float) -> np.ndarray:
+	"""
+	Hour of the day of each time step
+	:param nr_steps: number of time steps
+	:param delta_t: time step duration [h]
+	:return: array with the hour of the day (float, between 0 and 24) of each step
+	"""
+	return (np.arange(nr_steps) * delta_t) % 24
+
+
+def _tariffs(hours: np.ndarray, shape: str, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Market-indexed buying and selling tariffs
+	:param hours: hour of the day of each time step
+	:param shape: one of "flat", "tou" (time-of-use, with daytime peak and off-peak prices) or "dynamic" (spot-like
+		prices with a daily profile and noise)
+	:param rng: random generator
+	:return: arrays with the market-indexed buying and selling tariffs [€/kWh]
+	"""
+	if shape == 'flat':
+		spot = np.full(len(hours), 0.08)
+	elif shape == 'tou':
+		spot = np.where((hours >= 8) & (hours < 22), 0.11, 0.05)
+	elif shape == 'dynamic':
+		spot = 0.08 + 0.03 * np.sin((hours - 7) / 24 * 2 * np.pi) + rng.normal(0, 0.01, len(hours))
+		spot = np.maximum(spot, 0.0)
+	else:
+		raise ValueError(f'Please provide a tariff shape within the options {TARIFF_SHAPES}.')
+
+	return spot + 0.06, spot * 0.9
+
+
+def generate_rec(nr_meters=10,
+                 horizon=24.0,
+                 delta_t=1.0,
+                 pv_share=0.6,
+                 battery_share=0.3,
+                 ev_share=0.0,
+                 tariff='tou',
+                 market='pool',
+                 seed=0) -> dict:
+	"""
+	Generates the inputs of a synthetic REC, with the same structure as the inputs of the "loop_pre_*" functions
+	(i.e., without the LEM prices or the individual costs).
+	:param nr_meters: number of Meters
+	:param horizon: operation horizon [h]
+	:param delta_t: time step duration [h]
+	:param pv_share: share of the Meters with PV generation, between 0 and 1
+	:param battery_share: share of the Meters with a behind-the-meter battery, between 0 and 1
+	:param ev_share: share of the Meters with a behind-the-meter EV, between 0 and 1 (only used for "bilateral")
+	:param tariff: shape of the market-indexed tariffs, one of "flat", "tou" or "dynamic"
+	:param market: one of "pool" or "bilateral", defining the structure of "l_grid"
+	:param seed: seed of the random generator, so that the same instance can be generated again
+	:return: backpack with the REC data
+	"""
+	rng = np.random.default_rng(seed)
+	nr_steps = time_intervals(horizon, delta_t)
+	hours = _daily_hours(nr_steps, delta_t)
+	l_market_buy, l_market_sell = _tariffs(hours, tariff, rng)
+
+	# Residential-like load profile, with morning and evening peaks [kWh per step]
+	load_shape = 0.3 + 0.5 * np.exp(-((hours - 8) / 2) ** 2) + 0.9 * np.exp(-((hours - 20) / 3) ** 2)
+	# PV profile, from 6h to 18h [kWh per step, per kWp]
+	pv_shape = np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None)
+
+	meter_ids = [f'Meter#{n + 1}' for n in range(nr_meters)]
+	meters = {}
+	for meter_id in meter_ids:
+		e_c = load_shape * rng.uniform(0.5, 2.0) * (1 + rng.normal(0, 0.1, nr_steps)).clip(0) * delta_t
+		e_g = pv_shape * rng.uniform(1.0, 6.0) * delta_t if rng.random() < pv_share else np.zeros(nr_steps)
+		l_buy = np.minimum(l_market_buy + rng.uniform(-0.02, 0.03), l_market_buy.max())
+		l_sell = np.full(nr_steps, rng.uniform(0.03, 0.06))
+
+		btm_storage = None
+		if rng.random() < battery_share:
+			e_bn = float(rng.choice([5.0, 10.0, 13.5]))
+			btm_storage = {
+				'Storage#1': {
+					'degradation_cost': 0.01,
+					'e_bn': e_bn,
+					'eff_bc': 0.95,
+					'eff_bd': 0.95,
+					'init_e': e_bn / 2,
+					'p_max': e_bn / 2,
+					'soc_max': 100.0,
+					'soc_min': 10.0
+				}
+			}
+
+		meters[meter_id] = {
+			'btm_storage': btm_storage,
+			'e_c': np.round(e_c, 3).tolist(),
+			'e_g': np.round(e_g, 3).tolist(),
+			'l_buy': np.round(l_buy, 4).tolist(),
+			'l_sell': np.round(l_sell, 4).tolist(),
+			'max_p': float(rng.choice([6.9, 10.35, 20.7]))
+		}
+
+		if market == 'bilateral' and rng.random() < ev_share:
+			capacity = float(rng.choice([40.0, 60.0]))
+			plugged = ((hours >= 19) | (hours < 7)).astype(int)
+			trip = np.where(np.diff(plugged, prepend=plugged[0]) == 1, capacity * 0.15, 0.0)
+			meters[meter_id]['btm_evs'] = {
+				'EV#1': {
+					'battery_capacity_ev': capacity,
+					'bin_ev': plugged.tolist(),
+					'eff_bc_ev': 0.9,
+					'eff_bd_ev': 0.9,
+					'init_e_ev': capacity / 2,
+					'min_energy_storage_ev': capacity * 0.2,
+					'pmax_c_ev': 7.4,
+					'pmax_d_ev': 7.4,
+					'trip_ev': trip.tolist()
+				}
+			}
+
+	if market == 'pool':
+		l_grid = [0.01] * nr_steps
+	elif market == 'bilateral':
+		l_grid = {n: {m: [0.01] * nr_steps for m in meter_ids if m != n} for n in meter_ids}
+	else:
+		raise ValueError('Please provide a market structure within the options "pool" and "bilateral".')
+
+	return {
+		'delta_t': delta_t,
+		'horizon': horizon,
+		'l_extra': 10,
+		'l_grid': l_grid,
+		'l_market_buy': np.round(l_market_buy, 4).tolist(),
+		'l_market_sell': np.round(l_market_sell, 4).tolist(),
+		'meters': meters,
+		'strict_pos_coeffs': True,
+		'total_share_coeffs': False
+	}
+
+
+def individual_backpacks(backpack: dict) -> list[dict]:
+	"""
+	Splits a REC backpack into the inputs of the individual (stage 1) MILPs of its Meters
+	:param backpack: REC data, as generated by "generate_rec"
+	:return: list with one individual backpack per Meter
+	"""
+	return [{
+		'btm_storage': meter_data['btm_storage'],
+		'delta_t': backpack['delta_t'],
+		'e_c': meter_data['e_c'],
+		'e_g': meter_data['e_g'],
+		'horizon': backpack['horizon'],
+		'id': meter_id,
+		'l_buy': meter_data['l_buy'],
+		'l_extra': backpack['l_extra'],
+		'l_market_buy': backpack['l_market_buy'],
+		'l_market_sell': backpack['l_market_sell'],
+		'l_sell': meter_data['l_sell'],
+		'max_p': meter_data['max_p']
+	} for meter_id, meter_data in backpack['meters'].items()]
@@ -1,3 +1,5 @@
+import os
+
 # Datetime global format
 DT_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
@@ -5,3 +7,45 @@ DT_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 MIPGAP = 0.001
 SOLVER = 'CBC'
 TIMEOUT = 300  # seconds
+
+# Debug dump of the MILPs' formulations, written before each solve (disabled when no directory is set)
+EXPORT_DIR = os.environ.get('REC_OP_LEM_PRICES_EXPORT_DIR')
+EXPORT_FORMAT = 'lp'  # one of "lp" or "mps"
+
+# Worker processes used to run the individual (stage 1) procedures in parallel
+N_JOBS = int(os.environ.get('REC_OP_LEM_PRICES_N_JOBS', os.cpu_count() or 1))
+# Time series larger than this (e.g., a year of 15 minutes data, ~280 kB) are memory-mapped into the workers instead of
+# being pickled; shorter ones (e.g., a day-ahead horizon, under 1 kB) are cheaper to pickle than to dump to a file
+MAX_NBYTES = os.environ.get('REC_OP_LEM_PRICES_MAX_NBYTES', '1K')
+
+# Seed the collective MILPs with a starting solution (MIP start), e.g., the previous iteration's one in pricing loops
+WARM_START = False
+
+# Relax the binaries that a pre-analysis of the data proves unnecessary (see "presolve_helpers"), which turns many
+# instances into pure LPs; the optimal cost is unchanged, but ties between equivalent solutions may be broken otherwise
+RELAX_BINARIES = os.environ.get('REC_OP_LEM_PRICES_RELAX_BINARIES', '0') == '1'
+
+# Derive the big-M values of the MILPs, and bounds of their retail and LEM flows, per Meter and step from the Meters'
+# data (see "big_m_values"), instead of using a very big number, which tightens their LP relaxations
+TIGHT_BIG_M = os.environ.get('REC_OP_LEM_PRICES_TIGHT_BIG_M', '0') == '1'
+
+# Skip the LEM variables and constraints of the collective MILPs on the steps where no Meter can have a surplus and
+# no internal trade can pay off (see "lem_steps_needed"), e.g., at night without PV; their LEM flows are then null
+PRUNE_STEPS = os.environ.get('REC_OP_LEM_PRICES_PRUNE_STEPS', '0') == '1'
+
+# Solver option that builds the MILPs as sparse arrays and solves them in-process with HiGHS (see "Matrix*" classes),
+# avoiding the temporary files and subprocess of the puLP command line solvers
+IN_PROCESS_SOLVER = 'HiGHS_API'
+
+# Solver option that decomposes the collective (pool) MILP into per Meter subproblems, solved in parallel with the
+# in-process solver and coordinated by ADMM price updates on the market equilibrium (see "AdmmStageTwoMILPPool")
+DECOMPOSED_SOLVER = 'HiGHS_ADMM'
+ADMM_RHO = float(os.environ.get('REC_OP_LEM_PRICES_ADMM_RHO', 1.0))  # initial penalty parameter [€/kWh^2]
+ADMM_MAX_ITER = int(os.environ.get('REC_OP_LEM_PRICES_ADMM_MAX_ITER', 100))  # maximum number of iterations
+ADMM_TOLERANCE = float(os.environ.get('REC_OP_LEM_PRICES_ADMM_TOLERANCE', 1e-3))  # of the residuals, per step [kWh]
+ADMM_NR_BREAKPOINTS = 12  # tangents of the quadratic penalty, per sign of the deviation (see "add_exchange_terms")
+
+# Default windows of the rolling horizon mode: hours of each window that are kept (committed) and extra hours that are
+# only optimized to anticipate the following ones (look-ahead)
+COMMIT_HORIZON = 24
+LOOKAHEAD_HORIZON = 12
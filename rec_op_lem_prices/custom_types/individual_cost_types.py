@@ -1,9 +1,14 @@
-from typing import TypedDict
+import numpy as np
+
+from typing import (
+	TypedDict,
+	Union
+)
 
 
 # -- INPUTS ------------------------------------------------------------------------------------------------------------
 class BackpackIndCostDict(TypedDict):
-	delta_t: float
+	delta_t: Union[float, list[float]]  # single or per step
 	e_met: list[float]
 	id: str
 	l_buy: list[float]
@@ -14,6 +19,18 @@ class BackpackIndCostDict(TypedDict):
 	max_p: float
 
 
+class BackpackBatchIndCostDict(TypedDict):
+	delta_t: Union[float, list[float]]  # single or per step
+	e_met: np.ndarray  # N Meters x T steps
+	ids: list[str]  # N Meters
+	l_buy: np.ndarray  # N Meters x T steps
+	l_extra: float
+	l_market_buy: np.ndarray  # T steps
+	l_market_sell: np.ndarray  # T steps
+	l_sell: np.ndarray  # N Meters x T steps
+	max_p: np.ndarray  # N Meters
+
+
 # -- OUTPUTS -----------------------------------------------------------------------------------------------------------
 class OutputsIndCostDict(TypedDict):
 	c_ind: float
@@ -23,3 +40,13 @@ class OutputsIndCostDict(TypedDict):
 	e_sur_market: list[float]
 	e_sur_retail: list[float]
 	p_extra: list[float]
+
+
+class OutputsBatchIndCostDict(TypedDict):
+	c_ind: np.ndarray  # N Meters
+	meter_ids: list[str]  # N Meters
+	e_sup_market: np.ndarray  # N Meters x T steps
+	e_sup_retail: np.ndarray  # N Meters x T steps
+	e_sur_market: np.ndarray  # N Meters x T steps
+	e_sur_retail: np.ndarray  # N Meters x T steps
+	p_extra: np.ndarray  # N Meters x T steps
@@ -1,3 +1,5 @@
+import numpy as np
+
 from typing import (
 	TypeAlias,
 	TypedDict
@@ -12,3 +14,20 @@ class OfferDict(TypedDict):
 
 OffersList: TypeAlias = list[OfferDict]
 PricesList: TypeAlias = list[float]
+
+
+class OffersArrays(TypedDict):
+	amount: np.ndarray  # energy comprised by each offer, in kWh
+	value: np.ndarray  # price of each offer, in €/kWh
+	origin: np.ndarray  # index of the member / Meter that made each offer
+	session: np.ndarray  # index of the market session to which each offer belongs
+
+
+class OfferBookDict(TypedDict):
+	amount: np.ndarray  # energy comprised by each offer (absolute value), in kWh
+	value: np.ndarray  # price of each offer, in €/kWh
+	side: np.ndarray  # side of each offer: 1 for buying offers, -1 for selling offers
+	origin: np.ndarray  # index of the member / Meter that made each offer (position in "origins")
+	session: np.ndarray  # index of the market session to which each offer belongs
+	offsets: np.ndarray  # offers of session t are in positions offsets[t] to offsets[t + 1] - 1
+	origins: list[str]  # ids of the members / Meters
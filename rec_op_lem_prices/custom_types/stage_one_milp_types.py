@@ -1,14 +1,15 @@
 from rec_op_lem_prices.custom_types.btm_storage_types import BtmStorage
 from typing import (
 	TypeAlias,
-	TypedDict
+	TypedDict,
+	Union
 )
 
 
 # -- INPUTS ------------------------------------------------------------------------------------------------------------
 class BackpackS1Dict(TypedDict):
 	btm_storage: BtmStorage
-	delta_t: float
+	delta_t: Union[float, list[float]]  # single or per step
 	e_c: list[float]
 	e_g: list[float]
 	horizon: int
@@ -1,3 +1,5 @@
+import numpy as np
+
 from rec_op_lem_prices.custom_types.individual_cost_types import OutputsIndCostDict
 from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
 from rec_op_lem_prices.custom_types.meters_types import (
@@ -6,8 +8,11 @@ from rec_op_lem_prices.custom_types.meters_types import (
 	Meters
 )
 from typing import (
+	Literal,
+	NotRequired,
 	TypeAlias,
-	TypedDict
+	TypedDict,
+	Union
 )
 
 
@@ -18,14 +23,33 @@ LGridBilateral: TypeAlias = dict[
 	]
 ]
 
+Tariff: TypeAlias = Union[float, list[float]]
+
+
+class LGridBilateralCompact(TypedDict, total=False):
+	default: Tariff
+	level_tariffs: dict[str, dict[str, Tariff]]
+	overrides: dict[str, dict[str, Tariff]]
+	voltage_levels: dict[str, str]
+
+
+LGridBilateralSpec: TypeAlias = Union[LGridBilateral, LGridBilateralCompact, np.ndarray]
+
+Partners: TypeAlias = dict[
+	str, list[str]
+]
+
+PartnersSpec: TypeAlias = Union[Partners, Literal['l_grid'], None]
+
 
 class BaseBackpackS2BilateralDict(TypedDict):
-	delta_t: float
+	delta_t: Union[float, list[float]]  # single or per step
 	horizon: int
 	l_extra: float
-	l_grid: LGridBilateral
+	l_grid: LGridBilateralSpec
 	l_market_buy: list[float]
 	l_market_sell: list[float]
+	partners: NotRequired[PartnersSpec]
 	strict_pos_coeffs: bool
 	total_share_coeffs: bool
 
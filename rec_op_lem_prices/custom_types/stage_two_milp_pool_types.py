@@ -7,13 +7,14 @@ from rec_op_lem_prices.custom_types.meters_types import (
 )
 from typing import (
 	TypeAlias,
-	TypedDict
+	TypedDict,
+	Union
 )
 
 
 # -- INPUTS ------------------------------------------------------------------------------------------------------------
 class BaseBackpackS2PoolDict(TypedDict):
-	delta_t: float
+	delta_t: Union[float, list[float]]  # single or per step
 	horizon: int
 	l_extra: float
 	l_grid: list[float]
@@ -119,3 +120,23 @@ CollectivePreOutputsS2PoolDict = tuple[
 	OutputsS2PoolDict,
 	list[OutputsS1Dict]
 ]
+
+
+class LoopPreStateS2PoolDict(TypedDict):
+	l_lem: list[float]
+	stage1_outputs: list[OutputsS1Dict]
+	stage2_milp: object  # collective MILP instance, as provided in "new_milp"
+	stage2_outputs: OutputsS2PoolDict
+
+
+class AdmmIterationDict(TypedDict):
+	dual_residual: float
+	iteration: int
+	obj_value: float
+	primal_residual: float
+	rho: float
+
+
+class AdmmOutputsS2PoolDict(OutputsS2PoolDict):
+	admm_history: list[AdmmIterationDict]
+	primal_residual: float
@@ -0,0 +1,88 @@
+"""
+Helpers of the decomposed solver of the collective (pool) MILP (see "AdmmStageTwoMILPPool"), which relaxes the market
+equilibrium (Eq. 11), the only constraint coupling the Meters when all the REC's surplus / deficit is not required to
+be shared, into per Meter subproblems coordinated by the exchange ADMM (Boyd et al., 2011, Sec. 7.3.2).
+"""
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	ADMM_NR_BREAKPOINTS,
+	MIPGAP,
+	TIMEOUT
+)
+from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
+	BackpackS2PoolDict,
+	OutputsS2PoolDict
+)
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import unpack_batteries
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	step_durations,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import btm_energy_limits
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
+
+
+def split_meters(backpack: BackpackS2PoolDict) -> list[BackpackS2PoolDict]:
+	"""
+	Splits the backpack of a collective MILP into one backpack per Meter, with the same common data
+	:param backpack: inputs of the collective MILP
+	:return: list with the inputs of each Meter's subproblem, in the order of backpack["meters"]
+	"""
+	return [{**backpack, 'meters': {n: meter}} for n, meter in backpack['meters'].items()]
+
+
+def penalty_breakpoints(backpack: BackpackS2PoolDict, nr_breakpoints: int = ADMM_NR_BREAKPOINTS) -> np.ndarray:
+	"""
+	Deviations where the tangents of the quadratic penalty of the subproblems are taken (see "add_exchange_terms"):
+	0 and +/- the largest net LEM sale any Meter can have, halved "nr_breakpoints" - 1 times, so that the approximation
+	is finer for the small deviations found close to convergence
+	:param backpack: inputs of the collective MILP
+	:param nr_breakpoints: number of breakpoints per sign of the deviation
+	:return: array with the 2 * nr_breakpoints + 1 breakpoints, in ascending order [kWh]
+	"""
+	meters = list(backpack['meters'].values())
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	delta_t = step_durations(backpack['delta_t'], nr_steps)
+	e_net = np.array([meter['e_c'] for meter in meters], dtype=float) \
+		- np.array([meter['e_g'] for meter in meters], dtype=float)
+	batteries = unpack_batteries({n: meter['btm_storage'] for n, meter in backpack['meters'].items()})
+	e_btm_max = np.maximum(*btm_energy_limits(batteries, len(meters), nr_steps, delta_t))
+	largest = (np.abs(e_net) + e_btm_max).max(initial=0.0)
+	halvings = largest * 2.0 ** -np.arange(nr_breakpoints)
+	return np.concatenate([-halvings, [0.0], halvings[::-1]])
+
+
+def exchange_residuals(x: np.ndarray, x_prev: np.ndarray, rho: float) -> tuple[float, float]:
+	"""
+	Residuals of an iteration of the exchange ADMM
+	:param x: net LEM sales of the Meters in the iteration, N x T [kWh]
+	:param x_prev: net LEM sales of the Meters in the previous iteration, N x T [kWh]
+	:param rho: penalty parameter of the iteration [€/kWh^2]
+	:return: tuple with the primal residual, i.e., the norm of the REC's imbalance, sum(x), which is null when the
+		market equilibrium holds [kWh], and the dual residual, rho times the norm of the change of the Meters'
+		deviations from the average, x - mean(x) [€/kWh]
+	"""
+	deviations = x - x.mean(axis=0)
+	deviations_prev = x_prev - x_prev.mean(axis=0)
+	return float(np.linalg.norm(x.sum(axis=0))), float(rho * np.linalg.norm(deviations - deviations_prev))
+
+
+def solve_exchange_subproblem(backpack: BackpackS2PoolDict, timeout: float = TIMEOUT, mipgap: float = MIPGAP,
+                              relax_binaries: bool = False) -> OutputsS2PoolDict:
+	"""
+	Solves the subproblem of one or more Meters, i.e., the collective MILP with the market equilibrium relaxed (see
+	"add_exchange_terms"); meant to be run on the workers of "run_in_parallel"
+	:param backpack: inputs of the Meters' subproblem, plus the "exchange" dictionary with the "prices", "targets",
+		"rho" and "breakpoints" of the relaxation
+	:param timeout: solver's time limit [s]
+	:param mipgap: solver's relative MIP gap tolerance
+	:param relax_binaries: if True, the binaries proven unnecessary for the data are relaxed
+	:return: the outputs of the subproblem, whose "obj_value" excludes the prices and penalties of the relaxation
+	"""
+	milp = MatrixStageTwoMILPPool(backpack, timeout=timeout, mipgap=mipgap, relax_binaries=relax_binaries,
+	                              tight_big_m=False, prune_steps=False, exchange=backpack['exchange'])
+	milp.solve_milp()
+	outputs = milp.generate_outputs()
+	outputs['milp_status'] = milp.status
+	return outputs
@@ -0,0 +1,262 @@
+"""
+Helpers for running the collective (pool) pre-delivery procedures on a reduced community, for very large RECs:
+- the Meters are clustered by their profiles, tariffs and assets, and each cluster is replaced by a single aggregate
+Meter, with the summed profiles and assets and the (energy weighted) average tariffs of its members;
+- after solving the reduced community, the schedules and pool transactions of each aggregate Meter are disaggregated
+back to its members, and their costs are recomputed from their own data.
+The energy netted inside each cluster is settled as pool transactions among its members; the individual cost
+constraints of a two-stage procedure are only observed by the aggregate Meters.
+"""
+import copy
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	step_durations,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.rolling_horizon_helpers import stitch_collective_outputs
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+
+def _storage_totals(meter: dict) -> tuple[float, float]:
+	"""
+	Auxiliary function that returns the total nominal capacity and power of the storage units of a Meter
+	:param meter: data of the Meter
+	:return: total "e_bn" and "p_max" of its storage units
+	"""
+	storages = (meter.get('btm_storage') or {}).values()
+	return sum(storage['e_bn'] for storage in storages), sum(storage['p_max'] for storage in storages)
+
+
+def meter_features(backpack: dict) -> tuple[list[str], np.ndarray]:
+	"""
+	Builds the features on which the Meters of a collective backpack are clustered: their consumption, generation
+	and tariffs' profiles, the total capacity and power of their storage units and their maximum power
+	:param backpack: collective (pool) backpack
+	:return: tuple with the Meters' identifications and the N x F array with their standardized features
+	"""
+	meter_ids = list(backpack['meters'].keys())
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	features = []
+	for meter in backpack['meters'].values():
+		profiles = [np.broadcast_to(np.asarray(meter[key], dtype=float), nr_steps)
+		            for key in ('e_c', 'e_g', 'l_buy', 'l_sell')]
+		features.append(np.concatenate(profiles + [[*_storage_totals(meter), meter['max_p']]]))
+
+	return meter_ids, StandardScaler().fit_transform(np.array(features))
+
+
+def cluster_meters(backpack: dict, nr_clusters: int, random_state=0) -> dict[str, str]:
+	"""
+	Clusters the Meters of a collective backpack with similar profiles, tariffs and assets (k-means)
+	:param backpack: collective (pool) backpack
+	:param nr_clusters: number of clusters, i.e., of aggregate Meters; when not below the number of Meters, each Meter
+		is kept in a cluster of its own
+	:param random_state: seed of the k-means initialization, for reproducible clusters
+	:return: {#meter_id: identification of its cluster (and aggregate Meter)}
+	"""
+	if nr_clusters < 1:
+		raise ValueError('Please provide at least one cluster.')
+
+	meter_ids, features = meter_features(backpack)
+	if nr_clusters >= len(meter_ids):
+		labels = np.arange(len(meter_ids))
+	else:
+		labels = KMeans(n_clusters=nr_clusters, n_init=10, random_state=random_state).fit_predict(features)
+
+	# Number the clusters by order of their first Meter
+	order = {label: k for k, label in enumerate(dict.fromkeys(labels.tolist()))}
+	return {meter_id: f'Cluster#{order[label] + 1}' for meter_id, label in zip(meter_ids, labels.tolist())}
+
+
+def cluster_members(clusters: dict[str, str]) -> dict[str, list[str]]:
+	"""
+	Inverts the Meters' clusters
+	:param clusters: {#meter_id: cluster identification}, as returned by "cluster_meters"
+	:return: {#cluster_id: list with its Meters}
+	"""
+	members = {}
+	for meter_id, cluster_id in clusters.items():
+		members.setdefault(cluster_id, []).append(meter_id)
+	return members
+
+
+def _weighted_tariff(tariffs: list, weights: np.ndarray) -> list[float]:
+	"""
+	Auxiliary function that averages the tariffs of several Meters per step, weighted by their energy flows; the
+	steps without flows revert to the simple average
+	:param tariffs: tariffs of each Meter, per step
+	:param weights: M x T array with the energy flows of each Meter
+	:return: list with the average tariff per step
+	"""
+	tariffs = np.broadcast_to(np.array(tariffs, dtype=float), weights.shape)
+	total = weights.sum(axis=0)
+	weighted = (tariffs * weights).sum(axis=0) / np.where(total > 0, total, 1.0)
+	return np.where(total > 0, weighted, tariffs.mean(axis=0)).tolist()
+
+
+def _aggregate_storage(storages: list[dict]) -> dict:
+	"""
+	Auxiliary function that merges several storage units into one, with their summed capacity, power and energy
+	content, and their capacity weighted efficiencies, SoC limits and degradation cost
+	:param storages: data of the storage units
+	:return: data of the aggregate storage unit
+	"""
+	e_bn = np.array([storage['e_bn'] for storage in storages], dtype=float)
+	weights = e_bn / e_bn.sum() if e_bn.sum() > 0 else np.full(len(storages), 1 / len(storages))
+	average = lambda key: float(sum(w * storage[key] for w, storage in zip(weights, storages)))
+	return {
+		'degradation_cost': average('degradation_cost'),
+		'e_bn': float(e_bn.sum()),
+		'eff_bc': average('eff_bc'),
+		'eff_bd': average('eff_bd'),
+		'init_e': float(sum(storage['init_e'] for storage in storages)),
+		'p_max': float(sum(storage['p_max'] for storage in storages)),
+		'soc_max': average('soc_max'),
+		'soc_min': average('soc_min')
+	}
+
+
+def aggregate_backpack(backpack: dict, clusters: dict[str, str]) -> dict:
+	"""
+	Builds the backpack of the reduced community, where each cluster of Meters is replaced by an aggregate Meter:
+	its consumption, generation, maximum power and individual cost are the sums of its members', its buying
+	(selling) tariffs are their consumption (generation) weighted averages and its storage units are merged into one
+	:param backpack: collective (pool) backpack
+	:param clusters: {#meter_id: cluster identification}, as returned by "cluster_meters"
+	:return: collective backpack of the aggregate Meters
+	"""
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	aggregated = {key: copy.deepcopy(val) for key, val in backpack.items() if key != 'meters'}
+	aggregated['meters'] = {}
+	for cluster_id, meter_ids in cluster_members(clusters).items():
+		meters = [backpack['meters'][meter_id] for meter_id in meter_ids]
+		e_c = np.array([np.broadcast_to(np.asarray(meter['e_c'], dtype=float), nr_steps) for meter in meters])
+		e_g = np.array([np.broadcast_to(np.asarray(meter['e_g'], dtype=float), nr_steps) for meter in meters])
+		storages = [storage for meter in meters for storage in (meter.get('btm_storage') or {}).values()]
+		aggregated['meters'][cluster_id] = {
+			'btm_storage': {'Storage#1': _aggregate_storage(storages)} if storages else {},
+			'e_c': e_c.sum(axis=0).tolist(),
+			'e_g': e_g.sum(axis=0).tolist(),
+			'l_buy': _weighted_tariff([meter['l_buy'] for meter in meters], e_c),
+			'l_sell': _weighted_tariff([meter['l_sell'] for meter in meters], e_g),
+			'max_p': float(sum(meter['max_p'] for meter in meters))
+		}
+		if all('c_ind' in meter for meter in meters):
+			aggregated['meters'][cluster_id]['c_ind'] = float(sum(meter['c_ind'] for meter in meters))
+
+	return aggregated
+
+
+def _shares(flows: np.ndarray) -> np.ndarray:
+	"""
+	Auxiliary function that computes the share of each Meter in the total flows of its cluster, per step; the steps
+	without flows are shared equally
+	:param flows: M x T array with the (non-negative) flows of the Meters
+	:return: M x T array with the shares, summing up to 1 per step
+	"""
+	total = flows.sum(axis=0)
+	return np.where(total > 0, flows / np.where(total > 0, total, 1.0), 1 / len(flows))
+
+
+def disaggregate_outputs(backpack: dict, clusters: dict[str, str], outputs: dict) -> dict:
+	"""
+	Disaggregates the collective (pool) outputs of the reduced community back to the Meters:
+	- the aggregate storage unit of a cluster is split among its members' storage units by their nominal capacity;
+	- the retail and market supply (surplus) and the pool purchases (sales) of a cluster are split among its members
+	with positive (negative) net consumption, by the size of it;
+	- what remains of each member's net consumption, i.e., the energy netted inside the cluster, is settled as pool
+	purchases and sales among its members, which keeps the pool balanced;
+	- the self-consumed energies, extra power and all costs are recomputed from each member's own data.
+	:param backpack: collective (pool) backpack of the Meters
+	:param clusters: {#meter_id: cluster identification}, as returned by "cluster_meters"
+	:param outputs: collective (pool) outputs of the aggregate Meters
+	:return: collective outputs of the Meters, with the same structure as "outputs" except for the binary variables
+	"""
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	delta_t = step_durations(backpack['delta_t'], nr_steps)
+	series = lambda val: np.broadcast_to(np.asarray(val, dtype=float), nr_steps)
+	flows = ('e_sup_retail', 'e_sup_market', 'e_pur_pool', 'e_sur_retail', 'e_sur_market', 'e_sale_pool')
+	keys = flows + ('e_alc', 'e_cmet', 'e_consumed', 'e_slc_pool', 'p_extra')
+	meter_outputs = {key: {} for key in keys + ('e_bat', 'e_bc', 'e_bd', 'soc_bat')}
+
+	for cluster_id, meter_ids in cluster_members(clusters).items():
+		meters = [backpack['meters'][meter_id] for meter_id in meter_ids]
+
+		# Split the aggregate storage unit by the members' storage units nominal capacity
+		e_bn = sum(_storage_totals(meter)[0] for meter in meters)
+		e_bc = np.zeros((len(meters), nr_steps))
+		e_bd = np.zeros((len(meters), nr_steps))
+		for m, (meter_id, meter) in enumerate(zip(meter_ids, meters)):
+			for key in ('e_bat', 'e_bc', 'e_bd', 'soc_bat'):
+				meter_outputs[key][meter_id] = {}
+			for b, storage in (meter.get('btm_storage') or {}).items():
+				ratio = storage['e_bn'] / e_bn if e_bn > 0 else 0.0
+				for key in ('e_bat', 'e_bc', 'e_bd'):
+					meter_outputs[key][meter_id][b] = (series(outputs[key][cluster_id]['Storage#1']) * ratio).tolist()
+				meter_outputs['soc_bat'][meter_id][b] = list(outputs['soc_bat'][cluster_id]['Storage#1'])
+				e_bc[m] += meter_outputs['e_bc'][meter_id][b]
+				e_bd[m] += meter_outputs['e_bd'][meter_id][b]
+
+		e_cmet = np.array([series(meter['e_c']) - series(meter['e_g']) for meter in meters]) + e_bc - e_bd
+		imports = _shares(np.maximum(e_cmet, 0.0))
+		exports = _shares(np.maximum(-e_cmet, 0.0))
+		split = {key: (imports if key.startswith(('e_sup', 'e_pur')) else exports) * series(outputs[key][cluster_id])
+		         for key in flows}
+
+		# Settle the energy netted inside the cluster as pool transactions among its members
+		residual = e_cmet - (split['e_sup_retail'] + split['e_sup_market'] + split['e_pur_pool']
+		                     - split['e_sur_retail'] - split['e_sur_market'] - split['e_sale_pool'])
+		net_pool = split['e_pur_pool'] - split['e_sale_pool'] + residual
+		split['e_pur_pool'] = np.maximum(net_pool, 0.0)
+		split['e_sale_pool'] = np.maximum(-net_pool, 0.0)
+		split['e_cmet'] = e_cmet
+		split['e_consumed'] = np.maximum(e_cmet, 0.0)
+		split['e_alc'] = split['e_pur_pool']
+		split['e_slc_pool'] = np.minimum(split['e_consumed'], split['e_alc'])
+		max_p = np.array([[meter['max_p']] for meter in meters])
+		split['p_extra'] = np.maximum(np.abs(e_cmet) / delta_t - max_p, 0.0)
+
+		for key in keys:
+			for m, meter_id in enumerate(meter_ids):
+				meter_outputs[key][meter_id] = split[key][m].tolist()
+
+	meter_outputs['dual_prices'] = outputs['dual_prices']
+	meter_outputs['milp_status'] = outputs['milp_status']
+
+	# Recompute the costs of each Meter from its own tariffs and assets
+	return stitch_collective_outputs([(backpack, nr_steps, meter_outputs)], [backpack['l_lem']])
+
+
+def approximation_error(backpack: dict, clusters: dict[str, str], aggregated_outputs: dict, outputs: dict) \
+		-> dict[str, float]:
+	"""
+	Assesses the approximation of solving the reduced community instead of the full one
+	:param backpack: collective (pool) backpack of the Meters
+	:param clusters: {#meter_id: cluster identification}, as returned by "cluster_meters"
+	:param aggregated_outputs: collective (pool) outputs of the aggregate Meters
+	:param outputs: disaggregated outputs of the Meters, as returned by "disaggregate_outputs"
+	:return: {
+		'cost': relative difference between the total cost of the Meters and the objective value of the reduced
+			community
+		'profile': relative (L1) difference between the Meters' net consumption profiles and their cluster's one,
+			scaled by their share of the cluster's net energy, i.e., how far the members are from their representative
+	}
+	"""
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	deviation = total = 0.0
+	for meter_ids in cluster_members(clusters).values():
+		e_net = np.array([np.broadcast_to(np.asarray(backpack['meters'][meter_id]['e_c'], dtype=float), nr_steps)
+		                  - np.broadcast_to(np.asarray(backpack['meters'][meter_id]['e_g'], dtype=float), nr_steps)
+		                  for meter_id in meter_ids])
+		size = np.abs(e_net).sum(axis=1)
+		ratio = size / size.sum() if size.sum() > 0 else np.full(len(meter_ids), 1 / len(meter_ids))
+		deviation += np.abs(e_net - ratio[:, np.newaxis] * e_net.sum(axis=0)).sum()
+		total += size.sum()
+
+	aggregated_cost = aggregated_outputs['obj_value']
+	return {
+		'cost': abs(outputs['obj_value'] - aggregated_cost) / max(abs(aggregated_cost), 1E-9),
+		'profile': float(deviation / total) if total > 0 else 0.0
+	}
@@ -0,0 +1,688 @@
+"""
+Array-based MILP assembly. Instead of building one puLP object per variable, term and constraint, the formulation is
+assembled in blocks of variables and constraints whose coefficients are stored as sparse (COO) triplets, computed with
+vectorized NumPy index arithmetic, and handed over as a CSR matrix to an in-process solver (HiGHS, through SciPy).
+"""
+import numpy as np
+
+from loguru import logger
+from scipy.optimize import (
+	Bounds,
+	LinearConstraint,
+	linprog,
+	milp
+)
+from scipy.sparse import (
+	coo_matrix,
+	vstack
+)
+from typing import Union
+
+
+ArrayLike = Union[np.ndarray, float, list]
+LEM_VARIABLES = ('e_pur', 'e_sale', 'e_slc')  # variables of the LEM transactions, per Meter or per pair of Meters
+
+
+class MatrixModel:
+	"""
+	Sparse, array-based formulation of a (minimization) MILP.
+	Variables and constraints are added in blocks, each identified by an array with the indices of its columns / rows,
+	so that the coefficients of a whole block can be set at once with broadcasting, e.g.:
+		e_cmet = model.add_variables((nr_meters, nr_steps), lb=-np.inf)
+		rows = model.add_rows((nr_meters, nr_steps), ub=p_max[:, np.newaxis])
+		model.add_terms(rows, e_cmet, 1 / delta_t)
+	The formulation is assembled once, on the first solve, and kept; its coefficients and bounds can then be
+	overwritten in place (see "set_cost", "set_terms" and "set_row_bounds") to re-solve it with new data, without
+	assembling it anew.
+	"""
+	def __init__(self):
+		self.nr_variables = 0
+		self.nr_rows = 0
+		self._lb = []  # lower bounds of the variables, per block
+		self._ub = []  # upper bounds of the variables, per block
+		self._integrality = []  # 1 for integer variables, 0 for continuous ones, per block
+		self._cost_idx = []  # objective function terms: variables' indices
+		self._cost_coef = []  # objective function terms: coefficients
+		self._row_lb = []  # lower bounds of the constraints, per block
+		self._row_ub = []  # upper bounds of the constraints, per block
+		self._rows = []  # constraints' terms: rows' indices
+		self._cols = []  # constraints' terms: variables' indices
+		self._vals = []  # constraints' terms: coefficients
+		self._arrays = None  # assembled formulation (see "to_arrays")
+		self._term_keys = None  # sorted keys (row * nr_variables + column) of the assembled constraints' terms
+		self.status = None  # stores the status of the MILP's solution
+		self.obj_value = None  # stores the MILP's numeric solution
+		self.x = None  # stores the values of all variables
+
+	def add_variables(self, shape: Union[int, tuple], lb: ArrayLike = 0.0, ub: ArrayLike = np.inf,
+	                  binary: Union[bool, np.ndarray] = False) -> np.ndarray:
+		"""
+		Adds a block of variables
+		:param shape: shape of the block, e.g., (nr_meters, nr_steps)
+		:param lb: lower bound(s) of the variables, broadcastable to "shape"
+		:param ub: upper bound(s) of the variables, broadcastable to "shape"
+		:param binary: if True, the variables are binary and their bounds are clipped to [0, 1] (an upper bound of 0
+			fixes them to 0); a boolean mask, broadcastable to "shape", makes only some of them binary, while the
+			others are relaxed to continuous variables in the same bounds
+		:return: array with the indices of the new variables, with the provided shape
+		"""
+		idx = np.arange(self.nr_variables, self.nr_variables + int(np.prod(shape))).reshape(shape)
+		self.nr_variables += idx.size
+		self._arrays = None
+		if binary is not False:
+			lb, ub = 0.0, np.minimum(ub, 1.0)
+		binary = np.broadcast_to(np.asarray(binary, dtype=bool), idx.shape)
+		self._lb.append(np.broadcast_to(np.asarray(lb, dtype=float), idx.shape).ravel())
+		self._ub.append(np.broadcast_to(np.asarray(ub, dtype=float), idx.shape).ravel())
+		self._integrality.append(binary.ravel().astype(int))
+		return idx
+
+	def add_cost(self, idx: np.ndarray, coef: ArrayLike = 1.0):
+		"""
+		Adds terms to the objective function; repeated variables have their coefficients summed
+		:param idx: indices of the variables
+		:param coef: coefficient(s) of the variables, broadcastable to the shape of "idx"
+		"""
+		idx, coef = np.broadcast_arrays(idx, np.asarray(coef, dtype=float))
+		self._arrays = None
+		self._cost_idx.append(idx.ravel())
+		self._cost_coef.append(coef.ravel())
+
+	def add_rows(self, shape: Union[int, tuple], lb: ArrayLike = -np.inf, ub: ArrayLike = np.inf) -> np.ndarray:
+		"""
+		Adds a block of constraints lb <= A x <= ub (use lb = ub for equalities), whose terms are added afterward
+		with "add_terms"
+		:param shape: shape of the block, e.g., (nr_meters, nr_steps)
+		:param lb: lower bound(s) of the constraints, broadcastable to "shape"
+		:param ub: upper bound(s) of the constraints, broadcastable to "shape"
+		:return: array with the indices of the new constraints, with the provided shape
+		"""
+		rows = np.arange(self.nr_rows, self.nr_rows + int(np.prod(shape))).reshape(shape)
+		self.nr_rows += rows.size
+		self._arrays = None
+		self._row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), rows.shape).ravel())
+		self._row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), rows.shape).ravel())
+		return rows
+
+	def add_terms(self, rows: np.ndarray, idx: np.ndarray, coef: ArrayLike = 1.0):
+		"""
+		Adds the terms "coef * x[idx]" to the constraints "rows"; the three arguments are broadcast together, so a
+		variable block with extra dimensions is summed into the rows (e.g., rows of shape (T,) and variables of shape
+		(N, T) add, to each row t, the variables of all N Meters at step t)
+		:param rows: indices of the constraints
+		:param idx: indices of the variables
+		:param coef: coefficient(s) of the variables
+		"""
+		rows, idx, coef = np.broadcast_arrays(rows, idx, np.asarray(coef, dtype=float))
+		self._arrays = None
+		self._rows.append(rows.ravel())
+		self._cols.append(idx.ravel())
+		self._vals.append(coef.ravel())
+
+	def to_arrays(self) -> dict:
+		"""
+		Assembles the formulation, only once: the arrays are kept (and returned on later calls) until new variables,
+		constraints or terms are added. After being assembled, the blocks are replaced by the assembled arrays, so that
+		the changes made in place (see "set_cost", "set_terms" and "set_row_bounds") are kept if it is assembled anew.
+		:return: dictionary with the objective function coefficients ("c"), the CSR constraint matrix ("A"), the
+			bounds of the constraints ("row_lb", "row_ub") and of the variables ("lb", "ub"), and the variables'
+			"integrality"
+		"""
+		if self._arrays is not None:
+			return self._arrays
+
+		concat = lambda blocks, dtype: np.concatenate(blocks).astype(dtype) if blocks else np.zeros(0, dtype=dtype)
+		c = np.zeros(self.nr_variables)
+		np.add.at(c, concat(self._cost_idx, int), concat(self._cost_coef, float))
+		a = coo_matrix(
+			(concat(self._vals, float), (concat(self._rows, int), concat(self._cols, int))),
+			shape=(self.nr_rows, self.nr_variables)
+		).tocsr()  # duplicated entries are summed
+		a.sort_indices()
+		self._arrays = {
+			'c': c,
+			'A': a,
+			'row_lb': concat(self._row_lb, float),
+			'row_ub': concat(self._row_ub, float),
+			'lb': concat(self._lb, float),
+			'ub': concat(self._ub, float),
+			'integrality': concat(self._integrality, int)
+		}
+
+		# Replace the blocks by the assembled arrays (sharing their memory)
+		rows = np.repeat(np.arange(self.nr_rows), np.diff(a.indptr))
+		self._term_keys = rows.astype(np.int64) * self.nr_variables + a.indices
+		self._cost_idx, self._cost_coef = [np.arange(self.nr_variables)], [c]
+		self._rows, self._cols, self._vals = [rows], [a.indices], [a.data]
+		self._row_lb, self._row_ub = [self._arrays['row_lb']], [self._arrays['row_ub']]
+		self._lb, self._ub = [self._arrays['lb']], [self._arrays['ub']]
+		self._integrality = [self._arrays['integrality']]
+
+		return self._arrays
+
+	def set_cost(self, idx: np.ndarray, coef: ArrayLike):
+		"""
+		Overwrites the objective function coefficients of some variables, in the assembled formulation
+		:param idx: indices of the variables
+		:param coef: new coefficient(s) of the variables, broadcastable to the shape of "idx"
+		"""
+		idx, coef = np.broadcast_arrays(idx, np.asarray(coef, dtype=float))
+		self.to_arrays()['c'][idx.ravel()] = coef.ravel()
+
+	def set_terms(self, rows: np.ndarray, idx: np.ndarray, coef: ArrayLike):
+		"""
+		Overwrites the coefficients of existing terms of some constraints, in the assembled formulation; the
+		arguments are broadcast together as in "add_terms", but no new terms can be added this way
+		:param rows: indices of the constraints
+		:param idx: indices of the variables
+		:param coef: new coefficient(s) of the variables
+		"""
+		rows, idx, coef = np.broadcast_arrays(rows, idx, np.asarray(coef, dtype=float))
+		a = self.to_arrays()['A']
+		keys = rows.ravel().astype(np.int64) * self.nr_variables + idx.ravel()
+		pos = np.minimum(np.searchsorted(self._term_keys, keys), len(self._term_keys) - 1)
+		if len(self._term_keys) == 0 or (self._term_keys[pos] != keys).any():
+			raise ValueError('Only the coefficients of existing terms can be overwritten; please use "add_terms"')
+		a.data[pos] = coef.ravel()
+
+	def set_row_bounds(self, rows: np.ndarray, lb: ArrayLike = None, ub: ArrayLike = None):
+		"""
+		Overwrites the bounds of some constraints, in the assembled formulation; bounds left as None are kept
+		:param rows: indices of the constraints
+		:param lb: new lower bound(s) of the constraints, broadcastable to the shape of "rows"
+		:param ub: new upper bound(s) of the constraints, broadcastable to the shape of "rows"
+		"""
+		arrays = self.to_arrays()
+		for key, bound in (('row_lb', lb), ('row_ub', ub)):
+			if bound is not None:
+				arrays[key][np.ravel(rows)] = np.broadcast_to(np.asarray(bound, dtype=float), np.shape(rows)).ravel()
+
+	def solve(self, timeout: float = None, mipgap: float = None):
+		"""
+		Solves the MILP with HiGHS and stores its status ("Optimal", "Infeasible", "Unbounded" or "Not Solved"),
+		objective function value and variables' values. As puLP does with CBC, a feasible solution found before
+		reaching the time limit is reported as "Optimal". The formulation is only assembled on the first call.
+		:param timeout: solver's time limit [s]
+		:param mipgap: solver's relative MIP gap tolerance
+		"""
+		arrays = self.to_arrays()
+		options = {'disp': False}
+		if timeout is not None:
+			options['time_limit'] = timeout
+		if mipgap is not None:
+			options['mip_rel_gap'] = mipgap
+		constraints = LinearConstraint(arrays['A'], arrays['row_lb'], arrays['row_ub']) if self.nr_rows else None
+
+		result = milp(arrays['c'], integrality=arrays['integrality'], bounds=Bounds(arrays['lb'], arrays['ub']),
+		              constraints=constraints, options=options)
+
+		if result.x is not None:
+			self.status = 'Optimal'
+			self.obj_value = float(result.fun)
+			self.x = result.x
+		else:
+			self.status = {2: 'Infeasible', 3: 'Unbounded'}.get(result.status, 'Not Solved')
+			self.obj_value = None
+			self.x = None
+			logger.warning(f'HiGHS did not find a solution: \'{result.message}\'')
+
+	def values(self, idx: np.ndarray) -> np.ndarray:
+		"""
+		Values of a block of variables in the last solution found
+		:param idx: indices of the variables
+		:return: array with the values, with the same shape as "idx"
+		"""
+		return self.x[idx]
+
+	def activity(self, rows: np.ndarray) -> np.ndarray:
+		"""
+		Values of the left-hand side (A x) of some constraints in the last solution found
+		:param rows: indices of the constraints
+		:return: array with the values, with the same shape as "rows"
+		"""
+		a = self.to_arrays()['A']
+		return a[np.ravel(rows)].dot(self.x).reshape(np.shape(rows))
+
+	def fixed_integers_duals(self, rows: np.ndarray) -> np.ndarray:
+		"""
+		Dual values (marginals) of some constraints, from the LP that results from fixing the integer variables at
+		their values in the last solution found
+		:param rows: indices of the constraints
+		:return: array with the dual values, with the same shape as "rows" (NaN if the LP could not be solved)
+		"""
+		arrays = self.to_arrays()
+		integer = arrays['integrality'] == 1
+		lb, ub = arrays['lb'].copy(), arrays['ub'].copy()
+		lb[integer] = ub[integer] = np.round(self.x[integer])
+
+		# linprog takes equalities and "less than or equal" inequalities separately
+		a, row_lb, row_ub = arrays['A'], arrays['row_lb'], arrays['row_ub']
+		eq = row_lb == row_ub
+		has_ub = np.flatnonzero(~eq & np.isfinite(row_ub))
+		has_lb = np.flatnonzero(~eq & np.isfinite(row_lb))
+		result = linprog(arrays['c'], A_ub=vstack([a[has_ub], -a[has_lb]]).tocsr(),
+		                 b_ub=np.concatenate([row_ub[has_ub], -row_lb[has_lb]]),
+		                 A_eq=a[eq], b_eq=row_lb[eq], bounds=np.column_stack([lb, ub]), method='highs')
+		if result.status != 0:
+			return np.full(np.shape(rows), np.nan)
+
+		# Marginals of the rows bounded on both sides are summed, since at most one of those bounds can be active
+		duals = np.zeros(self.nr_rows)
+		duals[eq] = result.eqlin.marginals
+		np.add.at(duals, has_ub, result.ineqlin.marginals[:len(has_ub)])
+		np.add.at(duals, has_lb, -result.ineqlin.marginals[len(has_ub):])
+		return duals[rows]
+
+
+def unpack_batteries(btm_storage: dict[str, Union[dict, None]]) -> dict:
+	"""
+	Flattens the Btm storage assets of several Meters into arrays with one entry per battery
+	:param btm_storage: {#meter_id: {#storage_id: storage parameters} or None}
+	:return: dictionary with the "owner" (position of the battery's Meter in "btm_storage"), the "meter_ids" and the
+		"storage_ids" of each battery, and one array per storage parameter
+	"""
+	owners, meter_ids, storage_ids, params = [], [], [], []
+	for i, (n, meter_btm_storage) in enumerate(btm_storage.items()):
+		for b, storage in (meter_btm_storage or {}).items():
+			owners.append(i)
+			meter_ids.append(n)
+			storage_ids.append(b)
+			params.append(storage)
+
+	batteries = {'owner': np.array(owners, dtype=int), 'meter_ids': meter_ids, 'storage_ids': storage_ids}
+	for key in ('degradation_cost', 'e_bn', 'eff_bc', 'eff_bd', 'init_e', 'p_max', 'soc_max', 'soc_min'):
+		batteries[key] = np.array([storage[key] for storage in params], dtype=float)
+
+	return batteries
+
+
+def add_meters_formulation(model: MatrixModel, e_net: np.ndarray, p_meter_max: np.ndarray,
+                           big_m: Union[ArrayLike, tuple], delta_t: ArrayLike, sup_needed: np.ndarray = True,
+                           bound_flows=False) -> tuple[dict, dict]:
+	"""
+	Adds the variables and constraints that are common to the individual and collective MILPs, for all Meters:
+	the Meters' energy balance, power limits and supply / surplus exclusivity (Eq. 2-5 and Eq. 12-15).
+	:param model: the MILP being assembled
+	:param e_net: N x T array with the Meters' net consumption, e_c - e_g [kWh]
+	:param p_meter_max: array with the maximum power flow desired at each Meter [kW]
+	:param big_m: big-M values of the supply / surplus exclusivity, for all, per Meter or per Meter and step (N x T);
+		a pair of them sets different values for the supply and for the surplus [kWh]
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param sup_needed: N x T mask of the "delta_sup" that must be binary (see "supply_binaries_needed"); the others
+		are relaxed to continuous variables
+	:param bound_flows: if True, the big-M values are also set as upper bounds of the supply and surplus variables
+	:return: tuple with the dictionaries of the variables' and of the constraints' indices, per name; the latter
+		includes "Equilibrium" and "C_met", to which the LEM transactions and the Btm assets are added afterward
+	"""
+	shape = e_net.shape
+
+	def per_meter_and_step(values: ArrayLike) -> np.ndarray:
+		values = np.asarray(values, dtype=float)
+		return np.broadcast_to(values if values.ndim == 2 else values.reshape(-1, 1), shape)
+
+	if not isinstance(big_m, tuple):
+		big_m = (big_m, big_m)
+	sup_big_m, sur_big_m = (per_meter_and_step(values) for values in big_m)
+	sup_max, sur_max = (sup_big_m, sur_big_m) if bound_flows else (np.inf, np.inf)
+	p_meter_max = np.asarray(p_meter_max, dtype=float).reshape(-1, 1)
+	v = {
+		'e_sup_retail': model.add_variables(shape, ub=sup_max),
+		'e_sur_retail': model.add_variables(shape, ub=sur_max),
+		'e_sup_market': model.add_variables(shape, ub=sup_max),
+		'e_sur_market': model.add_variables(shape, ub=sur_max),
+		'delta_sup': model.add_variables(shape, binary=sup_needed),
+		'e_cmet': model.add_variables(shape, lb=-np.inf),
+		'p_extra': model.add_variables(shape)
+	}
+	r = {}
+
+	# Eq. 2 / 12: e_cmet == e_sup_retail + e_sup_market - e_sur_retail - e_sur_market (+ LEM transactions)
+	r['Equilibrium'] = model.add_rows(shape, lb=0.0, ub=0.0)
+	model.add_terms(r['Equilibrium'], v['e_cmet'], 1.0)
+	for name, coef in (('e_sup_retail', -1.0), ('e_sup_market', -1.0), ('e_sur_retail', 1.0), ('e_sur_market', 1.0)):
+		model.add_terms(r['Equilibrium'], v[name], coef)
+
+	# Eq. 3 / 13: e_cmet == e_c - e_g (+ Btm assets)
+	r['C_met'] = model.add_rows(shape, lb=e_net, ub=e_net)
+	model.add_terms(r['C_met'], v['e_cmet'], 1.0)
+
+	# Eq. 4 / 14: - p_extra - p_meter_max <= e_cmet / delta_t <= p_extra + p_meter_max
+	r['P_flow_low_limit'] = model.add_rows(shape, lb=-p_meter_max)
+	model.add_terms(r['P_flow_low_limit'], v['e_cmet'], 1 / delta_t)
+	model.add_terms(r['P_flow_low_limit'], v['p_extra'], 1.0)
+	r['P_flow_high_limit'] = model.add_rows(shape, ub=p_meter_max)
+	model.add_terms(r['P_flow_high_limit'], v['e_cmet'], 1 / delta_t)
+	model.add_terms(r['P_flow_high_limit'], v['p_extra'], -1.0)
+
+	# Eq. 5 / 15: supply and surplus are mutually exclusive
+	r['Supply_ON'] = model.add_rows(shape, ub=0.0)
+	model.add_terms(r['Supply_ON'], v['e_sup_retail'], 1.0)
+	model.add_terms(r['Supply_ON'], v['e_sup_market'], 1.0)
+	model.add_terms(r['Supply_ON'], v['delta_sup'], -sup_big_m)
+	r['Supply_OFF'] = model.add_rows(shape, ub=sur_big_m)
+	model.add_terms(r['Supply_OFF'], v['e_sur_retail'], 1.0)
+	model.add_terms(r['Supply_OFF'], v['e_sur_market'], 1.0)
+	model.add_terms(r['Supply_OFF'], v['delta_sup'], sur_big_m)
+
+	return v, r
+
+
+def add_batteries_formulation(model: MatrixModel, batteries: dict, nr_steps: int, delta_t: ArrayLike,
+                              c_met_rows: np.ndarray, skip_empty=True, bc_needed: np.ndarray = True) -> dict:
+	"""
+	Adds the variables and constraints of the Btm batteries (Eq. 6-8 and Eq. 16-18) and their contribution to the
+	Meters' net consumption ("C_met" constraints)
+	:param model: the MILP being assembled
+	:param batteries: batteries' data, as returned by "unpack_batteries"
+	:param nr_steps: number of time steps
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param c_met_rows: N x T array with the indices of the "C_met" constraints
+	:param skip_empty: if True, no constraints are set for batteries with a null nominal capacity (as in the
+		collective MILPs)
+	:param bc_needed: B x T mask of the "delta_bc" that must be binary (see "charge_binaries_needed"); the others are
+		relaxed to continuous variables
+	:return: dictionary of the variables' indices, per name, each with shape B x T
+	"""
+	shape = (len(batteries['owner']), nr_steps)
+	v = {
+		'e_bat': model.add_variables(shape),
+		'soc_bat': model.add_variables(shape),
+		'e_bc': model.add_variables(shape),
+		'e_bd': model.add_variables(shape),
+		'delta_bc': model.add_variables(shape, binary=bc_needed)
+	}
+
+	# Contribution to the net consumption of the Meters
+	model.add_terms(c_met_rows[batteries['owner']], v['e_bc'], -1.0)
+	model.add_terms(c_met_rows[batteries['owner']], v['e_bd'], 1.0)
+
+	active = batteries['e_bn'] > 0 if skip_empty else np.ones(shape[0], dtype=bool)
+	col = lambda key: batteries[key][active, np.newaxis]
+	act = {name: idx[active] for name, idx in v.items()}
+	act_shape = (int(active.sum()), nr_steps)
+
+	# Eq. 6 / 16: e_bat[t] == e_bat[t-1] + e_bc[t] * eff_bc - e_bd[t] / eff_bd, with e_bat[-1] == init_e
+	init_e = np.zeros(act_shape)
+	init_e[:, 0] = batteries['init_e'][active]
+	rows = model.add_rows(act_shape, lb=init_e, ub=init_e)
+	model.add_terms(rows, act['e_bat'], 1.0)
+	model.add_terms(rows[:, 1:], act['e_bat'][:, :-1], -1.0)
+	model.add_terms(rows, act['e_bc'], -col('eff_bc'))
+	model.add_terms(rows, act['e_bd'], 1 / col('eff_bd'))
+
+	# Eq. 7 / 17: soc_bat == e_bat * 100 / e_bn, within [soc_min, soc_max]
+	rows = model.add_rows(act_shape, lb=0.0, ub=0.0)
+	model.add_terms(rows, act['soc_bat'], 1.0)
+	model.add_terms(rows, act['e_bat'], -100 / col('e_bn'))
+	model.add_terms(model.add_rows(act_shape, lb=col('soc_min')), act['soc_bat'], 1.0)
+	model.add_terms(model.add_rows(act_shape, ub=col('soc_max')), act['soc_bat'], 1.0)
+
+	# Eq. 8 / 18: charge and discharge rate limits, mutually exclusive
+	rows = model.add_rows(act_shape, ub=0.0)
+	model.add_terms(rows, act['e_bc'], 1 / delta_t)
+	model.add_terms(rows, act['delta_bc'], -col('p_max'))
+	rows = model.add_rows(act_shape, ub=col('p_max'))
+	model.add_terms(rows, act['e_bd'], 1 / delta_t)
+	model.add_terms(rows, act['delta_bc'], col('p_max'))
+
+	return v
+
+
+def per_battery(values: np.ndarray, batteries: dict, meter_ids: list[str]) -> dict[str, dict[str, list[float]]]:
+	"""
+	Reshapes the B x T values of a battery variable into the outputs' structure {#meter_id: {#storage_id: [values]}}
+	"""
+	outputs = {n: {} for n in meter_ids}
+	for n, b, row in zip(batteries['meter_ids'], batteries['storage_ids'], values.tolist()):
+		outputs[n][b] = row
+	return outputs
+
+
+def unpack_evs(btm_evs: dict[str, Union[dict, None]], nr_steps: int) -> dict:
+	"""
+	Flattens the Btm EVs of several Meters into arrays with one entry (or row, for time series) per EV
+	:param btm_evs: {#meter_id: {#ev_id: EV parameters} or None}
+	:param nr_steps: number of time steps
+	:return: dictionary with the "owner" (position of the EV's Meter in "btm_evs"), the "meter_ids" and the "ev_ids"
+		of each EV, and one array per EV parameter
+	"""
+	owners, meter_ids, ev_ids, params = [], [], [], []
+	for i, (n, meter_btm_evs) in enumerate(btm_evs.items()):
+		for ev, ev_params in (meter_btm_evs or {}).items():
+			owners.append(i)
+			meter_ids.append(n)
+			ev_ids.append(ev)
+			params.append(ev_params)
+
+	evs = {'owner': np.array(owners, dtype=int), 'meter_ids': meter_ids, 'ev_ids': ev_ids}
+	for key in ('battery_capacity_ev', 'eff_bc_ev', 'eff_bd_ev', 'init_e_ev', 'min_energy_storage_ev', 'pmax_c_ev',
+	            'pmax_d_ev'):
+		evs[key] = np.array([ev_params[key] for ev_params in params], dtype=float)
+	for key in ('bin_ev', 'trip_ev'):
+		evs[key] = np.array([ev_params[key] for ev_params in params], dtype=float).reshape(len(params), nr_steps)
+
+	return evs
+
+
+def add_evs_formulation(model: MatrixModel, evs: dict, nr_steps: int, delta_t: ArrayLike, c_met_rows: np.ndarray) \
+		-> dict:
+	"""
+	Adds the variables and constraints of the Btm EVs (Eq. 41-45) and their contribution to the Meters' net
+	consumption ("C_met" constraints)
+	:param model: the MILP being assembled
+	:param evs: EVs' data, as returned by "unpack_evs"
+	:param nr_steps: number of time steps
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param c_met_rows: N x T array with the indices of the "C_met" constraints
+	:return: dictionary of the variables' indices, per name, each with shape V x T
+	"""
+	shape = (len(evs['owner']), nr_steps)
+	col = lambda key: evs[key][:, np.newaxis]
+	v = {
+		'ev_stored': model.add_variables(shape),
+		'p_ev_charge': model.add_variables(shape),
+		'p_ev_discharge': model.add_variables(shape)
+	}
+
+	# Contribution to the net consumption of the Meters
+	model.add_terms(c_met_rows[evs['owner']], v['p_ev_charge'], -delta_t)
+	model.add_terms(c_met_rows[evs['owner']], v['p_ev_discharge'], delta_t)
+
+	# Eq. 41: ev_stored[t] == ev_stored[t-1] + charged - discharged - trip_ev[t], with ev_stored[-1] == init_e_ev
+	rhs = -evs['trip_ev']
+	rhs[:, 0] += evs['init_e_ev']
+	rows = model.add_rows(shape, lb=rhs, ub=rhs)
+	model.add_terms(rows, v['ev_stored'], 1.0)
+	model.add_terms(rows[:, 1:], v['ev_stored'][:, :-1], -1.0)
+	model.add_terms(rows, v['p_ev_charge'], -col('eff_bc_ev') * delta_t)
+	model.add_terms(rows, v['p_ev_discharge'], 1 / col('eff_bd_ev') * delta_t)
+
+	# Eq. 42-43: charge and discharge limits, only while plugged-in
+	model.add_terms(model.add_rows(shape, ub=col('pmax_d_ev') * evs['bin_ev']), v['p_ev_discharge'],
+	                1 / col('eff_bd_ev'))
+	model.add_terms(model.add_rows(shape, ub=col('pmax_c_ev') * evs['bin_ev']), v['p_ev_charge'], col('eff_bc_ev'))
+
+	# Eq. 44-45: stored energy limits
+	model.add_terms(model.add_rows(shape, ub=col('battery_capacity_ev')), v['ev_stored'], 1.0)
+	model.add_terms(model.add_rows(shape, lb=col('min_energy_storage_ev')), v['ev_stored'], 1.0)
+
+	return v
+
+
+def add_sharing_formulation(model: MatrixModel, v: dict, owner: np.ndarray, nonneg: np.ndarray, big_m: ArrayLike,
+                            rec_big_m: ArrayLike, strict_pos_coeffs: bool, total_share_coeffs: bool,
+                            steps: np.ndarray = None) -> dict:
+	"""
+	Adds the constraints that define the self-consumed energy of each Meter (Eq. 20-29), and, optionally, the
+	constraints on the allocation coefficients (Eq. 30-31) and on sharing all the REC's surplus / deficit (Eq. 32-39),
+	which are common to the pool and bilateral MILPs.
+	The LEM variables ("e_pur", "e_sale", "e_slc") can either be per Meter (pool) or per pair of trading partners
+	(bilateral); in both cases, "owner" maps their rows to the Meters they are summed into.
+	:param model: the MILP being assembled
+	:param v: dictionary of the variables' indices; N x T for the Meters' variables and K x T for the LEM ones
+	:param owner: array with the position of the Meter that owns each of the K rows of the LEM variables
+	:param nonneg: N x T boolean array, True where the access tariffs of the local grid are non-negative
+	:param big_m: big-M values of the constraints that only involve the Meters' net consumption (or consumption), for
+		all or per Meter and step (N x T) [kWh]
+	:param rec_big_m: big-M values of the constraints that involve the LEM flows or the REC's net consumption, for
+		all or per step (T) [kWh]
+	:param strict_pos_coeffs: if True, the allocation coefficients are non-negative
+	:param total_share_coeffs: if True, all the surplus / deficit of the REC must be shared
+	:param steps: T boolean mask of the steps where the LEM is modelled (see "lem_steps_needed"); the constraints
+		are skipped elsewhere and the new binary variables fixed to 0; all steps if None
+	:return: dictionary with the indices of the new (binary) variables, per name
+	"""
+	shape = nonneg.shape
+	big_m = np.broadcast_to(np.asarray(big_m, dtype=float), shape)
+	rec_big_m = np.broadcast_to(np.asarray(rec_big_m, dtype=float), shape[1])
+	rec_big_m_grid = np.broadcast_to(rec_big_m, shape)
+	steps = np.ones(shape[1], dtype=bool) if steps is None else np.asarray(steps, dtype=bool)
+	everywhere = np.broadcast_to(steps, shape)
+
+	def rows_where(mask: np.ndarray, lb: ArrayLike = -np.inf, ub: ArrayLike = np.inf) -> np.ndarray:
+		# N x T map of the new constraints' indices, set only where "mask" holds (and -1 elsewhere)
+		rows_map = np.full(shape, -1)
+		rows_map[mask] = model.add_rows(int(mask.sum()), lb=np.broadcast_to(lb, shape)[mask],
+		                                ub=np.broadcast_to(ub, shape)[mask])
+		return rows_map
+
+	def terms(rows_map: np.ndarray, name: str, coef: ArrayLike):
+		# Adds a (Meter or LEM) variable to the constraints set in "rows_map", with a coefficient for all or per
+		# Meter and step
+		rows = rows_map[owner] if name in LEM_VARIABLES else rows_map
+		keep = rows >= 0
+		model.add_terms(rows[keep], v[name][keep], np.broadcast_to(coef, rows.shape)[keep])
+
+	new = {}
+	neg = ~nonneg & everywhere
+	nonneg = nonneg & everywhere
+
+	# Eq. 20-23 (and auxiliary), where the access tariffs are non-negative
+	rows = rows_where(nonneg, lb=0.0)
+	terms(rows, 'e_consumed', 1.0)
+	terms(rows, 'e_cmet', -1.0)
+	rows = rows_where(nonneg, lb=0.0)
+	terms(rows, 'e_alc', 1.0)
+	terms(rows, 'e_pur', -1.0)
+	terms(rows, 'e_sale', 1.0)
+	rows = rows_where(nonneg, lb=-big_m)
+	terms(rows, 'e_slc', 1.0)
+	terms(rows, 'e_consumed', -1.0)
+	terms(rows, 'delta_slc', -big_m)
+	rows = rows_where(nonneg, lb=0.0)
+	terms(rows, 'e_slc', 1.0)
+	terms(rows, 'e_alc', -1.0)
+	terms(rows, 'delta_slc', rec_big_m_grid)
+	terms(rows_where(nonneg, lb=0.0, ub=0.0), 'delta_cmet', 1.0)
+	terms(rows_where(nonneg, lb=0.0, ub=0.0), 'delta_alc', 1.0)
+
+	# Eq. 24-29 (and auxiliary), where some access tariff is negative
+	rows = rows_where(neg, ub=0.0)
+	terms(rows, 'e_consumed', 1.0)
+	terms(rows, 'e_cmet', -1.0)
+	terms(rows, 'delta_cmet', -big_m)
+	rows = rows_where(neg, ub=big_m)
+	terms(rows, 'e_consumed', 1.0)
+	terms(rows, 'delta_cmet', big_m)
+	rows = rows_where(neg, ub=0.0)
+	terms(rows, 'e_alc', 1.0)
+	terms(rows, 'e_pur', -1.0)
+	terms(rows, 'e_sale', 1.0)
+	terms(rows, 'delta_alc', -rec_big_m_grid)
+	rows = rows_where(neg, ub=rec_big_m_grid)
+	terms(rows, 'e_alc', 1.0)
+	terms(rows, 'delta_alc', rec_big_m_grid)
+	rows = rows_where(neg, ub=0.0)
+	terms(rows, 'e_slc', 1.0)
+	terms(rows, 'e_consumed', -1.0)
+	rows = rows_where(neg, ub=0.0)
+	terms(rows, 'e_slc', 1.0)
+	terms(rows, 'e_alc', -1.0)
+	terms(rows_where(neg, lb=0.0, ub=0.0), 'delta_slc', 1.0)
+
+	if strict_pos_coeffs:
+		# Eq. 30-31
+		v['delta_coeff'] = new['delta_coeff'] = model.add_variables(shape, ub=everywhere, binary=True)
+		rows = rows_where(everywhere, ub=0.0)
+		terms(rows, 'e_sale', 1.0)
+		terms(rows, 'e_pur', -1.0)
+		terms(rows, 'e_cmet', 1.0)
+		terms(rows, 'delta_coeff', -big_m)
+		rows = rows_where(everywhere, ub=rec_big_m_grid)
+		terms(rows, 'e_sale', 1.0)
+		terms(rows, 'e_pur', -1.0)
+		terms(rows, 'delta_coeff', rec_big_m_grid)
+
+	if total_share_coeffs:
+		v['delta_rec_balance'] = new['delta_rec_balance'] = rec = model.add_variables(shape[1], ub=steps, binary=True)
+		v['delta_meter_balance'] = new['delta_meter_balance'] = model.add_variables(shape, ub=everywhere, binary=True)
+
+		# Eq. 32-33
+		for lb, ub in ((0.0, np.inf), (-np.inf, rec_big_m[steps])):
+			rows = model.add_rows(int(steps.sum()), lb=lb, ub=ub)
+			model.add_terms(rows, v['e_cmet'][:, steps], 1.0)
+			model.add_terms(rows, rec[steps], rec_big_m[steps])
+
+		# Eq. 34-35
+		for lb, ub in ((0.0, np.inf), (-np.inf, big_m)):
+			rows = rows_where(everywhere, lb=lb, ub=ub)
+			terms(rows, 'e_cmet', 1.0)
+			terms(rows, 'delta_meter_balance', big_m)
+
+		# Eq. 36-39, where the binary variables are added with the signs of
+		# "- rec_big_m * (1 - delta_meter_balance + delta_rec_balance)" on Eq. 36, the opposite on Eq. 37, and swapped
+		# on Eq. 38-39
+		for name, cmet_coef, bin_sign, lb, ub in (('e_sale', 1.0, 1.0, -rec_big_m_grid, np.inf),
+		                                          ('e_sale', 1.0, -1.0, -np.inf, rec_big_m_grid),
+		                                          ('e_pur', -1.0, -1.0, -rec_big_m_grid, np.inf),
+		                                          ('e_pur', -1.0, 1.0, -np.inf, rec_big_m_grid)):
+			rows = rows_where(everywhere, lb=lb, ub=ub)
+			terms(rows, name, 1.0)
+			terms(rows, 'e_cmet', cmet_coef)
+			terms(rows, 'delta_meter_balance', -bin_sign * rec_big_m_grid)
+			model.add_terms(rows[everywhere], np.broadcast_to(rec, shape)[everywhere],
+			                bin_sign * rec_big_m_grid[everywhere])
+
+	return new
+
+
+def add_exchange_terms(model: MatrixModel, v: dict, prices: ArrayLike, targets: ArrayLike, rho: float,
+                       breakpoints: ArrayLike) -> dict:
+	"""
+	Adds the (augmented) Lagrangian relaxation of the market equilibrium (Eq. 11) used by the decomposed solver (see
+	"AdmmStageTwoMILPPool"): each Meter's net LEM sales, x = e_sale - e_pur, are priced at "prices" and penalized by
+	their squared deviation from "targets", rho / 2 * (x - target) ^ 2. Since the solver is linear, that quadratic
+	term is replaced by its tangents at "breakpoints" (an outer, piecewise linear approximation, exact at them).
+	:param model: the MILP being assembled
+	:param v: dictionary of the variables' indices, with the N x T "e_sale" and "e_pur" of the Meters
+	:param prices: Lagrange multipliers of the market equilibrium, per step (T) or per Meter and step (N x T) [€/kWh]
+	:param targets: targets of the Meters' net LEM sales, per Meter and step (N x T) [kWh]
+	:param rho: penalty parameter [€/kWh^2]
+	:param breakpoints: deviations from the targets where the tangents of the penalty are taken [kWh]
+	:return: dictionary with the indices of the new variables: the deviations ("exchange_deviation") and their
+		penalties ("exchange_penalty"), both N x T
+	"""
+	shape = v['e_sale'].shape
+	prices = np.broadcast_to(np.asarray(prices, dtype=float), shape)
+	new = {
+		'exchange_deviation': model.add_variables(shape, lb=-np.inf),
+		'exchange_penalty': model.add_variables(shape)
+	}
+
+	# x - deviation = target
+	rows = model.add_rows(shape, lb=targets, ub=targets)
+	model.add_terms(rows, v['e_sale'], 1.0)
+	model.add_terms(rows, v['e_pur'], -1.0)
+	model.add_terms(rows, new['exchange_deviation'], -1.0)
+
+	# penalty >= rho * b * deviation - rho / 2 * b ^ 2, for each breakpoint b
+	for b in np.asarray(breakpoints, dtype=float):
+		rows = model.add_rows(shape, lb=-rho / 2 * b ** 2)
+		model.add_terms(rows, new['exchange_penalty'], 1.0)
+		model.add_terms(rows, new['exchange_deviation'], -rho * b)
+
+	model.add_cost(v['e_sale'], prices)
+	model.add_cost(v['e_pur'], -prices)
+	model.add_cost(new['exchange_penalty'], 1.0)
+
+	return new
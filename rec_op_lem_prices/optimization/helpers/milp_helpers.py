@@ -1,10 +1,19 @@
 import math
 import numpy as np
+import os
+import time
+import uuid
 
+from numbers import Number
 from rec_op_lem_prices.custom_types.optimization_helpers_types import (
 	MetersDict,
 	MetersParamDict
 )
+from pulp import (
+	LpBinary,
+	LpProblem,
+	LpVariable
+)
 from typing import Union
 
 
@@ -40,18 +49,51 @@ def dict_per_param(meters: MetersDict, values_id: str) -> MetersParamDict:
 	return {key: value.get(values_id) for key, value in meters.items()}
 
 
-def time_intervals(horizon: Union[int, float], delta_t: Union[int, float], func='int') -> int:
+def individual_backpack(backpack: dict, meter_id: str) -> dict:
+	"""
+	Prepares the inputs of the individual optimization stage (stage 1) of a Meter, according to BackpackS1Dict, from
+	the inputs of a pre-delivery collective MILP.
+	:param backpack: inputs of the collective MILP
+	:param meter_id: ID of the Meter
+	:return: the inputs of the Meter's individual MILP
+	"""
+	meter_data = backpack['meters'][meter_id]
+	return {
+		'btm_storage': meter_data['btm_storage'],
+		'delta_t': backpack['delta_t'],
+		'e_c': meter_data['e_c'],
+		'e_g': meter_data['e_g'],
+		'horizon': backpack['horizon'],
+		'id': meter_id,
+		'l_buy': meter_data['l_buy'],
+		'l_extra': backpack['l_extra'],
+		'l_market_buy': backpack['l_market_buy'],
+		'l_market_sell': backpack['l_market_sell'],
+		'l_sell': meter_data['l_sell'],
+		'max_p': meter_data['max_p']
+	}
+
+
+def time_intervals(horizon: Union[int, float], delta_t: Union[int, float, list[float], np.ndarray], func='int') \
+		-> int:
 	"""
 	Retrieves the integer number of time steps within a horizon, provided the duration of those steps.
 	By defining "func", the rounding method to integer can be changed.
 	:param horizon: an interval of time in hours
-	:param delta_t: duration of the time intervals in which th horizon is divided; provided in hours
+	:param delta_t: duration of the time intervals in which th horizon is divided; provided in hours, either as a
+		single value or as a list with the duration of each time interval, that must add up to the horizon
 	:param func: rounding method to achieve an integer; available options are:
 	 - "ceil": rounds to the highest nearest integer
 	 - "floor": rounds to the smallest nearest integer
 	 - "int": truncates the floating point value
 	:return: the resulting integer expressing the total number of time intervals
 	"""
+	if not isinstance(delta_t, Number):
+		if not math.isclose(sum(delta_t), horizon, rel_tol=1E-9, abs_tol=1E-6):
+			raise ValueError(f'The durations of the time intervals ({sum(delta_t)}h) do not match the horizon '
+			                 f'({horizon}h).')
+		return len(delta_t)
+
 	if func == 'ceil':
 		return math.ceil(horizon / delta_t)
 	elif func == 'floor':
@@ -62,6 +104,33 @@ def time_intervals(horizon: Union[int, float], delta_t: Union[int, float], func=
 		raise ValueError('Please provide a valid division method within the options "ceil", "floor" and "int".')
 
 
+def step_durations(delta_t: Union[int, float, list[float], np.ndarray], nr_steps: int) -> np.ndarray:
+	"""
+	Returns the duration of each time interval, for a uniform ("delta_t" as a single value) or a variable time
+	resolution ("delta_t" as a list with the duration of each time interval).
+	:param delta_t: duration of the time intervals, in hours
+	:param nr_steps: number of time intervals
+	:return: array with the duration of each time interval, in hours
+	"""
+	durations = np.asarray(delta_t, dtype=float)
+	if durations.ndim > 0 and durations.shape != (nr_steps,):
+		raise ValueError(f'Please provide one duration per time interval ({nr_steps}) in "delta_t".')
+	return np.broadcast_to(durations, (nr_steps,)).copy()
+
+
+def binary_variable(name: str, binary=True) -> LpVariable:
+	"""
+	Creates a binary variable or, if it was found to be unnecessary (see "presolve_helpers"), its relaxation to a
+	continuous variable in [0, 1].
+	:param name: name of the variable
+	:param binary: if False, the variable is relaxed
+	:return: the puLP variable
+	"""
+	if binary:
+		return LpVariable(name, cat=LpBinary)
+	return LpVariable(name, lowBound=0, upBound=1)
+
+
 def round_up(val: float, decimals=3) -> float:
 	"""
 	Rounds a float to the nearest highest float with the number of decimals specified;
@@ -74,3 +143,67 @@ def round_up(val: float, decimals=3) -> float:
 	:return: the rounded value
 	"""
 	return round(val + 5*10**(-decimals-1), decimals)
+
+
+def export_milp(milp: LpProblem, export_dir: str, prefix: str, file_format='lp') -> str:
+	"""
+	Writes a MILP formulation to a file, for debugging purposes.
+	Each call writes to a new file, named after the prefix, the current time and a random suffix, so that
+	parallel runs (or successive solves of the same MILP) do not overwrite each other.
+	:param milp: the MILP formulation to export
+	:param export_dir: directory where the file is written; created if it does not exist
+	:param prefix: first part of the file name, identifying the MILP
+	:param file_format: one of "lp" or "mps"
+	:return: the path to the file written
+	"""
+	if file_format not in ('lp', 'mps'):
+		raise ValueError('Please provide a valid export format within the options "lp" and "mps".')
+
+	os.makedirs(export_dir, exist_ok=True)
+	file_name = f'{prefix}_{time.strftime("%Y%m%dT%H%M%S")}_{uuid.uuid4().hex[:8]}.{file_format}'
+	file_path = os.path.join(export_dir, file_name.replace(os.sep, '_'))
+	if file_format == 'lp':
+		milp.writeLP(file_path)
+	else:
+		milp.writeMPS(file_path)
+
+	return file_path
+
+
+def lem_flows_as_variables(values: dict, market: str) -> dict:
+	"""
+	Renames the LEM flows of a collective MILP's outputs (e.g., "e_pur_pool") after the respective variables (e.g.,
+	"e_pur"), so that the outputs of a previous solution can be used as a starting point (see "set_initial_values")
+	:param values: structure with the same format as the outputs of the collective MILP
+	:param market: one of "pool" or "bilateral", the suffix of the LEM flows' outputs
+	:return: a shallow copy of "values" with the LEM flows also under the names of the variables
+	"""
+	renamed = {**values}
+	for name in ('e_pur', 'e_sale', 'e_slc'):
+		if f'{name}_{market}' in values:
+			renamed[name] = values[f'{name}_{market}']
+	return renamed
+
+
+def set_initial_values(lp_vars: Union[LpVariable, dict, list], values: Union[float, dict, list]):
+	"""
+	Sets the initial values (i.e., a MIP start) of a MILP's variables, from a structure with the same nesting as the
+	variables' handles (e.g., the outputs of a previous solution of the same MILP).
+	Keys missing from "values", and None values, are ignored, so partial starting points can be provided.
+	:param lp_vars: variables' handles, possibly nested in dictionaries (per name, Meter, asset, ...) and lists
+		(per time step); constants in place of variables (e.g., those skipped on some steps) are ignored
+	:param values: starting values, with the same nesting as "lp_vars"
+	"""
+	if values is None:
+		return
+	if isinstance(lp_vars, LpVariable):
+		lp_vars.setInitialValue(values)
+	elif isinstance(lp_vars, Number):
+		return
+	elif isinstance(lp_vars, dict):
+		for key, key_vars in lp_vars.items():
+			if key in values:
+				set_initial_values(key_vars, values[key])
+	else:
+		for step_vars, step_values in zip(lp_vars, values):
+			set_initial_values(step_vars, step_values)
@@ -0,0 +1,149 @@
+import numpy as np
+
+from concurrent.futures import (
+	as_completed,
+	ProcessPoolExecutor
+)
+from multiprocessing import get_context
+from rec_op_lem_prices.configs.configs import (
+	MAX_NBYTES,
+	N_JOBS
+)
+from joblib import Parallel, delayed
+from loguru import logger
+from typing import (
+	Any,
+	Callable,
+	Iterator
+)
+
+
+# Set on the workers of "run_as_completed", so that their tasks run their own parallel procedures sequentially instead
+# of each spawning a pool of workers of its own
+_SEQUENTIAL = False
+
+
+def _set_sequential():
+	"""
+	Initializer of the workers of "run_as_completed"
+	"""
+	global _SEQUENTIAL
+	_SEQUENTIAL = True
+
+
+def _to_arrays(backpack: dict) -> dict:
+	"""
+	Auxiliary function that converts the time series (lists of numbers) of a backpack into NumPy arrays,
+	so that they can be memory-mapped into the workers
+	:param backpack: structure with the inputs of a given procedure
+	:return: shallow copy of the backpack, with its time series as arrays
+	"""
+	return {key: np.asarray(val, dtype=float) if isinstance(val, list) and val and not isinstance(val[0], dict)
+	        else val for key, val in backpack.items()}
+
+
+def _to_lists(backpack: dict) -> dict:
+	"""
+	Auxiliary function that converts the arrays of a backpack back into the lists expected by the MILP classes
+	:param backpack: structure with the inputs of a given procedure
+	:return: shallow copy of the backpack, with its arrays as lists
+	"""
+	return {key: val.tolist() if isinstance(val, np.ndarray) else val for key, val in backpack.items()}
+
+
+def _run_with_lists(func: Callable, backpack: dict, *args):
+	"""
+	Auxiliary function, run on the workers, that restores the backpack's lists before calling "func"
+	:param func: function to be called
+	:param backpack: structure with the inputs of the function, with its time series as (memory-mapped) arrays
+	:param args: extra positional arguments of the function
+	:return: the outputs of the function
+	"""
+	return func(_to_lists(backpack), *args)
+
+
+def _run_sequentially(func: Callable, backpack: dict, *args, **kwargs):
+	"""
+	Auxiliary function that calls "func" in the calling process with its parallel procedures (see "run_in_parallel")
+	run sequentially, as they would on a worker of "run_as_completed"
+	:param func: function to be called
+	:param backpack: structure with the inputs of the function
+	:param args: extra positional arguments of the function
+	:param kwargs: extra keyword arguments of the function
+	:return: the outputs of the function
+	"""
+	global _SEQUENTIAL
+	sequential = _SEQUENTIAL
+	_SEQUENTIAL = True
+	try:
+		return func(backpack, *args, **kwargs)
+	finally:
+		_SEQUENTIAL = sequential
+
+
+def run_in_parallel(func: Callable, backpacks: list[dict], *args, n_jobs: int = None) -> list:
+	"""
+	Function to run "func" for each of the provided backpacks on a shared pool of worker processes.
+	The pool is joblib's reusable (loky) executor, so the workers are only spawned on the first call and are kept alive
+	for the following ones (e.g., across the iterations of a pricing loop), instead of a new pool being created per call.
+	Time series are passed to the workers as arrays; those larger than "MAX_NBYTES" (configurable through the
+	REC_OP_LEM_PRICES_MAX_NBYTES environment variable) are dumped once per call to a file that the workers memory-map,
+	instead of being pickled into every task sent to them, while shorter ones are pickled. Note that the workers still
+	convert the arrays back into lists before calling "func", so this saves the transfer of the data, not its copy.
+	:param func: function to be called, with the signature func(backpack, *args)
+	:param backpacks: list with the inputs of each call
+	:param args: extra positional arguments, common to all calls
+	:param n_jobs: number of worker processes; if not provided, defaults to "N_JOBS" (configurable through the
+		REC_OP_LEM_PRICES_N_JOBS environment variable); with 1 worker, or when called from a task of
+		"run_as_completed", calls are run sequentially in the calling process
+	:return: list with the outputs of each call, in the same order as the backpacks
+	"""
+	n_jobs = N_JOBS if n_jobs is None else n_jobs
+	if n_jobs == 1 or len(backpacks) <= 1 or _SEQUENTIAL:
+		return [func(backpack, *args) for backpack in backpacks]
+
+	parallel = Parallel(n_jobs=n_jobs, backend='loky', max_nbytes=MAX_NBYTES, mmap_mode='r')
+	return parallel(delayed(_run_with_lists)(func, _to_arrays(backpack), *args) for backpack in backpacks)
+
+
+def run_as_completed(func: Callable, backpacks: list[dict], *args, priorities: list[float] = None, n_jobs: int = None,
+                     **kwargs) -> Iterator[tuple[int, Any]]:
+	"""
+	Function to run "func" for each of the provided backpacks, as independent tasks (e.g., the pricing loops of several
+	RECs), on a bounded pool of worker processes, yielding their outputs as soon as each task finishes.
+	Tasks are started by decreasing priority (e.g., estimated size; see "estimated_size"), so that the longest ones do
+	not start last and delay the whole batch. The parallel procedures of each task (see "run_in_parallel") run
+	sequentially on its worker, so that no more than "n_jobs" processes (plus the solvers' subprocesses each of them
+	waits on) run at once, whatever the number and size of the tasks.
+	:param func: function to be called, with the signature func(backpack, *args, **kwargs)
+	:param backpacks: list with the inputs of each task
+	:param args: extra positional arguments, common to all tasks
+	:param priorities: priority of each task, in the same order as the backpacks; tasks are started in the provided
+		order if not provided
+	:param n_jobs: number of worker processes; if not provided (or not positive), defaults to "N_JOBS"; with 1 worker,
+		tasks are run one after the other in the main process, with their parallel procedures also run sequentially
+	:param kwargs: extra keyword arguments, common to all tasks
+	:return: iterator over tuples with the position of each task in "backpacks" and its outputs, in the order the tasks
+		finish; a task that raised an exception has the exception as its outputs, so that the others are not lost
+	"""
+	n_jobs = N_JOBS if n_jobs is None or n_jobs < 1 else n_jobs
+	priorities = [0.0] * len(backpacks) if priorities is None else priorities
+	order = sorted(range(len(backpacks)), key=lambda idx: -priorities[idx])
+
+	def outputs_of(idx: int, call: Callable) -> Any:
+		try:
+			return call()
+		except Exception as exc:
+			logger.error(f'Task {idx} raised an exception: {exc!r}')
+			return exc
+
+	if n_jobs == 1 or len(backpacks) <= 1:
+		for idx in order:
+			yield idx, outputs_of(idx, lambda: _run_sequentially(func, backpacks[idx], *args, **kwargs))
+		return
+
+	with ProcessPoolExecutor(max_workers=min(n_jobs, len(backpacks)), mp_context=get_context('spawn'),
+	                         initializer=_set_sequential) as executor:
+		futures = {executor.submit(func, backpacks[idx], *args, **kwargs): idx for idx in order}
+		for future in as_completed(futures):
+			yield futures[future], outputs_of(futures[future], future.result)
@@ -0,0 +1,170 @@
+"""
+Helpers for the per-pair data of a bilateral market structure: the trading graph, i.e., the pairs of Meters that are
+allowed to trade energy with each other (the bilateral MILP is only generated over the edges of that graph), and the
+access tariffs of the local grid between those pairs ("l_grid").
+"""
+import itertools
+import numpy as np
+
+from rec_op_lem_prices.custom_types.stage_two_milp_bilateral_types import (
+	LGridBilateralSpec,
+	Partners,
+	PartnersSpec,
+	Tariff
+)
+from typing import Iterable
+
+
+COMPACT_L_GRID_KEYS = {'default', 'level_tariffs', 'overrides', 'voltage_levels'}
+
+
+def _tariff_array(tariff: Tariff, nr_steps: int) -> np.ndarray:
+	"""
+	Broadcasts a tariff, either uniform (float) or time-varying (array), to an array with "nr_steps" values
+	"""
+	tariff = np.asarray(tariff, dtype=float)
+	if tariff.ndim > 0 and tariff.shape != (nr_steps,):
+		raise ValueError(f'Time-varying "l_grid" tariffs must have {nr_steps} values; got {tariff.shape[0]}.')
+	return np.broadcast_to(tariff, (nr_steps,))
+
+
+def l_grid_to_array(l_grid: LGridBilateralSpec, meter_ids: list[str], nr_steps: int) -> np.ndarray:
+	"""
+	Converts the access tariffs of the local grid between pairs of Meters to a dense N x N x T array, where
+	array[i, j, t] is the tariff applicable at step t to the energy self-consumed by the i-th Meter and allocated from
+	the j-th Meter (following the order of "meter_ids"). Pairs without a tariff, including each Meter with itself,
+	are NaN.
+	:param l_grid: one of:
+		- {#meter_id: {#meter_id: array with the tariffs between both Meters}}, with the pairs provided;
+		- an N x N x T array, already ordered as "meter_ids", where NaN marks the pairs without a tariff;
+		- a compact form, where each tariff can be uniform (float) or time-varying (array): {
+			'default': (optional) tariff applicable to all pairs,
+			'voltage_levels': (optional) {#meter_id: voltage level (or any other grouping) of the Meter},
+			'level_tariffs': (optional) {#level: {#level: tariff}}, applicable to the pairs of Meters of those levels,
+				taking precedence over "default",
+			'overrides': (optional) {#meter_id: {#meter_id: tariff}}, taking precedence over all the above
+		}
+	:param meter_ids: IDs of the Meters
+	:param nr_steps: number of time steps
+	:return: N x N x T array with the tariffs, in €/kWh
+	"""
+	nr_meters = len(meter_ids)
+
+	if isinstance(l_grid, np.ndarray):
+		if l_grid.shape != (nr_meters, nr_meters, nr_steps):
+			raise ValueError(f'"l_grid" array must have shape {(nr_meters, nr_meters, nr_steps)}; got {l_grid.shape}.')
+		array = l_grid.astype(float, copy=True)
+
+	elif l_grid and set(l_grid.keys()) <= COMPACT_L_GRID_KEYS:
+		array = np.full((nr_meters, nr_meters, nr_steps), np.nan)
+		if l_grid.get('default') is not None:
+			array[:] = _tariff_array(l_grid['default'], nr_steps)
+		if l_grid.get('level_tariffs'):
+			levels = np.array([l_grid['voltage_levels'][n] for n in meter_ids], dtype=object)
+			for level_from, level_tariffs in l_grid['level_tariffs'].items():
+				for level_to, tariff in level_tariffs.items():
+					mask = np.outer(levels == level_from, levels == level_to)
+					array[mask] = _tariff_array(tariff, nr_steps)
+		overrides = l_grid.get('overrides') or {}
+		pairs = [(n, m, tariff) for n, n_overrides in overrides.items() for m, tariff in n_overrides.items()]
+
+	else:
+		array = np.full((nr_meters, nr_meters, nr_steps), np.nan)
+		pairs = [(n, m, tariff) for n, n_tariffs in l_grid.items() for m, tariff in n_tariffs.items()]
+
+	if not isinstance(l_grid, np.ndarray):
+		index = {n: i for i, n in enumerate(meter_ids)}
+		for n, m, tariff in pairs:
+			if n in index and m in index:
+				array[index[n], index[m]] = _tariff_array(tariff, nr_steps)
+
+	# Meters do not trade with themselves
+	array[np.arange(nr_meters), np.arange(nr_meters)] = np.nan
+	return array
+
+
+def all_partners(meter_ids: list[str]) -> Partners:
+	"""
+	Dense (complete) trading graph, where every Meter can trade with all the others
+	:param meter_ids: IDs of the Meters
+	:return: {#meter_id: [list of partners' IDs]}
+	"""
+	return {n: [m for m in meter_ids if m != n] for n in meter_ids}
+
+
+def partners_from_pairs(meter_ids: list[str], pairs: Iterable[tuple[str, str]]) -> Partners:
+	"""
+	Trading graph from a list of explicitly allowed pairs of Meters.
+	Trades are bidirectional, so a pair (n, m) allows n to buy from and sell to m, and vice-versa.
+	:param meter_ids: IDs of the Meters
+	:param pairs: iterable of (meter_id, meter_id) tuples
+	:return: {#meter_id: [list of partners' IDs]}, following the order of "meter_ids"
+	"""
+	edges = set()
+	for n, m in pairs:
+		if n not in meter_ids or m not in meter_ids:
+			raise ValueError(f'Pair ({n}, {m}) includes a Meter that is not part of the REC.')
+		if n != m:
+			edges.update(((n, m), (m, n)))
+
+	return {n: [m for m in meter_ids if (n, m) in edges] for n in meter_ids}
+
+
+def partners_from_l_grid(meter_ids: list[str], l_grid: np.ndarray) -> Partners:
+	"""
+	Trading graph including only the pairs of Meters with tariffs in "l_grid".
+	Since trades are bidirectional, a pair is only included if the tariffs of both directions are provided.
+	:param meter_ids: IDs of the Meters
+	:param l_grid: N x N x T array with the tariffs between pairs of Meters, as returned by "l_grid_to_array"
+	:return: {#meter_id: [list of partners' IDs]}, following the order of "meter_ids"
+	"""
+	present = ~np.isnan(l_grid).any(axis=2)
+	present &= present.T
+	return {n: [meter_ids[j] for j in np.flatnonzero(present[i])] for i, n in enumerate(meter_ids)}
+
+
+def partners_k_nearest(distances: dict[str, dict[str, float]], k: int) -> Partners:
+	"""
+	Trading graph where each Meter can trade with its k nearest Meters (e.g., by electrical distance in the local grid).
+	The graph is made symmetric, so a Meter can end up with more than k partners.
+	:param distances: {#meter_id: {#meter_id: distance between both Meters}}; missing pairs are considered unreachable
+	:param k: number of nearest Meters to connect to each Meter
+	:return: {#meter_id: [list of partners' IDs]}
+	"""
+	assert k >= 0, 'Please provide a non-negative number of neighbours.'
+	meter_ids = list(distances.keys())
+	pairs = itertools.chain.from_iterable(
+		((n, m) for m in sorted((m for m in n_distances if m != n), key=n_distances.get)[:k])
+		for n, n_distances in distances.items()
+	)
+	return partners_from_pairs(meter_ids, pairs)
+
+
+def resolve_partners(meter_ids: list[str], l_grid: np.ndarray, partners: PartnersSpec = None) -> Partners:
+	"""
+	Trading graph to consider in the bilateral MILP, from the "partners" entry of its backpack
+	:param meter_ids: IDs of the Meters
+	:param l_grid: N x N x T array with the tariffs between pairs of Meters, as returned by "l_grid_to_array"
+	:param partners: one of:
+		- None, for a dense graph (all pairs of Meters);
+		- "l_grid", for considering only the pairs with tariffs in "l_grid";
+		- {#meter_id: [list of partners' IDs]}, for an explicit graph (e.g., from "partners_from_pairs" or
+			"partners_k_nearest"), which is made symmetric if it is not
+	:return: {#meter_id: [list of partners' IDs]}, following the order of "meter_ids"
+	"""
+	if partners is None:
+		graph = all_partners(meter_ids)
+	elif isinstance(partners, str) and partners == 'l_grid':
+		return partners_from_l_grid(meter_ids, l_grid)
+	elif isinstance(partners, dict):
+		graph = partners_from_pairs(meter_ids, ((n, m) for n, n_partners in partners.items() for m in n_partners))
+	else:
+		raise ValueError('Please provide "partners" as None, "l_grid" or a dictionary with the partners of each Meter.')
+
+	index = {n: i for i, n in enumerate(meter_ids)}
+	missing_mask = np.isnan(l_grid).any(axis=2)
+	missing = [(n, m) for n, n_partners in graph.items() for m in n_partners if missing_mask[index[n], index[m]]]
+	if missing:
+		raise ValueError(f'"l_grid" must be provided for all pairs of trading partners; missing {missing[:5]}.')
+
+	return graph
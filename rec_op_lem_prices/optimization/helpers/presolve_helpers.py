@@ -0,0 +1,200 @@
+"""
+Data-driven analysis of the MILPs, run before defining them:
+- to find the binary variables that are provably unnecessary for the data at hand: their pair of (big-M) exclusivity
+constraints can then be dropped, since an optimal solution of the remaining problem never violates it, and their
+values are retrieved from the solution afterward;
+- to derive tight big-M values and variables' bounds, per Meter and step, from the Meters' data;
+- to find the steps where no internal trade can take place, whose LEM variables and constraints can be skipped;
+- to estimate the size of the MILPs of a REC, for scheduling several of them.
+"""
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+from typing import Union
+
+
+ArrayLike = Union[float, list, np.ndarray]
+
+
+def supply_binaries_needed(l_buy: ArrayLike, l_sell: ArrayLike, l_market_buy: ArrayLike, l_market_sell: ArrayLike) \
+		-> np.ndarray:
+	"""
+	Flags the steps where the supply / surplus exclusivity binaries ("delta_sup") are needed.
+	Whenever the cheapest buying tariff is above the best selling tariff, supplying and selling at the same time is
+	strictly more expensive than the net flow alone (which satisfies the same balances), so it is never optimal.
+	:param l_buy: supply energy tariffs, per Meter and step (N x T) or per step [€/kWh]
+	:param l_sell: feed in energy tariffs, with the same shape as "l_buy" [€/kWh]
+	:param l_market_buy: market-indexed buying tariff, per step [€/kWh]
+	:param l_market_sell: market-indexed selling tariff, per step [€/kWh]
+	:return: boolean array, with the shape of "l_buy", True where the binary is needed
+	"""
+	cheapest_buy = np.minimum(np.asarray(l_buy, dtype=float), np.asarray(l_market_buy, dtype=float))
+	best_sell = np.maximum(np.asarray(l_sell, dtype=float), np.asarray(l_market_sell, dtype=float))
+	return ~(cheapest_buy > best_sell)
+
+
+def charge_binaries_needed(batteries: dict, e_net: np.ndarray, p_meter_max: float, delta_t: ArrayLike,
+                           l_buy: ArrayLike, l_sell: ArrayLike, l_market_buy: ArrayLike, l_market_sell: ArrayLike) \
+		-> np.ndarray:
+	"""
+	Flags the steps where the charge / discharge exclusivity binaries ("delta_bc") of the batteries of a single Meter
+	are needed, in an individual (first stage) MILP.
+	Charging and discharging at the same time keeps the energy content of a battery while dissipating energy, when its
+	round-trip efficiency is below 1; without the dissipation, the Meter consumes less energy, which is strictly
+	cheaper when no tariff is negative (and some tariff, or the degradation cost, is positive), provided that the
+	Meter can never overstep its maximum power by injecting, i.e., when the dissipation cannot avoid extra power.
+	:param batteries: batteries' data of the Meter, as returned by "unpack_batteries"
+	:param e_net: array with the Meter's net consumption per step, e_c - e_g [kWh]
+	:param p_meter_max: maximum power flow desired at the Meter [kW]
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param l_buy: supply energy tariff, per step [€/kWh]
+	:param l_sell: feed in energy tariff, per step [€/kWh]
+	:param l_market_buy: market-indexed buying tariff, per step [€/kWh]
+	:param l_market_sell: market-indexed selling tariff, per step [€/kWh]
+	:return: boolean array B x T, True where the binary is needed
+	"""
+	tariffs = np.array([np.broadcast_to(np.asarray(tariff, dtype=float), np.shape(e_net))
+	                    for tariff in (l_buy, l_sell, l_market_buy, l_market_sell)])
+	nonneg = (tariffs >= 0).all(axis=0)
+	positive = (tariffs > 0).all(axis=0)
+	delta_t = np.asarray(delta_t, dtype=float)
+	min_e_cmet = np.asarray(e_net, dtype=float) - batteries['p_max'].sum() * delta_t
+	no_extra_power = min_e_cmet >= -p_meter_max * delta_t
+
+	lossy = (batteries['eff_bc'] * batteries['eff_bd'] < 1)[:, np.newaxis]
+	strictly_cheaper = positive | (batteries['degradation_cost'] > 0)[:, np.newaxis]
+	return ~(lossy & nonneg & no_extra_power & strictly_cheaper)
+
+
+def relaxed_binaries_values(values: ArrayLike, needed: ArrayLike, on_flow: ArrayLike) -> np.ndarray:
+	"""
+	Retrieves the values of a family of binaries of which some were relaxed: since the relaxed ones are not bound to
+	0 or 1 by the solver, they are set to 1 where the flow they would switch on is positive, and to 0 otherwise
+	:param values: solution values of the (binary and relaxed) variables
+	:param needed: mask of the variables that were kept binary
+	:param on_flow: solution values of the flow allowed when the binary is 1 (e.g., supply for "delta_sup")
+	:return: array with the values of the binaries, with the shape of "values"
+	"""
+	values = np.asarray(values, dtype=float)
+	on = (np.asarray(on_flow, dtype=float) > 0).astype(float)
+	return np.where(np.broadcast_to(needed, values.shape), values, on)
+
+
+def btm_energy_limits(batteries: dict, nr_meters: int, nr_steps: int, delta_t: ArrayLike, evs: dict = None) \
+		-> tuple[np.ndarray, np.ndarray]:
+	"""
+	Computes the maximum energy that the Btm assets of each Meter can absorb (charge) and inject (discharge) per step.
+	:param batteries: batteries' data, as returned by "unpack_batteries"
+	:param nr_meters: number of Meters
+	:param nr_steps: number of time steps
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param evs: EVs' data, as returned by "unpack_evs", if any
+	:return: tuple with the N x T arrays of the energy absorbed and injected at most by the Btm assets [kWh]
+	"""
+	delta_t = np.asarray(delta_t, dtype=float)
+	e_in = np.zeros((nr_meters, nr_steps))
+	e_out = np.zeros((nr_meters, nr_steps))
+	np.add.at(e_in, batteries['owner'], batteries['p_max'][:, np.newaxis] * delta_t)
+	np.add.at(e_out, batteries['owner'], batteries['p_max'][:, np.newaxis] * delta_t)
+	if evs is not None:
+		col = lambda key: evs[key][:, np.newaxis]
+		np.add.at(e_in, evs['owner'], col('pmax_c_ev') / col('eff_bc_ev') * evs['bin_ev'] * delta_t)
+		np.add.at(e_out, evs['owner'], col('pmax_d_ev') * col('eff_bd_ev') * evs['bin_ev'] * delta_t)
+	return e_in, e_out
+
+
+def net_consumption_bounds(e_net: np.ndarray, e_in: np.ndarray, e_out: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Bounds the net consumption of each Meter ("e_cmet") per step, which only depends on the data and on the Btm
+	assets' operation (the maximum power flow desired at the Meter is a soft limit, violated at a cost).
+	:param e_net: N x T array with the Meters' net consumption, e_c - e_g [kWh]
+	:param e_in: N x T array with the energy absorbed at most by the Meters' Btm assets [kWh]
+	:param e_out: N x T array with the energy injected at most by the Meters' Btm assets [kWh]
+	:return: tuple with the N x T arrays of the lowest and highest net consumption of the Meters [kWh]
+	"""
+	e_net = np.asarray(e_net, dtype=float)
+	return e_net - e_out, e_net + e_in
+
+
+def big_m_values(e_cmet_min: np.ndarray, e_cmet_max: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Derives tight big-M values for the collective MILPs, from the bounds of the Meters' net consumption:
+	- per Meter and step, for the constraints that only involve the Meter's net consumption (or its consumption);
+	- per step, for the constraints that involve the retail or LEM flows, since a Meter can buy (sell) energy for
+	(from) the other Meters, but, without trading cycles, no flow exceeds the sum of all the Meters' net flows.
+	The same values are used as upper bounds of the respective variables.
+	:param e_cmet_min: N x T array with the lowest net consumption of the Meters [kWh]
+	:param e_cmet_max: N x T array with the highest net consumption of the Meters [kWh]
+	:return: tuple with the N x T array of the big-M values per Meter and the T array of the big-M values of the
+		REC [kWh]
+	"""
+	meter_big_m = np.maximum(np.maximum(-e_cmet_min, e_cmet_max), 0.0)
+	return meter_big_m, meter_big_m.sum(axis=0)
+
+
+def lem_steps_needed(e_net: np.ndarray, batteries: dict, delta_t: ArrayLike, l_buy: ArrayLike,
+                     l_market_buy: ArrayLike, l_grid: ArrayLike, second_stage: bool, strict_pos_coeffs: bool,
+                     evs: dict = None) -> np.ndarray:
+	"""
+	Flags the steps where the LEM variables and constraints of the collective MILPs are needed.
+	On a step where no Meter can have a surplus, even by discharging its Btm assets at full power, no Meter can sell
+	its own energy, so the LEM flows are null on an optimal solution whenever:
+	- the allocation coefficients must be non-negative, since no Meter can then sell more than it buys;
+	- or, on single stage runs, buying from a retailer to sell internally (at the cost of the access tariff) is
+	strictly more expensive than buying directly from a retailer, for every pair of Meters.
+	On second stage runs without that restriction, internal trades can shift costs between Meters to meet their
+	stage 1 costs, so no step is skipped.
+	:param e_net: N x T array with the Meters' net consumption, e_c - e_g [kWh]
+	:param batteries: batteries' data, as returned by "unpack_batteries"
+	:param delta_t: interval settlement duration, single or per step [h]
+	:param l_buy: supply energy tariffs, per Meter and step (N x T) [€/kWh]
+	:param l_market_buy: market-indexed buying tariff, per step [€/kWh]
+	:param l_grid: (lowest) access tariff of the local grid, per step [€/kWh]
+	:param second_stage: True on second stage runs, bound by the stage 1 costs
+	:param strict_pos_coeffs: True if the allocation coefficients are non-negative
+	:param evs: EVs' data, as returned by "unpack_evs", if any
+	:return: boolean array T, True where the LEM is needed
+	"""
+	e_net = np.asarray(e_net, dtype=float)
+	nr_meters, nr_steps = e_net.shape
+	_, e_out = btm_energy_limits(batteries, nr_meters, nr_steps, delta_t, evs=evs)
+	# batteries with a null nominal capacity are not constrained on the collective MILPs
+	e_out[batteries['owner'][batteries['e_bn'] <= 0]] = np.inf
+	surplus = (e_net - e_out < 0).any(axis=0)
+	if strict_pos_coeffs:
+		return surplus
+	if second_stage:
+		return np.ones(nr_steps, dtype=bool)
+
+	buy_value = np.minimum(np.asarray(l_buy, dtype=float), np.asarray(l_market_buy, dtype=float))
+	no_arbitrage = buy_value.min(axis=0) + np.asarray(l_grid, dtype=float) > buy_value.max(axis=0)
+	return surplus | ~no_arbitrage
+
+
+def empty_session_prices(e_cmet: np.ndarray, l_buy: ArrayLike, l_market_buy: ArrayLike) -> np.ndarray:
+	"""
+	Prices of the market sessions without selling offers (e.g., those skipped by "lem_steps_needed"), following the
+	same rule as the pricing mechanisms: the most valuable buying offer, or 0 if there are no offers at all
+	:param e_cmet: N x T array with the Meters' net consumption [kWh]
+	:param l_buy: supply energy tariffs, per Meter and step (N x T) [€/kWh]
+	:param l_market_buy: market-indexed buying tariff, per step [€/kWh]
+	:return: array T with the price of each session [€/kWh]
+	"""
+	buying = np.asarray(e_cmet, dtype=float) > 0
+	buy_value = np.minimum(np.asarray(l_buy, dtype=float), np.asarray(l_market_buy, dtype=float))
+	return np.where(buying.any(axis=0), np.where(buying, buy_value, -np.inf).max(axis=0), 0.0)
+
+
+def estimated_size(backpack: dict, bilateral: bool = False) -> int:
+	"""
+	Estimates the size of the MILPs run for a REC, as the number of (Meter, pair of Meters, or battery) time series
+	of their variables, which the number of variables and constraints of the collective MILP are proportional to
+	:param backpack: inputs of the REC's procedure, with its "meters", "horizon" and "delta_t"
+	:param bilateral: True for a bilateral LEM structure, whose LEM variables are per pair of Meters
+	:return: the estimated size
+	"""
+	meters = backpack['meters'].values()
+	nr_meters = len(meters)
+	nr_batteries = sum(len(meter.get('btm_storage') or {}) for meter in meters)
+	nr_pairs = nr_meters * (nr_meters - 1) if bilateral else 0
+	return time_intervals(backpack['horizon'], backpack['delta_t']) * (nr_meters + nr_batteries + nr_pairs)
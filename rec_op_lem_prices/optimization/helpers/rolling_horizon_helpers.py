@@ -0,0 +1,343 @@
+"""
+Helpers for running the pre-delivery procedures in rolling horizon mode: the full horizon is split into overlapping
+windows (committed steps plus look-ahead steps), solved in sequence, with the final energy content of the storage units
+and EVs at the end of each window's committed steps carried forward as the initial one of the next window.
+The committed steps of all windows are then stitched into a single result.
+"""
+import numpy as np
+
+from numbers import Number
+from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+from rec_op_lem_prices.optimization.helpers.partners_helpers import l_grid_to_array
+from typing import (
+	Any,
+	Callable,
+	Union
+)
+
+
+# (first step, first step after the committed ones, first step after the look-ahead ones) of a window
+Window = tuple[int, int, int]
+
+
+def rolling_windows(nr_steps: int, commit_steps: int, lookahead_steps: int) -> list[Window]:
+	"""
+	Splits a horizon into consecutive windows of "commit_steps" committed steps, each followed by (up to)
+	"lookahead_steps" look-ahead steps; the last windows are truncated at the end of the horizon.
+	:param nr_steps: number of time steps of the full horizon
+	:param commit_steps: number of committed time steps per window
+	:param lookahead_steps: number of look-ahead time steps per window
+	:return: list with the (start, commit end, end) steps of each window
+	"""
+	if commit_steps < 1:
+		raise ValueError('Please provide a committed horizon of at least one time step.')
+	if lookahead_steps < 0:
+		raise ValueError('Please provide a non-negative look-ahead horizon.')
+
+	return [(start, min(start + commit_steps, nr_steps), min(start + commit_steps + lookahead_steps, nr_steps))
+	        for start in range(0, nr_steps, commit_steps)]
+
+
+def duration_windows(durations: Union[list[float], np.ndarray], commit_horizon: Union[int, float],
+                     lookahead_horizon: Union[int, float]) -> list[Window]:
+	"""
+	Splits a horizon with a variable time resolution into consecutive windows of "commit_horizon" committed hours,
+	each followed by (up to) "lookahead_horizon" look-ahead hours; each window holds the steps starting within them,
+	and at least one committed step
+	:param durations: duration of each time step of the full horizon, in hours
+	:param commit_horizon: hours committed per window
+	:param lookahead_horizon: extra hours of each window, after the committed ones
+	:return: list with the (start, commit end, end) steps of each window
+	"""
+	if commit_horizon <= 0:
+		raise ValueError('Please provide a positive committed horizon.')
+	if lookahead_horizon < 0:
+		raise ValueError('Please provide a non-negative look-ahead horizon.')
+
+	begins = np.concatenate(([0.0], np.cumsum(np.asarray(durations, dtype=float))[:-1]))
+	windows = []
+	start = 0
+	while start < len(begins):
+		commit_end = max(int(np.searchsorted(begins, begins[start] + commit_horizon - 1E-9)), start + 1)
+		end = max(int(np.searchsorted(begins, begins[start] + commit_horizon + lookahead_horizon - 1E-9)), commit_end)
+		windows.append((start, commit_end, end))
+		start = commit_end
+
+	return windows
+
+
+def _is_series(val: Any, nr_steps: int) -> bool:
+	"""
+	Auxiliary function that identifies the time series (per step values on its last dimension) of a structure
+	:param val: value to check
+	:param nr_steps: number of time steps of the series
+	:return: True if "val" is a time series with "nr_steps" steps
+	"""
+	if isinstance(val, np.ndarray):
+		return val.ndim > 0 and val.shape[-1] == nr_steps
+	return isinstance(val, list) and len(val) == nr_steps and \
+		all(x is None or isinstance(x, Number) for x in val)
+
+
+def slice_window(data: Any, start: int, end: int, nr_steps: int) -> Any:
+	"""
+	Returns a copy of a structure (e.g., a backpack) where all time series with "nr_steps" steps are cut to the
+	steps between "start" (inclusive) and "end" (exclusive); other values are kept, with dictionaries copied
+	:param data: structure to slice
+	:param start: first step of the window
+	:param end: first step after the window
+	:param nr_steps: number of time steps of the series in "data"
+	:return: sliced copy of "data"
+	"""
+	if isinstance(data, dict):
+		return {key: slice_window(val, start, end, nr_steps) for key, val in data.items()}
+	if _is_series(data, nr_steps):
+		return data[..., start:end] if isinstance(data, np.ndarray) else data[start:end]
+	return data
+
+
+def _meters_of(backpack: dict) -> dict[str, dict]:
+	"""
+	Auxiliary function that returns the Meters' data of a backpack, either collective (under "meters") or individual
+	:param backpack: inputs of a pre-delivery procedure
+	:return: {#meter_id: meter data}
+	"""
+	return backpack['meters'] if 'meters' in backpack else {backpack['id']: backpack}
+
+
+def _meter_outputs(outputs: dict, meter_id: str, collective: bool) -> dict:
+	"""
+	Auxiliary function that returns the outputs of a single Meter, from collective or individual outputs
+	:param outputs: outputs of a pre-delivery procedure
+	:param meter_id: Meter identification
+	:param collective: True if "outputs" are collective, i.e., indexed by Meter
+	:return: {#variable: values of the Meter}
+	"""
+	if not collective:
+		return outputs
+	return {key: val[meter_id] for key, val in outputs.items() if isinstance(val, dict) and meter_id in val}
+
+
+def carry_states(backpack: dict, outputs: dict, step: int):
+	"""
+	Sets, in place, the initial energy content of the storage units ("init_e") and EVs ("init_e_ev") of a backpack
+	to the energy content scheduled in "outputs" at the end of a given step
+	:param backpack: inputs of the next window
+	:param outputs: outputs of the previous window, individual or collective
+	:param step: last committed step of the previous window
+	"""
+	collective = 'meters' in backpack
+	for meter_id, meter in _meters_of(backpack).items():
+		meter_outputs = _meter_outputs(outputs, meter_id, collective)
+		for b, storage in (meter.get('btm_storage') or {}).items():
+			storage['init_e'] = meter_outputs['e_bat'][b][step]
+		for ev, btm_ev in (meter.get('btm_evs') or {}).items():
+			btm_ev['init_e_ev'] = meter_outputs['ev_stored'][ev][step]
+
+	return
+
+
+def solve_rolling_horizon(solve: Callable, schedule: Callable, backpack: dict, commit_horizon: Union[int, float],
+                          lookahead_horizon: Union[int, float]) -> list[tuple[dict, int, Any]]:
+	"""
+	Solves a pre-delivery procedure in rolling horizon mode
+	:param solve: function that solves the procedure for a window's backpack
+	:param schedule: function that retrieves, from the results of "solve", the outputs with the scheduled energy
+		content of the storage units and EVs
+	:param backpack: inputs of the procedure for the full horizon
+	:param commit_horizon: hours committed per window
+	:param lookahead_horizon: extra hours of each window, after the committed ones
+	:return: list with, per window, its backpack, its number of committed steps and the results of "solve"
+	"""
+	delta_t = backpack['delta_t']
+	nr_steps = time_intervals(backpack['horizon'], delta_t)
+	uniform = isinstance(delta_t, Number)
+	if uniform:
+		windows = rolling_windows(nr_steps, time_intervals(commit_horizon, delta_t),
+		                          time_intervals(lookahead_horizon, delta_t))
+	else:
+		windows = duration_windows(delta_t, commit_horizon, lookahead_horizon)
+
+	solved = []
+	for start, commit_end, end in windows:
+		# (a per step "delta_t" is sliced as any other time series)
+		window_backpack = slice_window(backpack, start, end, nr_steps)
+		window_backpack['horizon'] = (end - start) * delta_t if uniform else sum(window_backpack['delta_t'])
+		if solved:
+			_, previous_commit_steps, previous_results = solved[-1]
+			carry_states(window_backpack, schedule(previous_results), previous_commit_steps - 1)
+		solved.append((window_backpack, commit_end - start, solve(window_backpack)))
+
+	return solved
+
+
+def stitch_series(window_outputs: list, window_steps: list[int], commit_steps: list[int]) -> Any:
+	"""
+	Stitches the outputs of consecutive windows: the time series are replaced by the concatenation of the committed
+	steps of all windows, while other values are taken from the first window
+	:param window_outputs: outputs of each window, with the same structure
+	:param window_steps: number of steps of each window
+	:param commit_steps: number of committed steps of each window
+	:return: stitched outputs
+	"""
+	first = window_outputs[0]
+	if isinstance(first, dict):
+		return {key: stitch_series([outputs[key] for outputs in window_outputs], window_steps, commit_steps)
+		        for key in first}
+	if _is_series(first, window_steps[0]):
+		return [val for series, steps in zip(window_outputs, commit_steps) for val in list(series[:steps])]
+	return first
+
+
+def _series(val: Any, steps: int) -> np.ndarray:
+	"""
+	Auxiliary function that returns the first "steps" values of a time series as an array
+	:param val: time series
+	:param steps: number of steps
+	:return: array with the first "steps" values
+	"""
+	return np.asarray(val, dtype=float)[:steps]
+
+
+def _individual_costs(meter: dict, backpack: dict, meter_outputs: dict, steps: int) -> tuple[float, float, float]:
+	"""
+	Auxiliary function that computes the costs of a Meter with its retailer and the market, with the degradation of
+	its storage units and with overstepping its maximum power, over the first steps of a window
+	:param meter: data of the Meter
+	:param backpack: inputs of the window
+	:param meter_outputs: outputs of the Meter in the window
+	:param steps: number of (committed) steps
+	:return: energy, degradation and extra power costs
+	"""
+	energy_cost = (_series(meter_outputs['e_sup_retail'], steps) * _series(meter['l_buy'], steps)
+	               - _series(meter_outputs['e_sur_retail'], steps) * _series(meter['l_sell'], steps)
+	               + _series(meter_outputs['e_sup_market'], steps) * _series(backpack['l_market_buy'], steps)
+	               - _series(meter_outputs['e_sur_market'], steps) * _series(backpack['l_market_sell'], steps)).sum()
+	deg_cost = sum(storage['degradation_cost'] * _series(meter_outputs['e_bd'][b], steps).sum()
+	               for b, storage in (meter.get('btm_storage') or {}).items())
+	p_extra_cost = _series(meter_outputs['p_extra'], steps).sum() * backpack['l_extra']
+
+	return float(energy_cost), float(deg_cost), float(p_extra_cost)
+
+
+def _local_costs(meter_id: str, backpack: dict, outputs: dict, l_lem: list[float], steps: int) -> tuple[float, float]:
+	"""
+	Auxiliary function that computes the costs of a Meter with the local grid access tariffs and with the LEM
+	transactions, over the first steps of a window of a collective procedure
+	:param meter_id: Meter identification
+	:param backpack: inputs of the window
+	:param outputs: collective outputs of the window
+	:param l_lem: LEM prices of the window
+	:param steps: number of (committed) steps
+	:return: local grid and LEM costs
+	"""
+	lem = _series(l_lem, steps)
+	if 'e_slc_pool' in outputs:
+		grid_cost = (_series(outputs['e_slc_pool'][meter_id], steps) * _series(backpack['l_grid'], steps)).sum()
+		net_purchases = _series(outputs['e_pur_pool'][meter_id], steps) - _series(outputs['e_sale_pool'][meter_id], steps)
+		return float(grid_cost), float((net_purchases * lem).sum())
+
+	meter_ids = list(backpack['meters'].keys())
+	window_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	l_grid = l_grid_to_array(backpack['l_grid'], meter_ids, window_steps)
+	n = meter_ids.index(meter_id)
+	grid_cost = sum((_series(e_slc, steps) * l_grid[n, meter_ids.index(m), :steps]).sum()
+	                for m, e_slc in outputs['e_slc_bilateral'][meter_id].items())
+	net_purchases = sum(_series(outputs['e_pur_bilateral'][meter_id][m], steps)
+	                    - _series(outputs['e_sale_bilateral'][meter_id][m], steps)
+	                    for m in outputs['e_pur_bilateral'][meter_id])
+	return float(grid_cost), float((net_purchases * lem).sum())
+
+
+def stitch_individual_outputs(windows: list[tuple[dict, int, dict]]) -> dict:
+	"""
+	Stitches the outputs of an individual (first stage) procedure solved in rolling horizon mode, recomputing its
+	costs over the committed steps of each window only
+	:param windows: list with, per window, the individual (or collective) backpack, its number of committed steps and
+		the individual outputs (of one of its Meters)
+	:return: outputs with the same structure as "run_pre_individual_milp"
+	"""
+	backpacks, commit_steps, window_outputs = zip(*windows)
+	window_steps = [time_intervals(bp['horizon'], bp['delta_t']) for bp in backpacks]
+	outputs = stitch_series(list(window_outputs), window_steps, list(commit_steps))
+
+	costs = np.array([_individual_costs(_meters_of(bp)[out['meter_id']], bp, out, steps)
+	                  for bp, steps, out in windows]).sum(axis=0)
+	energy_cost, deg_cost, p_extra_cost = costs.tolist()
+	c_ind = energy_cost + deg_cost + p_extra_cost
+	outputs['obj_value'] = c_ind
+	outputs['deg_cost'] = deg_cost
+	outputs['p_extra_cost'] = p_extra_cost
+	outputs['c_ind'] = c_ind
+	outputs['c_ind_without_deg'] = c_ind - deg_cost
+	outputs['c_ind_without_deg_and_p_extra'] = c_ind - deg_cost - p_extra_cost
+	outputs['c_ind_without_p_extra'] = c_ind - p_extra_cost
+
+	return outputs
+
+
+def stitch_collective_outputs(windows: list[tuple[dict, int, dict]], l_lem: list[list[float]]) -> dict:
+	"""
+	Stitches the outputs of a collective (pool or bilateral) procedure solved in rolling horizon mode, recomputing its
+	costs over the committed steps of each window only
+	:param windows: list with, per window, the collective backpack, its number of committed steps and its outputs
+	:param l_lem: LEM prices used in each window
+	:return: outputs with the same structure as the collective outputs of the procedure
+	"""
+	backpacks, commit_steps, window_outputs = zip(*windows)
+	window_steps = [time_intervals(bp['horizon'], bp['delta_t']) for bp in backpacks]
+	outputs = stitch_series(list(window_outputs), window_steps, list(commit_steps))
+	structure = 'pool' if 'e_slc_pool' in outputs else 'bilateral'
+
+	for key in ('c_ind2', 'c_ind2_without_deg', 'c_ind2_without_deg_and_p_extra', 'c_ind2_without_p_extra'):
+		outputs[key.replace('c_ind2', f'c_ind2{structure}')] = {}
+	outputs[f'deg_cost2{structure}'] = {}
+	outputs[f'p_extra_cost2{structure}'] = {}
+
+	obj_value = 0.0
+	for meter_id in backpacks[0]['meters']:
+		energy_cost = deg_cost = p_extra_cost = lem_cost = 0.0
+		for (bp, steps, out), window_l_lem in zip(windows, l_lem):
+			energy, deg, p_extra = _individual_costs(bp['meters'][meter_id], bp, _meter_outputs(out, meter_id, True),
+			                                         steps)
+			grid, lem = _local_costs(meter_id, bp, out, window_l_lem, steps)
+			energy_cost += energy + grid
+			deg_cost += deg
+			p_extra_cost += p_extra
+			lem_cost += lem
+
+		# the LEM transactions cancel out in the collective objective function
+		obj_value += energy_cost + deg_cost + p_extra_cost
+		c_ind2 = energy_cost + deg_cost + p_extra_cost + lem_cost
+		outputs[f'c_ind2{structure}'][meter_id] = c_ind2
+		outputs[f'c_ind2{structure}_without_deg'][meter_id] = c_ind2 - deg_cost
+		outputs[f'c_ind2{structure}_without_deg_and_p_extra'][meter_id] = c_ind2 - deg_cost - p_extra_cost
+		outputs[f'c_ind2{structure}_without_p_extra'][meter_id] = c_ind2 - p_extra_cost
+		outputs[f'deg_cost2{structure}'][meter_id] = deg_cost
+		outputs[f'p_extra_cost2{structure}'][meter_id] = p_extra_cost
+	outputs['obj_value'] = obj_value
+
+	return outputs
+
+
+def stitch_results(windows: list[tuple[dict, int, Any]], l_lem: list[list[float]] = None) -> Any:
+	"""
+	Stitches the results of a pre-delivery procedure solved in rolling horizon mode, i.e., individual outputs,
+	collective outputs or a tuple with the collective outputs and the list of individual outputs of the first stage
+	:param windows: list with, per window, its backpack, its number of committed steps and its results
+	:param l_lem: LEM prices used in each window; if not provided, the "l_lem" of each window's backpack
+	:return: results with the same structure as the ones of each window
+	"""
+	backpacks, commit_steps, results = zip(*windows)
+	if 'meters' not in backpacks[0]:
+		return stitch_individual_outputs(windows)
+
+	l_lem = [bp['l_lem'] for bp in backpacks] if l_lem is None else l_lem
+	if not isinstance(results[0], tuple):
+		return stitch_collective_outputs(windows, l_lem)
+
+	stage2_outputs = stitch_collective_outputs(list(zip(backpacks, commit_steps, [r[0] for r in results])), l_lem)
+	stage1_outputs = [stitch_individual_outputs(list(zip(backpacks, commit_steps, [r[1][i] for r in results])))
+	                  for i in range(len(results[0][1]))]
+
+	return stage2_outputs, stage1_outputs
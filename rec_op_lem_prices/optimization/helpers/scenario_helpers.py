@@ -0,0 +1,91 @@
+"""
+Helpers of the multi-scenario mode (see "scenarios_pre_pool"), where the same REC is run for several forecasts of its
+Meters' consumption and generation: each scenario only holds the forecasts that differ from the ones of the REC's
+backpack, which holds everything that does not vary across scenarios (tariffs, storage units, parameters, ...).
+The same structure holds the forecasts revised intraday, for the incremental re-runs of "update_pre_pool".
+"""
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+
+
+SCENARIO_KEYS = ('e_c', 'e_g')  # forecasts that can vary across scenarios
+
+
+def validate_scenarios(backpack: dict, scenarios: list[dict[str, dict[str, list[float]]]]):
+	"""
+	Asserts that the scenarios only vary the forecasts of existing Meters, with one value per time step
+	:param backpack: inputs of the REC's procedure, shared by all scenarios
+	:param scenarios: list with the forecasts of each scenario, as {#meter_id: {'e_c': [...], 'e_g': [...]}}, only
+		for the Meters and forecasts that differ from the ones of the backpack
+	"""
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	for idx, scenario in enumerate(scenarios):
+		for meter_id, forecasts in scenario.items():
+			if meter_id not in backpack['meters']:
+				raise ValueError(f'Scenario {idx} refers to an unknown Meter: "{meter_id}".')
+			unknown = set(forecasts) - set(SCENARIO_KEYS)
+			if unknown:
+				raise ValueError(f'Scenario {idx} can only vary {SCENARIO_KEYS} of the Meters, not {sorted(unknown)}.')
+			if any(len(forecast) != nr_steps for forecast in forecasts.values()):
+				raise ValueError(f'Please provide one value per time step ({nr_steps}) in scenario {idx}, '
+				                 f'for "{meter_id}".')
+
+
+def forecast_update(backpack: dict, updates: dict[str, dict[str, dict[int, float]]]) \
+		-> dict[str, dict[str, list[float]]]:
+	"""
+	Full forecasts of the Meters revised by an update that only holds the steps that changed
+	:param backpack: inputs of the REC's procedure, with the previous forecasts
+	:param updates: revised forecasts, as {#meter_id: {'e_c': {#step: value}, 'e_g': {#step: value}}}, only for the
+		Meters, forecasts and steps that changed
+	:return: the revised forecasts, as a scenario (see "validate_scenarios"), i.e., with all the steps of the forecasts
+		that changed
+	"""
+	nr_steps = time_intervals(backpack['horizon'], backpack['delta_t'])
+	scenario = {}
+	for meter_id, forecasts in updates.items():
+		if meter_id not in backpack['meters']:
+			raise ValueError(f'The update refers to an unknown Meter: "{meter_id}".')
+		unknown = set(forecasts) - set(SCENARIO_KEYS)
+		if unknown:
+			raise ValueError(f'The update can only revise {SCENARIO_KEYS} of the Meters, not {sorted(unknown)}.')
+		scenario[meter_id] = {}
+		for key, steps in forecasts.items():
+			if any(not 0 <= t < nr_steps for t in steps):
+				raise ValueError(f'Please provide steps between 0 and {nr_steps - 1} in the update of "{meter_id}".')
+			forecast = list(backpack['meters'][meter_id][key])
+			for t, val in steps.items():
+				forecast[t] = val
+			scenario[meter_id][key] = forecast
+	return scenario
+
+
+def apply_scenario(backpack: dict, scenario: dict[str, dict[str, list[float]]]) -> dict:
+	"""
+	Inputs of the REC's procedure for a scenario; only the backpack and the Meters' dictionaries are copied (shallowly),
+	so that the procedure can set its own values on them, while all the data that does not vary is shared
+	:param backpack: inputs of the REC's procedure, shared by all scenarios
+	:param scenario: forecasts of the scenario (see "validate_scenarios")
+	:return: the inputs for the scenario
+	"""
+	meters = {meter_id: {**meter_data, **scenario.get(meter_id, {})}
+	          for meter_id, meter_data in backpack['meters'].items()}
+	return {**backpack, 'meters': meters}
+
+
+def price_statistics(prices: list[list[float]]) -> dict[str, list[float]]:
+	"""
+	Statistics of the LEM prices of several scenarios, per market session
+	:param prices: list with the LEM prices of each scenario [€/kWh]
+	:return: dictionary with the "mean", "std" (standard deviation), "min", "median" and "max" of the prices of each
+		session [€/kWh]
+	"""
+	prices = np.asarray(prices, dtype=float)
+	return {
+		'mean': prices.mean(axis=0).tolist(),
+		'std': prices.std(axis=0).tolist(),
+		'min': prices.min(axis=0).tolist(),
+		'median': np.median(prices, axis=0).tolist(),
+		'max': prices.max(axis=0).tolist()
+	}
@@ -0,0 +1,62 @@
+"""
+Helpers for selecting the solver backend of the MILPs: either a puLP command line solver (CBC, CPLEX, ...) or the
+in-process HiGHS backend, which solves the array-based ("Matrix*") counterparts of the MILP classes, optionally with
+the collective (pool) MILP decomposed per Meter ("AdmmStageTwoMILPPool").
+"""
+from rec_op_lem_prices.configs.configs import (
+	DECOMPOSED_SOLVER,
+	IN_PROCESS_SOLVER
+)
+from rec_op_lem_prices.optimization.module.AdmmStageTwoMILPPool import AdmmStageTwoMILPPool
+from rec_op_lem_prices.optimization.module.MatrixStageOneMILP import MatrixStageOneMILP
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPBilateral import MatrixStageTwoMILPBilateral
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
+from rec_op_lem_prices.optimization.module.StageOneMILP import StageOneMILP
+from rec_op_lem_prices.optimization.module.StageTwoMILPBilateral import StageTwoMILPBilateral
+from rec_op_lem_prices.optimization.module.StageTwoMILPPool import StageTwoMILPPool
+from pulp import listSolvers
+
+
+IS_CPLEX_AVAILABLE = "CPLEX_CMD" in listSolvers(onlyAvailable=True)
+
+# Array-based counterpart of each MILP class, used with the in-process solver
+MATRIX_MILPS = {
+	StageOneMILP: MatrixStageOneMILP,
+	StageTwoMILPBilateral: MatrixStageTwoMILPBilateral,
+	StageTwoMILPPool: MatrixStageTwoMILPPool
+}
+
+
+def validate_solver(solver: str) -> str:
+	"""
+	Validates the solver requested
+	:param solver: one of "CBC", "CPLEX", IN_PROCESS_SOLVER or DECOMPOSED_SOLVER
+	:return: the solver requested, or "CBC" if it is not one of the above or if "CPLEX" is not available
+	"""
+	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
+		return 'CPLEX'
+	if solver in (IN_PROCESS_SOLVER, DECOMPOSED_SOLVER):
+		return solver
+	return 'CBC'
+
+
+def new_milp(milp_class: type, backpack: dict, solver: str, **kwargs):
+	"""
+	Creates a MILP instance for the solver provided
+	:param milp_class: one of StageOneMILP, StageTwoMILPPool or StageTwoMILPBilateral
+	:param backpack: inputs of the MILP
+	:param solver: a solver validated with "validate_solver"
+	:param kwargs: other keyword arguments of "milp_class" (ignored by the in-process backend, except for "timeout",
+		"mipgap", "relax_binaries", "tight_big_m" and "prune_steps", of which the decomposed solver only takes the first
+		three)
+	:return: an instance of "milp_class" or, for the in-process solver, of its array-based counterpart; for the
+		decomposed solver, the collective (pool) MILP is an "AdmmStageTwoMILPPool" and the others are array-based
+	"""
+	if solver == DECOMPOSED_SOLVER and milp_class is StageTwoMILPPool:
+		admm_kwargs = {k: v for k, v in kwargs.items() if k in ('timeout', 'mipgap', 'relax_binaries')}
+		return AdmmStageTwoMILPPool(backpack, **admm_kwargs)
+	if solver in (IN_PROCESS_SOLVER, DECOMPOSED_SOLVER):
+		matrix_kwargs = {k: v for k, v in kwargs.items()
+		                 if k in ('timeout', 'mipgap', 'relax_binaries', 'tight_big_m', 'prune_steps')}
+		return MATRIX_MILPS[milp_class](backpack, **matrix_kwargs)
+	return milp_class(backpack, solver=solver, **kwargs)
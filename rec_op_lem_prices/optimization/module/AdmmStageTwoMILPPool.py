@@ -0,0 +1,211 @@
+"""
+Decomposed counterpart of "StageTwoMILPPool": the collective (pool) MILP is split into one subproblem per Meter, with
+the market equilibrium (Eq. 11) relaxed, which are solved in parallel with the in-process solver and coordinated by the
+exchange ADMM, i.e., by price updates on the REC's imbalance, until it vanishes (see "admm_helpers").
+"""
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	ADMM_MAX_ITER,
+	ADMM_RHO,
+	ADMM_TOLERANCE,
+	MIPGAP,
+	RELAX_BINARIES,
+	TIMEOUT
+)
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
+from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
+	AdmmOutputsS2PoolDict,
+	BackpackS2PoolDict
+)
+from rec_op_lem_prices.optimization.helpers.admm_helpers import (
+	exchange_residuals,
+	penalty_breakpoints,
+	solve_exchange_subproblem,
+	split_meters
+)
+from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+from rec_op_lem_prices.optimization.helpers.parallel_helpers import run_in_parallel
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import empty_session_prices
+from loguru import logger
+
+
+class AdmmStageTwoMILPPool:
+	def __init__(self, backpack: BackpackS2PoolDict, timeout=TIMEOUT, mipgap=MIPGAP, relax_binaries=RELAX_BINARIES,
+	             rho=ADMM_RHO, max_iter=ADMM_MAX_ITER, tolerance=ADMM_TOLERANCE, n_jobs=None):
+		if backpack.get('total_share_coeffs'):
+			raise ValueError('Sharing all the REC\'s surplus / deficit ("total_share_coeffs") couples the Meters '
+			                 'beyond the market equilibrium, so it is not supported by the decomposed solver.')
+		self._backpack = {**backpack}  # inputs of the collective MILP, split into the subproblems on each solve
+		self.timeout = timeout  # solvers temporal limit to find optimal solution of each subproblem (s)
+		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.rho = rho  # initial penalty parameter [€/kWh^2], adapted along the iterations
+		self.max_iter = max_iter  # maximum number of ADMM iterations
+		self.tolerance = tolerance  # tolerance of the primal and dual residuals, per step (and Meter)
+		self.n_jobs = n_jobs  # number of worker processes for the subproblems (see "run_in_parallel")
+		self.warm_start = False  # MIP starts are not supported by the in-process solver
+		self.status = None  # "Optimal" if converged, "Not Converged" or the status of a failed subproblem otherwise
+		self.obj_value = None  # sum of the Meters' costs in the last iteration
+		self.set_meters = list(backpack['meters'].keys())  # set with Meters' ID
+		self.history = []  # residuals and objective function value, per iteration
+		self._prices = None  # Lagrange multipliers of the market equilibrium, per step, kept to warm start next solve
+		self._x = None  # net LEM sales of the Meters (e_sale - e_pur), N x T, kept to warm start the next solve
+		self._outputs = None  # outputs of the Meters' subproblems in the last iteration
+
+	def update_prices(self, l_lem=None, l_market_buy=None, l_market_sell=None, l_buy=None, l_sell=None, l_grid=None):
+		"""
+		Update the price vectors considered by the subproblems.
+		Arguments left as None are kept unchanged.
+		:param l_lem: price for LEM transactions [€/kWh]
+		:param l_market_buy: market-indexed buying tariff [€/kWh]
+		:param l_market_sell: market-indexed selling tariff [€/kWh]
+		:param l_buy: supply energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_sell: feed in energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_grid: access tariff of the local grid [€/kWh]
+		"""
+		for key, val in (('l_lem', l_lem), ('l_market_buy', l_market_buy), ('l_market_sell', l_market_sell),
+		                 ('l_grid', l_grid)):
+			if val is not None:
+				self._backpack[key] = val
+		for key, per_meter in (('l_buy', l_buy), ('l_sell', l_sell)):
+			for n, val in (per_meter or {}).items():
+				self._backpack['meters'][n][key] = val
+
+	def update_forecasts(self, e_c=None, e_g=None):
+		"""
+		Update the consumption and generation forecasts considered by the subproblems; the multipliers and net LEM
+		sales of the last solve are kept, to warm start the next one.
+		Arguments left as None are kept unchanged.
+		:param e_c: Btm total energy consumption, per Meter (only the Meters to update need to be provided) [kWh]
+		:param e_g: Btm total energy generation, per Meter (only the Meters to update need to be provided) [kWh]
+		"""
+		for key, per_meter in (('e_c', e_c), ('e_g', e_g)):
+			for n, forecast in (per_meter or {}).items():
+				self._backpack['meters'][n][key] = forecast
+
+	def update_c_ind(self, c_ind: dict[str, float]):
+		"""
+		Update the individual costs (from the first stage) that bound each Meter's cost on the second stage.
+		Ignored on single stage runs, where that bound is relaxed.
+		:param c_ind: objective function values of each Meters' 1st stage MILP solution, per Meter
+		"""
+		if not self._backpack.get('second_stage'):
+			return
+
+		for n, c in c_ind.items():
+			self._backpack['meters'][n]['c_ind'] = c
+
+	def set_initial_values(self, values: dict):
+		"""
+		Kept for interface compatibility with "StageTwoMILPPool"; the starting point is ignored, since MIP starts are
+		not supported by the in-process solver.
+		"""
+		return
+
+	def set_initial_values_from_stage_1(self, stage1_outputs: list[OutputsS1Dict]):
+		"""
+		Kept for interface compatibility with "StageTwoMILPPool"; the starting point is ignored, since MIP starts are
+		not supported by the in-process solver.
+		"""
+		return
+
+	def solve_milp(self):
+		"""
+		Function that heads the ADMM iterations. In each of them, every Meter's subproblem is solved, in parallel, with
+		its net LEM sales (x) priced at the current multipliers and penalized by their deviation from the targets
+		x_prev - mean(x_prev); the multipliers are then raised by rho * mean(x), i.e., in proportion to the REC's
+		imbalance. Rho is adapted to keep both residuals within the same order of magnitude (residual balancing).
+		The iterations stop when the primal and dual residuals are within the tolerance, or after "max_iter" of them.
+		The next solve (e.g., in a pricing loop) is warm started with the last multipliers and net LEM sales.
+		"""
+		logger.debug('-- solving the collective (pool, ADMM) MILP problem...')
+		nr_steps = time_intervals(self._backpack['horizon'], self._backpack['delta_t'])
+		nr_meters = len(self.set_meters)
+		if self._prices is None:
+			self._prices = np.zeros(nr_steps)
+			self._x = np.zeros((nr_meters, nr_steps))
+		backpacks = split_meters(self._backpack)
+		breakpoints = penalty_breakpoints(self._backpack).tolist()
+		rho = self.rho
+		self.history = []
+		self.status = 'Not Converged'
+
+		for iteration in range(1, self.max_iter + 1):
+			targets = self._x - self._x.mean(axis=0)
+			for i, backpack in enumerate(backpacks):
+				backpack['exchange'] = {'prices': self._prices.tolist(), 'targets': [targets[i].tolist()],
+				                        'rho': rho, 'breakpoints': breakpoints}
+			outputs = run_in_parallel(solve_exchange_subproblem, backpacks, self.timeout, self.mipgap,
+			                          self.relax_binaries, n_jobs=self.n_jobs)
+
+			failed = [o['milp_status'] for o in outputs if o['milp_status'] != 'Optimal']
+			if failed:
+				logger.warning(f'A subproblem of the collective (pool, ADMM) MILP was not solved: \'{failed[0]}\'')
+				self.status = failed[0]
+				self.obj_value = None
+				return
+
+			x_prev = self._x
+			per_meter = lambda name: np.array([o[name][n] for o, n in zip(outputs, self.set_meters)], dtype=float)
+			self._x = per_meter('e_sale_pool') - per_meter('e_pur_pool')
+			self._prices = self._prices + rho * self._x.mean(axis=0)
+			primal_residual, dual_residual = exchange_residuals(self._x, x_prev, rho)
+			self._outputs = outputs
+			self.obj_value = sum(o['obj_value'] for o in outputs)
+			self.history.append({
+				'iteration': iteration,
+				'primal_residual': primal_residual,
+				'dual_residual': dual_residual,
+				'rho': rho,
+				'obj_value': self.obj_value
+			})
+			logger.debug(f'-- ADMM iteration {iteration}: primal residual {primal_residual:.6f}; '
+			             f'dual residual {dual_residual:.6f}')
+
+			if primal_residual <= self.tolerance * np.sqrt(nr_steps) \
+					and dual_residual <= self.tolerance * np.sqrt(nr_meters * nr_steps):
+				self.status = 'Optimal'
+				break
+
+			# Residual balancing (Boyd et al., 2011, Sec. 3.4.1); the multipliers are kept as prices, not scaled
+			if primal_residual > 10 * dual_residual:
+				rho *= 2
+			elif dual_residual > 10 * primal_residual:
+				rho /= 2
+
+		if self.status != 'Optimal':
+			logger.warning(f'The collective (pool, ADMM) MILP did not converge in {self.max_iter} iterations.')
+		logger.debug('-- solving the collective (pool, ADMM) MILP problem... DONE!')
+
+		return
+
+	def generate_outputs(self) -> AdmmOutputsS2PoolDict:
+		"""
+		Function for generating the outputs of optimization, with the same structure as
+		"StageTwoMILPPool.generate_outputs", merged from the Meters' subproblems of the last iteration, plus the
+		convergence history ("admm_history") and the final imbalance of the REC ("primal_residual"). The "dual_prices"
+		are the (absolute) multipliers of the market equilibrium, except on the sessions without selling offers, whose
+		multipliers only grow until no Meter buys, which are priced as in "empty_session_prices".
+		:return: outputs dictionary with MILP variables' and other computed values
+		"""
+		outputs = {}
+
+		if self.obj_value is None:
+			return outputs
+
+		for meter_outputs in self._outputs:
+			for key, val in meter_outputs.items():
+				if isinstance(val, dict):
+					outputs.setdefault(key, {}).update(val)
+		outputs['obj_value'] = self.obj_value
+		outputs['milp_status'] = self.status
+		e_cmet = np.array([outputs['e_cmet'][n] for n in self.set_meters], dtype=float)
+		l_buy = np.array([self._backpack['meters'][n]['l_buy'] for n in self.set_meters], dtype=float)
+		sold = (self._x > 0).any(axis=0)
+		outputs['dual_prices'] = np.where(sold, np.abs(self._prices),
+		                                  empty_session_prices(e_cmet, l_buy, self._backpack['l_market_buy'])).tolist()
+		outputs['admm_history'] = self.history
+		outputs['primal_residual'] = self.history[-1]['primal_residual']
+
+		return outputs
@@ -4,10 +4,15 @@ Class for calculating the individual Meter cost for post-delivery optimization.
 import numpy as np
 
 from rec_op_lem_prices.custom_types.individual_cost_types import (
+	BackpackBatchIndCostDict,
 	BackpackIndCostDict,
+	OutputsBatchIndCostDict,
 	OutputsIndCostDict
 )
+from rec_op_lem_prices.custom_types.stage_two_milp_bilateral_types import BackpackS2BilateralDict
+from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import BackpackS2PoolDict
 from loguru import logger
+from typing import Union
 
 
 def calculate_individual_cost(backpack: BackpackIndCostDict) -> OutputsIndCostDict:
@@ -25,66 +30,133 @@ def calculate_individual_cost(backpack: BackpackIndCostDict) -> OutputsIndCostDi
 	:return: dictionary comprised of an array with the calculated extra power flows at the Meter (absolute values)
 	and the individual cost with energy for the Meter
 	"""
+	# Assert that all arrays provided have the same length (i.e., operation horizon)
+	baseline_length = len(backpack.get('l_buy'))
+	assert len(backpack.get('l_sell')) == baseline_length, 'length of "l_sell" does not match the length of "l_buy"'
+	assert len(backpack.get('l_market_buy')) == baseline_length, \
+		'length of "l_market_buy" does not match the length of "l_buy"'
+	assert len(backpack.get('l_market_sell')) == baseline_length, \
+		'length of "l_market_sell" does not match the length of "l_buy"'
+	assert len(backpack.get('e_met')) == baseline_length, 'length of "e_met" does not match the length of "l_buy"'
+
+	# Compute it as a batch with a single Meter
+	results = calculate_individual_costs({
+		'delta_t': backpack.get('delta_t'),
+		'e_met': np.array([backpack.get('e_met')], dtype=float),
+		'ids': [backpack.get('id')],
+		'l_buy': np.array([backpack.get('l_buy')], dtype=float),
+		'l_extra': backpack.get('l_extra'),
+		'l_market_buy': np.array(backpack.get('l_market_buy'), dtype=float),
+		'l_market_sell': np.array(backpack.get('l_market_sell'), dtype=float),
+		'l_sell': np.array([backpack.get('l_sell')], dtype=float),
+		'max_p': np.array([backpack.get('max_p')], dtype=float)
+	})
+
+	return split_individual_costs(results)[0]
+
 
+def calculate_individual_costs(backpack: BackpackBatchIndCostDict) -> OutputsBatchIndCostDict:
+	"""
+	Batched version of "calculate_individual_cost", used to compute the individual costs with energy of several
+	Meters at once, for a given horizon. All Meters' time series are provided as (N Meters x T steps) matrices.
+	:param backpack: dictionary with all post-delivery data needed, for all Meters
+	:return: dictionary comprised of (N x T) matrices with the energy flows and the extra power flows at each Meter
+	(absolute values) and an array with the individual cost with energy for each Meter
+	"""
 	# Parameters
-	_delta_t = backpack.get('delta_t')  # interval settlement duration [h]
-	_l_buy = np.array(backpack.get('l_buy'))  # supply energy tariff [€/kWh]
-	_l_sell = np.array(backpack.get('l_sell'))  # feed in energy tariff [€/kWh]
-	_l_market_buy = np.array(backpack.get('l_market_buy'))  # market-indexed buying tariff [€/kWh]
-	_l_market_sell = np.array(backpack.get('l_market_sell'))  # market-indexed selling tariff [€/kWh]
-	_p_meter_max = backpack.get('max_p')  # maximum power flow desired at the Meter [kW]
+	_delta_t = np.asarray(backpack.get('delta_t'), dtype=float)  # interval settlement duration, per step [h]
+	_l_buy = np.asarray(backpack.get('l_buy'), dtype=float)  # supply energy tariff [€/kWh]
+	_l_sell = np.asarray(backpack.get('l_sell'), dtype=float)  # feed in energy tariff [€/kWh]
+	_l_market_buy = np.asarray(backpack.get('l_market_buy'), dtype=float)  # market-indexed buying tariff [€/kWh]
+	_l_market_sell = np.asarray(backpack.get('l_market_sell'), dtype=float)  # market-indexed selling tariff [€/kWh]
+	_p_meter_max = np.asarray(backpack.get('max_p'), dtype=float)  # maximum power flow desired at the Meters [kW]
 	_l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
-	_e_met = backpack.get('e_met')  # net consumption (positive = imported; negative = exported) [kWh]
-	meter_id = backpack.get('id')  # identification of the Meter for which te MILP will run
+	_e_met = np.asarray(backpack.get('e_met'), dtype=float)  # net consumption (+ imported; - exported) [kWh]
+	meter_ids = backpack.get('ids')  # identification of the Meters
 
-	# Assert that all arrays provided have the same length (i.e., operation horizon)
-	baseline_length = len(_l_buy)
-	assert len(_l_sell) == baseline_length, 'length of "l_sell" does not match the length of "l_buy"'
-	assert len(_l_market_buy) == baseline_length, 'length of "l_market_buy" does not match the length of "l_buy"'
-	assert len(_l_market_sell) == baseline_length, 'length of "l_market_sell" does not match the length of "l_buy"'
-	assert len(_e_met) == baseline_length, 'length of "e_met" does not match the length of "l_buy"'
+	# Assert that all arrays provided have the same shape (i.e., number of Meters and operation horizon)
+	baseline_shape = _l_buy.shape
+	assert _l_sell.shape == baseline_shape, 'shape of "l_sell" does not match the shape of "l_buy"'
+	assert _e_met.shape == baseline_shape, 'shape of "e_met" does not match the shape of "l_buy"'
+	assert _l_market_buy.shape == baseline_shape[1:], 'length of "l_market_buy" does not match the horizon of "l_buy"'
+	assert _l_market_sell.shape == baseline_shape[1:], 'length of "l_market_sell" does not match the horizon of "l_buy"'
+	assert _p_meter_max.shape == baseline_shape[:1], 'length of "max_p" does not match the number of Meters'
+	assert len(meter_ids) == baseline_shape[0], 'length of "ids" does not match the number of Meters'
 
-	logger.debug(f'-- calculating the individual cost for Meter id: {meter_id}...')
+	logger.debug(f'-- calculating the individual costs for {len(meter_ids)} Meters...')
 
 	# Decide how to optimally distribute the net load (when equal, defaults to retailer)
-	e_sup_retail = np.zeros(baseline_length)  # energy effectively bought from the supplier [kWh]
-	e_sur_retail = np.zeros(baseline_length)  # energy effectively sold to the supplier [kWh]
-	e_sup_market = np.zeros(baseline_length)  # energy effectively bought at an OMIE-indexed price [kWh]
-	e_sur_market = np.zeros(baseline_length)  # energy effectively sold at an OMIE-indexed price [kWh]
-	for pos, net_load in enumerate(_e_met):
-		if net_load >= 0:
-			if _l_buy[pos] > _l_market_buy[pos]:
-				e_sup_market[pos] = net_load
-			else:
-				e_sup_retail[pos] = net_load
-		else:
-			if _l_sell[pos] >= _l_market_sell[pos]:
-				e_sur_retail[pos] = -net_load
-			else:
-				e_sur_market[pos] = -net_load
-
-	# Calculate the absolute of the extra power flow at the Meter
+	importing = _e_met >= 0
+	to_market_buy = _l_buy > _l_market_buy
+	to_retail_sell = _l_sell >= _l_market_sell
+	e_sup_retail = np.where(importing & ~to_market_buy, _e_met, 0.0)  # energy bought from the supplier [kWh]
+	e_sur_retail = np.where(~importing & to_retail_sell, -_e_met, 0.0)  # energy sold to the supplier [kWh]
+	e_sup_market = np.where(importing & to_market_buy, _e_met, 0.0)  # energy bought at an OMIE-indexed price [kWh]
+	e_sur_market = np.where(~importing & ~to_retail_sell, -_e_met, 0.0)  # energy sold at an OMIE-indexed price [kWh]
+
+	# Calculate the absolute of the extra power flow at the Meters
 	energy_flows = e_sup_retail + e_sup_market - e_sur_retail - e_sur_market
-	abs_energy_flows = abs(energy_flows)
-	abs_power_flows = abs_energy_flows / _delta_t
-	raw_p_extra = abs_power_flows - _p_meter_max
-	p_extra_array = np.maximum(raw_p_extra, 0)
-	p_extra = p_extra_array.tolist()
+	abs_power_flows = abs(energy_flows) / _delta_t
+	p_extra = np.maximum(abs_power_flows - _p_meter_max[:, None], 0)
 
 	# Calculate the cost with energy
 	c_ind_array = (e_sup_retail * _l_buy - e_sur_retail * _l_sell
 				   + e_sup_market * _l_market_buy - e_sur_market * _l_market_sell
-				   + p_extra_array * _l_extra)
-	c_ind = c_ind_array.sum()
+				   + p_extra * _l_extra)
+	c_ind = c_ind_array.sum(axis=1)
 
-	logger.debug(f'-- calculating the individual cost for Meter id: {meter_id}... DONE!')
+	logger.debug(f'-- calculating the individual costs for {len(meter_ids)} Meters... DONE!')
 
 	return {
 		'c_ind': c_ind,
-		'meter_id': meter_id,
-		'e_sup_market': list(e_sup_market),
-		'e_sup_retail': list(e_sup_retail),
-		'e_sur_market': list(e_sur_market),
-		'e_sur_retail': list(e_sur_retail),
+		'meter_ids': meter_ids,
+		'e_sup_market': e_sup_market,
+		'e_sup_retail': e_sup_retail,
+		'e_sur_market': e_sur_market,
+		'e_sur_retail': e_sur_retail,
 		'p_extra': p_extra
 	}
+
+
+def split_individual_costs(results: OutputsBatchIndCostDict) -> list[OutputsIndCostDict]:
+	"""
+	Converts the outputs of "calculate_individual_costs" into a list with the outputs of each Meter, as provided by
+	"calculate_individual_cost"
+	:param results: outputs of "calculate_individual_costs"
+	:return: list with one dictionary of outputs per Meter, in the same order as the batch
+	"""
+	return [
+		{
+			'c_ind': results['c_ind'][n],
+			'meter_id': meter_id,
+			'e_sup_market': results['e_sup_market'][n].tolist(),
+			'e_sup_retail': results['e_sup_retail'][n].tolist(),
+			'e_sur_market': results['e_sur_market'][n].tolist(),
+			'e_sur_retail': results['e_sur_retail'][n].tolist(),
+			'p_extra': results['p_extra'][n].tolist()
+		} for n, meter_id in enumerate(results['meter_ids'])
+	]
+
+
+def calculate_collective_individual_costs(backpack: Union[BackpackS2BilateralDict, BackpackS2PoolDict]) \
+		-> list[OutputsIndCostDict]:
+	"""
+	Computes the individual costs of all Meters of a post-delivery collective (stage 2) backpack at once, through
+	"calculate_individual_costs", to be used as the restrictions of the collective optimization
+	:param backpack: dictionary with all post-delivery data of the collective optimization
+	:return: list with one dictionary of outputs per Meter, as provided by "calculate_individual_cost", in the same
+	order as the backpack's Meters
+	"""
+	meters = backpack['meters']
+	return split_individual_costs(calculate_individual_costs({
+		'delta_t': backpack['delta_t'],
+		'e_met': np.array([meter_data['e_c'] for meter_data in meters.values()], dtype=float) -
+		         np.array([meter_data['e_g'] for meter_data in meters.values()], dtype=float),
+		'ids': list(meters.keys()),
+		'l_buy': np.array([meter_data['l_buy'] for meter_data in meters.values()], dtype=float),
+		'l_extra': backpack['l_extra'],
+		'l_market_buy': np.array(backpack['l_market_buy'], dtype=float),
+		'l_market_sell': np.array(backpack['l_market_sell'], dtype=float),
+		'l_sell': np.array([meter_data['l_sell'] for meter_data in meters.values()], dtype=float),
+		'max_p': np.array([meter_data['max_p'] for meter_data in meters.values()], dtype=float)
+	}))
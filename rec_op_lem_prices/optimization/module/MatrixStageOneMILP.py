@@ -0,0 +1,147 @@
+"""
+Array-based counterpart of "StageOneMILP": the same individual (first stage) formulation, assembled as sparse
+coefficient arrays instead of puLP expressions, and solved in-process with HiGHS.
+"""
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	MIPGAP,
+	RELAX_BINARIES,
+	TIGHT_BIG_M,
+	TIMEOUT
+)
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import (
+	add_batteries_formulation,
+	add_meters_formulation,
+	MatrixModel,
+	per_battery,
+	unpack_batteries
+)
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	step_durations,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	btm_energy_limits,
+	charge_binaries_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
+from rec_op_lem_prices.custom_types.stage_one_milp_types import (
+	BackpackS1Dict,
+	OutputsS1Dict
+)
+from loguru import logger
+
+
+class MatrixStageOneMILP:
+	def __init__(self, backpack: BackpackS1Dict, timeout=TIMEOUT, mipgap=MIPGAP,
+	             relax_binaries=RELAX_BINARIES, tight_big_m=TIGHT_BIG_M):
+		self._backpack = backpack  # data of the Meter
+		self.meter_id = backpack.get('id')  # identification of the Meter for which te MILP will run
+		self.milp = None  # for storing the MILP formulation
+		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
+		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
+		self.status = None  # stores the status of the MILP's solution
+		self.obj_value = None  # stores the MILP's numeric solution
+		self.time_intervals = None  # for number of time intervals per horizon
+		self._batteries = None  # batteries' data, flattened into arrays
+		self._vars = {}  # indices of the MILP variables, per variable name
+		self._sup_needed = None  # mask of the "delta_sup" kept binary
+		self._bc_needed = None  # mask of the "delta_bc" kept binary
+
+	def __define_milp(self):
+		"""
+		Method to define the first stage MILP problem.
+		"""
+		logger.debug(f'-- defining the individual (matrix) MILP problem for Meter id: {self.meter_id}...')
+		bp = self._backpack
+		self.milp = MatrixModel()
+		self.time_intervals = time_intervals(bp['horizon'], bp['delta_t'])
+		delta_t = step_durations(bp['delta_t'], self.time_intervals)
+		e_net = np.array([bp['e_c']], dtype=float) - np.array([bp['e_g']], dtype=float)
+
+		# Binaries that are provably unnecessary for the data at hand are relaxed, if requested
+		tariffs = (bp['l_buy'], bp['l_sell'], bp['l_market_buy'], bp['l_market_sell'])
+		self._batteries = unpack_batteries({self.meter_id: bp.get('btm_storage')})
+		self._sup_needed = supply_binaries_needed(*tariffs)[np.newaxis, :] | (not self.relax_binaries)
+		self._bc_needed = charge_binaries_needed(self._batteries, e_net[0], bp['max_p'], delta_t, *tariffs) \
+			| (not self.relax_binaries)
+
+		# Big-M values of the supply and surplus, derived from the net consumption and the batteries' power if
+		# requested, in which case they also bound these flows
+		if self.tight_big_m:
+			e_cmet_min, e_cmet_max = net_consumption_bounds(
+				e_net, *btm_energy_limits(self._batteries, 1, self.time_intervals, delta_t))
+			big_m = (np.maximum(e_cmet_max, 0.0), np.maximum(-e_cmet_min, 0.0))
+		else:
+			big_m = 10 * bp['max_p']
+
+		# Eq. 2-5
+		v, r = add_meters_formulation(self.milp, e_net, [bp['max_p']], big_m, delta_t,
+		                              sup_needed=self._sup_needed, bound_flows=self.tight_big_m)
+
+		# Eq. 6-8
+		v.update(add_batteries_formulation(self.milp, self._batteries, self.time_intervals, delta_t,
+		                                   r['C_met'], skip_empty=False, bc_needed=self._bc_needed))
+
+		# Eq. 1: Objective Function
+		self.milp.add_cost(v['e_sup_retail'], bp['l_buy'])
+		self.milp.add_cost(v['e_sur_retail'], -np.asarray(bp['l_sell'], dtype=float))
+		self.milp.add_cost(v['e_sup_market'], bp['l_market_buy'])
+		self.milp.add_cost(v['e_sur_market'], -np.asarray(bp['l_market_sell'], dtype=float))
+		self.milp.add_cost(v['p_extra'], bp['l_extra'])
+		self.milp.add_cost(v['e_bd'], self._batteries['degradation_cost'][:, np.newaxis])
+
+		self._vars = v
+
+		return
+
+	def solve_milp(self):
+		"""
+		Function that heads the definition and solution of the first stage MILP.
+		"""
+		self.__define_milp()
+
+		logger.debug(f'-- solving the individual (matrix) MILP problem for Meter id: {self.meter_id}...')
+		self.milp.solve(self.timeout, self.mipgap)
+		self.status = self.milp.status
+		self.obj_value = self.milp.obj_value
+		logger.debug(f'-- solving the individual (matrix) MILP problem for Meter id: {self.meter_id}... DONE!')
+
+		return
+
+	def generate_outputs(self) -> OutputsS1Dict:
+		"""
+		Function for generating the outputs of optimization, with the same structure as "StageOneMILP.generate_outputs".
+		:return: outputs dictionary with MILP variables' and other computed values
+		"""
+		outputs = {}
+
+		if self.obj_value is None:
+			return outputs
+
+		outputs['meter_id'] = self.meter_id
+		outputs['obj_value'] = self.obj_value
+		outputs['milp_status'] = self.status
+
+		values = {name: self.milp.values(idx) for name, idx in self._vars.items()}
+		values['delta_sup'] = relaxed_binaries_values(values['delta_sup'], self._sup_needed,
+		                                              values['e_sup_retail'] + values['e_sup_market'])
+		values['delta_bc'] = relaxed_binaries_values(values['delta_bc'], self._bc_needed, values['e_bc'])
+		for name in ('e_sup_retail', 'e_sur_retail', 'e_sup_market', 'e_sur_market', 'delta_sup', 'e_cmet', 'p_extra'):
+			outputs[name] = values[name][0].tolist()
+		for name in ('e_bat', 'soc_bat', 'e_bc', 'e_bd', 'delta_bc'):
+			outputs[name] = per_battery(values[name], self._batteries, [self.meter_id])[self.meter_id]
+
+		outputs['deg_cost'] = float((self._batteries['degradation_cost'][:, np.newaxis] * values['e_bd']).sum())
+		outputs['p_extra_cost'] = float(values['p_extra'].sum()) * self._backpack['l_extra']
+		outputs['c_ind'] = self.obj_value
+		outputs['c_ind_without_deg'] = self.obj_value - outputs['deg_cost']
+		outputs['c_ind_without_deg_and_p_extra'] = self.obj_value - outputs['deg_cost'] - outputs['p_extra_cost']
+		outputs['c_ind_without_p_extra'] = self.obj_value - outputs['p_extra_cost']
+
+		return outputs
@@ -0,0 +1,310 @@
+"""
+Array-based counterpart of "StageTwoMILPBilateral": the same collective (bilateral) formulation, assembled as sparse
+coefficient arrays instead of puLP expressions, and solved in-process with HiGHS.
+The LEM variables are indexed by the (directed) edges of the trading graph, so the pairwise constraints are generated
+at once for all pairs of trading partners.
+"""
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	MIPGAP,
+	PRUNE_STEPS,
+	RELAX_BINARIES,
+	TIGHT_BIG_M,
+	TIMEOUT
+)
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import (
+	add_batteries_formulation,
+	add_evs_formulation,
+	add_meters_formulation,
+	add_sharing_formulation,
+	MatrixModel,
+	per_battery,
+	unpack_batteries,
+	unpack_evs
+)
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	round_up,
+	step_durations,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	big_m_values,
+	btm_energy_limits,
+	lem_steps_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
+from rec_op_lem_prices.optimization.helpers.partners_helpers import (
+	l_grid_to_array,
+	resolve_partners
+)
+from rec_op_lem_prices.custom_types.stage_two_milp_bilateral_types import (
+	BackpackS2BilateralDict,
+	OutputsS2BilateralDict
+)
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
+from loguru import logger
+
+
+class MatrixStageTwoMILPBilateral:
+	def __init__(self, backpack: BackpackS2BilateralDict, timeout=TIMEOUT, mipgap=MIPGAP,
+	             relax_binaries=RELAX_BINARIES, tight_big_m=TIGHT_BIG_M, prune_steps=PRUNE_STEPS):
+		self._horizon = backpack.get('horizon')  # operation period (hours)
+		self._delta_t = backpack.get('delta_t')  # interval settlement duration [h]
+		self._l_market_buy = backpack.get('l_market_buy')  # market-indexed buying tariff [€/kWh]
+		self._l_market_sell = backpack.get('l_market_sell')  # market-indexed selling tariff [€/kWh]
+		self._l_grid = backpack.get('l_grid')  # access tariff of the local grid between each pair of members [€/kWh]
+		self._partners = backpack.get('partners')  # trading graph; all pairs of members if None (see "resolve_partners")
+		self._l_lem = backpack.get('l_lem')  # price for LEM transactions [€/kWh]
+		self._l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
+		self._c_ind = None  # objective function values of each Meters' 1st stage MILP solution
+		self.milp = None  # for storing the MILP formulation
+		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
+		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
+		self.prune_steps = prune_steps  # if True, the LEM is skipped on the steps where no internal trade can occur
+		self.warm_start = False  # MIP starts are not supported by the in-process solver
+		self.status = None  # stores the status of the MILP's solution
+		self.obj_value = None  # stores the MILP's numeric solution
+		self.time_intervals = None  # for number of time intervals per horizon
+		self.set_meters = None  # set with Meters' ID
+		self.sets_other_meters = {}  # stores the trading partners of each Meter
+		self._meters_data = backpack.get('meters')  # data from Meters
+		self.second_stage = backpack.get('second_stage')  # indicates if second stage (True) or single stage (False)
+		self.strict_pos_coeffs = backpack.get('strict_pos_coeffs')  # no negative coefficients if True
+		self.total_share_coeffs = backpack.get('total_share_coeffs')  # share all required in the REC if True
+		self._edges = None  # positions of the seller / buyer Meters of each edge of the trading graph
+		self._batteries = None  # batteries' data, flattened into arrays
+		self._evs = None  # EVs' data, flattened into arrays
+		self._vars = {}  # indices of the MILP variables, per variable name
+		self._sup_needed = None  # mask of the "delta_sup" kept binary
+		self._stage_1_cost = None  # indices of the "Stage_1_cost" constraints, per Meter
+		self._lem_steps = None  # mask of the time steps where the LEM is modelled
+
+	def __define_milp(self):
+		"""
+		Method to define the second stage MILP problem.
+		"""
+		logger.debug(f'-- defining the collective (bilateral, matrix) MILP problem...')
+		self.milp = model = MatrixModel()
+		self.time_intervals = nr_steps = time_intervals(self._horizon, self._delta_t)
+		self._delta_t = step_durations(self._delta_t, nr_steps)
+		self.set_meters = list(self._meters_data.keys())
+		meters = [self._meters_data[n] for n in self.set_meters]
+		shape = (len(meters), nr_steps)
+
+		# Trading graph, as the lists of the origin and destination Meters of its (directed) edges
+		l_grid = l_grid_to_array(self._l_grid, self.set_meters, nr_steps)
+		self.sets_other_meters = resolve_partners(self.set_meters, l_grid, self._partners)
+		index = {n: i for i, n in enumerate(self.set_meters)}
+		edges = [(index[n], index[m]) for n, n_partners in self.sets_other_meters.items() for m in n_partners]
+		src, dst = (np.array(ends, dtype=int) for ends in zip(*edges)) if edges else (np.zeros(0, dtype=int),) * 2
+		edge_index = {edge: e for e, edge in enumerate(edges)}
+		reverse = np.array([edge_index[(j, i)] for i, j in edges], dtype=int)
+		self._edges = (src, dst)
+		l_grid_pairs = l_grid[src, dst]
+		adjacency = np.zeros(l_grid.shape[:2], dtype=bool)
+		adjacency[src, dst] = True
+		nonneg = np.where(adjacency[:, :, np.newaxis], l_grid >= 0, True).all(axis=1)
+
+		per_meter = lambda key: np.array([meter[key] for meter in meters], dtype=float)
+		l_buy, l_sell = per_meter('l_buy'), per_meter('l_sell')
+		l_market_buy = np.asarray(self._l_market_buy, dtype=float)
+		l_market_sell = np.asarray(self._l_market_sell, dtype=float)
+		l_lem = np.asarray(self._l_lem, dtype=float)
+		p_meter_max = per_meter('max_p')
+		if self.second_stage:
+			self._c_ind = per_meter('c_ind')
+		else:
+			# Unbound the restriction regarding stage 1 cost for single stage runs
+			self._c_ind = np.full(len(meters), 1000.0)
+
+		# Big-M values, derived from the Meters' net consumption and Btm assets' power if requested (see
+		# "big_m_values"), in which case they also bound the retail and LEM flows; a very big number otherwise
+		self._batteries = unpack_batteries({n: meter['btm_storage'] for n, meter in zip(self.set_meters, meters)})
+		self._evs = unpack_evs({n: meter.get('btm_evs') for n, meter in zip(self.set_meters, meters)}, nr_steps)
+		e_net = per_meter('e_c') - per_meter('e_g')
+		if self.tight_big_m:
+			e_btm_max = btm_energy_limits(self._batteries, len(meters), nr_steps, self._delta_t, evs=self._evs)
+			big_m, rec_big_m = big_m_values(*net_consumption_bounds(e_net, *e_btm_max))
+		else:
+			big_m = rec_big_m = 10 * p_meter_max.max()
+		flow_max = rec_big_m if self.tight_big_m else np.inf
+
+		# Time steps where the LEM is modelled; on the others, its variables are fixed to 0 and its constraints skipped
+		self._lem_steps = np.ones(nr_steps, dtype=bool)
+		if self.prune_steps:
+			lowest_l_grid = l_grid_pairs.min(axis=0) if len(edges) else np.full(nr_steps, np.inf)
+			self._lem_steps = lem_steps_needed(e_net, self._batteries, self._delta_t, l_buy, l_market_buy,
+			                                   lowest_l_grid, self.second_stage, self.strict_pos_coeffs, evs=self._evs)
+		lem_ub = np.where(self._lem_steps, 1.0, 0.0)
+
+		# Eq. 12-15
+		self._sup_needed = supply_binaries_needed(l_buy, l_sell, l_market_buy, l_market_sell) | (not self.relax_binaries)
+		v, r = add_meters_formulation(model, e_net, p_meter_max, np.broadcast_to(rec_big_m, shape), self._delta_t,
+		                              sup_needed=self._sup_needed, bound_flows=self.tight_big_m)
+		for name in ('e_consumed', 'e_alc'):
+			v[name] = model.add_variables(shape, ub=np.where(self._lem_steps, np.inf, 0.0))
+		for name in ('delta_slc', 'delta_cmet', 'delta_alc'):
+			v[name] = model.add_variables(shape, ub=lem_ub, binary=True)
+		for name in ('e_pur', 'e_sale'):
+			v[name] = model.add_variables((len(edges), nr_steps), ub=np.where(self._lem_steps, flow_max, 0.0))
+		v['e_slc'] = model.add_variables((len(edges), nr_steps), ub=np.where(self._lem_steps, np.inf, 0.0))
+		model.add_terms(r['Equilibrium'][src], v['e_pur'], -1.0)
+		model.add_terms(r['Equilibrium'][src], v['e_sale'], 1.0)
+
+		# Eq. 16-18
+		v.update(add_batteries_formulation(model, self._batteries, nr_steps, self._delta_t, r['C_met']))
+
+		# Eq. 41-45
+		v.update(add_evs_formulation(model, self._evs, nr_steps, self._delta_t, r['C_met']))
+
+		# Eq. 11: what n sells to m is what m buys from n
+		lem_steps = self._lem_steps
+		rows = model.add_rows((len(edges), int(lem_steps.sum())), lb=0.0, ub=0.0)
+		model.add_terms(rows, v['e_sale'][:, lem_steps], 1.0)
+		model.add_terms(rows, v['e_pur'][reverse][:, lem_steps], -1.0)
+
+		# Eq. 35-36: self-consumed energy per pair, where the access tariffs of the Meter are non-negative
+		edge_nonneg = nonneg[src] & lem_steps
+		pair_big_m = np.broadcast_to(rec_big_m, v['e_slc'].shape)[edge_nonneg]
+		rows = model.add_rows(int(edge_nonneg.sum()), lb=0.0, ub=pair_big_m)
+		model.add_terms(rows, v['e_slc'][edge_nonneg], 1.0)
+		model.add_terms(rows, v['e_pur'][edge_nonneg], -1.0)
+		model.add_terms(rows, v['e_sale'][edge_nonneg], 1.0)
+		model.add_terms(rows, v['delta_slc'][src][edge_nonneg], pair_big_m)
+
+		# Eq. 20-39
+		add_sharing_formulation(model, v, src, nonneg, big_m, rec_big_m, self.strict_pos_coeffs,
+		                        self.total_share_coeffs, steps=lem_steps)
+
+		# Eq. 10: Objective Function, as the sum of the Meters' costs
+		costs = (
+			('e_sup_retail', l_buy),
+			('e_sur_retail', -l_sell),
+			('e_sup_market', l_market_buy),
+			('e_sur_market', -l_market_sell),
+			('p_extra', self._l_extra)
+		)
+		deg_cost = self._batteries['degradation_cost'][:, np.newaxis]
+		for name, coef in costs:
+			model.add_cost(v[name], coef)
+		model.add_cost(v['e_slc'], l_grid_pairs)
+		model.add_cost(v['e_bd'], deg_cost)
+
+		# Eq. 19: the same costs, per Meter, plus the LEM transactions
+		c_ind_bound = np.array([round_up(c) for c in self._c_ind])
+		self._stage_1_cost = model.add_rows(len(meters), ub=c_ind_bound)
+		rows = self._stage_1_cost[:, np.newaxis]
+		for name, coef in costs:
+			model.add_terms(rows, v[name], coef)
+		edge_rows = self._stage_1_cost[src][:, np.newaxis]
+		model.add_terms(edge_rows, v['e_slc'], l_grid_pairs)
+		model.add_terms(edge_rows, v['e_pur'], l_lem)
+		model.add_terms(edge_rows, v['e_sale'], -l_lem)
+		model.add_terms(self._stage_1_cost[self._batteries['owner']][:, np.newaxis], v['e_bd'], deg_cost)
+
+		self._vars = v
+
+		logger.debug('-- defining the collective (bilateral, matrix) MILP problem... DONE!')
+
+		return
+
+	def set_initial_values(self, values: dict):
+		"""
+		Kept for interface compatibility with "StageTwoMILPBilateral"; the starting point is ignored, since MIP starts
+		are not supported by the in-process solver.
+		"""
+		return
+
+	def set_initial_values_from_stage_1(self, stage1_outputs: list[OutputsS1Dict]):
+		"""
+		Kept for interface compatibility with "StageTwoMILPBilateral"; the starting point is ignored, since MIP starts
+		are not supported by the in-process solver.
+		"""
+		return
+
+	def solve_milp(self):
+		"""
+		Function that heads the definition and solution of the second stage MILP.
+		"""
+		self.__define_milp()
+
+		logger.debug('-- solving the collective (bilateral, matrix) MILP problem...')
+		self.milp.solve(self.timeout, self.mipgap)
+		self.status = self.milp.status
+		self.obj_value = self.milp.obj_value
+		logger.debug('-- solving the collective (bilateral, matrix) MILP problem... DONE!')
+
+		return
+
+	def generate_outputs(self) -> OutputsS2BilateralDict:
+		"""
+		Function for generating the outputs of optimization, with the same structure as
+		"StageTwoMILPBilateral.generate_outputs".
+		:return: outputs dictionary with MILP variables' and other computed values
+		"""
+		outputs = {}
+
+		if self.obj_value is None:
+			return outputs
+
+		outputs['obj_value'] = self.obj_value
+		outputs['milp_status'] = self.status
+
+		values = {name: self.milp.values(idx) for name, idx in self._vars.items()}
+		values['delta_sup'] = relaxed_binaries_values(values['delta_sup'], self._sup_needed,
+		                                              values['e_sup_retail'] + values['e_sup_market'])
+		per_meter = lambda name: dict(zip(self.set_meters, values[name].tolist()))
+
+		def per_partner(name: str) -> dict[str, dict[str, list[float]]]:
+			partner_values = {n: {} for n in self.set_meters}
+			for i, j, row in zip(*self._edges, values[name].tolist()):
+				partner_values[self.set_meters[i]][self.set_meters[j]] = row
+			return partner_values
+
+		def per_ev(name: str) -> dict[str, dict[str, list[float]]]:
+			ev_values = {n: {} for n in self.set_meters}
+			for n, ev, row in zip(self._evs['meter_ids'], self._evs['ev_ids'], values[name].tolist()):
+				ev_values[n][ev] = row
+			return ev_values
+
+		for name in ('e_sup_retail', 'e_sur_retail', 'e_sup_market', 'e_sur_market', 'delta_sup'):
+			outputs[name] = per_meter(name)
+		outputs['e_pur_bilateral'] = per_partner('e_pur')
+		outputs['e_sale_bilateral'] = per_partner('e_sale')
+		outputs['e_cmet'] = per_meter('e_cmet')
+		outputs['e_slc_bilateral'] = per_partner('e_slc')
+		for name in ('e_consumed', 'e_alc', 'delta_slc', 'delta_cmet', 'delta_alc', 'p_extra'):
+			outputs[name] = per_meter(name)
+		for name in ('e_bat', 'soc_bat', 'e_bc', 'e_bd', 'delta_bc'):
+			outputs[name] = per_battery(values[name], self._batteries, self.set_meters)
+		if len(self._evs['owner']):
+			for name in ('ev_stored', 'p_ev_charge', 'p_ev_discharge'):
+				outputs[name] = per_ev(name)
+		if self.strict_pos_coeffs:
+			outputs['delta_coeff'] = per_meter('delta_coeff')
+		if self.total_share_coeffs:
+			outputs['delta_rec_balance'] = values['delta_rec_balance'].tolist()
+			outputs['delta_meter_balance'] = per_meter('delta_meter_balance')
+
+		# Individual costs found on stage 2
+		deg_cost = np.zeros(len(self.set_meters))
+		np.add.at(deg_cost, self._batteries['owner'],
+		          (self._batteries['degradation_cost'][:, np.newaxis] * values['e_bd']).sum(axis=1))
+		p_extra_cost = values['p_extra'].sum(axis=1) * self._l_extra
+		c_ind_bound = np.array([round_up(c) for c in self._c_ind])
+		c_ind2bilateral = self.milp.activity(self._stage_1_cost) - c_ind_bound + self._c_ind
+		outputs['c_ind2bilateral'] = dict(zip(self.set_meters, c_ind2bilateral.tolist()))
+		outputs['c_ind2bilateral_without_deg'] = dict(zip(self.set_meters, (c_ind2bilateral - deg_cost).tolist()))
+		outputs['c_ind2bilateral_without_deg_and_p_extra'] = \
+			dict(zip(self.set_meters, (c_ind2bilateral - deg_cost - p_extra_cost).tolist()))
+		outputs['c_ind2bilateral_without_p_extra'] = \
+			dict(zip(self.set_meters, (c_ind2bilateral - p_extra_cost).tolist()))
+		outputs['deg_cost2bilateral'] = dict(zip(self.set_meters, deg_cost.tolist()))
+		outputs['p_extra_cost2bilateral'] = dict(zip(self.set_meters, p_extra_cost.tolist()))
+
+		return outputs
@@ -0,0 +1,425 @@
+"""
+Array-based counterpart of "StageTwoMILPPool": the same collective (pool) formulation, assembled as sparse
+coefficient arrays instead of puLP expressions, and solved in-process with HiGHS.
+"""
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	MIPGAP,
+	PRUNE_STEPS,
+	RELAX_BINARIES,
+	TIGHT_BIG_M,
+	TIMEOUT
+)
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import (
+	add_batteries_formulation,
+	add_exchange_terms,
+	add_meters_formulation,
+	add_sharing_formulation,
+	MatrixModel,
+	per_battery,
+	unpack_batteries
+)
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	round_up,
+	step_durations,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	big_m_values,
+	btm_energy_limits,
+	empty_session_prices,
+	lem_steps_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
+from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
+	BackpackS2PoolDict,
+	OutputsS2PoolDict
+)
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
+from loguru import logger
+
+
+class MatrixStageTwoMILPPool:
+	def __init__(self, backpack: BackpackS2PoolDict, timeout=TIMEOUT, mipgap=MIPGAP,
+	             relax_binaries=RELAX_BINARIES, tight_big_m=TIGHT_BIG_M, prune_steps=PRUNE_STEPS, exchange=None):
+		self._horizon = backpack.get('horizon')  # operation period (hours)
+		self._delta_t = backpack.get('delta_t')  # interval settlement duration [h]
+		self._l_market_buy = backpack.get('l_market_buy')  # market-indexed buying tariff [€/kWh]
+		self._l_market_sell = backpack.get('l_market_sell')  # market-indexed selling tariff [€/kWh]
+		self._l_grid = backpack.get('l_grid')  # access tariff of the local grid [€/kWh]
+		self._l_lem = backpack.get('l_lem')  # price for LEM transactions [€/kWh]
+		self._l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
+		self._c_ind = None  # objective function values of each Meters' 1st stage MILP solution
+		self.milp = None  # for storing the MILP formulation
+		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
+		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
+		self.prune_steps = prune_steps  # if True, the LEM is skipped on the steps where no internal trade can occur
+		self.exchange = exchange  # prices and targets that relax Eq. 11, if provided (see "add_exchange_terms")
+		self.warm_start = False  # MIP starts are not supported by the in-process solver
+		self.status = None  # stores the status of the MILP's solution
+		self.obj_value = None  # stores the MILP's numeric solution
+		self.time_intervals = None  # for number of time intervals per horizon
+		self.set_meters = None  # set with Meters' ID
+		self._meters_data = backpack.get('meters')  # data from Meters
+		self.second_stage = backpack.get('second_stage')  # indicates if second stage (True) or single stage (False)
+		self.strict_pos_coeffs = backpack.get('strict_pos_coeffs')  # no negative coefficients if True
+		self.total_share_coeffs = backpack.get('total_share_coeffs')  # share all required in the REC if True
+		self._batteries = None  # batteries' data, flattened into arrays
+		self._vars = {}  # indices of the MILP variables, per variable name
+		self._sup_needed = None  # mask of the "delta_sup" kept binary
+		self._stage_1_cost = None  # indices of the "Stage_1_cost" constraints, per Meter
+		self._c_met = None  # indices of the "C_met" constraints, per Meter and time step
+		self._big_m = None  # big-M values of the MILP, per Meter and time step
+		self._rec_big_m = None  # big-M values of the MILP, per time step
+		self._market_equilibrium = None  # indices of the "Market_equilibrium" constraints, per time step
+		self._lem_steps = None  # mask of the time steps where the LEM is modelled
+
+	def __per_meter(self, key: str) -> np.ndarray:
+		"""
+		Array with a parameter of all Meters, in the order of "set_meters"
+		"""
+		return np.array([self._meters_data[n][key] for n in self.set_meters], dtype=float)
+
+	def __supply_binaries_needed(self) -> np.ndarray:
+		"""
+		N x T mask of the "delta_sup" that are kept binary, given the current tariffs (see "supply_binaries_needed");
+		all of them, unless their relaxation is requested.
+		"""
+		return supply_binaries_needed(self.__per_meter('l_buy'), self.__per_meter('l_sell'),
+		                              np.asarray(self._l_market_buy, dtype=float),
+		                              np.asarray(self._l_market_sell, dtype=float)) | (not self.relax_binaries)
+
+	def __lem_steps_needed(self, e_net: np.ndarray) -> np.ndarray:
+		"""
+		Mask of the time steps where the LEM is modelled, given the current data and tariffs (see "lem_steps_needed");
+		all of them, unless the pruning of the other steps is requested.
+		"""
+		if not self.prune_steps:
+			return np.ones(self.time_intervals, dtype=bool)
+
+		return lem_steps_needed(e_net, self._batteries, self._delta_t, self.__per_meter('l_buy'),
+		                        np.asarray(self._l_market_buy, dtype=float), np.asarray(self._l_grid, dtype=float),
+		                        self.second_stage, self.strict_pos_coeffs)
+
+	def __big_m_values(self, e_net: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Big-M values, derived from the Meters' net consumption and Btm assets' power if requested (see "big_m_values"),
+		in which case they also bound the retail and LEM flows; a very big number otherwise.
+		:return: tuple with the big-M values per Meter and time step and the ones per time step [kWh]
+		"""
+		if self.tight_big_m:
+			e_btm_max = btm_energy_limits(self._batteries, len(self.set_meters), self.time_intervals, self._delta_t)
+			return big_m_values(*net_consumption_bounds(e_net, *e_btm_max))
+
+		big_m = np.full(e_net.shape, 10 * self.__per_meter('max_p').max())
+		return big_m, big_m[0]
+
+	def __costs(self) -> tuple:
+		"""
+		Cost coefficients of the Meters' variables (Eq. 10 and Eq. 19), given the current tariffs
+		:return: tuple with pairs of variable name and coefficients, per Meter and time step or for all
+		"""
+		return (
+			('e_sup_retail', self.__per_meter('l_buy')),
+			('e_sur_retail', -self.__per_meter('l_sell')),
+			('e_sup_market', np.asarray(self._l_market_buy, dtype=float)),
+			('e_sur_market', -np.asarray(self._l_market_sell, dtype=float)),
+			('e_slc', np.asarray(self._l_grid, dtype=float)),
+			('p_extra', self._l_extra)
+		)
+
+	def __define_milp(self):
+		"""
+		Method to define the second stage MILP problem.
+		"""
+		logger.debug(f'-- defining the collective (pool, matrix) MILP problem...')
+		self.milp = model = MatrixModel()
+		self.time_intervals = nr_steps = time_intervals(self._horizon, self._delta_t)
+		self._delta_t = step_durations(self._delta_t, nr_steps)
+		self.set_meters = list(self._meters_data.keys())
+		shape = (len(self.set_meters), nr_steps)
+
+		l_grid = np.asarray(self._l_grid, dtype=float)
+		p_meter_max = self.__per_meter('max_p')
+		if self.second_stage:
+			self._c_ind = self.__per_meter('c_ind')
+		else:
+			# Unbound the restriction regarding stage 1 cost for single stage runs
+			self._c_ind = np.full(len(self.set_meters), 1000.0)
+
+		# Big-M values (see "__big_m_values")
+		self._batteries = unpack_batteries({n: self._meters_data[n]['btm_storage'] for n in self.set_meters})
+		e_net = self.__per_meter('e_c') - self.__per_meter('e_g')
+		self._big_m, self._rec_big_m = big_m, rec_big_m = self.__big_m_values(e_net)
+		flow_max = rec_big_m if self.tight_big_m else np.inf
+
+		# Time steps where the LEM is modelled; on the others, its variables are fixed to 0 and its constraints skipped
+		self._lem_steps = self.__lem_steps_needed(e_net)
+		lem_ub = np.where(self._lem_steps, 1.0, 0.0)
+
+		# Eq. 12-15
+		self._sup_needed = self.__supply_binaries_needed()
+		v, r = add_meters_formulation(model, e_net, p_meter_max, np.broadcast_to(rec_big_m, shape), self._delta_t,
+		                              sup_needed=self._sup_needed, bound_flows=self.tight_big_m)
+		self._c_met = r['C_met']
+		for name in ('e_pur', 'e_sale'):
+			v[name] = model.add_variables(shape, ub=np.where(self._lem_steps, flow_max, 0.0))
+		for name in ('e_slc', 'e_consumed', 'e_alc'):
+			v[name] = model.add_variables(shape, ub=np.where(self._lem_steps, np.inf, 0.0))
+		for name in ('delta_slc', 'delta_cmet', 'delta_alc'):
+			v[name] = model.add_variables(shape, ub=lem_ub, binary=True)
+		model.add_terms(r['Equilibrium'], v['e_pur'], -1.0)
+		model.add_terms(r['Equilibrium'], v['e_sale'], 1.0)
+
+		# Eq. 16-18
+		v.update(add_batteries_formulation(model, self._batteries, nr_steps, self._delta_t, r['C_met']))
+
+		# Eq. 11, or its relaxation, when the MILP is a subproblem of the decomposed solver (see "AdmmStageTwoMILPPool")
+		if self.exchange is None:
+			self._market_equilibrium = model.add_rows(int(self._lem_steps.sum()), lb=0.0, ub=0.0)
+			model.add_terms(self._market_equilibrium, v['e_sale'][:, self._lem_steps], 1.0)
+			model.add_terms(self._market_equilibrium, v['e_pur'][:, self._lem_steps], -1.0)
+		else:
+			v.update(add_exchange_terms(model, v, self.exchange['prices'], self.exchange['targets'],
+			                            self.exchange['rho'], self.exchange['breakpoints']))
+
+		# Eq. 20-39
+		nonneg = np.broadcast_to(l_grid >= 0, shape)
+		add_sharing_formulation(model, v, np.arange(len(self.set_meters)), nonneg, big_m, rec_big_m,
+		                        self.strict_pos_coeffs, self.total_share_coeffs, steps=self._lem_steps)
+
+		# Eq. 10: Objective Function, as the sum of the Meters' costs
+		costs = self.__costs()
+		deg_cost = self._batteries['degradation_cost'][:, np.newaxis]
+		for name, coef in costs:
+			model.add_cost(v[name], coef)
+		model.add_cost(v['e_bd'], deg_cost)
+
+		# Eq. 19: the same costs, per Meter, plus the LEM transactions
+		c_ind_bound = np.array([round_up(c) for c in self._c_ind])
+		self._stage_1_cost = model.add_rows(len(self.set_meters), ub=c_ind_bound)
+		rows = self._stage_1_cost[:, np.newaxis]
+		for name, coef in costs:
+			model.add_terms(rows, v[name], coef)
+		model.add_terms(self._stage_1_cost[self._batteries['owner']][:, np.newaxis], v['e_bd'], deg_cost)
+		model.add_terms(rows, v['e_pur'], np.asarray(self._l_lem, dtype=float))
+		model.add_terms(rows, v['e_sale'], -np.asarray(self._l_lem, dtype=float))
+
+		self._vars = v
+
+		logger.debug('-- defining the collective (pool, matrix) MILP problem... DONE!')
+
+		return
+
+	def update_prices(self, l_lem=None, l_market_buy=None, l_market_sell=None, l_buy=None, l_sell=None, l_grid=None):
+		"""
+		Update the price vectors considered by the MILP. If the MILP was already assembled, its structure is kept and
+		only the coefficients of the objective function and of the "Stage_1_cost" constraints are overwritten, so that
+		it can be re-solved (e.g., across the iterations of a pricing loop) without being assembled anew, as in
+		"StageTwoMILPPool.update_prices".
+		Arguments left as None are kept unchanged.
+		:param l_lem: price for LEM transactions [€/kWh]
+		:param l_market_buy: market-indexed buying tariff [€/kWh]
+		:param l_market_sell: market-indexed selling tariff [€/kWh]
+		:param l_buy: supply energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_sell: feed in energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_grid: access tariff of the local grid [€/kWh]; if the sign of any step changes, the MILP
+			is assembled anew on the next solve, since the sign of l_grid selects the set of constraints applied
+		The MILP is also assembled anew if the new tariffs change which "delta_sup" binaries can be relaxed, or on
+		which steps the LEM is modelled.
+		"""
+		if l_lem is not None:
+			self._l_lem = l_lem
+		if l_market_buy is not None:
+			self._l_market_buy = l_market_buy
+		if l_market_sell is not None:
+			self._l_market_sell = l_market_sell
+		if l_buy is not None:
+			for n, meter_l_buy in l_buy.items():
+				self._meters_data[n]['l_buy'] = meter_l_buy
+		if l_sell is not None:
+			for n, meter_l_sell in l_sell.items():
+				self._meters_data[n]['l_sell'] = meter_l_sell
+		if l_grid is not None:
+			sign_change = any((new >= 0) != (old >= 0) for new, old in zip(l_grid, self._l_grid))
+			self._l_grid = l_grid
+			if sign_change:
+				self.milp = None
+
+		# The binaries that are relaxed and the steps where the LEM is modelled depend on the tariffs
+		if self.milp is not None and (self.__supply_binaries_needed() != self._sup_needed).any():
+			self.milp = None
+		if self.milp is not None and \
+				(self.__lem_steps_needed(self.__per_meter('e_c') - self.__per_meter('e_g')) != self._lem_steps).any():
+			self.milp = None
+
+		# Nothing else to do if the MILP is (still) to be assembled
+		if self.milp is None:
+			return
+
+		rows = self._stage_1_cost[:, np.newaxis]
+		for name, coef in self.__costs():
+			self.milp.set_cost(self._vars[name], coef)
+			self.milp.set_terms(rows, self._vars[name], coef)
+
+		# LEM transactions only affect the individual costs
+		l_lem = np.asarray(self._l_lem, dtype=float)
+		self.milp.set_terms(rows, self._vars['e_pur'], l_lem)
+		self.milp.set_terms(rows, self._vars['e_sale'], -l_lem)
+
+		return
+
+	def update_forecasts(self, e_c=None, e_g=None):
+		"""
+		Update the consumption and generation forecasts considered by the MILP (e.g., when revised intraday). If the
+		MILP was already assembled, only the bounds of the "C_met" constraints are overwritten, as long as the big-M
+		values and flows' bounds derived from the data are still valid, i.e., not lower than the new ones, and the LEM
+		is still modelled on every step where it is now needed; otherwise, the MILP is assembled anew on the next
+		solve.
+		Arguments left as None are kept unchanged.
+		:param e_c: Btm total energy consumption, per Meter (only the Meters to update need to be provided) [kWh]
+		:param e_g: Btm total energy generation, per Meter (only the Meters to update need to be provided) [kWh]
+		"""
+		for key, per_meter in (('e_c', e_c), ('e_g', e_g)):
+			for n, forecast in (per_meter or {}).items():
+				self._meters_data[n][key] = forecast
+
+		# Nothing else to do if the MILP is (still) to be assembled
+		if self.milp is None:
+			return
+
+		# The big-M values and the steps where the LEM is modelled depend on the forecasts
+		e_net = self.__per_meter('e_c') - self.__per_meter('e_g')
+		if self.tight_big_m:
+			big_m, rec_big_m = self.__big_m_values(e_net)
+			if (big_m > self._big_m).any() or (rec_big_m > self._rec_big_m).any():
+				self.milp = None
+				return
+		if (self.__lem_steps_needed(e_net) & ~self._lem_steps).any():
+			self.milp = None
+			return
+
+		self.milp.set_row_bounds(self._c_met, lb=e_net, ub=e_net)
+
+		return
+
+	def update_c_ind(self, c_ind: dict[str, float]):
+		"""
+		Update the individual costs (from the first stage) that bound each Meter's cost on the second stage.
+		If the MILP was already assembled, only the upper bounds of the "Stage_1_cost" constraints are overwritten.
+		Ignored on single stage runs, where that bound is relaxed.
+		:param c_ind: objective function values of each Meters' 1st stage MILP solution, per Meter
+		"""
+		if not self.second_stage:
+			return
+
+		for n, c in c_ind.items():
+			self._meters_data[n]['c_ind'] = c
+
+		if self.milp is None:
+			return
+
+		self._c_ind = self.__per_meter('c_ind')
+		self.milp.set_row_bounds(self._stage_1_cost, ub=[round_up(c) for c in self._c_ind])
+
+		return
+
+	def set_initial_values(self, values: dict):
+		"""
+		Kept for interface compatibility with "StageTwoMILPPool"; the starting point is ignored, since MIP starts are
+		not supported by the in-process solver.
+		"""
+		return
+
+	def set_initial_values_from_stage_1(self, stage1_outputs: list[OutputsS1Dict]):
+		"""
+		Kept for interface compatibility with "StageTwoMILPPool"; the starting point is ignored, since MIP starts are
+		not supported by the in-process solver.
+		"""
+		return
+
+	def solve_milp(self):
+		"""
+		Function that heads the definition and solution of the second stage MILP.
+		The MILP is only assembled on the first call, or when an update changes its structure; later calls re-solve
+		it with the prices, forecasts and individual costs updated in place (see "update_prices", "update_forecasts"
+		and "update_c_ind").
+		"""
+		if self.milp is None:
+			self.__define_milp()
+
+		logger.debug('-- solving the collective (pool, matrix) MILP problem...')
+		self.milp.solve(self.timeout, self.mipgap)
+		self.status = self.milp.status
+		self.obj_value = self.milp.obj_value
+		logger.debug('-- solving the collective (pool, matrix) MILP problem... DONE!')
+
+		return
+
+	def generate_outputs(self) -> OutputsS2PoolDict:
+		"""
+		Function for generating the outputs of optimization, with the same structure as
+		"StageTwoMILPPool.generate_outputs".
+		:return: outputs dictionary with MILP variables' and other computed values
+		"""
+		outputs = {}
+
+		if self.obj_value is None:
+			return outputs
+
+		outputs['obj_value'] = self.obj_value
+		outputs['milp_status'] = self.status
+
+		values = {name: self.milp.values(idx) for name, idx in self._vars.items()}
+		if self.exchange is not None:
+			# Costs of the Meters alone, without the prices and penalties of the relaxed Eq. 11
+			prices = np.broadcast_to(np.asarray(self.exchange['prices'], dtype=float), values['e_sale'].shape)
+			outputs['obj_value'] = self.obj_value - float((prices * (values['e_sale'] - values['e_pur'])).sum()) \
+				- float(values['exchange_penalty'].sum())
+		values['delta_sup'] = relaxed_binaries_values(values['delta_sup'], self._sup_needed,
+		                                              values['e_sup_retail'] + values['e_sup_market'])
+		per_meter = lambda name: dict(zip(self.set_meters, values[name].tolist()))
+		output_names = {'e_pur': 'e_pur_pool', 'e_sale': 'e_sale_pool', 'e_slc': 'e_slc_pool'}
+		for name in ('e_sup_retail', 'e_sur_retail', 'e_sup_market', 'e_sur_market', 'delta_sup', 'e_pur', 'e_sale',
+		             'e_cmet', 'e_slc', 'e_consumed', 'e_alc', 'delta_slc', 'delta_cmet', 'delta_alc', 'p_extra'):
+			outputs[output_names.get(name, name)] = per_meter(name)
+		for name in ('e_bat', 'soc_bat', 'e_bc', 'e_bd', 'delta_bc'):
+			outputs[name] = per_battery(values[name], self._batteries, self.set_meters)
+		if self.strict_pos_coeffs:
+			outputs['delta_coeff'] = per_meter('delta_coeff')
+		if self.total_share_coeffs:
+			outputs['delta_rec_balance'] = values['delta_rec_balance'].tolist()
+			outputs['delta_meter_balance'] = per_meter('delta_meter_balance')
+
+		# Individual costs found on stage 2
+		deg_cost = np.zeros(len(self.set_meters))
+		np.add.at(deg_cost, self._batteries['owner'],
+		          (self._batteries['degradation_cost'][:, np.newaxis] * values['e_bd']).sum(axis=1))
+		p_extra_cost = values['p_extra'].sum(axis=1) * self._l_extra
+		c_ind_bound = np.array([round_up(c) for c in self._c_ind])
+		c_ind2pool = self.milp.activity(self._stage_1_cost) - c_ind_bound + self._c_ind
+		outputs['c_ind2pool'] = dict(zip(self.set_meters, c_ind2pool.tolist()))
+		outputs['c_ind2pool_without_deg'] = dict(zip(self.set_meters, (c_ind2pool - deg_cost).tolist()))
+		outputs['c_ind2pool_without_deg_and_p_extra'] = \
+			dict(zip(self.set_meters, (c_ind2pool - deg_cost - p_extra_cost).tolist()))
+		outputs['c_ind2pool_without_p_extra'] = dict(zip(self.set_meters, (c_ind2pool - p_extra_cost).tolist()))
+		outputs['deg_cost2pool'] = dict(zip(self.set_meters, deg_cost.tolist()))
+		outputs['p_extra_cost2pool'] = dict(zip(self.set_meters, p_extra_cost.tolist()))
+
+		# Dual values of the "Market_equilibrium" constraints, from the LP with the binary variables fixed, or the
+		# prices of its relaxation; the sessions without LEM are priced as those without selling offers (see
+		# "empty_session_prices")
+		l_buy = np.array([self._meters_data[n]['l_buy'] for n in self.set_meters], dtype=float)
+		dual_prices = empty_session_prices(values['e_cmet'], l_buy, self._l_market_buy)
+		if self.exchange is None:
+			dual_prices[self._lem_steps] = np.abs(self.milp.fixed_integers_duals(self._market_equilibrium))
+		else:
+			dual_prices[self._lem_steps] = np.abs(np.asarray(self.exchange['prices'], dtype=float))[self._lem_steps]
+		outputs['dual_prices'] = dual_prices.tolist()
+
+		return outputs
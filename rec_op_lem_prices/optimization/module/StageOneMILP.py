@@ -2,19 +2,33 @@
 Class for implementing and running the Stage 1 MILP for each individual Meter / microgrid / hybrid park.
 """
 import itertools
-import os
-import re
+import numpy as np
 
 from rec_op_lem_prices.configs.configs import (
+	EXPORT_DIR,
+	EXPORT_FORMAT,
 	MIPGAP,
+	RELAX_BINARIES,
 	SOLVER,
+	TIGHT_BIG_M,
 	TIMEOUT
 )
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import unpack_batteries
 from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	binary_variable,
 	dict_none_lists,
+	export_milp,
 	none_lists,
+	step_durations,
 	time_intervals
 )
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	btm_energy_limits,
+	charge_binaries_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
 from rec_op_lem_prices.custom_types.stage_one_milp_types import (
 	BackpackS1Dict,
 	OutputsS1Dict
@@ -24,7 +38,6 @@ from pulp import (
 	CPLEX_CMD,
 	HiGHS_CMD,
 	listSolvers,
-	LpBinary,
 	LpMinimize,
 	LpProblem,
 	LpStatus,
@@ -37,7 +50,8 @@ from pulp import (
 
 
 class StageOneMILP:
-	def __init__(self, backpack: BackpackS1Dict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP):
+	def __init__(self, backpack: BackpackS1Dict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP,
+	             export_dir=EXPORT_DIR, relax_binaries=RELAX_BINARIES, tight_big_m=TIGHT_BIG_M):
 		# Indices and sets
 		self._horizon = backpack.get('horizon')  # operation period [h]
 		# Parameters
@@ -58,19 +72,27 @@ class StageOneMILP:
 		self._soc_max = {}  # maximum state of charge [%]
 		self._init_e_bat = {}  # initial energy content of the batteries [kWh]
 		self._deg_cost = {}  # estimated degradation cost of the batteries of n [€/kWh]
-		self._big_m = 10 * self._p_meter_max  # a very big number [kWh]
+		self._big_m = None  # big-M values of the supply and surplus constraints, per time step [kWh]
+		self._e_sup_max = None  # upper bounds of the energy supplied to n, per time step, if derived [kWh]
+		self._e_sur_max = None  # upper bounds of the energy surplus of n, per time step, if derived [kWh]
 		self._l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
 		# MILP variables
 		self.milp = None  # for storing the MILP formulation
 		self.solver = solver  # solver chosen for the MILP
 		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
 		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.export_dir = export_dir  # if provided, the MILP is written to this directory before each solve
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
 		self.status = None  # stores the status of the MILP's solution
 		self.obj_value = None  # stores the MILP's numeric solution
 		self.meter_id = backpack.get('id')  # identification of the Meter for which te MILP will run
 		self.time_intervals = None  # for number of time intervals per horizon
 		self.time_series = None  # for a range of time intervals
 		self.set_btm_storage = []  # stores the Meter's Btm storage assets' ids
+		self._lp_vars = {}  # handles of the MILP variables, per variable name (, asset) and time step
+		self._sup_needed = None  # mask of the "delta_sup" kept binary, per time step
+		self._bc_needed = {}  # mask of the "delta_bc" kept binary, per battery and time step
 
 	def __define_milp(self):
 		"""
@@ -83,6 +105,7 @@ class StageOneMILP:
 
 		# Additional temporal variables
 		self.time_intervals = time_intervals(self._horizon, self._delta_t)
+		self._delta_t = step_durations(self._delta_t, self.time_intervals).tolist()
 		self.time_series = range(self.time_intervals)
 
 		# Unpack batteries information
@@ -97,6 +120,26 @@ class StageOneMILP:
 		self._init_e_bat = {b: self._btm_storage[b]['init_e'] for b in self.set_btm_storage}
 		self._deg_cost = {b: self._btm_storage[b]['degradation_cost'] for b in self.set_btm_storage}
 
+		# Binaries that are provably unnecessary for the data at hand are relaxed, if requested
+		tariffs = (self._l_buy, self._l_sell, self._l_market_buy, self._l_market_sell)
+		e_net = np.asarray(self._e_c, dtype=float) - np.asarray(self._e_g, dtype=float)
+		self._sup_needed = supply_binaries_needed(*tariffs) | (not self.relax_binaries)
+		batteries = unpack_batteries({n: self._btm_storage})
+		bc_needed = charge_binaries_needed(batteries, e_net, self._p_meter_max, self._delta_t, *tariffs)
+		self._bc_needed = dict(zip(batteries['storage_ids'], bc_needed | (not self.relax_binaries)))
+
+		# Bounds of the supply and surplus, also used as big-M values, derived from the net consumption and the
+		# batteries' power if requested; a very big number otherwise
+		if self.tight_big_m:
+			e_cmet_min, e_cmet_max = net_consumption_bounds(
+				e_net, *btm_energy_limits(batteries, 1, self.time_intervals, self._delta_t))
+			self._e_sup_max = np.maximum(e_cmet_max[0], 0.0).tolist()
+			self._e_sur_max = np.maximum(-e_cmet_min[0], 0.0).tolist()
+			self._big_m = {'sup': self._e_sup_max, 'sur': self._e_sur_max}
+		else:
+			self._e_sup_max = self._e_sur_max = [None] * self.time_intervals
+			self._big_m = dict.fromkeys(('sup', 'sur'), [10 * self._p_meter_max] * self.time_intervals)
+
 		# Initialize the decision variables
 		e_sup_retail = none_lists(self.time_intervals)  # energy supplied to n from its retailer [kWh]
 		e_sur_retail = none_lists(self.time_intervals)  # energy surplus sold by n to its retailer [kWh]
@@ -114,11 +157,11 @@ class StageOneMILP:
 		# Define the decision variables as puLP objets
 		for t in self.time_series:
 			increment = f'{t:03d}'
-			e_sup_retail[t] = LpVariable('e_sup_retail_' + increment, lowBound=0)
-			e_sur_retail[t] = LpVariable('e_sur_retail_' + increment, lowBound=0)
-			e_sup_market[t] = LpVariable('e_sup_market_' + increment, lowBound=0)
-			e_sur_market[t] = LpVariable('e_sur_market_' + increment, lowBound=0)
-			delta_sup[t] = LpVariable('delta_sup_' + increment, cat=LpBinary)
+			e_sup_retail[t] = LpVariable('e_sup_retail_' + increment, lowBound=0, upBound=self._e_sup_max[t])
+			e_sur_retail[t] = LpVariable('e_sur_retail_' + increment, lowBound=0, upBound=self._e_sur_max[t])
+			e_sup_market[t] = LpVariable('e_sup_market_' + increment, lowBound=0, upBound=self._e_sup_max[t])
+			e_sur_market[t] = LpVariable('e_sur_market_' + increment, lowBound=0, upBound=self._e_sur_max[t])
+			delta_sup[t] = binary_variable('delta_sup_' + increment, self._sup_needed[t])
 			e_cmet[t] = LpVariable('e_cmet_' + increment)
 			p_extra[t] = LpVariable('p_extra_' + increment, lowBound=0)
 			for b in self.set_btm_storage:
@@ -127,7 +170,23 @@ class StageOneMILP:
 				soc_bat[b][t] = LpVariable('soc_bat_' + increment, lowBound=0)
 				e_bc[b][t] = LpVariable('e_bc_' + increment, lowBound=0)
 				e_bd[b][t] = LpVariable('e_bd_' + increment, lowBound=0)
-				delta_bc[b][t] = LpVariable('delta_bc_' + increment, cat=LpBinary)
+				delta_bc[b][t] = binary_variable('delta_bc_' + increment, self._bc_needed[b][t])
+
+		# Keep the handles of the variables, for retrieving their values
+		self._lp_vars = {
+			'e_sup_retail': e_sup_retail,
+			'e_sur_retail': e_sur_retail,
+			'e_sup_market': e_sup_market,
+			'e_sur_market': e_sur_market,
+			'delta_sup': delta_sup,
+			'e_cmet': e_cmet,
+			'p_extra': p_extra,
+			'e_bat': e_bat,
+			'soc_bat': soc_bat,
+			'e_bc': e_bc,
+			'e_bd': e_bd,
+			'delta_bc': delta_bc
+		}
 
 		# Eq. 1: Objective Function
 		objective = lpSum(
@@ -159,20 +218,20 @@ class StageOneMILP:
 
 			# Eq. 4
 			self.milp += \
-				- p_extra[t] - self._p_meter_max <= e_cmet[t] * 1 / self._delta_t, \
+				- p_extra[t] - self._p_meter_max <= e_cmet[t] * 1 / self._delta_t[t], \
 				'P_flow_low_limit_' + increment
 
 			self.milp += \
-				e_cmet[t] * 1 / self._delta_t <= p_extra[t] + self._p_meter_max, \
+				e_cmet[t] * 1 / self._delta_t[t] <= p_extra[t] + self._p_meter_max, \
 				'P_flow_high_limit_' + increment
 
 			# Eq. 5
 			self.milp += \
-				e_sup_retail[t] + e_sup_market[t] <= self._big_m * delta_sup[t], \
+				e_sup_retail[t] + e_sup_market[t] <= self._big_m['sup'][t] * delta_sup[t], \
 				'Supply_ON_' + increment
 
 			self.milp += \
-				e_sur_retail[t] + e_sur_market[t] <= self._big_m * (1 - delta_sup[t]), \
+				e_sur_retail[t] + e_sur_market[t] <= self._big_m['sur'][t] * (1 - delta_sup[t]), \
 				'Supply_OFF_' + increment
 
 		for b, t in itertools.product(self.set_btm_storage, self.time_series):
@@ -204,18 +263,13 @@ class StageOneMILP:
 
 			# Eq. 8
 			self.milp += \
-				e_bc[b][t] * 1 / self._delta_t <= self._p_max[b] * delta_bc[b][t], \
+				e_bc[b][t] * 1 / self._delta_t[t] <= self._p_max[b] * delta_bc[b][t], \
 				'Charge_rate_limit_' + increment
 
 			self.milp += \
-				e_bd[b][t] * 1 / self._delta_t <= self._p_max[b] * (1 - delta_bc[b][t]), \
+				e_bd[b][t] * 1 / self._delta_t[t] <= self._p_max[b] * (1 - delta_bc[b][t]), \
 				'Discharge_rate_limit' + increment
 
-		# Write MILP to .lp file
-		dir_name = os.path.abspath(os.path.join(__file__, '..'))
-		lp_file = os.path.join(dir_name, f'Stage1_{n}.lp')
-		self.milp.writeLP(lp_file)
-
 		# Set the solver to be called
 		if self.solver == 'CBC' and 'PULP_CBC_CMD' in listSolvers(onlyAvailable=True):
 			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap))
@@ -242,6 +296,10 @@ class StageOneMILP:
 		# Define the MILP
 		self.__define_milp()
 
+		# Dump the MILP formulation for debugging purposes
+		if self.export_dir is not None:
+			export_milp(self.milp, self.export_dir, f'Stage1_{self.meter_id}', EXPORT_FORMAT)
+
 		# Solve the MILP
 		logger.debug(f'-- solving the individual MILP problem for Meter id: {self.meter_id}...')
 
@@ -279,59 +337,28 @@ class StageOneMILP:
 		outputs['obj_value'] = self.obj_value
 		outputs['milp_status'] = self.status
 
-		outputs['e_sup_retail'] = none_lists(self.time_intervals)
-		outputs['e_sur_retail'] = none_lists(self.time_intervals)
-		outputs['e_sup_market'] = none_lists(self.time_intervals)
-		outputs['e_sur_market'] = none_lists(self.time_intervals)
-		outputs['delta_sup'] = none_lists(self.time_intervals)
-		outputs['e_cmet'] = none_lists(self.time_intervals)
-		outputs['p_extra'] = none_lists(self.time_intervals)
-		outputs['e_bat'] = dict_none_lists(self.time_intervals, self.set_btm_storage)
-		outputs['soc_bat'] = dict_none_lists(self.time_intervals, self.set_btm_storage)
-		outputs['e_bc'] = dict_none_lists(self.time_intervals, self.set_btm_storage)
-		outputs['e_bd'] = dict_none_lists(self.time_intervals, self.set_btm_storage)
-		outputs['delta_bc'] = dict_none_lists(self.time_intervals, self.set_btm_storage)
-
-		# required when vars include "-" since puLP converts it to "_"
-		btm_storage_ids = [bid for bid in self.set_btm_storage]
-		b_match = {key: key.replace('-', '_') for key in btm_storage_ids}
-
-		for v in self.milp.variables():
-			step_nr = None
-			if not re.search('dummy', v.name):
-				step_nr = int(v.name[-3:])
-			if re.search('e_sup_retail', v.name):
-				outputs['e_sup_retail'][step_nr] = v.varValue
-			elif re.search('e_sur_retail', v.name):
-				outputs['e_sur_retail'][step_nr] = v.varValue
-			elif re.search('e_sup_market', v.name):
-				outputs['e_sup_market'][step_nr] = v.varValue
-			elif re.search('e_sur_market', v.name):
-				outputs['e_sur_market'][step_nr] = v.varValue
-			elif re.search('delta_sup', v.name):
-				outputs['delta_sup'][step_nr] = v.varValue
-			elif re.search('e_cmet', v.name):
-				outputs['e_cmet'][step_nr] = v.varValue
-			elif re.search('p_extra', v.name):
-				outputs['p_extra'][step_nr] = v.varValue
-			else:
-				for b_ in self.set_btm_storage:
-					b = b_match[b_]
-					if re.search(f'e_bat_{b}_', v.name):
-						outputs['e_bat'][b_][step_nr] = v.varValue
-						break
-					elif re.search(f'soc_bat_{b}_', v.name):
-						outputs['soc_bat'][b_][step_nr] = v.varValue
-						break
-					elif re.search(f'e_bc_{b}_', v.name):
-						outputs['e_bc'][b_][step_nr] = v.varValue
-						break
-					elif re.search(f'e_bd_{b}_', v.name):
-						outputs['e_bd'][b_][step_nr] = v.varValue
-						break
-					elif re.search(f'delta_bc_{b}_', v.name):
-						outputs['delta_bc'][b_][step_nr] = v.varValue
-						break
+		# Associate the values of the variables with the respective outputs' structure
+		per_step = lambda name: [v.varValue for v in self._lp_vars[name]]
+		per_asset = lambda name: {b: [v.varValue for v in asset_vars] for b, asset_vars in self._lp_vars[name].items()}
+
+		outputs['e_sup_retail'] = per_step('e_sup_retail')
+		outputs['e_sur_retail'] = per_step('e_sur_retail')
+		outputs['e_sup_market'] = per_step('e_sup_market')
+		outputs['e_sur_market'] = per_step('e_sur_market')
+		outputs['delta_sup'] = per_step('delta_sup')
+		outputs['e_cmet'] = per_step('e_cmet')
+		outputs['p_extra'] = per_step('p_extra')
+		outputs['e_bat'] = per_asset('e_bat')
+		outputs['soc_bat'] = per_asset('soc_bat')
+		outputs['e_bc'] = per_asset('e_bc')
+		outputs['e_bd'] = per_asset('e_bd')
+		outputs['delta_bc'] = per_asset('delta_bc')
+
+		# Set the binaries that were relaxed according to the flows they would switch on
+		supply = np.add(outputs['e_sup_retail'], outputs['e_sup_market'])
+		outputs['delta_sup'] = relaxed_binaries_values(outputs['delta_sup'], self._sup_needed, supply).tolist()
+		outputs['delta_bc'] = {b: relaxed_binaries_values(delta_bc, self._bc_needed[b], outputs['e_bc'][b]).tolist()
+		                       for b, delta_bc in outputs['delta_bc'].items()}
 
 		# Calculate the cost of degradation
 		deg_cost = 0
@@ -3,25 +3,52 @@ Class for implementing and running the Stage 2 MILP for an energy community.
 The implementation is specific to a p2p structure, based on bilateral contracts.
 """
 import itertools
-import os
-import re
+import numpy as np
 
 from rec_op_lem_prices.configs.configs import (
+	EXPORT_DIR,
+	EXPORT_FORMAT,
 	MIPGAP,
+	PRUNE_STEPS,
+	RELAX_BINARIES,
 	SOLVER,
-	TIMEOUT
+	TIGHT_BIG_M,
+	TIMEOUT,
+	WARM_START
+)
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import (
+	unpack_batteries,
+	unpack_evs
 )
 from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	binary_variable,
 	dict_none_lists,
+	export_milp,
 	dict_per_param,
+	lem_flows_as_variables,
 	none_lists,
 	round_up,
+	set_initial_values,
+	step_durations,
 	time_intervals
 )
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	big_m_values,
+	btm_energy_limits,
+	lem_steps_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
+from rec_op_lem_prices.optimization.helpers.partners_helpers import (
+	l_grid_to_array,
+	resolve_partners
+)
 from rec_op_lem_prices.custom_types.stage_two_milp_bilateral_types import (
 	BackpackS2BilateralDict,
 	OutputsS2BilateralDict
 )
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
 from loguru import logger
 from pulp import (
 	CPLEX_CMD,
@@ -40,7 +67,9 @@ from pulp import (
 
 
 class StageTwoMILPBilateral:
-	def __init__(self, backpack: BackpackS2BilateralDict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP):
+	def __init__(self, backpack: BackpackS2BilateralDict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP,
+	             export_dir=EXPORT_DIR, warm_start=WARM_START, relax_binaries=RELAX_BINARIES,
+	             tight_big_m=TIGHT_BIG_M, prune_steps=PRUNE_STEPS):
 		# Indices and sets
 		self._horizon = backpack.get('horizon')  # operation period (hours)
 		# Parameters
@@ -62,8 +91,13 @@ class StageTwoMILPBilateral:
 		self._deg_cost = {}  # estimated degradation cost of the batteries of n [€/kWh]
 		self._c_ind = None  # objective function values of each Meters' 1st stage MILP solution
 		self._l_grid = backpack.get('l_grid')  # access tariff of the local grid between each pair of members [€/kWh]
+		self._partners = backpack.get('partners')  # trading graph; all pairs of members if None (see "resolve_partners")
+		self._l_grid_pairs = {}  # access tariff of the local grid, only for the pairs of trading partners [€/kWh]
+		self._l_grid_nonneg = {}  # True if all access tariffs of a Meter to its partners are non-negative, per step
 		self._l_lem = backpack.get('l_lem')  # price for LEM transactions [€/kWh]
-		self._big_m = None  # a very big number [kWh]
+		self._big_m = {}  # big-M values per Meter and time step [kWh]
+		self._rec_big_m = None  # big-M values per time step [kWh]
+		self._flow_max = None  # upper bounds of the retail and LEM flows, per time step, if derived [kWh]
 		self._l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
 		self._trip_ev = {}  # EV energy consumption, in kWh
 		self._min_energy_storage_ev = {}  # Minimum stored energy to be guaranteed for vehicle ev at CPE n, in kWh
@@ -79,17 +113,37 @@ class StageTwoMILPBilateral:
 		self.solver = solver  # solver chosen for the MILP
 		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
 		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.export_dir = export_dir  # if provided, the MILP is written to this directory before each solve
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
+		self.prune_steps = prune_steps  # if True, the LEM is skipped on the steps where no internal trade can occur
+		self.warm_start = warm_start  # if True, the solver is seeded with the initial values set (MIP start)
 		self.status = None  # stores the status of the MILP's solution
 		self.obj_value = None  # stores the MILP's numeric solution
 		self.time_intervals = None  # for number of time intervals per horizon
 		self.time_series = None  # for a range of time intervals
 		self.set_meters = None  # set with Meters' ID
+		self.sets_other_meters = {}  # stores the trading partners of each Meter
 		self.sets_btm_storage = {}  # stores the Meter's Btm storage assets' ids
 		self.sets_btm_ev = {}  # stores the Meter's Btm EVs ids
 		self._meters_data = backpack.get('meters')  # data from Meters
 		self.second_stage = backpack.get('second_stage')  # indicates if second stage (True) or single stage (False)
 		self.strict_pos_coeffs = backpack.get('strict_pos_coeffs')  # no negative coefficients if True
 		self.total_share_coeffs = backpack.get('total_share_coeffs')  # share all required in the REC if True
+		self._lp_vars = {}  # handles of the MILP variables, per variable name, Meter (, partner or asset) and time step
+		self._sup_needed = {}  # mask of the "delta_sup" kept binary, per Meter and time step
+		self._stage_1_cost = {}  # handles of the "Stage_1_cost_" constraints, per Meter
+		self._initial_values = None  # starting point to set on the next solve (see "set_initial_values")
+		self._lem_steps = None  # mask of the time steps where the LEM is modelled
+
+	def __supply_binaries_needed(self) -> dict[str, np.ndarray]:
+		"""
+		Flags, per Meter, the steps where the supply / surplus exclusivity binaries are needed, given the current
+		tariffs (see "supply_binaries_needed"); the other ones are relaxed, if requested.
+		"""
+		return {n: supply_binaries_needed(meter['l_buy'], meter['l_sell'], self._l_market_buy, self._l_market_sell)
+		           | (not self.relax_binaries)
+		        for n, meter in self._meters_data.items()}
 
 	def __define_milp(self):
 		"""
@@ -99,14 +153,30 @@ class StageTwoMILPBilateral:
 
 		# Define a minimization MILP
 		self.milp = LpProblem(f'stage2', LpMinimize)
+		self._stage_1_cost = {}
 
 		# Additional temporal variables
 		self.time_intervals = time_intervals(self._horizon, self._delta_t)
+		self._delta_t = step_durations(self._delta_t, self.time_intervals).tolist()
 		self.time_series = range(self.time_intervals)
 
 		# Set of Meters
 		self.set_meters = list(self._meters_data.keys())
-		self.sets_other_meters = {n: [m for m in self.set_meters if m != n] for n in self.set_meters}
+		l_grid = l_grid_to_array(self._l_grid, self.set_meters, self.time_intervals)
+		self.sets_other_meters = resolve_partners(self.set_meters, l_grid, self._partners)
+		logger.debug(f'-- trading graph with {sum(map(len, self.sets_other_meters.values()))} directed edges')
+
+		# Per-pair data derived from the access tariffs, computed at once for all pairs of trading partners
+		index = {n: i for i, n in enumerate(self.set_meters)}
+		adjacency = np.zeros(l_grid.shape[:2], dtype=bool)
+		for n, n_partners in self.sets_other_meters.items():
+			adjacency[index[n], [index[m] for m in n_partners]] = True
+		nonneg = np.where(adjacency[:, :, np.newaxis], l_grid >= 0, True).all(axis=1)
+		self._l_grid_nonneg = dict(zip(self.set_meters, nonneg.tolist()))
+		self._l_grid_pairs = {
+			n: dict(zip(n_partners, l_grid[index[n], [index[m] for m in n_partners]].tolist()))
+			for n, n_partners in self.sets_other_meters.items()
+		}
 
 		# For simplicity, unpack Meters' information into lists, by type of data, where each Meter is solely
 		# identified by its relative position on the list
@@ -115,7 +185,7 @@ class StageTwoMILPBilateral:
 		self._e_c = dict_per_param(self._meters_data, 'e_c')
 		self._e_g = dict_per_param(self._meters_data, 'e_g')
 		self._p_meter_max = dict_per_param(self._meters_data, 'max_p')
-		self._big_m = 10 * max(self._p_meter_max.values())
+		self._sup_needed = self.__supply_binaries_needed()
 		if self.second_stage:
 			self._c_ind = dict_per_param(self._meters_data, 'c_ind')
 		else:
@@ -157,6 +227,30 @@ class StageTwoMILPBilateral:
 			else:
 				self.sets_btm_ev[n] = []
 
+		# Big-M values, derived from the Meters' net consumption and Btm assets' power if requested (see
+		# "big_m_values"), which also bound the retail and LEM flows; a very big number otherwise
+		batteries = unpack_batteries({n: self._meters_data[n]['btm_storage'] for n in self.set_meters})
+		evs = unpack_evs({n: self._meters_data[n].get('btm_evs') for n in self.set_meters}, self.time_intervals)
+		e_net = np.array([np.subtract(self._e_c[n], self._e_g[n]) for n in self.set_meters], dtype=float)
+		if self.tight_big_m:
+			e_btm_max = btm_energy_limits(batteries, len(self.set_meters), self.time_intervals, self._delta_t, evs=evs)
+			meter_big_m, rec_big_m = big_m_values(*net_consumption_bounds(e_net, *e_btm_max))
+		else:
+			meter_big_m = np.full((len(self.set_meters), self.time_intervals), 10 * max(self._p_meter_max.values()))
+			rec_big_m = meter_big_m[0]
+		self._big_m = dict(zip(self.set_meters, meter_big_m.tolist()))
+		self._rec_big_m = rec_big_m.tolist()
+		self._flow_max = self._rec_big_m if self.tight_big_m else [None] * self.time_intervals
+
+		# Time steps where the LEM is modelled (see "lem_steps_needed"), considering the lowest access tariff between
+		# trading partners; on the others, the LEM variables are null and their constraints skipped
+		self._lem_steps = np.ones(self.time_intervals, dtype=bool)
+		if self.prune_steps:
+			lowest_l_grid = np.where(adjacency[:, :, np.newaxis], l_grid, np.inf).min(axis=(0, 1))
+			l_buy = np.array([self._l_buy[n] for n in self.set_meters], dtype=float)
+			self._lem_steps = lem_steps_needed(e_net, batteries, self._delta_t, l_buy, self._l_market_buy,
+			                                   lowest_l_grid, self.second_stage, self.strict_pos_coeffs, evs=evs)
+
 		# Initialize the decision variables
 		# energy supplied to n from its retailer [kWh]
 		e_sup_retail = dict_none_lists(self.time_intervals, self.set_meters)
@@ -218,27 +312,37 @@ class StageTwoMILPBilateral:
 		if self.total_share_coeffs:
 			for t in self.time_series:
 				increment = f't{t:03d}'
-				delta_rec_balance[t] = LpVariable('delta_rec_balance_' + increment, cat=LpBinary)
+				delta_rec_balance[t] = LpVariable('delta_rec_balance_' + increment, cat=LpBinary) \
+					if self._lem_steps[t] else 0.0
 
 		t_n_series = itertools.product(self.set_meters, self.time_series)  # iterates over each Meter and each time step
 		for n, t in t_n_series:
 			increment = f'{n}_t{t:03d}'
-			e_sup_retail[n][t] = LpVariable('e_sup_retail_' + increment, lowBound=0)
-			e_sur_retail[n][t] = LpVariable('e_sur_retail_' + increment, lowBound=0)
-			e_sup_market[n][t] = LpVariable('e_sup_market_' + increment, lowBound=0)
-			e_sur_market[n][t] = LpVariable('e_sur_market_' + increment, lowBound=0)
-			delta_sup[n][t] = LpVariable('delta_sup_' + increment, cat=LpBinary)
+			e_sup_retail[n][t] = LpVariable('e_sup_retail_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sur_retail[n][t] = LpVariable('e_sur_retail_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sup_market[n][t] = LpVariable('e_sup_market_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sur_market[n][t] = LpVariable('e_sur_market_' + increment, lowBound=0, upBound=self._flow_max[t])
+			delta_sup[n][t] = binary_variable('delta_sup_' + increment, self._sup_needed[n][t])
 			e_cmet[n][t] = LpVariable('e_cmet_' + increment)
-			e_consumed[n][t] = LpVariable('e_consumed_' + increment, lowBound=0)
-			e_alc[n][t] = LpVariable('e_alc_' + increment, lowBound=0)
-			delta_slc[n][t] = LpVariable('delta_slc_' + increment, cat=LpBinary)
-			delta_cmet[n][t] = LpVariable('delta_cmet_' + increment, cat=LpBinary)
-			delta_alc[n][t] = LpVariable('delta_alc_' + increment, cat=LpBinary)
 			p_extra[n][t] = LpVariable('p_extra_' + increment, lowBound=0)
-			if self.strict_pos_coeffs:
-				delta_coeff[n][t] = LpVariable('delta_coeff_' + increment, cat=LpBinary)
-			if self.total_share_coeffs:
-				delta_meter_balance[n][t] = LpVariable('delta_meter_balance_' + increment, cat=LpBinary)
+			if not self._lem_steps[t]:
+				# No internal trade on this step (see "lem_steps_needed"), so the LEM variables are null
+				e_consumed[n][t] = e_alc[n][t] = 0.0
+				delta_slc[n][t] = delta_cmet[n][t] = delta_alc[n][t] = 0.0
+				if self.strict_pos_coeffs:
+					delta_coeff[n][t] = 0.0
+				if self.total_share_coeffs:
+					delta_meter_balance[n][t] = 0.0
+			else:
+				e_consumed[n][t] = LpVariable('e_consumed_' + increment, lowBound=0)
+				e_alc[n][t] = LpVariable('e_alc_' + increment, lowBound=0)
+				delta_slc[n][t] = LpVariable('delta_slc_' + increment, cat=LpBinary)
+				delta_cmet[n][t] = LpVariable('delta_cmet_' + increment, cat=LpBinary)
+				delta_alc[n][t] = LpVariable('delta_alc_' + increment, cat=LpBinary)
+				if self.strict_pos_coeffs:
+					delta_coeff[n][t] = LpVariable('delta_coeff_' + increment, cat=LpBinary)
+				if self.total_share_coeffs:
+					delta_meter_balance[n][t] = LpVariable('delta_meter_balance_' + increment, cat=LpBinary)
 			for b in self.sets_btm_storage[n]:
 				increment = f'{n}_{b}_t{t:03d}'
 				e_bat[n][b][t] = LpVariable('e_bat_' + increment, lowBound=0)
@@ -248,8 +352,11 @@ class StageTwoMILPBilateral:
 				delta_bc[n][b][t] = LpVariable('delta_bc_' + increment, cat=LpBinary)
 			for m in self.sets_other_meters[n]:
 				increment = f'{n}_{m}_t{t:03d}'
-				e_pur[n][m][t] = LpVariable('e_pur_' + increment, lowBound=0)
-				e_sale[n][m][t] = LpVariable('e_sale_' + increment, lowBound=0)
+				if not self._lem_steps[t]:
+					e_pur[n][m][t] = e_sale[n][m][t] = e_slc[n][m][t] = 0.0
+					continue
+				e_pur[n][m][t] = LpVariable('e_pur_' + increment, lowBound=0, upBound=self._flow_max[t])
+				e_sale[n][m][t] = LpVariable('e_sale_' + increment, lowBound=0, upBound=self._flow_max[t])
 				e_slc[n][m][t] = LpVariable('e_slc_' + increment, lowBound=0)
 			for ev in self.sets_btm_ev[n]:
 				increment = f'{n}_{ev}_t{t:03d}'
@@ -257,12 +364,44 @@ class StageTwoMILPBilateral:
 				p_ev_charge[n][ev][t] = LpVariable('p_ev_charge_' + increment, lowBound=0)
 				p_ev_discharge[n][ev][t] = LpVariable('p_ev_discharge_' + increment, lowBound=0)
 
+		# Keep the handles of the variables, for retrieving their values
+		self._lp_vars = {
+			'e_sup_retail': e_sup_retail,
+			'e_sur_retail': e_sur_retail,
+			'e_sup_market': e_sup_market,
+			'e_sur_market': e_sur_market,
+			'delta_sup': delta_sup,
+			'e_pur': e_pur,
+			'e_sale': e_sale,
+			'e_cmet': e_cmet,
+			'e_slc': e_slc,
+			'e_consumed': e_consumed,
+			'e_alc': e_alc,
+			'delta_slc': delta_slc,
+			'delta_cmet': delta_cmet,
+			'delta_alc': delta_alc,
+			'p_extra': p_extra,
+			'e_bat': e_bat,
+			'soc_bat': soc_bat,
+			'e_bc': e_bc,
+			'e_bd': e_bd,
+			'delta_bc': delta_bc,
+			'ev_stored': ev_stored,
+			'p_ev_charge': p_ev_charge,
+			'p_ev_discharge': p_ev_discharge
+		}
+		if self.strict_pos_coeffs:
+			self._lp_vars['delta_coeff'] = delta_coeff
+		if self.total_share_coeffs:
+			self._lp_vars['delta_rec_balance'] = delta_rec_balance
+			self._lp_vars['delta_meter_balance'] = delta_meter_balance
+
 		# Eq. 10: Objective Function
 		objective = lpSum(
 			lpSum(
 				e_sup_retail[n][t] * self._l_buy[n][t] - e_sur_retail[n][t] * self._l_sell[n][t]
 				+ e_sup_market[n][t] * self._l_market_buy[t] - e_sur_market[n][t] * self._l_market_sell[t]
-				+ lpSum(e_slc[n][m][t] * self._l_grid[n][m][t] for m in self.sets_other_meters[n])
+				+ lpSum(e_slc[n][m][t] * self._l_grid_pairs[n][m][t] for m in self.sets_other_meters[n])
 				+ p_extra[n][t] * self._l_extra
 				+ lpSum(self._deg_cost[n][b] * e_bd[n][b][t] for b in self.sets_btm_storage[n])
 				for n in self.set_meters
@@ -274,35 +413,37 @@ class StageTwoMILPBilateral:
 
 		# Eq. 11-34: Constraints
 		if self.total_share_coeffs:
-			for t in self.time_series:
+			for t in itertools.compress(self.time_series, self._lem_steps):
 				increment = f'{t:03d}'
 				# Eq. 32
 				self.milp += \
-					lpSum(e_cmet[n][t] for n in self.set_meters) >= - self._big_m * delta_rec_balance[t], \
+					lpSum(e_cmet[n][t] for n in self.set_meters) >= - self._rec_big_m[t] * delta_rec_balance[t], \
 					'Check_REC_surplus_' + increment
 
 				# Eq. 33
 				self.milp += \
-					lpSum(e_cmet[n][t] for n in self.set_meters) <= self._big_m * (1 - delta_rec_balance[t]), \
+					lpSum(e_cmet[n][t] for n in self.set_meters) <= self._rec_big_m[t] * (1 - delta_rec_balance[t]), \
 					'Check_REC_deficit_' + increment
 
 		for n, t in itertools.product(self.set_meters, self.time_series):
-			for m in self.sets_other_meters[n]:
+			# Eq. 11, 20-39 and 35-36 are skipped on the steps without LEM
+			lem_step = self._lem_steps[t]
+			for m in self.sets_other_meters[n] if lem_step else []:
 				increment = f'{n}_{m}_t{t:03d}'
 				# Eq. 11
 				self.milp += \
 					e_sale[n][m][t] == e_pur[m][n][t], \
 					'Market_equilibrium_' + increment
 
-				if all([lg[t] >= 0 for _, lg in self._l_grid[n].items()]):
+				if self._l_grid_nonneg[n][t]:
 					# Eq. 35
 					self.milp += \
-						e_slc[n][m][t] >= e_pur[n][m][t] - e_sale[n][m][t] - self._big_m * delta_slc[n][t], \
+						e_slc[n][m][t] >= e_pur[n][m][t] - e_sale[n][m][t] - self._rec_big_m[t] * delta_slc[n][t], \
 						'Self_consumed_is_allocated_' + increment
 
 					# Eq. 36
 					self.milp += \
-						e_slc[n][m][t] <= e_pur[n][m][t] - e_sale[n][m][t] + self._big_m * (1 - delta_slc[n][t]), \
+						e_slc[n][m][t] <= e_pur[n][m][t] - e_sale[n][m][t] + self._rec_big_m[t] * (1 - delta_slc[n][t]), \
 						'Self_consumed_is_consumed_' + increment
 
 			increment = f'{n}_t{t:03d}'
@@ -316,29 +457,29 @@ class StageTwoMILPBilateral:
 			# Eq. 13
 			self.milp += \
 				e_cmet[n][t] == self._e_c[n][t] - self._e_g[n][t] \
-				+ lpSum(e_bc[n][b][t] - e_bd[n][b][t] for b in self.sets_btm_storage[n]) + lpSum(p_ev_charge[n][ev][t] * self._delta_t - p_ev_discharge[n][ev][t] * self._delta_t
+				+ lpSum(e_bc[n][b][t] - e_bd[n][b][t] for b in self.sets_btm_storage[n]) + lpSum(p_ev_charge[n][ev][t] * self._delta_t[t] - p_ev_discharge[n][ev][t] * self._delta_t[t]
 				 for ev in self.sets_btm_ev[n]), \
 				'C_met_' + increment
 
 			# Eq. 14
 			self.milp += \
-				- p_extra[n][t] - self._p_meter_max[n] <= e_cmet[n][t] * 1 / self._delta_t, \
+				- p_extra[n][t] - self._p_meter_max[n] <= e_cmet[n][t] * 1 / self._delta_t[t], \
 				'P_flow_low_limit_' + increment
 
 			self.milp += \
-				e_cmet[n][t] * 1 / self._delta_t <= p_extra[n][t] + self._p_meter_max[n], \
+				e_cmet[n][t] * 1 / self._delta_t[t] <= p_extra[n][t] + self._p_meter_max[n], \
 				'P_flow_high_limit_' + increment
 
 			# Eq. 15
 			self.milp += \
-				e_sup_retail[n][t] + e_sup_market[n][t] <= self._big_m * delta_sup[n][t], \
+				e_sup_retail[n][t] + e_sup_market[n][t] <= self._rec_big_m[t] * delta_sup[n][t], \
 				'Supply_ON_' + increment
 
 			self.milp += \
-				e_sur_retail[n][t] + e_sur_market[n][t] <= self._big_m * (1 - delta_sup[n][t]), \
+				e_sur_retail[n][t] + e_sur_market[n][t] <= self._rec_big_m[t] * (1 - delta_sup[n][t]), \
 				'Supply_OFF_' + increment
 
-			if all([lg[t] >= 0 for _, lg in self._l_grid[n].items()]):
+			if lem_step and self._l_grid_nonneg[n][t]:
 				# Eq. 20
 				self.milp += \
 					e_consumed[n][t] >= e_cmet[n][t], \
@@ -352,13 +493,13 @@ class StageTwoMILPBilateral:
 				# Eq. 22
 				self.milp += \
 					lpSum(e_slc[n][m][t] for m in self.sets_other_meters[n]) >= \
-					e_consumed[n][t] - self._big_m * (1 - delta_slc[n][t]), \
+					e_consumed[n][t] - self._big_m[n][t] * (1 - delta_slc[n][t]), \
 					'Self_consumption_1_' + increment
 
 				# Eq. 23
 				self.milp += \
 					lpSum(e_slc[n][m][t] for m in self.sets_other_meters[n]) >= \
-					e_alc[n][t] - self._big_m * delta_slc[n][t], \
+					e_alc[n][t] - self._rec_big_m[t] * delta_slc[n][t], \
 					'Self_consumption_2_' + increment
 
 				# Eq. aux
@@ -371,26 +512,26 @@ class StageTwoMILPBilateral:
 					delta_alc[n][t] == 0, \
 					'Allocated_energy_bin_' + increment
 
-			else:
+			elif lem_step:
 				# Eq. 24
 				self.milp += \
-					e_consumed[n][t] <= e_cmet[n][t] + self._big_m * delta_cmet[n][t], \
+					e_consumed[n][t] <= e_cmet[n][t] + self._big_m[n][t] * delta_cmet[n][t], \
 					'Consumption_1_' + increment
 
 				# Eq. 25
 				self.milp += \
-					e_consumed[n][t] <= self._big_m * (1 - delta_cmet[n][t]), \
+					e_consumed[n][t] <= self._big_m[n][t] * (1 - delta_cmet[n][t]), \
 					'Consumption_2_' + increment
 
 				# Eq. 26
 				self.milp += \
 					e_alc[n][t] <= lpSum(e_pur[n][m][t] - e_sale[n][m][t] for m in self.sets_other_meters[n]) \
-					+ self._big_m * delta_alc[n][t], \
+					+ self._rec_big_m[t] * delta_alc[n][t], \
 					'Allocated_energy_1_' + increment
 
 				# Eq. 27
 				self.milp += \
-					e_alc[n][t] <= self._big_m * (1 - delta_alc[n][t]), \
+					e_alc[n][t] <= self._rec_big_m[t] * (1 - delta_alc[n][t]), \
 					'Allocated_energy_2_' + increment
 
 				# Eq. 28
@@ -408,52 +549,52 @@ class StageTwoMILPBilateral:
 					delta_slc[n][t] == 0, \
 					'Self_consumed_energy_bin_' + increment
 
-			if self.strict_pos_coeffs:
+			if self.strict_pos_coeffs and lem_step:
 				# Eq. 30
 				self.milp += \
 					lpSum(e_sale[n][m][t] - e_pur[n][m][t] for m in self.sets_other_meters[n]) <= \
-					-e_cmet[n][t] + self._big_m * delta_coeff[n][t], \
+					-e_cmet[n][t] + self._big_m[n][t] * delta_coeff[n][t], \
 					'Positive_coefficients_1_' + increment
 
 				# Eq. 31
 				self.milp += \
 					lpSum(e_sale[n][m][t] - e_pur[n][m][t] for m in self.sets_other_meters[n]) <= \
-					self._big_m * (1 - delta_coeff[n][t]), \
+					self._rec_big_m[t] * (1 - delta_coeff[n][t]), \
 					'Positive_coefficients_2_' + increment
 
-			if self.total_share_coeffs:
+			if self.total_share_coeffs and lem_step:
 				# Eq. 34
 				self.milp += \
-					e_cmet[n][t] >= - self._big_m * delta_meter_balance[n][t], \
+					e_cmet[n][t] >= - self._big_m[n][t] * delta_meter_balance[n][t], \
 					'Check_meter_surplus_' + increment
 
 				# Eq. 35
 				self.milp += \
-					e_cmet[n][t] <= self._big_m * (1 - delta_meter_balance[n][t]), \
+					e_cmet[n][t] <= self._big_m[n][t] * (1 - delta_meter_balance[n][t]), \
 					'Check_meter_deficit_' + increment
 
 				# Eq. 36
 				self.milp += \
 					lpSum(e_sale[n][m][t] for m in self.sets_other_meters[n]) >= \
-					- e_cmet[n][t] - self._big_m * (1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
+					- e_cmet[n][t] - self._rec_big_m[t] * (1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
 					'Share_all_surplus_low_' + increment
 
 				# Eq. 37
 				self.milp += \
 					lpSum(e_sale[n][m][t] for m in self.sets_other_meters[n]) <= \
-					- e_cmet[n][t] + self._big_m * (1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
+					- e_cmet[n][t] + self._rec_big_m[t] * (1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
 					'Share_all_surplus_high_' + increment
 
 				# Eq. 38
 				self.milp += \
 					lpSum(e_pur[n][m][t] for m in self.sets_other_meters[n]) >= \
-					e_cmet[n][t] - self._big_m * (1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
+					e_cmet[n][t] - self._rec_big_m[t] * (1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
 					'Buy_all_deficit_low_' + increment
 
 				# Eq. 39
 				self.milp += \
 					lpSum(e_pur[n][m][t] for m in self.sets_other_meters[n]) <= \
-					e_cmet[n][t] + self._big_m * (1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
+					e_cmet[n][t] + self._rec_big_m[t] * (1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
 					'Buy_all_deficit_high_' + increment
 
 			for b in self.sets_btm_storage[n]:
@@ -487,11 +628,11 @@ class StageTwoMILPBilateral:
 
 					# Eq. 18
 					self.milp += \
-						e_bc[n][b][t] * 1 / self._delta_t <= self._p_max[n][b] * delta_bc[n][b][t], \
+						e_bc[n][b][t] * 1 / self._delta_t[t] <= self._p_max[n][b] * delta_bc[n][b][t], \
 						'Charge_rate_limit_' + increment
 
 					self.milp += \
-						e_bd[n][b][t] * 1 / self._delta_t <= self._p_max[n][b] * (1 - delta_bc[n][b][t]), \
+						e_bd[n][b][t] * 1 / self._delta_t[t] <= self._p_max[n][b] * (1 - delta_bc[n][b][t]), \
 						'Discharge_rate_limit' + increment
 			#EVs constraints
 			for ev in self.sets_btm_ev[n]:
@@ -500,16 +641,16 @@ class StageTwoMILPBilateral:
 				if t == 0:
 					self.milp += ev_stored[n][ev][t] == self._init_e_ev[n][ev] + self._eff_bc_ev[n][ev] * \
 								 p_ev_charge[n][ev][t] \
-								 * self._delta_t - (1 / self._eff_bd_ev[n][ev]) * p_ev_discharge[n][ev][
-									 t] * self._delta_t \
+								 * self._delta_t[t] - (1 / self._eff_bd_ev[n][ev]) * p_ev_discharge[n][ev][
+									 t] * self._delta_t[t] \
 								 - self._trip_ev[n][ev][t], \
 								 'EV_balance_' + increment
 				else:
 					self.milp += ev_stored[n][ev][t] == ev_stored[n][ev][t - 1] + self._eff_bc_ev[n][ev] * \
 								 p_ev_charge[n][ev][
 									 t] * \
-								 self._delta_t - (1 / self._eff_bd_ev[n][ev]) * p_ev_discharge[n][ev][t] * \
-								 self._delta_t - self._trip_ev[n][ev][t], \
+								 self._delta_t[t] - (1 / self._eff_bd_ev[n][ev]) * p_ev_discharge[n][ev][t] * \
+								 self._delta_t[t] - self._trip_ev[n][ev][t], \
 								 'EV_balance_' + increment
 
 				# Eq. 42
@@ -532,33 +673,33 @@ class StageTwoMILPBilateral:
 			increment = f'{n}'
 
 			# Eq. 19
-			self.milp += lpSum(
+			self._stage_1_cost[n] = lpSum(
 				e_sup_retail[n][t] * self._l_buy[n][t] - e_sur_retail[n][t] * self._l_sell[n][t]
 				+ e_sup_market[n][t] * self._l_market_buy[t] - e_sur_market[n][t] * self._l_market_sell[t]
-				+ lpSum(e_slc[n][m][t] * self._l_grid[n][m][t] for m in self.sets_other_meters[n])
+				+ lpSum(e_slc[n][m][t] * self._l_grid_pairs[n][m][t] for m in self.sets_other_meters[n])
 				+ p_extra[n][t] * self._l_extra
 				+ lpSum(self._deg_cost[n][b] * e_bd[n][b][t] for b in self.sets_btm_storage[n])
 				+ (lpSum(e_pur[n][m][t] - e_sale[n][m][t] for m in self.sets_other_meters[n])) * self._l_lem[t]
 				for t in self.time_series
-			) <= round_up(self._c_ind[n]), 'Stage_1_cost_' + increment
-
-		# Write MILP to .lp file
-		dir_name = os.path.abspath(os.path.join(__file__, '..'))
-		lp_file = os.path.join(dir_name, f'Stage2Bilateral.lp')
-		self.milp.writeLP(lp_file)
+			) <= round_up(self._c_ind[n])
+			self.milp += self._stage_1_cost[n], 'Stage_1_cost_' + increment
 
 		# Set the solver to be called
 		if self.solver == 'CBC' and 'PULP_CBC_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap))
+			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap,
+			                                      warmStart=self.warm_start))
 
 		elif self.solver == 'GUROBI' and 'GUROBI_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap))
+			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap,
+			                               warmStart=self.warm_start))
 
 		elif self.solver == 'CPLEX' and 'CPLEX_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(CPLEX_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap))
+			self.milp.setSolver(CPLEX_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap,
+			                              warmStart=self.warm_start))
 
 		elif self.solver == 'HiGHS' and 'HiGHS_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(HiGHS_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap, threads=1))
+			self.milp.setSolver(HiGHS_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap, threads=1,
+			                              warmStart=self.warm_start))
 
 		else:
 			raise ValueError(f'{self.solver}_CMD not available in puLP; '
@@ -568,6 +709,36 @@ class StageTwoMILPBilateral:
 
 		return
 
+	def set_initial_values(self, values: dict):
+		"""
+		Provide a starting point (MIP start) for the next solve, which is only passed on to the solver if "warm_start"
+		is True. Typically, the outputs of a previous solution (e.g., from the previous iteration of a pricing loop);
+		only the keys named after the MILP's variables, or after their outputs (e.g., "e_pur_bilateral" for "e_pur"), are
+		used and partial starting points are accepted.
+		:param values: structure with the same format as the outputs of "generate_outputs"
+		"""
+		self._initial_values = lem_flows_as_variables(values, 'bilateral')
+
+	def set_initial_values_from_stage_1(self, stage1_outputs: list[OutputsS1Dict]):
+		"""
+		Provide the individual (stage 1) solutions of all Meters as the starting point for the next solve.
+		Together, and with no LEM transactions, they are a feasible solution of the second stage, since each Meter
+		keeps its individual cost.
+		:param stage1_outputs: list with the outputs of the individual MILPs, one per Meter, as provided in
+			"StageOneMILP.generate_outputs"
+		"""
+		nr_steps = time_intervals(self._horizon, self._delta_t)
+		values = {
+			name: {output['meter_id']: output[name] for output in stage1_outputs}
+			for name in ('e_sup_retail', 'e_sur_retail', 'e_sup_market', 'e_sur_market', 'delta_sup', 'e_cmet',
+			             'p_extra', 'e_bat', 'soc_bat', 'e_bc', 'e_bd', 'delta_bc')
+		}
+		meter_ids = list(self._meters_data.keys())
+		partners = resolve_partners(meter_ids, l_grid_to_array(self._l_grid, meter_ids, nr_steps), self._partners)
+		values['e_pur'] = {n: {m: [0.0] * nr_steps for m in n_partners} for n, n_partners in partners.items()}
+		values['e_sale'] = values['e_pur']
+		self.set_initial_values(values)
+
 	def solve_milp(self):
 		"""
 		Function that heads the definition and solution of the second stage MILP.
@@ -575,6 +746,15 @@ class StageTwoMILPBilateral:
 		# Define the MILP
 		self.__define_milp()
 
+		# Dump the MILP formulation for debugging purposes
+		if self.export_dir is not None:
+			export_milp(self.milp, self.export_dir, 'Stage2Bilateral', EXPORT_FORMAT)
+
+		# Seed the solver with the starting point provided, if any
+		if self._initial_values is not None:
+			set_initial_values(self._lp_vars, self._initial_values)
+			self._initial_values = None
+
 		# Solve the MILP
 		logger.debug('-- solving the collective (bilateral) MILP problem...')
 
@@ -611,163 +791,47 @@ class StageTwoMILPBilateral:
 		outputs['obj_value'] = self.obj_value
 		outputs['milp_status'] = self.status
 
-		outputs['e_sup_retail'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sur_retail'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sup_market'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sur_market'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_sup'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_pur_bilateral'] = \
-			{n: dict_none_lists(self.time_intervals, self.sets_other_meters[n]) for n in self.set_meters}
-		outputs['e_sale_bilateral'] = \
-			{n: dict_none_lists(self.time_intervals, self.sets_other_meters[n]) for n in self.set_meters}
-		outputs['e_cmet'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_slc_bilateral'] = \
-			{n: dict_none_lists(self.time_intervals, self.sets_other_meters[n]) for n in self.set_meters}
-		outputs['e_consumed'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_alc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_slc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_cmet'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_alc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['p_extra'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_bat'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['soc_bat'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['e_bc'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['e_bd'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['delta_bc'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		for n_meter in self.set_meters:
-			meter_btm_ev = self._meters_data[n_meter].get('btm_evs') #Check if there are EVs
-			if meter_btm_ev is not None:
-				outputs['ev_stored'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_ev[n]) for n in self.set_meters}
-				outputs['p_ev_charge'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_ev[n]) for n in self.set_meters}
-				outputs['p_ev_discharge'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_ev[n]) for n in self.set_meters}
-				break
+		# Associate the values of the variables with the respective outputs' structure (the LEM variables skipped on
+		# the steps without LEM are constant)
+		per_meter = lambda name: {n: [value(v) for v in self._lp_vars[name][n]] for n in self.set_meters}
+		per_other = lambda name: {
+			n: {k: [value(v) for v in k_vars] for k, k_vars in self._lp_vars[name][n].items()}
+			for n in self.set_meters
+		}
+
+		outputs['e_sup_retail'] = per_meter('e_sup_retail')
+		outputs['e_sur_retail'] = per_meter('e_sur_retail')
+		outputs['e_sup_market'] = per_meter('e_sup_market')
+		outputs['e_sur_market'] = per_meter('e_sur_market')
+		outputs['delta_sup'] = {
+			n: relaxed_binaries_values(delta_sup, self._sup_needed[n],
+			                           np.add(outputs['e_sup_retail'][n], outputs['e_sup_market'][n])).tolist()
+			for n, delta_sup in per_meter('delta_sup').items()
+		}
+		outputs['e_pur_bilateral'] = per_other('e_pur')
+		outputs['e_sale_bilateral'] = per_other('e_sale')
+		outputs['e_cmet'] = per_meter('e_cmet')
+		outputs['e_slc_bilateral'] = per_other('e_slc')
+		outputs['e_consumed'] = per_meter('e_consumed')
+		outputs['e_alc'] = per_meter('e_alc')
+		outputs['delta_slc'] = per_meter('delta_slc')
+		outputs['delta_cmet'] = per_meter('delta_cmet')
+		outputs['delta_alc'] = per_meter('delta_alc')
+		outputs['p_extra'] = per_meter('p_extra')
+		outputs['e_bat'] = per_other('e_bat')
+		outputs['soc_bat'] = per_other('soc_bat')
+		outputs['e_bc'] = per_other('e_bc')
+		outputs['e_bd'] = per_other('e_bd')
+		outputs['delta_bc'] = per_other('delta_bc')
+		if any(self._meters_data[n].get('btm_evs') is not None for n in self.set_meters):
+			outputs['ev_stored'] = per_other('ev_stored')
+			outputs['p_ev_charge'] = per_other('p_ev_charge')
+			outputs['p_ev_discharge'] = per_other('p_ev_discharge')
 		if self.strict_pos_coeffs:
-			outputs['delta_coeff'] = dict_none_lists(self.time_intervals, self.set_meters)
+			outputs['delta_coeff'] = per_meter('delta_coeff')
 		if self.total_share_coeffs:
-			outputs['delta_rec_balance'] = none_lists(self.time_intervals)
-			outputs['delta_meter_balance'] = dict_none_lists(self.time_intervals, self.set_meters)
-
-		# Required when vars include "-" since puLP converts it to "_"
-		btm_storage_ids = [bid for bids in [v for _, v in self.sets_btm_storage.items()] for bid in bids]
-		matchd = {key: key.replace('-', '_') for key in self.set_meters}
-		b_matchd = {key: key.replace('-', '_') for key in btm_storage_ids}
-
-		# Auxiliary lambda functions to extract the neter and batteries' designations from the variables
-		original_n_name = \
-			lambda v_name: [ori_n for ori_n in self.set_meters if matchd[ori_n] + '_' in v_name][0]
-		original_b_name = \
-			lambda v_name: [ori_b for ori_b in btm_storage_ids if b_matchd[ori_b] + '_' in v_name][0]
-		alt_original_n_name = \
-			lambda v_name, v_group: [ori_n for ori_n in self.set_meters if v_group + matchd[ori_n] in v.name][0]
-		original_m_name = \
-			lambda v_name, v_group: [ori_m for ori_m in self.set_meters if (matchd[ori_m] in v_name) and
-									 (matchd[ori_m] != alt_original_n_name(v_name, v_group))][0]
-
-		# EVs______________________________________________________________________________________________
-		# Required when vars include "-" since puLP converts it to "_"
-		btm_ev_ids = [bid for bids in [v for _, v in self.sets_btm_ev.items()] for bid in bids]
-		matchd = {key: key.replace('-', '_') for key in self.set_meters}
-		ev_matchd = {key: key.replace('-', '_') for key in btm_ev_ids}
-
-		original_ev_name = \
-			lambda v_name: [ori_ev for ori_ev in btm_ev_ids if ev_matchd[ori_ev] + '_' in v_name][0]
-		# EVs______________________________________________________________________________________________
-
-		# Associate the values of the variables with the respective outputs' structure
-		for v in self.milp.variables():
-			if re.search('dummy', v.name):
-				continue
-
-			# Returns the variable name termination "t000"
-			step_nr = int(v.name[-3:])
-
-			if re.search(f'e_sup_retail_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sup_retail'][n][step_nr] = v.varValue
-			elif re.search(f'e_sur_retail_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sur_retail'][n][step_nr] = v.varValue
-			elif re.search(f'e_sup_market_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sup_market'][n][step_nr] = v.varValue
-			elif re.search(f'e_sur_market_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sur_market'][n][step_nr] = v.varValue
-			elif re.search(f'delta_sup_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_sup'][n][step_nr] = v.varValue
-			elif re.search(f'e_pur_', v.name):
-				n = alt_original_n_name(v.name, 'e_pur_')
-				m = original_m_name(v.name, 'e_pur_')
-				outputs['e_pur_bilateral'][n][m][step_nr] = v.varValue
-			elif re.search(f'e_sale_', v.name):
-				n = alt_original_n_name(v.name, 'e_sale_')
-				m = original_m_name(v.name, 'e_sale_')
-				outputs['e_sale_bilateral'][n][m][step_nr] = v.varValue
-			elif re.search(f'e_cmet_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_cmet'][n][step_nr] = v.varValue
-			elif re.search(f'e_slc_', v.name):
-				n = alt_original_n_name(v.name, 'e_slc_')
-				m = original_m_name(v.name, 'e_slc_')
-				outputs['e_slc_bilateral'][n][m][step_nr] = v.varValue
-			elif re.search(f'e_consumed_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_consumed'][n][step_nr] = v.varValue
-			elif re.search(f'e_alc_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_alc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_slc_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_slc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_cmet_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_cmet'][n][step_nr] = v.varValue
-			elif re.search(f'delta_alc_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_alc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_coeff_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_coeff'][n][step_nr] = v.varValue
-			elif re.search(f'delta_meter_balance_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_meter_balance'][n][step_nr] = v.varValue
-			elif re.search(f'p_extra_', v.name):
-				n = original_n_name(v.name)
-				outputs['p_extra'][n][step_nr] = v.varValue
-			elif re.search(f'e_bat_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bat'][n][b][step_nr] = v.varValue
-			elif re.search(f'soc_bat_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['soc_bat'][n][b][step_nr] = v.varValue
-			elif re.search(f'e_bc_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bc'][n][b][step_nr] = v.varValue
-			elif re.search(f'e_bd_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bd'][n][b][step_nr] = v.varValue
-			elif re.search(f'delta_bc_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['delta_bc'][n][b][step_nr] = v.varValue
-			# EVs
-			elif re.search(f'ev_stored_', v.name):
-				n = original_n_name(v.name)
-				ev = original_ev_name(v.name)
-				outputs['ev_stored'][n][ev][step_nr] = v.varValue
-			elif re.search(f'p_ev_charge_', v.name):
-				n = original_n_name(v.name)
-				ev = original_ev_name(v.name)
-				outputs['p_ev_charge'][n][ev][step_nr] = v.varValue
-			elif re.search(f'p_ev_discharge_', v.name):
-				n = original_n_name(v.name)
-				ev = original_ev_name(v.name)
-				outputs['p_ev_discharge'][n][ev][step_nr] = v.varValue
+			outputs['delta_rec_balance'] = [value(v) for v in self._lp_vars['delta_rec_balance']]
+			outputs['delta_meter_balance'] = per_meter('delta_meter_balance')
 
 		# Include other individual cost metrics
 		outputs['c_ind2bilateral'] = {n: None for n in self.set_meters}
@@ -778,11 +842,8 @@ class StageTwoMILPBilateral:
 		outputs['p_extra_cost2bilateral'] = {n: None for n in self.set_meters}
 
 		# Calculate the individual costs found on stage 2
-		rematchd = {v: k for k, v in matchd.items()}
-		constraints = [self.milp.constraints[c] for c in self.milp.constraints if c.startswith('Stage_1_cost_')]
-		for constraint in constraints:
+		for n, constraint in self._stage_1_cost.items():
 			# Calculate the cost that came from overstepping the maximum Meter power limit
-			n = rematchd[constraint.name.split('Stage_1_cost_')[-1]]
 			p_extra = sum(outputs['p_extra'][n])
 			p_extra_cost = p_extra * self._l_extra
 			outputs['p_extra_cost2bilateral'][n] = p_extra_cost
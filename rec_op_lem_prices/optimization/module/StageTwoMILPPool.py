@@ -3,31 +3,54 @@ Class for implementing and running the Stage 2 MILP for an energy community.
 The implementation is specific to a pool market structure.
 """
 import itertools
-import os
-import re
+import numpy as np
 
 from rec_op_lem_prices.configs.configs import (
+	EXPORT_DIR,
+	EXPORT_FORMAT,
 	MIPGAP,
+	PRUNE_STEPS,
+	RELAX_BINARIES,
 	SOLVER,
-	TIMEOUT
+	TIGHT_BIG_M,
+	TIMEOUT,
+	WARM_START
 )
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import unpack_batteries
 from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	binary_variable,
 	dict_none_lists,
+	export_milp,
 	dict_per_param,
+	lem_flows_as_variables,
 	none_lists,
 	round_up,
+	set_initial_values,
+	step_durations,
 	time_intervals
 )
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	big_m_values,
+	btm_energy_limits,
+	empty_session_prices,
+	lem_steps_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
 from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
 	BackpackS2PoolDict,
 	OutputsS2PoolDict
 )
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
 from loguru import logger
 from pulp import (
 	CPLEX_CMD,
 	HiGHS_CMD,
 	listSolvers,
 	LpBinary,
+	LpContinuous,
+	LpInteger,
 	LpMinimize,
 	LpProblem,
 	LpStatus,
@@ -37,10 +60,13 @@ from pulp import (
 	pulp,
 	value
 )
+from typing import Union
 
 
 class StageTwoMILPPool:
-	def __init__(self, backpack: BackpackS2PoolDict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP):
+	def __init__(self, backpack: BackpackS2PoolDict, solver=SOLVER, timeout=TIMEOUT, mipgap=MIPGAP,
+	             export_dir=EXPORT_DIR, warm_start=WARM_START, relax_binaries=RELAX_BINARIES,
+	             tight_big_m=TIGHT_BIG_M, prune_steps=PRUNE_STEPS, lp_duals=False):
 		# Indices and sets
 		self._horizon = backpack.get('horizon')  # operation period (hours)
 		# Parameters
@@ -63,13 +89,21 @@ class StageTwoMILPPool:
 		self._c_ind = None  # objective function values of each Meters' 1st stage MILP solution
 		self._l_grid = backpack.get('l_grid')  # access tariff of the local grid [€/kWh]
 		self._l_lem = backpack.get('l_lem')  # price for LEM transactions [€/kWh]
-		self._big_m = None  # a very big number [kWh]
+		self._big_m = {}  # big-M values per Meter and time step [kWh]
+		self._rec_big_m = None  # big-M values per time step [kWh]
+		self._flow_max = None  # upper bounds of the retail and LEM flows, per time step, if derived [kWh]
 		self._l_extra = backpack.get('l_extra')  # (fictitious) very high cost of violating p_meter_max
 		# MILP variables
 		self.milp = None  # for storing the MILP formulation
 		self.solver = solver  # solver chosen for the MILP
 		self.timeout = timeout  # solvers temporal limit to find optimal solution (s)
 		self.mipgap = mipgap  # controls the solver's tolerance; intolerant [0 - 1] fully permissive
+		self.export_dir = export_dir  # if provided, the MILP is written to this directory before each solve
+		self.relax_binaries = relax_binaries  # if True, the binaries proven unnecessary for the data are relaxed
+		self.tight_big_m = tight_big_m  # if True, the big-M values and flows' bounds are derived from the data
+		self.prune_steps = prune_steps  # if True, the LEM is skipped on the steps where no internal trade can occur
+		self.warm_start = warm_start  # if True, the solver is seeded with the initial values set (MIP start)
+		self.lp_duals = lp_duals  # if True, the dual prices are taken from the LP with the binaries fixed
 		self.status = None  # stores the status of the MILP's solution
 		self.obj_value = None  # stores the MILP's numeric solution
 		self.time_intervals = None  # for number of time intervals per horizon
@@ -80,6 +114,53 @@ class StageTwoMILPPool:
 		self.second_stage = backpack.get('second_stage')  # indicates if second stage (True) or single stage (False)
 		self.strict_pos_coeffs = backpack.get('strict_pos_coeffs')  # no negative coefficients if True
 		self.total_share_coeffs = backpack.get('total_share_coeffs')  # share all required in the REC if True
+		self._lp_vars = {}  # handles of the MILP variables, per variable name, Meter (, asset) and time step
+		self._sup_needed = {}  # mask of the "delta_sup" kept binary, per Meter and time step
+		self._stage_1_cost = {}  # handles of the "Stage_1_cost_" constraints, per Meter
+		self._c_met = {}  # handles of the "C_met_" constraints, per Meter and time step
+		self._initial_values = None  # starting point to set on the next solve (see "set_initial_values")
+		self._market_equilibrium = []  # handles of the "Market_equilibrium_" constraints, per time step
+		self._lem_steps = None  # mask of the time steps where the LEM is modelled
+
+	def __supply_binaries_needed(self) -> dict[str, np.ndarray]:
+		"""
+		Flags, per Meter, the steps where the supply / surplus exclusivity binaries are needed, given the current
+		tariffs (see "supply_binaries_needed"); the other ones are relaxed, if requested.
+		"""
+		return {n: supply_binaries_needed(meter['l_buy'], meter['l_sell'], self._l_market_buy, self._l_market_sell)
+		           | (not self.relax_binaries)
+		        for n, meter in self._meters_data.items()}
+
+	def __lem_steps_needed(self) -> np.ndarray:
+		"""
+		Flags the steps where the LEM variables and constraints are needed, given the current data and tariffs (see
+		"lem_steps_needed"); all of them, unless the pruning of the other steps is requested.
+		"""
+		nr_steps = time_intervals(self._horizon, self._delta_t)
+		if not self.prune_steps:
+			return np.ones(nr_steps, dtype=bool)
+
+		meters = self._meters_data.values()
+		batteries = unpack_batteries({n: meter['btm_storage'] for n, meter in self._meters_data.items()})
+		e_net = np.array([np.subtract(meter['e_c'], meter['e_g']) for meter in meters], dtype=float)
+		l_buy = np.array([meter['l_buy'] for meter in meters], dtype=float)
+		return lem_steps_needed(e_net, batteries, step_durations(self._delta_t, nr_steps), l_buy,
+		                        self._l_market_buy, self._l_grid, self.second_stage, self.strict_pos_coeffs)
+
+	def __big_m_values(self) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		Big-M values, derived from the Meters' net consumption and Btm assets' power if requested (see "big_m_values"),
+		which also bound the retail and LEM flows; a very big number otherwise.
+		:return: tuple with the big-M values per Meter and time step and the ones per time step [kWh]
+		"""
+		if self.tight_big_m:
+			batteries = unpack_batteries({n: self._meters_data[n]['btm_storage'] for n in self.set_meters})
+			e_net = np.array([np.subtract(self._e_c[n], self._e_g[n]) for n in self.set_meters], dtype=float)
+			e_btm_max = btm_energy_limits(batteries, len(self.set_meters), self.time_intervals, self._delta_t)
+			return big_m_values(*net_consumption_bounds(e_net, *e_btm_max))
+
+		meter_big_m = np.full((len(self.set_meters), self.time_intervals), 10 * max(self._p_meter_max.values()))
+		return meter_big_m, meter_big_m[0]
 
 	def __define_milp(self):
 		"""
@@ -89,9 +170,13 @@ class StageTwoMILPPool:
 
 		# Define a minimization MILP
 		self.milp = LpProblem(f'stage2', LpMinimize)
+		self._stage_1_cost = {}
+		self._c_met = {}
+		self._market_equilibrium = []
 
 		# Additional temporal variables
 		self.time_intervals = time_intervals(self._horizon, self._delta_t)
+		self._delta_t = step_durations(self._delta_t, self.time_intervals).tolist()
 		self.time_series = range(self.time_intervals)
 
 		# Set of Meters
@@ -104,7 +189,8 @@ class StageTwoMILPPool:
 		self._e_c = dict_per_param(self._meters_data, 'e_c')
 		self._e_g = dict_per_param(self._meters_data, 'e_g')
 		self._p_meter_max = dict_per_param(self._meters_data, 'max_p')
-		self._big_m = 10 * max(self._p_meter_max.values())
+		self._sup_needed = self.__supply_binaries_needed()
+		self._lem_steps = self.__lem_steps_needed()
 		if self.second_stage:
 			self._c_ind = dict_per_param(self._meters_data, 'c_ind')
 		else:
@@ -127,6 +213,12 @@ class StageTwoMILPPool:
 			else:
 				self.sets_btm_storage[n] = []
 
+		# Big-M values (see "__big_m_values")
+		meter_big_m, rec_big_m = self.__big_m_values()
+		self._big_m = dict(zip(self.set_meters, meter_big_m.tolist()))
+		self._rec_big_m = rec_big_m.tolist()
+		self._flow_max = self._rec_big_m if self.tight_big_m else [None] * self.time_intervals
+
 		# Initialize the decision variables
 		# energy supplied to n from its retailer [kWh]
 		e_sup_retail = dict_none_lists(self.time_intervals, self.set_meters)
@@ -181,30 +273,40 @@ class StageTwoMILPPool:
 		if self.total_share_coeffs:
 			for t in self.time_series:
 				increment = f't{t:03d}'
-				delta_rec_balance[t] = LpVariable('delta_rec_balance_' + increment, cat=LpBinary)
+				delta_rec_balance[t] = LpVariable('delta_rec_balance_' + increment, cat=LpBinary) \
+					if self._lem_steps[t] else 0.0
 
 		t_n_series = itertools.product(self.set_meters, self.time_series)  # iterates over each Meter and each time step
 		for n, t in t_n_series:
 			increment = f'{n}_t{t:03d}'
-			e_sup_retail[n][t] = LpVariable('e_sup_retail_' + increment, lowBound=0)
-			e_sur_retail[n][t] = LpVariable('e_sur_retail_' + increment, lowBound=0)
-			e_sup_market[n][t] = LpVariable('e_sup_market_' + increment, lowBound=0)
-			e_sur_market[n][t] = LpVariable('e_sur_market_' + increment, lowBound=0)
-			delta_sup[n][t] = LpVariable('delta_sup_' + increment, cat=LpBinary)
-			e_pur[n][t] = LpVariable('e_pur_' + increment, lowBound=0)
-			e_sale[n][t] = LpVariable('e_sale_' + increment, lowBound=0)
+			e_sup_retail[n][t] = LpVariable('e_sup_retail_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sur_retail[n][t] = LpVariable('e_sur_retail_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sup_market[n][t] = LpVariable('e_sup_market_' + increment, lowBound=0, upBound=self._flow_max[t])
+			e_sur_market[n][t] = LpVariable('e_sur_market_' + increment, lowBound=0, upBound=self._flow_max[t])
+			delta_sup[n][t] = binary_variable('delta_sup_' + increment, self._sup_needed[n][t])
 			e_cmet[n][t] = LpVariable('e_cmet_' + increment)
-			e_slc[n][t] = LpVariable('e_slc_' + increment, lowBound=0)
-			e_consumed[n][t] = LpVariable('e_consumed_' + increment, lowBound=0)
-			e_alc[n][t] = LpVariable('e_alc_' + increment, lowBound=0)
-			delta_slc[n][t] = LpVariable('delta_slc_' + increment, cat=LpBinary)
-			delta_cmet[n][t] = LpVariable('delta_cmet_' + increment, cat=LpBinary)
-			delta_alc[n][t] = LpVariable('delta_alc_' + increment, cat=LpBinary)
 			p_extra[n][t] = LpVariable('p_extra_' + increment, lowBound=0)
-			if self.strict_pos_coeffs:
-				delta_coeff[n][t] = LpVariable('delta_coeff_' + increment, cat=LpBinary)
-			if self.total_share_coeffs:
-				delta_meter_balance[n][t] = LpVariable('delta_meter_balance_' + increment, cat=LpBinary)
+			if not self._lem_steps[t]:
+				# No internal trade on this step (see "lem_steps_needed"), so the LEM variables are null
+				e_pur[n][t] = e_sale[n][t] = e_slc[n][t] = e_consumed[n][t] = e_alc[n][t] = 0.0
+				delta_slc[n][t] = delta_cmet[n][t] = delta_alc[n][t] = 0.0
+				if self.strict_pos_coeffs:
+					delta_coeff[n][t] = 0.0
+				if self.total_share_coeffs:
+					delta_meter_balance[n][t] = 0.0
+			else:
+				e_pur[n][t] = LpVariable('e_pur_' + increment, lowBound=0, upBound=self._flow_max[t])
+				e_sale[n][t] = LpVariable('e_sale_' + increment, lowBound=0, upBound=self._flow_max[t])
+				e_slc[n][t] = LpVariable('e_slc_' + increment, lowBound=0)
+				e_consumed[n][t] = LpVariable('e_consumed_' + increment, lowBound=0)
+				e_alc[n][t] = LpVariable('e_alc_' + increment, lowBound=0)
+				delta_slc[n][t] = LpVariable('delta_slc_' + increment, cat=LpBinary)
+				delta_cmet[n][t] = LpVariable('delta_cmet_' + increment, cat=LpBinary)
+				delta_alc[n][t] = LpVariable('delta_alc_' + increment, cat=LpBinary)
+				if self.strict_pos_coeffs:
+					delta_coeff[n][t] = LpVariable('delta_coeff_' + increment, cat=LpBinary)
+				if self.total_share_coeffs:
+					delta_meter_balance[n][t] = LpVariable('delta_meter_balance_' + increment, cat=LpBinary)
 			for b in self.sets_btm_storage[n]:
 				increment = f'{n}_{b}_t{t:03d}'
 				e_bat[n][b][t] = LpVariable('e_bat_' + increment, lowBound=0)
@@ -228,24 +330,59 @@ class StageTwoMILPPool:
 
 		self.milp += objective, 'Objective Function'
 
+		# Keep the handles of the variables, for updating their coefficients and retrieving their values
+		self._lp_vars = {
+			'e_sup_retail': e_sup_retail,
+			'e_sur_retail': e_sur_retail,
+			'e_sup_market': e_sup_market,
+			'e_sur_market': e_sur_market,
+			'delta_sup': delta_sup,
+			'e_pur': e_pur,
+			'e_sale': e_sale,
+			'e_cmet': e_cmet,
+			'e_slc': e_slc,
+			'e_consumed': e_consumed,
+			'e_alc': e_alc,
+			'delta_slc': delta_slc,
+			'delta_cmet': delta_cmet,
+			'delta_alc': delta_alc,
+			'p_extra': p_extra,
+			'e_bat': e_bat,
+			'soc_bat': soc_bat,
+			'e_bc': e_bc,
+			'e_bd': e_bd,
+			'delta_bc': delta_bc
+		}
+		if self.strict_pos_coeffs:
+			self._lp_vars['delta_coeff'] = delta_coeff
+		if self.total_share_coeffs:
+			self._lp_vars['delta_rec_balance'] = delta_rec_balance
+			self._lp_vars['delta_meter_balance'] = delta_meter_balance
+
 		# Eq. 11-31: Constraints
 		for t in self.time_series:
 			increment = f'{t:03d}'
 
+			# Eq. 11, 32-33 are skipped on the steps without LEM
+			if not self._lem_steps[t]:
+				self._market_equilibrium.append(None)
+				continue
+
 			# Eq. 11
-			self.milp += \
-				lpSum(e_sale[n][t] for n in self.set_meters) == lpSum(e_pur[n][t] for n in self.set_meters), \
-				'Market_equilibrium_' + increment
+			market_equilibrium = \
+				lpSum(e_sale[n][t] for n in self.set_meters) == lpSum(e_pur[n][t] for n in self.set_meters)
+			self.milp += market_equilibrium, 'Market_equilibrium_' + increment
+			self._market_equilibrium.append(market_equilibrium)
 
 			if self.total_share_coeffs:
 				# Eq. 32
 				self.milp += \
-					lpSum(e_cmet[n][t] for n in self.set_meters) >= - self._big_m * delta_rec_balance[t], \
+					lpSum(e_cmet[n][t] for n in self.set_meters) >= - self._rec_big_m[t] * delta_rec_balance[t], \
 					'Check_REC_surplus_' + increment
 
 				# Eq. 33
 				self.milp += \
-					lpSum(e_cmet[n][t] for n in self.set_meters) <= self._big_m * (1 - delta_rec_balance[t]), \
+					lpSum(e_cmet[n][t] for n in self.set_meters) <= self._rec_big_m[t] * (1 - delta_rec_balance[t]), \
 					'Check_REC_deficit_' + increment
 
 		for n, t in itertools.product(self.set_meters, self.time_series):
@@ -259,30 +396,33 @@ class StageTwoMILPPool:
 				'Equilibrium_' + increment
 
 			# Eq. 13
-			self.milp += \
+			c_met = \
 				e_cmet[n][t] == self._e_c[n][t] - self._e_g[n][t] \
-				+ lpSum(e_bc[n][b][t] - e_bd[n][b][t] for b in self.sets_btm_storage[n]), \
-				'C_met_' + increment
+				+ lpSum(e_bc[n][b][t] - e_bd[n][b][t] for b in self.sets_btm_storage[n])
+			self.milp += c_met, 'C_met_' + increment
+			self._c_met.setdefault(n, []).append(c_met)
 
 			# Eq. 14
 			self.milp += \
-				- p_extra[n][t] - self._p_meter_max[n] <= e_cmet[n][t] * 1 / self._delta_t, \
+				- p_extra[n][t] - self._p_meter_max[n] <= e_cmet[n][t] * 1 / self._delta_t[t], \
 				'P_flow_low_limit_' + increment
 
 			self.milp += \
-				e_cmet[n][t] * 1 / self._delta_t <= p_extra[n][t] + self._p_meter_max[n], \
+				e_cmet[n][t] * 1 / self._delta_t[t] <= p_extra[n][t] + self._p_meter_max[n], \
 				'P_flow_high_limit_' + increment
 
 			# Eq. 15
 			self.milp += \
-				e_sup_retail[n][t] + e_sup_market[n][t] <= self._big_m * delta_sup[n][t], \
+				e_sup_retail[n][t] + e_sup_market[n][t] <= self._rec_big_m[t] * delta_sup[n][t], \
 				'Supply_ON_' + increment
 
 			self.milp += \
-				e_sur_retail[n][t] + e_sur_market[n][t] <= self._big_m * (1 - delta_sup[n][t]), \
+				e_sur_retail[n][t] + e_sur_market[n][t] <= self._rec_big_m[t] * (1 - delta_sup[n][t]), \
 				'Supply_OFF_' + increment
 
-			if self._l_grid[t] >= 0:
+			# Eq. 20-39 are skipped on the steps without LEM
+			lem_step = self._lem_steps[t]
+			if lem_step and self._l_grid[t] >= 0:
 				# Eq. 20
 				self.milp += \
 					e_consumed[n][t] >= e_cmet[n][t], \
@@ -295,12 +435,12 @@ class StageTwoMILPPool:
 
 				# Eq. 22
 				self.milp += \
-					e_slc[n][t] >= e_consumed[n][t] - self._big_m * (1 - delta_slc[n][t]), \
+					e_slc[n][t] >= e_consumed[n][t] - self._big_m[n][t] * (1 - delta_slc[n][t]), \
 					'Self_consumption_1_' + increment
 
 				# Eq. 23
 				self.milp += \
-					e_slc[n][t] >= e_alc[n][t] - self._big_m * delta_slc[n][t], \
+					e_slc[n][t] >= e_alc[n][t] - self._rec_big_m[t] * delta_slc[n][t], \
 					'Self_consumption_2_' + increment
 
 				# Eq. aux
@@ -313,25 +453,25 @@ class StageTwoMILPPool:
 					delta_alc[n][t] == 0, \
 					'Allocated_energy_bin_' + increment
 
-			else:
+			elif lem_step:
 				# Eq. 24
 				self.milp += \
-					e_consumed[n][t] <= e_cmet[n][t] + self._big_m * delta_cmet[n][t], \
+					e_consumed[n][t] <= e_cmet[n][t] + self._big_m[n][t] * delta_cmet[n][t], \
 					'Consumption_1_' + increment
 
 				# Eq. 25
 				self.milp += \
-					e_consumed[n][t] <= self._big_m * (1 - delta_cmet[n][t]), \
+					e_consumed[n][t] <= self._big_m[n][t] * (1 - delta_cmet[n][t]), \
 					'Consumption_2_' + increment
 
 				# Eq. 26
 				self.milp += \
-					e_alc[n][t] <= e_pur[n][t] - e_sale[n][t] + self._big_m * delta_alc[n][t], \
+					e_alc[n][t] <= e_pur[n][t] - e_sale[n][t] + self._rec_big_m[t] * delta_alc[n][t], \
 					'Allocated_energy_1_' + increment
 
 				# Eq. 27
 				self.milp += \
-					e_alc[n][t] <= self._big_m * (1 - delta_alc[n][t]), \
+					e_alc[n][t] <= self._rec_big_m[t] * (1 - delta_alc[n][t]), \
 					'Allocated_energy_2_' + increment
 
 				# Eq. 28
@@ -349,49 +489,49 @@ class StageTwoMILPPool:
 					delta_slc[n][t] == 0, \
 					'Self_consumed_energy_bin_' + increment
 
-			if self.strict_pos_coeffs:
+			if self.strict_pos_coeffs and lem_step:
 				# Eq. 30
 				self.milp += \
-					e_sale[n][t] - e_pur[n][t] <= -e_cmet[n][t] + self._big_m * delta_coeff[n][t], \
+					e_sale[n][t] - e_pur[n][t] <= -e_cmet[n][t] + self._big_m[n][t] * delta_coeff[n][t], \
 					'Positive_coefficients_1_' + increment
 
 				# Eq. 31
 				self.milp += \
-					e_sale[n][t] - e_pur[n][t] <= self._big_m * (1 - delta_coeff[n][t]), \
+					e_sale[n][t] - e_pur[n][t] <= self._rec_big_m[t] * (1 - delta_coeff[n][t]), \
 					'Positive_coefficients_2_' + increment
 
-			if self.total_share_coeffs:
+			if self.total_share_coeffs and lem_step:
 				# Eq. 34
 				self.milp += \
-					e_cmet[n][t] >= - self._big_m * delta_meter_balance[n][t], \
+					e_cmet[n][t] >= - self._big_m[n][t] * delta_meter_balance[n][t], \
 					'Check_meter_surplus_' + increment
 
 				# Eq. 35
 				self.milp += \
-					e_cmet[n][t] <= self._big_m * (1 - delta_meter_balance[n][t]), \
+					e_cmet[n][t] <= self._big_m[n][t] * (1 - delta_meter_balance[n][t]), \
 					'Check_meter_deficit_' + increment
 
 				# Eq. 36
 				self.milp += \
-					e_sale[n][t] >= - e_cmet[n][t] - self._big_m * (
+					e_sale[n][t] >= - e_cmet[n][t] - self._rec_big_m[t] * (
 								1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
 					'Share_all_surplus_low_' + increment
 
 				# Eq. 37
 				self.milp += \
-					e_sale[n][t] <= - e_cmet[n][t] + self._big_m * (
+					e_sale[n][t] <= - e_cmet[n][t] + self._rec_big_m[t] * (
 								1 - delta_meter_balance[n][t] + delta_rec_balance[t]), \
 					'Share_all_surplus_high_' + increment
 
 				# Eq. 38
 				self.milp += \
-					e_pur[n][t] >= e_cmet[n][t] - self._big_m * (
+					e_pur[n][t] >= e_cmet[n][t] - self._rec_big_m[t] * (
 							1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
 					'Buy_all_deficit_low_' + increment
 
 				# Eq. 39
 				self.milp += \
-					e_pur[n][t] <= e_cmet[n][t] + self._big_m * (
+					e_pur[n][t] <= e_cmet[n][t] + self._rec_big_m[t] * (
 							1 - delta_rec_balance[t] + delta_meter_balance[n][t]), \
 					'Buy_all_deficit_high_' + increment
 
@@ -426,18 +566,18 @@ class StageTwoMILPPool:
 
 					# Eq. 18
 					self.milp += \
-						e_bc[n][b][t] * 1 / self._delta_t <= self._p_max[n][b] * delta_bc[n][b][t], \
+						e_bc[n][b][t] * 1 / self._delta_t[t] <= self._p_max[n][b] * delta_bc[n][b][t], \
 						'Charge_rate_limit_' + increment
 
 					self.milp += \
-						e_bd[n][b][t] * 1 / self._delta_t <= self._p_max[n][b] * (1 - delta_bc[n][b][t]), \
+						e_bd[n][b][t] * 1 / self._delta_t[t] <= self._p_max[n][b] * (1 - delta_bc[n][b][t]), \
 						'Discharge_rate_limit' + increment
 
 		for n in self.set_meters:
 			increment = f'{n}'
 
 			# Eq. 19
-			self.milp += lpSum(
+			self._stage_1_cost[n] = lpSum(
 				e_sup_retail[n][t] * self._l_buy[n][t] - e_sur_retail[n][t] * self._l_sell[n][t]
 				+ e_sup_market[n][t] * self._l_market_buy[t] - e_sur_market[n][t] * self._l_market_sell[t]
 				+ e_slc[n][t] * self._l_grid[t]
@@ -445,25 +585,25 @@ class StageTwoMILPPool:
 				+ lpSum(self._deg_cost[n][b] * e_bd[n][b][t] for b in self.sets_btm_storage[n])
 				+ (e_pur[n][t] - e_sale[n][t]) * self._l_lem[t]
 				for t in self.time_series
-			) <= round_up(self._c_ind[n]), 'Stage_1_cost_' + increment
-
-		# Write MILP to .lp file
-		dir_name = os.path.abspath(os.path.join(__file__, '..'))
-		lp_file = os.path.join(dir_name, f'Stage2Pool.lp')
-		self.milp.writeLP(lp_file)
+			) <= round_up(self._c_ind[n])
+			self.milp += self._stage_1_cost[n], 'Stage_1_cost_' + increment
 
 		# Set the solver to be called
 		if self.solver == 'CBC' and 'PULP_CBC_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap))
+			self.milp.setSolver(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap,
+			                                      warmStart=self.warm_start))
 
 		elif self.solver == 'GUROBI' and 'GUROBI_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap))
+			self.milp.setSolver(GUROBI_CMD(msg=False, timeLimit=self.timeout, mip=self.mipgap,
+			                               warmStart=self.warm_start))
 
 		elif self.solver == 'CPLEX' and 'CPLEX_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(CPLEX_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap))
+			self.milp.setSolver(CPLEX_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap,
+			                              warmStart=self.warm_start))
 
 		elif self.solver == 'HiGHS' and 'HiGHS_CMD' in listSolvers(onlyAvailable=True):
-			self.milp.setSolver(HiGHS_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap, threads=1))
+			self.milp.setSolver(HiGHS_CMD(msg=False, timeLimit=self.timeout, gapRel=self.mipgap, threads=1,
+			                              warmStart=self.warm_start))
 
 		else:
 			raise ValueError(f'{self.solver}_CMD not available in puLP; '
@@ -473,12 +613,183 @@ class StageTwoMILPPool:
 
 		return
 
+	def update_prices(self, l_lem=None, l_market_buy=None, l_market_sell=None, l_buy=None, l_sell=None, l_grid=None):
+		"""
+		Update the price vectors considered by the MILP. If the MILP was already defined, its structure is kept and
+		only the coefficients of the objective function and of the "Stage_1_cost_" constraints are updated, so that
+		the same instance can be re-solved (e.g., across the iterations of a pricing loop) without being rebuilt.
+		Arguments left as None are kept unchanged.
+		:param l_lem: price for LEM transactions [€/kWh]
+		:param l_market_buy: market-indexed buying tariff [€/kWh]
+		:param l_market_sell: market-indexed selling tariff [€/kWh]
+		:param l_buy: supply energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_sell: feed in energy tariff, per Meter (only the Meters to update need to be provided) [€/kWh]
+		:param l_grid: access tariff of the local grid [€/kWh]; if the sign of any step changes, the MILP
+			is defined anew on the next solve, since the sign of l_grid selects the set of constraints applied
+		The MILP is also defined anew if the new tariffs change which "delta_sup" binaries can be relaxed, or on
+		which steps the LEM is modelled.
+		"""
+		if l_lem is not None:
+			self._l_lem = l_lem
+		if l_market_buy is not None:
+			self._l_market_buy = l_market_buy
+		if l_market_sell is not None:
+			self._l_market_sell = l_market_sell
+		if l_buy is not None:
+			for n, meter_l_buy in l_buy.items():
+				self._meters_data[n]['l_buy'] = meter_l_buy
+		if l_sell is not None:
+			for n, meter_l_sell in l_sell.items():
+				self._meters_data[n]['l_sell'] = meter_l_sell
+		if l_grid is not None:
+			sign_change = any((new >= 0) != (old >= 0) for new, old in zip(l_grid, self._l_grid))
+			self._l_grid = l_grid
+			if sign_change:
+				self.milp = None
+
+		# The binaries that are relaxed depend on the tariffs, so the MILP is defined anew if they change
+		if self.milp is not None and any((needed != self._sup_needed[n]).any()
+		                                 for n, needed in self.__supply_binaries_needed().items()):
+			self.milp = None
+		if self.milp is not None and (self.__lem_steps_needed() != self._lem_steps).any():
+			self.milp = None
+
+		# Nothing else to do if the MILP is (still) to be defined
+		if self.milp is None:
+			return
+
+		self._l_buy = dict_per_param(self._meters_data, 'l_buy')
+		self._l_sell = dict_per_param(self._meters_data, 'l_sell')
+		objective = self.milp.objective
+		for n, t in itertools.product(self.set_meters, self.time_series):
+			stage_1_cost = self._stage_1_cost[n]
+			cost_coefficients = {
+				'e_sup_retail': self._l_buy[n][t],
+				'e_sur_retail': -self._l_sell[n][t],
+				'e_sup_market': self._l_market_buy[t],
+				'e_sur_market': -self._l_market_sell[t]
+			}
+			if self._lem_steps[t]:
+				cost_coefficients['e_slc'] = self._l_grid[t]
+			for var_name, coefficient in cost_coefficients.items():
+				var = self._lp_vars[var_name][n][t]
+				objective[var] = coefficient
+				stage_1_cost[var] = coefficient
+
+			# LEM transactions only affect the individual costs
+			if self._lem_steps[t]:
+				stage_1_cost[self._lp_vars['e_pur'][n][t]] = self._l_lem[t]
+				stage_1_cost[self._lp_vars['e_sale'][n][t]] = -self._l_lem[t]
+
+		return
+
+	def update_forecasts(self, e_c=None, e_g=None):
+		"""
+		Update the consumption and generation forecasts considered by the MILP (e.g., when revised intraday). If the
+		MILP was already defined, only the right-hand side of the updated Meters' "C_met_" constraints is changed,
+		as long as the big-M values and flows' bounds derived from the data are still valid, i.e., not lower than the
+		new ones, and the LEM is still modelled on every step where it is now needed; otherwise, the MILP is defined
+		anew on the next solve.
+		Arguments left as None are kept unchanged.
+		:param e_c: Btm total energy consumption, per Meter (only the Meters to update need to be provided) [kWh]
+		:param e_g: Btm total energy generation, per Meter (only the Meters to update need to be provided) [kWh]
+		"""
+		for key, per_meter in (('e_c', e_c), ('e_g', e_g)):
+			for n, forecast in (per_meter or {}).items():
+				self._meters_data[n][key] = forecast
+
+		# Nothing else to do if the MILP is (still) to be defined
+		if self.milp is None:
+			return
+
+		self._e_c = dict_per_param(self._meters_data, 'e_c')
+		self._e_g = dict_per_param(self._meters_data, 'e_g')
+
+		# The big-M values and the steps where the LEM is modelled depend on the forecasts
+		if self.tight_big_m:
+			meter_big_m, rec_big_m = self.__big_m_values()
+			if (meter_big_m > np.array([self._big_m[n] for n in self.set_meters])).any() \
+					or (rec_big_m > np.array(self._rec_big_m)).any():
+				self.milp = None
+				return
+		if (self.__lem_steps_needed() & ~self._lem_steps).any():
+			self.milp = None
+			return
+
+		for n in set(e_c or {}) | set(e_g or {}):
+			for t, constraint in enumerate(self._c_met[n]):
+				constraint.constant = - (self._e_c[n][t] - self._e_g[n][t])
+
+		return
+
+	def update_c_ind(self, c_ind: dict[str, float]):
+		"""
+		Update the individual costs (from the first stage) that bound each Meter's cost on the second stage.
+		If the MILP was already defined, only the right-hand side of the "Stage_1_cost_" constraints is updated.
+		Ignored on single stage runs, where that bound is relaxed.
+		:param c_ind: objective function values of each Meters' 1st stage MILP solution, per Meter
+		"""
+		if not self.second_stage:
+			return
+
+		for n, c in c_ind.items():
+			self._meters_data[n]['c_ind'] = c
+
+		if self.milp is None:
+			return
+
+		self._c_ind = dict_per_param(self._meters_data, 'c_ind')
+		for n, constraint in self._stage_1_cost.items():
+			constraint.constant = - round_up(self._c_ind[n])
+
+		return
+
+	def set_initial_values(self, values: dict):
+		"""
+		Provide a starting point (MIP start) for the next solve, which is only passed on to the solver if "warm_start"
+		is True. Typically, the outputs of a previous solution (e.g., from the previous iteration of a pricing loop);
+		only the keys named after the MILP's variables, or after their outputs (e.g., "e_pur_pool" for "e_pur"), are
+		used and partial starting points are accepted.
+		:param values: structure with the same format as the outputs of "generate_outputs"
+		"""
+		self._initial_values = lem_flows_as_variables(values, 'pool')
+
+	def set_initial_values_from_stage_1(self, stage1_outputs: list[OutputsS1Dict]):
+		"""
+		Provide the individual (stage 1) solutions of all Meters as the starting point for the next solve.
+		Together, and with no LEM transactions, they are a feasible solution of the second stage, since each Meter
+		keeps its individual cost.
+		:param stage1_outputs: list with the outputs of the individual MILPs, one per Meter, as provided in
+			"StageOneMILP.generate_outputs"
+		"""
+		nr_steps = time_intervals(self._horizon, self._delta_t)
+		values = {
+			name: {output['meter_id']: output[name] for output in stage1_outputs}
+			for name in ('e_sup_retail', 'e_sur_retail', 'e_sup_market', 'e_sur_market', 'delta_sup', 'e_cmet',
+			             'p_extra', 'e_bat', 'soc_bat', 'e_bc', 'e_bd', 'delta_bc')
+		}
+		values['e_pur'] = {n: [0.0] * nr_steps for n in self._meters_data}
+		values['e_sale'] = values['e_pur']
+		self.set_initial_values(values)
+
 	def solve_milp(self):
 		"""
 		Function that heads the definition and solution of the second stage MILP.
+		The MILP is only defined on the first call; later calls re-solve the same instance, whose prices and
+		individual costs can be updated in between through "update_prices" and "update_c_ind".
 		"""
 		# Define the MILP
-		self.__define_milp()
+		if self.milp is None:
+			self.__define_milp()
+
+		# Dump the MILP formulation for debugging purposes
+		if self.export_dir is not None:
+			export_milp(self.milp, self.export_dir, 'Stage2Pool', EXPORT_FORMAT)
+
+		# Seed the solver with the starting point provided, if any
+		if self._initial_values is not None:
+			set_initial_values(self._lp_vars, self._initial_values)
+			self._initial_values = None
 
 		# Solve the MILP
 		logger.debug('-- solving the collective (pool) MILP problem...')
@@ -500,6 +811,58 @@ class StageTwoMILPPool:
 
 		return
 
+	def fixed_binaries_duals(self) -> list[Union[float, None]]:
+		"""
+		Dual values (shadow prices) of the "Market_equilibrium_" constraints, from the LP that results from fixing the
+		binary variables at their values in the last solution found, instead of the last LP solved by the MILP solver
+		(e.g., on its last node), which makes them reproducible.
+		The same instance is re-solved as an LP, warm-started from that solution, and then restored, so that it can
+		still be re-solved as a MILP (e.g., in pricing loops); the values of its variables are kept as well.
+		:return: list with the dual values per time step (None for the steps without LEM or if the LP is not solved)
+		"""
+		lp_vars = self.milp.variables()
+		incumbent = [v.varValue for v in lp_vars]
+		# -- Without an optimal solution (e.g., the MILP timed out or is infeasible) there are no binaries to fix
+		if LpStatus[self.milp.status] != 'Optimal' or any(v_value is None for v_value in incumbent):
+			logger.warning('The collective (pool) MILP has no optimal solution. No dual values were retrieved.')
+			return [None] * len(self._market_equilibrium)
+
+		binaries = [v for v in lp_vars if v.cat == LpInteger]
+		bounds = [(v.lowBound, v.upBound) for v in binaries]
+		status, sol_status = self.milp.status, self.milp.sol_status
+		solver = self.milp.solver
+		mip, warm_start = solver.mip, solver.optionsDict.get('warmStart', False)
+
+		logger.debug('-- solving the collective (pool) LP with the binaries fixed...')
+		solved = False
+		try:
+			# Fix the binaries at their (rounded) values and solve the remaining LP, from the current solution
+			for v in binaries:
+				v.cat = LpContinuous
+				v.lowBound = v.upBound = round(v.varValue)
+			solver.mip = False
+			solver.optionsDict['warmStart'] = True
+			self.milp.solve()
+			solved = LpStatus[self.milp.status] == 'Optimal'
+		except Exception as e:
+			logger.warning(f'Solver raised an error: \'{e}\'. No dual values were retrieved.')
+		finally:
+			dual_prices = [abs(constraint.pi) if solved and constraint is not None else None
+			               for constraint in self._market_equilibrium]
+
+			# Restore the MILP and its solution
+			for v, (low_bound, up_bound) in zip(binaries, bounds):
+				v.cat = LpInteger
+				v.lowBound, v.upBound = low_bound, up_bound
+			for v, v_value in zip(lp_vars, incumbent):
+				v.varValue = v_value
+			self.milp.status, self.milp.sol_status = status, sol_status
+			solver.mip = mip
+			solver.optionsDict['warmStart'] = warm_start
+		logger.debug('-- solving the collective (pool) LP with the binaries fixed... DONE!')
+
+		return dual_prices
+
 	def generate_outputs(self) -> OutputsS2PoolDict:
 		"""
 		Function for generating the outputs of optimization, namely the battery's set points.
@@ -516,124 +879,43 @@ class StageTwoMILPPool:
 		outputs['obj_value'] = self.obj_value
 		outputs['milp_status'] = self.status
 
-		outputs['e_sup_retail'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sur_retail'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sup_market'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sur_market'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_sup'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_pur_pool'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_sale_pool'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_cmet'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_slc_pool'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_consumed'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_alc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_slc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_cmet'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['delta_alc'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['p_extra'] = dict_none_lists(self.time_intervals, self.set_meters)
-		outputs['e_bat'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['soc_bat'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['e_bc'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['e_bd'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
-		outputs['delta_bc'] = {n: dict_none_lists(self.time_intervals, self.sets_btm_storage[n]) for n in self.set_meters}
+		# Associate the values of the variables with the respective outputs' structure (the LEM variables skipped on
+		# the steps without LEM are constant)
+		per_meter = lambda name: {n: [value(v) for v in self._lp_vars[name][n]] for n in self.set_meters}
+		per_asset = lambda name: {
+			n: {b: [v.varValue for v in asset_vars] for b, asset_vars in self._lp_vars[name][n].items()}
+			for n in self.set_meters
+		}
+
+		outputs['e_sup_retail'] = per_meter('e_sup_retail')
+		outputs['e_sur_retail'] = per_meter('e_sur_retail')
+		outputs['e_sup_market'] = per_meter('e_sup_market')
+		outputs['e_sur_market'] = per_meter('e_sur_market')
+		outputs['delta_sup'] = {
+			n: relaxed_binaries_values(delta_sup, self._sup_needed[n],
+			                           np.add(outputs['e_sup_retail'][n], outputs['e_sup_market'][n])).tolist()
+			for n, delta_sup in per_meter('delta_sup').items()
+		}
+		outputs['e_pur_pool'] = per_meter('e_pur')
+		outputs['e_sale_pool'] = per_meter('e_sale')
+		outputs['e_cmet'] = per_meter('e_cmet')
+		outputs['e_slc_pool'] = per_meter('e_slc')
+		outputs['e_consumed'] = per_meter('e_consumed')
+		outputs['e_alc'] = per_meter('e_alc')
+		outputs['delta_slc'] = per_meter('delta_slc')
+		outputs['delta_cmet'] = per_meter('delta_cmet')
+		outputs['delta_alc'] = per_meter('delta_alc')
+		outputs['p_extra'] = per_meter('p_extra')
+		outputs['e_bat'] = per_asset('e_bat')
+		outputs['soc_bat'] = per_asset('soc_bat')
+		outputs['e_bc'] = per_asset('e_bc')
+		outputs['e_bd'] = per_asset('e_bd')
+		outputs['delta_bc'] = per_asset('delta_bc')
 		if self.strict_pos_coeffs:
-			outputs['delta_coeff'] = dict_none_lists(self.time_intervals, self.set_meters)
+			outputs['delta_coeff'] = per_meter('delta_coeff')
 		if self.total_share_coeffs:
-			outputs['delta_rec_balance'] = none_lists(self.time_intervals)
-			outputs['delta_meter_balance'] = dict_none_lists(self.time_intervals, self.set_meters)
-
-		# Required when vars include "-" since puLP converts it to "_"
-		btm_storage_ids = [bid for bids in [v for _, v in self.sets_btm_storage.items()] for bid in bids]
-		matchd = {key: key.replace('-', '_') for key in self.set_meters}
-		b_matchd = {key: key.replace('-', '_') for key in btm_storage_ids}
-
-		# Auxiliary lambda functions to extract the neter and batteries' designations from the variables
-		original_n_name = \
-			lambda v_name: [ori_n for ori_n in self.set_meters if matchd[ori_n] + '_' in v_name][0]
-		original_b_name = \
-			lambda v_name: [ori_b for ori_b in btm_storage_ids if b_matchd[ori_b] + '_' in v_name][0]
-
-		# Associate the values of the variables with the respective outputs' structure
-		for v in self.milp.variables():
-			if re.search('dummy', v.name):
-				continue
-
-			# Returns the variable name termination "t000"
-			step_nr = int(v.name[-3:])
-
-			if re.search(f'delta_rec_balance_', v.name):
-				outputs['delta_rec_balance'][step_nr] = v.varValue
-			elif re.search(f'e_sup_retail_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sup_retail'][n][step_nr] = v.varValue
-			elif re.search(f'e_sur_retail_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sur_retail'][n][step_nr] = v.varValue
-			elif re.search(f'e_sup_market_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sup_market'][n][step_nr] = v.varValue
-			elif re.search(f'e_sur_market_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sur_market'][n][step_nr] = v.varValue
-			elif re.search(f'delta_sup_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_sup'][n][step_nr] = v.varValue
-			elif re.search(f'e_pur_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_pur_pool'][n][step_nr] = v.varValue
-			elif re.search(f'e_sale_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_sale_pool'][n][step_nr] = v.varValue
-			elif re.search(f'e_cmet_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_cmet'][n][step_nr] = v.varValue
-			elif re.search(f'e_slc_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_slc_pool'][n][step_nr] = v.varValue
-			elif re.search(f'e_consumed_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_consumed'][n][step_nr] = v.varValue
-			elif re.search(f'e_alc_', v.name):
-				n = original_n_name(v.name)
-				outputs['e_alc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_slc_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_slc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_cmet_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_cmet'][n][step_nr] = v.varValue
-			elif re.search(f'delta_alc_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_alc'][n][step_nr] = v.varValue
-			elif re.search(f'delta_coeff_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_coeff'][n][step_nr] = v.varValue
-			elif re.search(f'delta_meter_balance_', v.name):
-				n = original_n_name(v.name)
-				outputs['delta_meter_balance'][n][step_nr] = v.varValue
-			elif re.search(f'p_extra_', v.name):
-				n = original_n_name(v.name)
-				outputs['p_extra'][n][step_nr] = v.varValue
-			elif re.search(f'e_bat_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bat'][n][b][step_nr] = v.varValue
-			elif re.search(f'soc_bat_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['soc_bat'][n][b][step_nr] = v.varValue
-			elif re.search(f'e_bc_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bc'][n][b][step_nr] = v.varValue
-			elif re.search(f'e_bd_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['e_bd'][n][b][step_nr] = v.varValue
-			elif re.search(f'delta_bc_', v.name):
-				n = original_n_name(v.name)
-				b = original_b_name(v.name)
-				outputs['delta_bc'][n][b][step_nr] = v.varValue
+			outputs['delta_rec_balance'] = [value(v) for v in self._lp_vars['delta_rec_balance']]
+			outputs['delta_meter_balance'] = per_meter('delta_meter_balance')
 
 		# Include other individual cost metrics
 		outputs['c_ind2pool'] = {n: None for n in self.set_meters}
@@ -644,11 +926,8 @@ class StageTwoMILPPool:
 		outputs['p_extra_cost2pool'] = {n: None for n in self.set_meters}
 
 		# Calculate the individual costs found on stage 2
-		rematchd = {v: k for k, v in matchd.items()}
-		constraints = [self.milp.constraints[c] for c in self.milp.constraints if c.startswith('Stage_1_cost_')]
-		for constraint in constraints:
+		for n, constraint in self._stage_1_cost.items():
 			# Calculate the cost that came from overstepping the maximum Meter power limit
-			n = rematchd[constraint.name.split('Stage_1_cost_')[-1]]
 			p_extra = sum(outputs['p_extra'][n])
 			p_extra_cost = p_extra * self._l_extra
 			outputs['p_extra_cost2pool'][n] = p_extra_cost
@@ -671,10 +950,17 @@ class StageTwoMILPPool:
 			outputs['c_ind2pool_without_p_extra'][n] = outputs['c_ind2pool'][n] - p_extra_cost
 			outputs['c_ind2pool_without_deg_and_p_extra'][n] = outputs['c_ind2pool'][n] - deg_cost - p_extra_cost
 
-		# Also retrieve the slack values of the "Market Equilibrium" constraints. These can be considered as the
-		# "optimal" market prices whenever "Stage_1_cost_" constraints are not active, otherwise they are 0.
-		dual_prices = \
-			[abs(self.milp.constraints[c].pi) for c in self.milp.constraints if c.startswith('Market_equilibrium_')]
+		# Also retrieve the slack values of the "Market Equilibrium" constraints, if requested from the LP with the
+		# binary variables fixed (see "fixed_binaries_duals"), falling back to the MILP's ones where that LP fails.
+		# These can be considered as the "optimal" market prices whenever "Stage_1_cost_" constraints are not active,
+		# otherwise they are 0.
+		# The sessions without LEM are priced as those without selling offers (see "empty_session_prices").
+		e_cmet = np.array([outputs['e_cmet'][n] for n in self.set_meters], dtype=float)
+		l_buy = np.array([self._l_buy[n] for n in self.set_meters], dtype=float)
+		empty_prices = empty_session_prices(e_cmet, l_buy, self._l_market_buy).tolist()
+		lp_prices = self.fixed_binaries_duals() if self.lp_duals else [None] * len(self._market_equilibrium)
+		dual_prices = [empty_prices[t] if constraint is None else abs(constraint.pi) if lp_price is None else lp_price
+		               for t, (constraint, lp_price) in enumerate(zip(self._market_equilibrium, lp_prices))]
 		outputs['dual_prices'] = dual_prices
 
 		logger.debug('-- generating outputs from the collective (pool) MILP problem... DONE!')
@@ -1,6 +1,29 @@
-import multiprocessing as mp
-
-from rec_op_lem_prices.optimization.module.IndividualCost import calculate_individual_cost
+from rec_op_lem_prices.configs.configs import (
+	COMMIT_HORIZON,
+	LOOKAHEAD_HORIZON,
+	WARM_START
+)
+from rec_op_lem_prices.optimization.helpers.aggregation_helpers import (
+	aggregate_backpack,
+	approximation_error,
+	cluster_meters,
+	disaggregate_outputs
+)
+from rec_op_lem_prices.optimization.helpers.milp_helpers import individual_backpack
+from rec_op_lem_prices.optimization.helpers.parallel_helpers import run_in_parallel
+from rec_op_lem_prices.optimization.helpers.rolling_horizon_helpers import (
+	solve_rolling_horizon,
+	stitch_results
+)
+from rec_op_lem_prices.optimization.helpers.solver_helpers import (
+	new_milp,
+	validate_solver
+)
+from rec_op_lem_prices.optimization.module.IndividualCost import (
+	calculate_collective_individual_costs,
+	calculate_individual_cost
+)
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
 from rec_op_lem_prices.optimization.module.StageOneMILP import StageOneMILP
 from rec_op_lem_prices.optimization.module.StageTwoMILPBilateral import StageTwoMILPBilateral
 from rec_op_lem_prices.optimization.module.StageTwoMILPPool import StageTwoMILPPool
@@ -32,12 +55,11 @@ from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
 	SinglePreBackpackS2PoolDict,
 	SinglePreOutputsS2PoolDict
 )
-from joblib import Parallel, delayed
 from loguru import logger
-from pulp import listSolvers
-
-
-IS_CPLEX_AVAILABLE = "CPLEX_CMD" in listSolvers(onlyAvailable=True)
+from typing import (
+	Callable,
+	Union
+)
 
 
 # --- FOR PRE-DELIVERY TIMEFRAME ---------------------------------------------------------------------------------------
@@ -80,7 +102,8 @@ def run_pre_individual_milp(backpack: BackpackS1Dict, solver='CBC') \
 		'l_sell': an array with the opportunity costs for selling energy to the retailer, in €/kWh
 		'max_p': maximum admissible power at the connection with the grid, in kW (e.g., can be the contracted power)
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: {
 		'c_ind': float with the individual cost with energy for the optimization horizon, in €;
 			positive values are costs, negative values are profits
@@ -111,13 +134,10 @@ def run_pre_individual_milp(backpack: BackpackS1Dict, solver='CBC') \
 	logger.info(f'Running a pre-delivery individual MILP ({backpack["id"]})...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
-	milp = StageOneMILP(backpack, solver=valid_solver)
+	milp = new_milp(StageOneMILP, backpack, valid_solver)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 
@@ -178,7 +198,8 @@ def run_pre_single_stage_collective_pool_milp(backpack: SinglePreBackpackS2PoolD
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: {
 		'c_ind2pool': dict of floats with the individual costs with energy for the optimization horizon, in €;
 			positive values are costs, negative values are profits
@@ -223,13 +244,10 @@ def run_pre_single_stage_collective_pool_milp(backpack: SinglePreBackpackS2PoolD
 		val['c_ind'] = 0.0
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPPool, backpack, valid_solver)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 
@@ -279,10 +297,14 @@ def run_pre_single_stage_collective_bilateral_milp(backpack: SinglePreBackpackS2
 		'horizon' a float or int with the horizon of the optimization (typically 24h), in hours
 		'l_extra': a float representing a fictitious value penalizing overstepping "max_p", in €/kWh
 		'l_grid': dict of dict of arrays with the applicable tariffs for self-consumed energy between
-			pairs of Meters / REC members, in €/kWh
+			pairs of Meters / REC members, in €/kWh; an N x N x T array (following the order of "meters") or a compact
+			form with uniform / per-voltage-level tariffs and overrides are also accepted (see "l_grid_to_array")
 		'l_lem': an array with the local energy market prices for transacting energy among members, in €/kWh
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -291,7 +313,8 @@ def run_pre_single_stage_collective_bilateral_milp(backpack: SinglePreBackpackS2
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: {
 		'c_ind2bilateral': dict of floats with the individual costs with energy for the optimization horizon, in €;
 			positive values are costs, negative values are profits
@@ -333,10 +356,7 @@ def run_pre_single_stage_collective_bilateral_milp(backpack: SinglePreBackpackS2
 	logger.info('Running a pre-delivery standalone/second stage collective (bilateral) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -344,7 +364,7 @@ def run_pre_single_stage_collective_bilateral_milp(backpack: SinglePreBackpackS2
 	for _, val in backpack['meters'].items():
 		val['c_ind'] = 0.0
 
-	milp = StageTwoMILPBilateral(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPBilateral, backpack, valid_solver)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 
@@ -353,7 +373,11 @@ def run_pre_single_stage_collective_bilateral_milp(backpack: SinglePreBackpackS2
 	return results
 
 
-def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2PoolDict, for_testing=False, solver='CBC') \
+def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2PoolDict, for_testing=False, solver='CBC',
+										   stage1_outputs: list[OutputsS1Dict] = None,
+										   stage2_milp: Union[StageTwoMILPPool, MatrixStageTwoMILPPool] = None,
+										   warm_start=WARM_START,
+										   stage2_start: CollectivePreOutputsS2PoolDict = None) \
 		-> CollectivePreOutputsS2PoolDict:
 	"""
 	Use this function to compute the two-step collective MILP for a given renewable energy community (REC)
@@ -366,8 +390,20 @@ def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2Pool
 	opportunity costs must comply with the expected length defined by the MILP's horizon and step
 	(e.g., for a 24h horizon, and a step of 15 minutes or 0.25 hours, the length of the arrays must be 96).
 	:param backpack: the same inputs used for "run_pre_single_stage_collective_pool_milp"
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param stage1_outputs: optional list with the results from the individual optimization stages, as provided in
+		"run_pre_individual_milp", previously computed for the same Meters' data; if provided, stage 1 is not run
+		again (e.g., across the iterations of a pricing loop, since those results do not depend on the LEM prices)
+	:param stage2_milp: optional StageTwoMILPPool (or MatrixStageTwoMILPPool) instance, created for this same
+		backpack, to be used on the second stage; its structure is only defined on the first call and later calls just update the LEM prices and
+		individual costs before re-solving it (e.g., across the iterations of a pricing loop)
+	:param warm_start: if True, the second stage is seeded with a starting solution (MIP start): "stage2_start", if
+		provided, or else the individual solutions of stage 1 (on the first solve of the MILP); when "stage2_milp" is
+		provided, its own "warm_start" setting is used instead, and its previous solution is the default seed
+	:param stage2_start: optional collective optimization results of a previous solution (e.g., from the previous
+		iteration of a pricing loop) to be used as the starting point of the second stage
 	:return: a tuple with first, the collective optimization results, as provided in
 		"run_pre_single_stage_collective_pool_milp" and second, a list with the results from the individual
 		optimization stages, as provided in "run_pre_individual_milp".
@@ -375,55 +411,36 @@ def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2Pool
 	logger.info('Running a pre-delivery two-stage collective (pool) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
 	backpack['second_stage'] = True
 
-	# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
-	individual_backpacks = []
-	for meter_name, meter_data in backpack['meters'].items():
-		ind_bp = {
-			'btm_storage': meter_data['btm_storage'],
-			'delta_t': backpack['delta_t'],
-			'e_c': meter_data['e_c'],
-			'e_g': meter_data['e_g'],
-			'horizon': backpack['horizon'],
-			'id': meter_name,
-			'l_buy': meter_data['l_buy'],
-			'l_extra': backpack['l_extra'],
-			'l_market_buy': backpack['l_market_buy'],
-			'l_market_sell': backpack['l_market_sell'],
-			'l_sell': meter_data['l_sell'],
-			'max_p': meter_data['max_p']
-		}
-		individual_backpacks.append(ind_bp)
-
-	# Run in parallel the first stage of optimization for all Meters provided
-	partitions = mp.cpu_count() if not for_testing else 1
-	stage1_outputs = Parallel(n_jobs=partitions, backend='multiprocessing', max_nbytes=None)(
-		delayed(run_pre_individual_milp)(ind_backpack, valid_solver) for ind_backpack in individual_backpacks)
-
-	# Check if all individual stages were successfully run
-	missing_outputs = any(not output for output in stage1_outputs)
-	if missing_outputs:
-		error_msg = 'The solver has raised an unexpected error during stage 1. ' \
-		            'At least one of the individual optimization procedures were unsuccessful. ' \
-		            'Please try making another request, verifying all input data. ' \
-		            'If the problem persists, please contact the developers.'
-		raise ValueError(error_msg)
-
-	not_optimal = {output['meter_id']: output['milp_status']
-	               for output in stage1_outputs if output['milp_status'] != 'Optimal'}
-	if not_optimal:
-		error_msg = f'The following individual optimization procedures were not optimally solved: {not_optimal}. ' \
-		            f'Please try making another request, verifying all input data. ' \
-		            f'If the problem persists, please contact the developers.'
-		raise ValueError(error_msg)
+	# Run the individual optimization stages only if their outputs were not provided
+	if stage1_outputs is None:
+		# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
+		individual_backpacks = [individual_backpack(backpack, meter_name) for meter_name in backpack['meters']]
+
+		# Run in parallel the first stage of optimization for all Meters provided, on the shared pool of workers
+		stage1_outputs = run_in_parallel(run_pre_individual_milp, individual_backpacks, valid_solver)
+
+		# Check if all individual stages were successfully run
+		missing_outputs = any(not output for output in stage1_outputs)
+		if missing_outputs:
+			error_msg = 'The solver has raised an unexpected error during stage 1. ' \
+			            'At least one of the individual optimization procedures were unsuccessful. ' \
+			            'Please try making another request, verifying all input data. ' \
+			            'If the problem persists, please contact the developers.'
+			raise ValueError(error_msg)
+
+		not_optimal = {output['meter_id']: output['milp_status']
+		               for output in stage1_outputs if output['milp_status'] != 'Optimal'}
+		if not_optimal:
+			error_msg = f'The following individual optimization procedures were not optimally solved: {not_optimal}. ' \
+			            f'Please try making another request, verifying all input data. ' \
+			            f'If the problem persists, please contact the developers.'
+			raise ValueError(error_msg)
 
 	# Add the individual costs found to the backpack for the collective optimization stage
 	for output in stage1_outputs:
@@ -431,8 +448,19 @@ def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2Pool
 		c_ind = output['c_ind']
 		backpack['meters'][meter_id]['c_ind'] = c_ind
 
-	# Run the second stage of optimization
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	# Run the second stage of optimization; if an instance was provided, only update its parameters
+	if stage2_milp is None:
+		milp = new_milp(StageTwoMILPPool, backpack, valid_solver, warm_start=warm_start)
+	else:
+		milp = stage2_milp
+		milp.second_stage = True
+		milp.update_c_ind({output['meter_id']: output['c_ind'] for output in stage1_outputs})
+		milp.update_prices(l_lem=backpack['l_lem'])
+	if milp.warm_start:
+		if stage2_start is not None:
+			milp.set_initial_values(stage2_start)
+		elif milp.obj_value is None:
+			milp.set_initial_values_from_stage_1(stage1_outputs)
 	milp.solve_milp()
 	stage2_outputs = milp.generate_outputs()
 
@@ -457,7 +485,9 @@ def run_pre_two_stage_collective_pool_milp(backpack: CollectivePreBackpackS2Pool
 
 
 def run_pre_two_stage_collective_bilateral_milp(backpack: CollectivePreBackpackS2BilateralDict, for_testing=False,
-												solver='CBC') \
+												solver='CBC', stage1_outputs: list[OutputsS1Dict] = None,
+												warm_start=WARM_START,
+												stage2_start: CollectivePreOutputsS2BilateralDict = None) \
 		-> CollectivePreOutputsS2BilateralDict:
 	"""
 	Use this function to compute the two-step collective MILP for a given renewable energy community (REC)
@@ -470,8 +500,16 @@ def run_pre_two_stage_collective_bilateral_milp(backpack: CollectivePreBackpackS
 	opportunity costs must comply with the expected length defined by the MILP's horizon and step
 	(e.g., for a 24h horizon, and a step of 15 minutes or 0.25 hours, the length of the arrays must be 96).
 	:param backpack: the same inputs used for "run_pre_single_stage_collective_bilateral_milp"
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param stage1_outputs: optional list with the results from the individual optimization stages, as provided in
+		"run_pre_individual_milp", previously computed for the same Meters' data; if provided, stage 1 is not run
+		again (e.g., across the iterations of a pricing loop, since those results do not depend on the LEM prices)
+	:param warm_start: if True, the second stage is seeded with a starting solution (MIP start): "stage2_start", if
+		provided, or else the individual solutions of stage 1
+	:param stage2_start: optional collective optimization results of a previous solution (e.g., from the previous
+		iteration of a pricing loop) to be used as the starting point of the second stage
 	:return: a tuple with first, the collective optimization results, as provided in
 		"run_pre_single_stage_collective_bilateral_milp" and second, a list with the results from the individual
 		optimization stages, as provided in "run_pre_individual_milp".
@@ -479,55 +517,36 @@ def run_pre_two_stage_collective_bilateral_milp(backpack: CollectivePreBackpackS
 	logger.info('Running a pre-delivery two-stage collective (bilateral) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
 	backpack['second_stage'] = True
 
-	# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
-	individual_backpacks = []
-	for meter_name, meter_data in backpack['meters'].items():
-		ind_bp = {
-			'btm_storage': meter_data['btm_storage'],
-			'delta_t': backpack['delta_t'],
-			'e_c': meter_data['e_c'],
-			'e_g': meter_data['e_g'],
-			'horizon': backpack['horizon'],
-			'id': meter_name,
-			'l_buy': meter_data['l_buy'],
-			'l_extra': backpack['l_extra'],
-			'l_market_buy': backpack['l_market_buy'],
-			'l_market_sell': backpack['l_market_sell'],
-			'l_sell': meter_data['l_sell'],
-			'max_p': meter_data['max_p']
-		}
-		individual_backpacks.append(ind_bp)
-
-	# Run in parallel the first stage of optimization for all Meters provided
-	partitions = mp.cpu_count() if not for_testing else 1
-	stage1_outputs = Parallel(n_jobs=partitions, backend='multiprocessing', max_nbytes=None)(
-		delayed(run_pre_individual_milp)(ind_backpack, solver) for ind_backpack in individual_backpacks)
-
-	# Check if all individual stages were successfully run
-	missing_outputs = any(not output for output in stage1_outputs)
-	if missing_outputs:
-		error_msg = 'The solver has raised an unexpected error during stage 1. ' \
-		            'At least one of the individual optimization procedures were unsuccessful. ' \
-		            'Please try making another request, verifying all input data. ' \
-		            'If the problem persists, please contact the developers.'
-		raise ValueError(error_msg)
-
-	not_optimal = {output['meter_id']: output['milp_status']
-	               for output in stage1_outputs if output['milp_status'] != 'Optimal'}
-	if not_optimal:
-		error_msg = f'The following individual optimization procedures were not optimally solved: {not_optimal}. ' \
-		            f'Please try making another request, verifying all input data. ' \
-		            f'If the problem persists, please contact the developers.'
-		raise ValueError(error_msg)
+	# Run the individual optimization stages only if their outputs were not provided
+	if stage1_outputs is None:
+		# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
+		individual_backpacks = [individual_backpack(backpack, meter_name) for meter_name in backpack['meters']]
+
+		# Run in parallel the first stage of optimization for all Meters provided, on the shared pool of workers
+		stage1_outputs = run_in_parallel(run_pre_individual_milp, individual_backpacks, valid_solver)
+
+		# Check if all individual stages were successfully run
+		missing_outputs = any(not output for output in stage1_outputs)
+		if missing_outputs:
+			error_msg = 'The solver has raised an unexpected error during stage 1. ' \
+			            'At least one of the individual optimization procedures were unsuccessful. ' \
+			            'Please try making another request, verifying all input data. ' \
+			            'If the problem persists, please contact the developers.'
+			raise ValueError(error_msg)
+
+		not_optimal = {output['meter_id']: output['milp_status']
+		               for output in stage1_outputs if output['milp_status'] != 'Optimal'}
+		if not_optimal:
+			error_msg = f'The following individual optimization procedures were not optimally solved: {not_optimal}. ' \
+			            f'Please try making another request, verifying all input data. ' \
+			            f'If the problem persists, please contact the developers.'
+			raise ValueError(error_msg)
 
 	# Add the individual costs found to the backpack for the collective optimization stage
 	for output in stage1_outputs:
@@ -536,7 +555,12 @@ def run_pre_two_stage_collective_bilateral_milp(backpack: CollectivePreBackpackS
 		backpack['meters'][meter_id]['c_ind'] = c_ind
 
 	# Run the second stage of optimization
-	milp = StageTwoMILPBilateral(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPBilateral, backpack, valid_solver, warm_start=warm_start)
+	if warm_start:
+		if stage2_start is not None:
+			milp.set_initial_values(stage2_start)
+		else:
+			milp.set_initial_values_from_stage_1(stage1_outputs)
 	milp.solve_milp()
 	stage2_outputs = milp.generate_outputs()
 
@@ -560,6 +584,88 @@ def run_pre_two_stage_collective_bilateral_milp(backpack: CollectivePreBackpackS
 	return stage2_outputs, stage1_outputs
 
 
+def run_pre_rolling_horizon(run_func: Callable, backpack: dict, commit_horizon=COMMIT_HORIZON,
+                            lookahead_horizon=LOOKAHEAD_HORIZON, **kwargs):
+	"""
+	Use this function to run any of the pre-delivery "run_pre_*" functions in rolling horizon mode, for horizons
+	too long to be solved as a single MILP (e.g., several days with a 15 minutes step).
+	The horizon is split into overlapping windows of "commit_horizon" + "lookahead_horizon" hours, solved in sequence
+	every "commit_horizon" hours. Only the schedules of the committed hours of each window are kept: the energy
+	content of the storage units ("init_e") and EVs ("init_e_ev") at their end is carried forward as the initial
+	energy content of the next window, while the look-ahead hours only prevent each window from depleting them.
+	The schedules of all windows are stitched into one result, with the same structure as the one of "run_func",
+	and its costs are computed over the committed hours only.
+	:param run_func: one of "run_pre_individual_milp", "run_pre_single_stage_collective_pool_milp",
+		"run_pre_single_stage_collective_bilateral_milp", "run_pre_two_stage_collective_pool_milp" or
+		"run_pre_two_stage_collective_bilateral_milp"
+	:param backpack: the inputs of "run_func", for the full horizon
+	:param commit_horizon: hours of each window that are committed, in hours
+	:param lookahead_horizon: hours optimized after the committed ones of each window, in hours
+	:param kwargs: other keyword arguments of "run_func" (e.g., "solver"); arguments that depend on the horizon,
+		such as "stage1_outputs" or "stage2_milp", are not supported
+	:return: the stitched results, with the same structure as the ones of "run_func"
+	"""
+	logger.info(f'Running {run_func.__name__} in rolling horizon mode '
+	            f'({commit_horizon}h committed + {lookahead_horizon}h look-ahead windows)...')
+
+	# The two-stage functions also return the individual outputs of stage 1, while the collective schedule is kept
+	schedule = lambda results: results[0] if isinstance(results, tuple) else results
+	windows = solve_rolling_horizon(lambda window_backpack: run_func(window_backpack, **kwargs), schedule,
+	                                backpack, commit_horizon, lookahead_horizon)
+	results = stitch_results(windows)
+
+	logger.info(f'Running {run_func.__name__} in rolling horizon mode... DONE!')
+
+	return results
+
+
+def run_pre_aggregated(run_func: Callable, backpack: dict, nr_clusters: int, random_state=0, **kwargs):
+	"""
+	Use this function to run a pre-delivery collective (pool) function on a reduced community, for very large RECs
+	(e.g., with thousands of members), whose collective MILP would take too long to solve.
+	The Meters are clustered (k-means) by their consumption, generation and tariffs' profiles and their assets, and each
+	cluster is replaced by an aggregate Meter with the summed profiles, maximum power and storage units of its members
+	and their energy weighted average tariffs. The schedules and pool transactions of each aggregate Meter are then
+	disaggregated back to its members, pro rata of their net consumption (and of their storage units' capacity), the
+	energy netted inside each cluster being settled as pool transactions among its members, and the costs of each
+	Meter are recomputed from its own data.
+	:param run_func: one of "run_pre_single_stage_collective_pool_milp" or "run_pre_two_stage_collective_pool_milp"
+	:param backpack: the inputs of "run_func", for the full community
+	:param nr_clusters: number of aggregate Meters of the reduced community
+	:param random_state: seed of the clustering, for reproducible results
+	:param kwargs: other keyword arguments of "run_func" (e.g., "solver"); arguments that depend on the Meters, such
+		as "stage1_outputs" or "stage2_milp", are not supported
+	:return: the collective results of "run_func", per Meter, without the auxiliary binary variables and with:
+		'clusters': dict with the identification of the aggregate Meter of each Meter
+		'approximation_error': {
+			'cost': relative difference between the total cost of the Meters and the objective value of the reduced
+				community
+			'profile': relative difference between the Meters' net consumption profiles and their cluster's one
+		}
+		for "run_pre_two_stage_collective_pool_milp", a tuple with these results and the individual outputs of the
+		aggregate Meters
+	"""
+	if run_func not in (run_pre_single_stage_collective_pool_milp, run_pre_two_stage_collective_pool_milp):
+		raise ValueError('The aggregation mode is only available for the collective pool functions.')
+
+	logger.info(f'Running {run_func.__name__} on a reduced community of (up to) {nr_clusters} aggregate Meters...')
+
+	clusters = cluster_meters(backpack, nr_clusters, random_state)
+	aggregated_results = run_func(aggregate_backpack(backpack, clusters), **kwargs)
+	aggregated_outputs = aggregated_results[0] if isinstance(aggregated_results, tuple) else aggregated_results
+
+	results = disaggregate_outputs(backpack, clusters, aggregated_outputs)
+	results['clusters'] = clusters
+	results['approximation_error'] = approximation_error(backpack, clusters, aggregated_outputs, results)
+	logger.info(f'Approximation error: {results["approximation_error"]}')
+
+	logger.info(f'Running {run_func.__name__} on a reduced community... DONE!')
+
+	if isinstance(aggregated_results, tuple):
+		return results, aggregated_results[1]
+	return results
+
+
 # --- FOR POST-DELIVERY TIMEFRAME --------------------------------------------------------------------------------------
 def run_post_individual_cost(backpack: BackpackIndCostDict) \
 		-> OutputsIndCostDict:
@@ -641,7 +747,8 @@ def run_post_single_stage_collective_pool_milp(backpack: SinglePostBackpackS2Poo
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: {
 		'c_ind2pool': dict of floats with the individual costs with energy for the optimization horizon, in €;
 			positive values are costs, negative values are profits
@@ -672,10 +779,7 @@ def run_post_single_stage_collective_pool_milp(backpack: SinglePostBackpackS2Poo
 	logger.info('Running a post-delivery standalone/second stage collective (pool) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -684,7 +788,7 @@ def run_post_single_stage_collective_pool_milp(backpack: SinglePostBackpackS2Poo
 		val['c_ind'] = 0.0
 		val['btm_storage'] = {}
 
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPPool, backpack, valid_solver)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 
@@ -732,6 +836,9 @@ def run_post_single_stage_collective_bilateral_milp(backpack: SinglePostBackpack
 		'l_lem': an array with the local energy market prices for transacting energy among members, in €/kWh
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -740,7 +847,8 @@ def run_post_single_stage_collective_bilateral_milp(backpack: SinglePostBackpack
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: {
 		'c_ind2bilateral': dict of floats with the individual costs with energy for the optimization horizon, in €;
 			positive values are costs, negative values are profits
@@ -770,10 +878,7 @@ def run_post_single_stage_collective_bilateral_milp(backpack: SinglePostBackpack
 	logger.info('Running a post-delivery standalone/second stage collective (bilateral) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -782,7 +887,7 @@ def run_post_single_stage_collective_bilateral_milp(backpack: SinglePostBackpack
 		val['c_ind'] = 0.0
 		val['btm_storage'] = {}
 
-	milp = StageTwoMILPBilateral(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPBilateral, backpack, valid_solver)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 
@@ -813,8 +918,9 @@ def run_post_two_stage_collective_pool_milp(backpack: CollectivePostBackpackS2Po
 	opportunity costs must comply with the expected length defined by the MILP's horizon and step
 	(e.g., for a 24h horizon, and a step of 15 minutes or 0.25 hours, the length of the arrays must be 96).
 	:param backpack: the same inputs used for "run_post_single_stage_collective_pool_milp"
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; the individual costs are computed in a single vectorized call
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: a tuple with first, the collective optimization results, as provided in
 		"run_post_single_stage_collective_pool_milp" and second, a list with the results from the individual
 		cost computations, as provided in "run_post_individual_cost".
@@ -822,10 +928,7 @@ def run_post_two_stage_collective_pool_milp(backpack: CollectivePostBackpackS2Po
 	logger.info('Running a post-delivery two-stage collective (pool) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -834,26 +937,11 @@ def run_post_two_stage_collective_pool_milp(backpack: CollectivePostBackpackS2Po
 		val['c_ind'] = 0.0
 		val['btm_storage'] = {}
 
-	# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
-	individual_backpacks = []
-	for meter_name, meter_data in backpack['meters'].items():
-		ind_bp = {
-			'delta_t': backpack['delta_t'],
-			'e_met': [ec - eg for ec, eg in zip(meter_data['e_c'], meter_data['e_g'])],
-			'l_buy': meter_data['l_buy'],
-			'l_extra': backpack['l_extra'],
-			'l_market_buy': backpack['l_market_buy'],
-			'l_market_sell': backpack['l_market_sell'],
-			'l_sell': meter_data['l_sell'],
-			'max_p': meter_data['max_p'],
-			'id': meter_name
-		}
-		individual_backpacks.append(ind_bp)
-
-	# Run in parallel the first stage of optimization for all Meters provided
-	partitions = mp.cpu_count() if not for_testing else 1
-	stage1_outputs = Parallel(n_jobs=partitions, backend='multiprocessing', max_nbytes=None)(
-		delayed(run_post_individual_cost)(ind_backpack) for ind_backpack in individual_backpacks)
+	# Compute the individual costs of all Meters provided at once
+	meters = backpack['meters']
+	logger.info(f'Calculating the individual post-delivery operation costs ({len(meters)} Meters)...')
+	stage1_outputs = calculate_collective_individual_costs(backpack)
+	logger.info(f'Calculating the individual post-delivery operation costs ({len(meters)} Meters)... DONE!')
 
 	# Add the individual costs found to the backpack for the collective optimization stage
 	for output in stage1_outputs:
@@ -862,7 +950,7 @@ def run_post_two_stage_collective_pool_milp(backpack: CollectivePostBackpackS2Po
 		backpack['meters'][meter_id]['c_ind'] = c_ind
 
 	# Run the second stage of optimization
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPPool, backpack, valid_solver)
 	milp.solve_milp()
 	stage2_outputs = milp.generate_outputs()
 
@@ -908,8 +996,9 @@ def run_post_two_stage_collective_bilateral_milp(backpack: CollectivePostBackpac
 	opportunity costs must comply with the expected length defined by the MILP's horizon and step
 	(e.g., for a 24h horizon, and a step of 15 minutes or 0.25 hours, the length of the arrays must be 96).
 	:param backpack: the same inputs used for "run_post_single_stage_collective_bilateral_milp"
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; the individual costs are computed in a single vectorized call
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: a tuple with first, the collective optimization results, as provided in
 		"run_post_single_stage_collective_bilateral_milp" and second, a list with the results from the individual
 		cost computations, as provided in "run_post_individual_cost".
@@ -917,10 +1006,7 @@ def run_post_two_stage_collective_bilateral_milp(backpack: CollectivePostBackpac
 	logger.info('Running a post-delivery two-stage collective (bilateral) MILP...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -929,26 +1015,11 @@ def run_post_two_stage_collective_bilateral_milp(backpack: CollectivePostBackpac
 		val['c_ind'] = 0.0
 		val['btm_storage'] = {}
 
-	# Prepare the inputs for the individual optimization stages according to BackpackS1Dict
-	individual_backpacks = []
-	for meter_name, meter_data in backpack['meters'].items():
-		ind_bp = {
-			'delta_t': backpack['delta_t'],
-			'e_met': [ec - eg for ec, eg in zip(meter_data['e_c'], meter_data['e_g'])],
-			'l_buy': meter_data['l_buy'],
-			'l_extra': backpack['l_extra'],
-			'l_market_buy': backpack['l_market_buy'],
-			'l_market_sell': backpack['l_market_sell'],
-			'l_sell': meter_data['l_sell'],
-			'max_p': meter_data['max_p'],
-			'id': meter_name
-		}
-		individual_backpacks.append(ind_bp)
-
-	# Run in parallel the first stage of optimization for all Meters provided
-	partitions = mp.cpu_count() if not for_testing else 1
-	stage1_outputs = Parallel(n_jobs=partitions, backend='multiprocessing', max_nbytes=None)(
-		delayed(run_post_individual_cost)(ind_backpack) for ind_backpack in individual_backpacks)
+	# Compute the individual costs of all Meters provided at once
+	meters = backpack['meters']
+	logger.info(f'Calculating the individual post-delivery operation costs ({len(meters)} Meters)...')
+	stage1_outputs = calculate_collective_individual_costs(backpack)
+	logger.info(f'Calculating the individual post-delivery operation costs ({len(meters)} Meters)... DONE!')
 
 	# Add the individual costs found to the backpack for the collective optimization stage
 	for output in stage1_outputs:
@@ -957,7 +1028,7 @@ def run_post_two_stage_collective_bilateral_milp(backpack: CollectivePostBackpac
 		backpack['meters'][meter_id]['c_ind'] = c_ind
 
 	# Run the second stage of optimization
-	milp = StageTwoMILPBilateral(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPBilateral, backpack, valid_solver)
 	milp.solve_milp()
 	stage2_outputs = milp.generate_outputs()
 
@@ -1,4 +1,9 @@
-from rec_op_lem_prices.custom_types.pricing_mechanims_types import OffersList
+import numpy as np
+
+from rec_op_lem_prices.custom_types.pricing_mechanims_types import (
+	OfferBookDict,
+	OffersList
+)
 from rec_op_lem_prices.custom_types.pricing_mechanisms_helpers_types import MetersDict
 from loguru import logger
 
@@ -30,6 +35,47 @@ def make_offers(meters: MetersDict,
 		the outer lists represent each market sessions and will have a length equal to "nr_sessions";
 		the inner lists, one per market session, represent the offers made for that session
 	"""
+	book = make_offer_book(meters, nr_sessions, l_market_buy, l_market_sell)
+
+	# Create final lists of buying and selling offers per market session
+	buys = [[] for _ in range(nr_sessions)]
+	sells = [[] for _ in range(nr_sessions)]
+	for side, origin, session, amount, value in zip(book['side'].tolist(), book['origin'].tolist(),
+	                                                book['session'].tolist(), book['amount'].tolist(),
+	                                                book['value'].tolist()):
+		offers = buys if side == 1 else sells
+		offers[session].append({
+			'origin': book['origins'][origin],
+			'amount': amount,
+			'value': value
+		})
+
+	return buys, sells
+
+
+def make_offer_book(meters: MetersDict,
+                    nr_sessions: int,
+                    l_market_buy: list[float],
+                    l_market_sell: list[float]) -> OfferBookDict:
+	"""
+	Columnar version of "make_offers": creates the bidding offers of all members / Meters for all market sessions,
+	stored as contiguous arrays ordered by market session (and by Meter within each session).
+	As in "make_offers", each Meter makes a single offer per session with a non-zero net load, whose value is the most
+	profitable for the Meter between the market-indexed tariffs and the opportunity costs with the retailer.
+	:param meters: {
+		#meter_id: {
+			'e_met': an array with the forecasted Btm net consumption (positive = consuming, negative = injecting),
+				in kWh
+			'l_buy': an array with the opportunity costs for buying energy from the retailer
+			'l_sell': an array with the opportunity costs for selling energy to the retailer
+		}
+	}
+	:param nr_sessions: number of market sessions (i.e., size of all data arrays)
+	:param l_market_buy: an array with market-indexed buying tariffs in €/kWh
+	:param l_market_sell: an array with market-indexed selling tariffs in €/kWh
+	:return: offer book with the amount, value, side (1 for buying, -1 for selling), Meter index and session index of
+		each offer, along with the per-session offsets and the list of Meter ids
+	"""
 	logger.debug('Organizing buying and selling offers...')
 
 	# Validate that all arrays have the same size as the total number of market sessions
@@ -41,31 +87,32 @@ def make_offers(meters: MetersDict,
 		assert nr_sessions == len(meter_data['l_buy']), message(f'"{meter_nae}[buy]"')
 		assert nr_sessions == len(meter_data['l_sell']), message(f'"{meter_nae}[sell]"')
 
-	# Create final lists of buying and selling offers per market session
-	buys = [[] for _ in range(nr_sessions)]
-	sells = [[] for _ in range(nr_sessions)]
+	# Session x Meter matrices (transposed), so that offers come out ordered by session and then by Meter
+	origins = list(meters.keys())
+	shape = (len(origins), nr_sessions)
+	e_met = np.array([meter_data['e_met'] for meter_data in meters.values()], dtype=float).reshape(shape).T
+	l_buy = np.array([meter_data['l_buy'] for meter_data in meters.values()], dtype=float).reshape(shape).T
+	l_sell = np.array([meter_data['l_sell'] for meter_data in meters.values()], dtype=float).reshape(shape).T
 
-	# Fill the offer lists iterating over each Meter / member
 	# The value of each buying and selling offer will be the most profitable for the Meter / member between
 	# the market-indexed tariffs and the opportunity costs with the retailer
-	for meter_nae, meter_data in meters.items():
-		for t in range(nr_sessions):
-			e_met = meter_data['e_met'][t]
-			if e_met > 0:
-				buy_value = min(meter_data['l_buy'][t], l_market_buy[t])
-				buys[t].append({
-					'origin': meter_nae,
-					'amount': e_met,
-					'value': buy_value
-				})
-			elif e_met < 0:
-				sell_value = max(meter_data['l_sell'][t], l_market_sell[t])
-				sells[t].append({
-					'origin': meter_nae,
-					'amount': abs(e_met),
-					'value': sell_value
-				})
+	buy_value = np.minimum(l_buy, np.array(l_market_buy, dtype=float)[:, None])
+	sell_value = np.maximum(l_sell, np.array(l_market_sell, dtype=float)[:, None])
+
+	# Only Meters with a non-zero net load make an offer
+	session, origin = np.nonzero(e_met)
+	amount = e_met[session, origin]
+	is_buy = amount > 0
+	offsets = np.concatenate(([0], np.cumsum(np.bincount(session, minlength=nr_sessions))))
 
 	logger.debug('Organizing buying and selling offers... DONE!')
 
-	return buys, sells
+	return {
+		'amount': np.abs(amount),
+		'value': np.where(is_buy, buy_value[session, origin], sell_value[session, origin]),
+		'side': np.where(is_buy, 1, -1),
+		'origin': origin,
+		'session': session,
+		'offsets': offsets,
+		'origins': origins
+	}
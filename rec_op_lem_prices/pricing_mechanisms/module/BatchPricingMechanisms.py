@@ -0,0 +1,357 @@
+import numpy as np
+
+from rec_op_lem_prices.custom_types.pricing_mechanims_types import (
+	OfferBookDict,
+	OffersArrays,
+	OffersList
+)
+from loguru import logger
+
+
+def offers_to_arrays(offers: list[OffersList], origins: list = None) -> OffersArrays:
+	"""
+	Function to convert the offers of several market sessions, given as lists of dictionaries, into the arrays' structure
+	used by the batched market mechanisms
+	:param offers: list with one list of offers per market session (the outer list's index is the session index),
+		each offer with the structure {'origin': str, 'amount': float, 'value': float}
+	:param origins: optional list of the members / Meters that can make offers, whose positions are used as origin
+		indexes; if not provided, origins are indexed by order of appearance
+	:return: structure with the offers' amounts (as absolute values), values, origin indexes and session indexes
+	"""
+	origin_idx = {} if origins is None else {origin: i for i, origin in enumerate(origins)}
+	amount = []
+	value = []
+	origin = []
+	session = []
+	for t, session_offers in enumerate(offers):
+		for offer in session_offers:
+			amount.append(abs(offer['amount']))
+			value.append(offer['value'])
+			origin.append(origin_idx.setdefault(offer['origin'], len(origin_idx)))
+			session.append(t)
+
+	return {
+		'amount': np.array(amount, dtype=float),
+		'value': np.array(value, dtype=float),
+		'origin': np.array(origin, dtype=int),
+		'session': np.array(session, dtype=int)
+	}
+
+
+def split_offer_book(book: OfferBookDict) -> tuple[OffersArrays, OffersArrays]:
+	"""
+	Function to split a columnar offer book (see "make_offer_book") into the buying and selling offers' arrays
+	consumed by the batched market mechanisms
+	:param book: offer book with the offers of all market sessions
+	:return: buying and selling offers' arrays, respectively
+	"""
+	is_buy = book['side'] == 1
+	buys = {key: book[key][is_buy] for key in ('amount', 'value', 'origin', 'session')}
+	sells = {key: book[key][~is_buy] for key in ('amount', 'value', 'origin', 'session')}
+	return buys, sells
+
+
+def _filter_offers(offers: OffersArrays, mask: np.ndarray) -> OffersArrays:
+	"""
+	Auxiliary function that returns the subset of offers flagged in a boolean mask
+	:param offers: offers' arrays
+	:param mask: boolean array with the same length as the offers' arrays
+	:return: filtered offers' arrays
+	"""
+	return {key: array[mask] for key, array in offers.items()}
+
+
+def _sort_offers(offers: OffersArrays, nr_sessions: int, descending: bool, small_increment=0.0) -> dict:
+	"""
+	Auxiliary function that sorts the offers of each market session by value and turns their amounts into accumulated
+	sums per session. The sorted offers are kept in flat arrays, with the offers of session t occupying the positions
+	start[t] to start[t] + count[t] - 1.
+	:param offers: offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param descending: True for buying offers (most valuable first), False for selling offers (least valuable first)
+	:param small_increment: a small increment that can be added to sell offers and subtracted to buy offers
+	:return: structure with the sorted values, accumulated amounts, and start position and count of offers per session
+	"""
+	# Stable sort by session and value, so that offers with the same value keep their original order
+	key = -(offers['value'] - small_increment) if descending else offers['value'] + small_increment
+	order = np.lexsort((key, offers['session']))
+	count = np.bincount(offers['session'], minlength=nr_sessions)
+	start = np.concatenate(([0], np.cumsum(count)[:-1]))
+
+	# Accumulate the amounts sequentially within each session (to keep the same rounding as the dict-based functions)
+	cum_amount = offers['amount'][order].astype(float)
+	for k in range(1, count.max(initial=0)):
+		pos = start[count > k] + k
+		cum_amount[pos] += cum_amount[pos - 1]
+
+	return {
+		'value': offers['value'][order].astype(float),
+		'cum_amount': cum_amount,
+		'start': start,
+		'count': count
+	}
+
+
+def _position_in_session(offers: OffersArrays, nr_sessions: int) -> np.ndarray:
+	"""
+	Auxiliary function that returns the position of each offer within its market session, following the input order
+	:param offers: offers' arrays
+	:param nr_sessions: total number of market sessions
+	:return: array with the position of each offer within its session
+	"""
+	order = np.argsort(offers['session'], kind='stable')
+	count = np.bincount(offers['session'], minlength=nr_sessions)
+	start = np.concatenate(([0], np.cumsum(count)[:-1]))
+	position = np.empty(len(order), dtype=int)
+	position[order] = np.arange(len(order)) - start[offers['session'][order]]
+	return position
+
+
+def batch_get_accepted_offers(buys: OffersArrays, sells: OffersArrays, nr_sessions: int) \
+		-> tuple[np.ndarray, np.ndarray]:
+	"""
+	Batched version of "get_accepted_offers", screening the offers of all market sessions at once.
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:return: boolean masks flagging the accepted buying and selling offers, respectively, in their input order
+	"""
+	logger.debug('Pruning offers...')
+
+	buyers = _sort_offers(buys, nr_sessions, descending=True)
+	sellers = _sort_offers(sells, nr_sessions, descending=False)
+
+	# Walk both sorted books of all sessions in lockstep;
+	# "last" codes the last rescued offer per session: 0 - BOTH, 1 - BUY, 2 - SELL
+	b = np.zeros(nr_sessions, dtype=int)
+	s = np.zeros(nr_sessions, dtype=int)
+	last = np.zeros(nr_sessions, dtype=int)
+	active = (buyers['count'] > 0) & (sellers['count'] > 0)
+	while active.any():
+		idx = np.flatnonzero(active)
+		bi = buyers['start'][idx] + b[idx]
+		si = sellers['start'][idx] + s[idx]
+		go = sellers['value'][si] <= buyers['value'][bi]
+		buy_cum = buyers['cum_amount'][bi]
+		sell_cum = sellers['cum_amount'][si]
+		adv_buy = go & (buy_cum < sell_cum)
+		adv_sell = go & ~adv_buy & (sell_cum < buy_cum)
+		adv_both = go & ~adv_buy & ~adv_sell
+		b[idx] += adv_buy | adv_both
+		s[idx] += adv_sell | adv_both
+		last[idx[adv_buy]] = 1
+		last[idx[adv_sell]] = 2
+		last[idx[adv_both]] = 0
+		active[idx] = go & (b[idx] < buyers['count'][idx]) & (s[idx] < sellers['count'][idx])
+
+	# Number of accepted offers per session
+	nr_accepted_buys = b + (last == 2)
+	nr_accepted_sells = s + (last == 1)
+
+	# As in "get_accepted_offers", the accepted offers are picked from the offers' input order
+	buy_mask = _position_in_session(buys, nr_sessions) < nr_accepted_buys[buys['session']]
+	sell_mask = _position_in_session(sells, nr_sessions) < nr_accepted_sells[sells['session']]
+
+	logger.debug('Pruning offers... DONE!')
+	return buy_mask, sell_mask
+
+
+def batch_compute_crossing_value(buys: OffersArrays, sells: OffersArrays, nr_sessions: int, small_increment=0.001) \
+		-> np.ndarray:
+	"""
+	Batched version of "compute_crossing_value", computing the crossing value of all market sessions at once.
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param small_increment: a small increment can be added to sell offers and subtracted to buy offers to promote
+		convergence of the overarching iterative algorithm
+	:return: array with the resulting price of each session's pool
+	"""
+	logger.debug('Computing the pools\' crossing values...')
+
+	buyers = _sort_offers(buys, nr_sessions, descending=True, small_increment=small_increment)
+	sellers = _sort_offers(sells, nr_sessions, descending=False, small_increment=small_increment)
+	has_buys = buyers['count'] > 0
+	has_sells = sellers['count'] > 0
+
+	# Sessions without offers get 0; sessions with only buyers (sellers) get the most (least) costly offer
+	crossing_value = np.zeros(nr_sessions)
+	only_buys = has_buys & ~has_sells
+	only_sells = has_sells & ~has_buys
+	crossing_value[only_buys] = buyers['value'][buyers['start'][only_buys]]
+	crossing_value[only_sells] = sellers['value'][sellers['start'][only_sells]]
+
+	# Sessions with buyers and sellers are cleared in lockstep
+	b = np.zeros(nr_sessions, dtype=int)
+	s = np.zeros(nr_sessions, dtype=int)
+	active = has_buys & has_sells
+	last_sold = np.zeros(nr_sessions)
+	last_sold[active] = sellers['value'][sellers['start'][active]]
+	while active.any():
+		idx = np.flatnonzero(active)
+		bi = buyers['start'][idx] + b[idx]
+		si = sellers['start'][idx] + s[idx]
+		buy_value = buyers['value'][bi]
+		sell_value = sellers['value'][si]
+		stop = sell_value >= buy_value
+		crossing_value[idx[stop]] = last_sold[idx[stop]]
+		go = ~stop
+		last_sold[idx[go]] = sell_value[go]
+		adv_sell = go & (buyers['cum_amount'][bi] > sellers['cum_amount'][si])
+		adv_buy = go & ~adv_sell
+		crossing_value[idx[adv_sell]] = buy_value[adv_sell]
+		crossing_value[idx[adv_buy]] = sell_value[adv_buy]
+		s[idx] += adv_sell
+		b[idx] += adv_buy
+		active[idx] = go & (b[idx] < buyers['count'][idx]) & (s[idx] < sellers['count'][idx])
+
+	logger.debug('Computing the pools\' crossing values... DONE!')
+	return crossing_value
+
+
+def _session_stats(offers: OffersArrays, nr_sessions: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Auxiliary function that computes, per market session, the number of offers, their total amount and their minimum
+	and maximum values (set to +inf and -inf, respectively, for sessions without offers)
+	:param offers: offers' arrays
+	:param nr_sessions: total number of market sessions
+	:return: number of offers, total amount, minimum value and maximum value per session
+	"""
+	count = np.bincount(offers['session'], minlength=nr_sessions)
+	total = np.bincount(offers['session'], weights=offers['amount'], minlength=nr_sessions)
+	min_value = np.full(nr_sessions, np.inf)
+	max_value = np.full(nr_sessions, -np.inf)
+	np.minimum.at(min_value, offers['session'], offers['value'])
+	np.maximum.at(max_value, offers['session'], offers['value'])
+	return count, total, min_value, max_value
+
+
+def batch_compute_mmr(buys: OffersArrays, sells: OffersArrays, nr_sessions: int, divider=0.5) -> np.ndarray:
+	"""
+	Batched version of "compute_mmr", computing the mid-market rate (MMR) of all market sessions at once;
+	If the divider is set to a value different from 2, the function is broadened and should be considered as the more
+	general intermediary-market rate (IMR);
+	For the sessions where any of the selling offers has a higher value than any of the buying offers,
+	the pool crossing value is returned instead
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
+	and the most valuable selling offer; By default, the value is 0.5, making the price equidistant from both offers;
+	Higher values skew the price towards the selling offers and smaller values towards the buying offers.
+	Note: must be non-negative and between 0.0 and 1.0
+	:return: array with the calculated price for transactions of each session
+	"""
+	logger.debug('Computing pool prices through MMR...')
+
+	nr_buys, _, min_buy, max_buy = _session_stats(buys, nr_sessions)
+	nr_sells, _, min_sell, max_sell = _session_stats(sells, nr_sessions)
+	both = (nr_buys > 0) & (nr_sells > 0)
+	cross = both & (min_buy < max_sell)
+
+	# Sessions without offers get 0; sessions with only buyers (sellers) get the most (least) costly offer
+	result = np.zeros(nr_sessions)
+	result[nr_sells == 0] = np.where(nr_buys > 0, max_buy, 0.0)[nr_sells == 0]
+	result[nr_buys == 0] = np.where(nr_sells > 0, min_sell, 0.0)[nr_buys == 0]
+
+	mmr = both & ~cross
+	result[mmr] = max_sell[mmr] + (min_buy[mmr] - max_sell[mmr]) * divider
+
+	# If the minimum buy price is smaller than the maximum sell price, return the crossing value instead
+	if cross.any():
+		logger.warning(f'No market price can be established through MMR for {cross.sum()} session(s) '
+		               'since the minimum buy offer has a smaller price '
+		               'than the maximum sell offer. '
+		               'Returning the pools\' cross value.')
+		result[cross] = batch_compute_crossing_value(buys, sells, nr_sessions)[cross]
+
+	logger.debug(f'Computing pool prices through MMR... DONE!')
+	return result
+
+
+def batch_compute_sdr(buys: OffersArrays, sells: OffersArrays, nr_sessions: int, compensation=0.0) -> np.ndarray:
+	"""
+	Batched version of "compute_sdr", computing the supply and demand ratio (SDR), compensated (SDRC) or not,
+	of all market sessions at once;
+	For the sessions where any of the selling offers has a higher value than any of the buying offers,
+	the pool crossing value is returned instead
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param compensation: float between 0 and 1 that establishes the relative compensation
+	:return: array with the calculated price for transactions of each session, in €/kWh
+	"""
+	logger.debug('Computing pool prices through SDR...')
+
+	assert 0 <= compensation <= 1, "Please provide a value for compensation that is between 0.0 and 1.0"
+	nr_buys, d_q, min_buy, max_buy = _session_stats(buys, nr_sessions)
+	nr_sells, e_q, min_sell, max_sell = _session_stats(sells, nr_sessions)
+	both = (nr_buys > 0) & (nr_sells > 0)
+	cross = both & (min_buy < max_sell)
+
+	# Sessions without offers get 0; sessions with only buyers (sellers) get the most (least) costly offer
+	result = np.zeros(nr_sessions)
+	result[nr_sells == 0] = np.where(nr_buys > 0, max_buy, 0.0)[nr_sells == 0]
+	result[nr_buys == 0] = np.where(nr_sells > 0, min_sell, 0.0)[nr_buys == 0]
+
+	sdr_sessions = both & ~cross
+	if sdr_sessions.any():
+		min_b = min_buy[sdr_sessions]
+		max_s = max_sell[sdr_sessions]
+
+		# Compute l_compensation (if simple SDR, compensation = 0, so l_compensation = 0)
+		l_compensation = (min_b - max_s) * compensation
+
+		# Compute SDR values
+		with np.errstate(divide='ignore', invalid='ignore'):
+			sdr = e_q[sdr_sessions] / d_q[sdr_sessions]
+			if not (sdr >= 0).all():
+				raise ValueError('A negative SDR was computed. Please contact the developers.')
+			excess = max_s + l_compensation / sdr
+			deficit = (min_b * (max_s + l_compensation)) / \
+				((min_b - max_s - l_compensation) * sdr + max_s + l_compensation)
+		result[sdr_sessions] = np.where(sdr == np.inf, 0.0, np.where(sdr >= 1, excess, deficit))
+
+	# If the minimum buy price is smaller than the maximum sell price, return the crossing value instead
+	if cross.any():
+		logger.warning(f'No market price can be established through SDR for {cross.sum()} session(s) '
+		               'since the minimum buy offer has a smaller price '
+		               'than the maximum sell offer. '
+		               'Returning the pools\' cross value.')
+		result[cross] = batch_compute_crossing_value(buys, sells, nr_sessions)[cross]
+
+	logger.debug(f'Computing pool prices through SDR... DONE!')
+	return result
+
+
+def batch_compute_pruned_mmr(buys: OffersArrays, sells: OffersArrays, nr_sessions: int, divider=0.5) -> np.ndarray:
+	"""
+	Batched version of "compute_pruned_mmr", computing the MMR (or IMR) of all market sessions at once
+	using only the offers that are accepted on each session's pool
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
+	and the most valuable selling offer; must be non-negative and between 0.0 and 1.0
+	:return: array with the calculated price for transactions of each session, in €/kWh
+	"""
+	logger.debug('(Opted for pruned MMR approach)')
+	buy_mask, sell_mask = batch_get_accepted_offers(buys, sells, nr_sessions)
+	return batch_compute_mmr(_filter_offers(buys, buy_mask), _filter_offers(sells, sell_mask), nr_sessions, divider)
+
+
+def batch_compute_pruned_sdr(buys: OffersArrays, sells: OffersArrays, nr_sessions: int, compensation=0.0) \
+		-> np.ndarray:
+	"""
+	Batched version of "compute_pruned_sdr", computing the SDR (or SDRC) of all market sessions at once
+	using only the offers that are accepted on each session's pool
+	:param buys: buying offers' arrays
+	:param sells: selling offers' arrays
+	:param nr_sessions: total number of market sessions
+	:param compensation: float between 0 and 1 that establishes the relative compensation
+	:return: array with the calculated price for transactions of each session, in €/kWh
+	"""
+	logger.debug('(Opted for pruned SDR approach)')
+	buy_mask, sell_mask = batch_get_accepted_offers(buys, sells, nr_sessions)
+	return batch_compute_sdr(_filter_offers(buys, buy_mask), _filter_offers(sells, sell_mask), nr_sessions,
+	                         compensation)
@@ -3,9 +3,17 @@ import numpy as np
 import pandas as pd
 
 from rec_op_lem_prices.custom_types.pricing_mechanims_types import (
+	OffersArrays,
 	OffersList,
 	PricesList
 )
+from rec_op_lem_prices.pricing_mechanisms.module.BatchPricingMechanisms import (
+	batch_compute_crossing_value,
+	batch_compute_mmr,
+	batch_compute_sdr,
+	batch_get_accepted_offers,
+	offers_to_arrays
+)
 from copy import deepcopy
 from loguru import logger
 
@@ -54,6 +62,17 @@ def _cumsum_offers(buys: OffersList, sells: OffersList, small_increment=0.0) ->
 	return buyers, sellers
 
 
+def _single_session(buys: OffersList, sells: OffersList) -> tuple[OffersArrays, OffersArrays]:
+	"""
+	Auxiliary function that converts the buy and sell offers' lists of a single market session into the arrays' structure
+	used by the batched market mechanisms
+	:param buys: list of buying offers, each with the structure {'origin': str, 'amount': float, 'value': float}
+	:param sells: same structure but for selling offers
+	:return: buying and selling offers' arrays
+	"""
+	return offers_to_arrays([buys]), offers_to_arrays([sells])
+
+
 def _parsing(offers: OffersList):
 	"""
 	Auxiliary function for sorting and aggregating buying or selling offers, based on their prices
@@ -117,44 +136,8 @@ def compute_mmr(buys: OffersList, sells: OffersList, divider=0.5) -> float:
 	Note: must be non-negative and between 0.0 and 1.0
 	:return: calculated price for transactions
 	"""
-	logger.debug('Computing pool price through MMR...')
-
-	buy_offers = pd.DataFrame(buys)
-	sell_offers = pd.DataFrame(sells)
-
-	# If only buyers return most costly offer
-	if sell_offers.empty and not buy_offers.empty:
-		logger.debug('There are no selling offers.')
-		return buy_offers['value'].max()
-
-	# If only sellers return less costly offer
-	elif buy_offers.empty and not sell_offers.empty:
-		logger.debug('There are no buying offers.')
-		return sell_offers['value'].min()
-
-	# If no buyers nor sellers, return 0
-	elif buy_offers.empty or sell_offers.empty:
-		logger.debug('There are no buying nor selling offers.')
-		return 0
-
-	# Calculate max l_buy and max l_sell per timestep among consuming and exporting peers, respectively
-	min_buy = buy_offers['value'].min()
-	max_sell = sell_offers['value'].max()
-
-	# If the minimum buy price is smaller than the maximum sell price,
-	# return the crossing value instead
-	if min_buy < max_sell:
-		logger.warning('No market price can be established through MMR '
-		               'since the minimum buy offer has a smaller price '
-		               'than the maximum sell offer. '
-		               'Returning the pools\' cross value.')
-		return compute_crossing_value(buys, sells)
-
-	price_range = min_buy - max_sell
-	result = max_sell + price_range * divider
-
-	logger.debug(f'Computing pool price through MMR... DONE!')
-	return result
+	buy_offers, sell_offers = _single_session(buys, sells)
+	return float(batch_compute_mmr(buy_offers, sell_offers, 1, divider)[0])
 
 
 def compute_pruned_mmr(buys: OffersList, sells: OffersList, divider=0.5) -> float:
@@ -207,66 +190,8 @@ def compute_sdr(buys: OffersList, sells: OffersList, compensation=0.0) -> float:
 	:param compensation: float between 0 and 1 that establishes the relative compensation
 	:return: calculated price for transactions, in €/kWh
 	"""
-	logger.debug('Computing pool price through SDR...')
-
-	assert 0 <= compensation <= 1, "Please provide a value for compensation that is between 0.0 and 1.0"
-	buy_offers = pd.DataFrame(buys)
-	sell_offers = pd.DataFrame(sells)
-
-	# -- if only buyers return most costly offer
-	if sell_offers.empty and not buy_offers.empty:
-		logger.debug('There are no selling offers.')
-		return buy_offers['value'].max()
-
-	# -- if only sellers return less costly offer
-	elif buy_offers.empty and not sell_offers.empty:
-		logger.debug('There are no buying offers.')
-		return sell_offers['value'].min()
-
-	# -- if no buyers nor sellers, return 0
-	elif buy_offers.empty and sell_offers.empty:
-		logger.debug('There are no buying nor selling offers.')
-		return 0
-
-	# -- else, make sure that sell offers' amount is a positive value
-	# (e.g., for compute_crossing_value function it is not)
-	else:
-		sell_offers['amount'] = abs(sell_offers['amount'])
-
-	# Calculate total consumption and total exported amounts
-	e_q = sell_offers['amount'].sum()
-	d_q = buy_offers['amount'].sum()
-
-	# Calculate min l_buy and max l_sell per timestep among consuming and exporting peers, respectively
-	min_buy = buy_offers['value'].min()
-	max_sell = sell_offers['value'].max()
-
-	# If the minimum buy price is smaller than the maximum sell price,
-	# return the crossing value instead
-	if min_buy < max_sell:
-		logger.warning('No market price can be established through SDR '
-		               'since the minimum buy offer has a smaller price '
-		               'than the maximum sell offer. '
-		               'Returning the pools\' cross value.')
-		return compute_crossing_value(buys, sells)
-
-	# Compute l_compensation (if simple SDR, compensation = 0, so l_compensation = 0)
-	l_compensation = (min_buy - max_sell) * compensation
-
-	# Compute SDR values
-	sdr = e_q / d_q
-	if sdr == np.inf:
-		result = 0
-	elif sdr >= 1:
-		result = max_sell + l_compensation / sdr
-	elif 0 <= sdr < 1:
-		result = (min_buy * (max_sell + l_compensation)) / \
-		         ((min_buy - max_sell - l_compensation) * sdr + max_sell + l_compensation)
-	else:
-		raise ValueError('A negative SDR was computed. Please contact the developers.')
-
-	logger.debug(f'Computing pool price through SDR... DONE!')
-	return result
+	buy_offers, sell_offers = _single_session(buys, sells)
+	return float(batch_compute_sdr(buy_offers, sell_offers, 1, compensation)[0])
 
 
 def compute_pruned_mmr_plus(buys: OffersList, sells: OffersList, divider=0.5) -> (float, OffersList, OffersList):
@@ -352,50 +277,14 @@ def get_accepted_offers(buys: OffersList, sells: OffersList) -> tuple[OffersList
 		provided; in theory this value should be te price that the member would otherwise receive from its retailer
 	:return: screened buy offers' list and sell offers' list
 	"""
-	logger.debug('Pruning offers...')
-
-	screened_buys = []
-	screened_sells = []
-
-	# Check if both offers' lists are empty and if so, return them as the empty lists that they are
-	if (len(buys) == 0) and (len(sells) == 0):
-		return screened_buys, screened_sells
+	# Abs values for sell offers (as in "_cumsum_offers")
+	for sell in sells:
+		sell['amount'] = abs(sell['amount'])
 
-	# Turn amounts into accumulated sums
-	buyers, sellers = _cumsum_offers(buys, sells)
+	buy_mask, sell_mask = batch_get_accepted_offers(*_single_session(buys, sells), 1)
+	screened_buys = [buy for buy, accepted in zip(buys, buy_mask) if accepted]
+	screened_sells = [sell for sell, accepted in zip(sells, sell_mask) if accepted]
 
-	# If there are only buyers or only sellers, there will be no accepted offers,
-	# so empty lists must be returned
-	if len(sellers) == 0 or len(buyers) == 0:
-		return screened_buys, screened_sells
-
-	# If there are sellers and buyers, screen which are the accepted offers
-	s = 0
-	b = 0
-	last_rescued = 'BOTH'
-	while (s < len(sellers)) and (b < len(buyers)):
-		if sellers[s]['value'] > buyers[b]['value']:
-			break
-		elif buyers[b]['amount'] < sellers[s]['amount']:
-			screened_buys.append(buys[b])
-			b += 1
-			last_rescued = 'BUY'
-		elif sellers[s]['amount'] < buyers[b]['amount']:
-			screened_sells.append(sells[s])
-			s += 1
-			last_rescued = 'SELL'
-		else:
-			screened_buys.append(buys[b])
-			screened_sells.append(sells[s])
-			b += 1
-			s += 1
-			last_rescued = 'BOTH'
-	if last_rescued == 'BUY':
-		screened_sells.append(sells[s])
-	elif last_rescued == 'SELL':
-		screened_buys.append(buys[b])
-
-	logger.debug('Pruning offers... DONE!')
 	return screened_buys, screened_sells
 
 
@@ -416,46 +305,12 @@ def compute_crossing_value(buys: OffersList, sells: OffersList, small_increment=
 		convergence of the overarching iterative algorithm
 	:return: resulting price for the pool
 	"""
-	logger.debug('Computing the pool\'s crossing value...')
-
-	# Check if both offers' lists are empty and if so, return 0 as the price
-	if (len(buys) == 0) and (len(sells) == 0):
-		return 0
-
-	# Turn amounts into accumulated sums
-	buyers, sellers = _cumsum_offers(buys, sells, small_increment)
+	# Abs values for sell offers (as in "_cumsum_offers")
+	for sell in sells:
+		sell['amount'] = abs(sell['amount'])
 
-	# Apply algorithm to find crossing value
-	crossing_value = None
-
-	# -- if only buyers return most costly offer
-	if len(sellers) == 0 and len(buyers) > 0:
-		crossing_value = buyers[0]['value']
-
-	# -- if only sellers return less costly offer
-	elif len(buyers) == 0 and len(sellers) > 0:
-		crossing_value = sellers[0]['value']
-
-	# -- if sellers and buyers, calculate pool
-	else:
-		last_sold_position = sellers[0]['value']
-		s = 0
-		b = 0
-		while (s < len(sellers)) and (b < len(buyers)):
-			if sellers[s]['value'] >= buyers[b]['value']:
-				crossing_value = last_sold_position
-				break
-			else:
-				last_sold_position = sellers[s]['value']
-				if buyers[b]['amount'] > sellers[s]['amount']:
-					crossing_value = buyers[b]['value']
-					s += 1
-				else:
-					crossing_value = sellers[s]['value']
-					b += 1
-
-	logger.debug('Computing the pool\'s crossing value... DONE!')
-	return crossing_value
+	buy_offers, sell_offers = _single_session(buys, sells)
+	return float(batch_compute_crossing_value(buy_offers, sell_offers, 1, small_increment)[0])
 
 
 def stop_criterion(old_prices: PricesList, new_prices: PricesList) -> tuple[bool, float]:
@@ -1,12 +1,52 @@
+import numpy as np
+
+from rec_op_lem_prices.configs.configs import (
+	COMMIT_HORIZON,
+	LOOKAHEAD_HORIZON,
+	N_JOBS,
+	WARM_START
+)
 from rec_op_lem_prices.optimization_functions import (
 	run_post_two_stage_collective_bilateral_milp,
 	run_post_two_stage_collective_pool_milp,
+	run_pre_individual_milp,
 	run_pre_two_stage_collective_bilateral_milp,
 	run_pre_two_stage_collective_pool_milp,
 )
-from rec_op_lem_prices.optimization.helpers.milp_helpers import time_intervals
+from rec_op_lem_prices.optimization.helpers.milp_helpers import (
+	individual_backpack,
+	time_intervals
+)
+from rec_op_lem_prices.optimization.helpers.parallel_helpers import (
+	run_as_completed,
+	run_in_parallel
+)
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import estimated_size
+from rec_op_lem_prices.optimization.helpers.rolling_horizon_helpers import (
+	solve_rolling_horizon,
+	stitch_results
+)
+from rec_op_lem_prices.optimization.helpers.scenario_helpers import (
+	apply_scenario,
+	forecast_update,
+	price_statistics,
+	validate_scenarios
+)
+from rec_op_lem_prices.optimization.helpers.solver_helpers import (
+	new_milp,
+	validate_solver
+)
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
 from rec_op_lem_prices.optimization.module.StageTwoMILPPool import StageTwoMILPPool
-from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import make_offers
+from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import make_offer_book
+from rec_op_lem_prices.pricing_mechanisms.module.BatchPricingMechanisms import (
+	batch_compute_crossing_value,
+	batch_compute_mmr,
+	batch_compute_pruned_mmr,
+	batch_compute_pruned_sdr,
+	batch_compute_sdr,
+	split_offer_book
+)
 from rec_op_lem_prices.pricing_mechanisms.module.PricingMechanisms import (
 	compute_crossing_value,
 	compute_mmr,
@@ -20,6 +60,7 @@ from rec_op_lem_prices.pricing_mechanisms.module.PricingMechanisms import (
 )
 from rec_op_lem_prices.custom_types.pricing_mechanims_types import OffersList
 from rec_op_lem_prices.custom_types.pricing_mechanisms_functions_types import RequestParams
+from rec_op_lem_prices.custom_types.stage_one_milp_types import OutputsS1Dict
 from rec_op_lem_prices.custom_types.stage_two_milp_bilateral_types import (
 	CollectivePostOutputsS2BilateralDict,
 	CollectivePreOutputsS2BilateralDict,
@@ -31,18 +72,15 @@ from rec_op_lem_prices.custom_types.stage_two_milp_pool_types import (
 	CollectivePreOutputsS2PoolDict,
 	LoopPostBackpackS2PoolDict,
 	LoopPreBackpackS2PoolDict,
+	LoopPreStateS2PoolDict,
 	OutputsS2PoolDict
 )
 
 from loguru import logger
-from pulp import listSolvers
-from typing import Callable, Union
+from typing import Callable, Iterator, Union
 from typing_extensions import Unpack
 
 
-IS_CPLEX_AVAILABLE = "CPLEX_CMD" in listSolvers(onlyAvailable=True)
-
-
 # -- AUXILIARY FUNCTIONS -----------------------------------------------------------------------------------------------
 def accepted_offers(buys: OffersList, sells: OffersList) -> tuple[OffersList, OffersList]:
 	"""
@@ -228,11 +266,17 @@ def vanilla_crossing_value_plus(buys: OffersList,
 
 
 # -- DUALS -------------------------------------------------------------------------------------------------------------
-def dual_pre_pool(backpack: LoopPreBackpackS2PoolDict, solver='CBC') -> (list[float], OutputsS2PoolDict):
+def dual_pre_pool(backpack: LoopPreBackpackS2PoolDict, solver='CBC',
+                  stage1_outputs: list[OutputsS1Dict] = None,
+                  stage2_milp: Union[StageTwoMILPPool, MatrixStageTwoMILPPool] = None,
+                  warm_start=WARM_START) \
+		-> (list[float], OutputsS2PoolDict):
 	"""
 	Function to compute the LEM prices' array from the market equilibrium constraint shadow values.
 	A standalone collective MILP is run, where the costs with energy for the whole REC are computed,
 	and the shadow values of the market equilibrium constraint are returned after an optimal solution is achieved.
+	These are taken from the LP that results from fixing the binary variables at their optimal values, re-solved on
+	the same instance, so that they do not depend on the last LP solved by the MILP solver.
 	This function is specific for a pre-delivery timeframe, which means that the schedules for controllable assets,
 	such as battery energy storage systems (BESS, presently the only modelled controllable assets)
 	are decision variables of the MILP.
@@ -279,17 +323,24 @@ def dual_pre_pool(backpack: LoopPreBackpackS2PoolDict, solver='CBC') -> (list[fl
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param stage1_outputs: optional list with the results from the individual optimization stages, as provided in
+		"run_pre_individual_milp", previously computed for the same Meters' data; they are not needed for the prices,
+		but, together and with no LEM transactions, they are a feasible solution of the MILP, used as its starting
+		point (MIP start) if it is warm started
+	:param stage2_milp: optional StageTwoMILPPool (or MatrixStageTwoMILPPool) instance, created for this same
+		backpack with "lp_duals=True", to be re-solved instead of defining a new MILP (e.g., across the forecast
+		scenarios of "scenarios_pre_pool", after updating its forecasts)
+	:param warm_start: if True, the MILP is seeded with the individual solutions of "stage1_outputs", if provided;
+		when "stage2_milp" is provided, its own "warm_start" setting is used instead
 	:return: array of float with the LEM prices computed, plus the full MILP outputs' structure;
 		the order of the values in the array follows the same order of the provided data
 	"""
 	logger.info('Running a pre-delivery standalone pool MILP to retrieve dual LEM prices...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -299,7 +350,14 @@ def dual_pre_pool(backpack: LoopPreBackpackS2PoolDict, solver='CBC') -> (list[fl
 	for _, val in backpack['meters'].items():
 		val['c_ind'] = 0.0
 
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	if stage2_milp is None:
+		milp = new_milp(StageTwoMILPPool, backpack, valid_solver, lp_duals=True, warm_start=warm_start)
+	else:
+		milp = stage2_milp
+		milp.second_stage = False
+		milp.update_prices(l_lem=backpack['l_lem'])
+	if milp.warm_start and stage1_outputs is not None:
+		milp.set_initial_values_from_stage_1(stage1_outputs)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 	dual_prices = results['dual_prices']
@@ -314,6 +372,8 @@ def dual_post_pool(backpack: LoopPostBackpackS2PoolDict, solver='CBC') -> (list[
 	Function to compute the LEM prices' array from the market equilibrium constraint shadow values.
 	A standalone collective MILP is run, where the costs with energy for the whole REC are computed,
 	and the shadow values of the market equilibrium constraint are returned after an optimal solution is achieved.
+	These are taken from the LP that results from fixing the binary variables at their optimal values, re-solved on
+	the same instance, so that they do not depend on the last LP solved by the MILP solver.
 	This function is specific for a post-delivery timeframe, which means that only the financial transactions
 	(i.e., with the retailers and within markets) are optimized.
 	The function requires the provision of several historical data thoroughly described	below,
@@ -346,17 +406,15 @@ def dual_post_pool(backpack: LoopPostBackpackS2PoolDict, solver='CBC') -> (list[
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: array of float with the LEM prices computed, plus the full MILP outputs' structure;
 		the order of the values in the array follows the same order of the provided data
 	"""
 	logger.info('Running a post-delivery standalone pool MILP to retrieve dual LEM prices...')
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	# Set values for specific run
@@ -367,7 +425,7 @@ def dual_post_pool(backpack: LoopPostBackpackS2PoolDict, solver='CBC') -> (list[
 		val['c_ind'] = 0.0
 		val['btm_storage'] = {}
 
-	milp = StageTwoMILPPool(backpack, solver=valid_solver)
+	milp = new_milp(StageTwoMILPPool, backpack, valid_solver, lp_duals=True)
 	milp.solve_milp()
 	results = milp.generate_outputs()
 	dual_prices = results['dual_prices']
@@ -383,6 +441,9 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
                  optimization_func: Callable,
                  for_testing: False,
 				 solver: str,
+				 stage2_milp: Union[StageTwoMILPPool, MatrixStageTwoMILPPool] = None,
+				 warm_start=WARM_START,
+				 state: LoopPreStateS2PoolDict = None,
                  **kwargs: Unpack[RequestParams]) \
 		-> (
 				list[float],
@@ -391,12 +452,22 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 				Union[CollectivePreOutputsS2PoolDict, CollectivePreOutputsS2BilateralDict]
 		):
 	"""
-	Iterative overarching algorithm for the pre-delivery timeframe
+	Iterative overarching algorithm for the pre-delivery timeframe.
+	The individual optimization stages (stage 1) are only run on the first iteration, since they do not depend on
+	the LEM prices; their outputs are passed on to "optimization_func" in the following iterations.
 	:param backpack: data for running the two-stage MILP
-	:param pricing_func: market mechanism function to be applied
+	:param pricing_func: batched market mechanism function to be applied, computing the prices of all sessions at once
 	:param optimization_func: optimization function to be applied
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param stage2_milp: optional collective MILP instance, passed on to "optimization_func" in every iteration so that
+		its structure is only built once and just re-priced with the new LEM prices afterwards
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the solution of the previous
+		iteration (and the first one with the individual solutions of stage 1) as a MIP start
+	:param state: optional dictionary where the state of the loop is kept, at the end, for re-running it (see
+		"update_pre_pool"); if it already holds the state of a previous run, the loop starts from its LEM prices and
+		offers, reusing its stage 1 outputs and (if "warm_start") seeding the first collective MILP with its solution
 	:param kwargs: necessary flags or numeric parameters that are required by the passed func
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
@@ -416,11 +487,16 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 	l_market_sell = backpack['l_market_sell']
 	meters = backpack['meters'].copy()
 	for meter_name, meter_data in meters.items():
-		meter_data['e_met'] = [c - g for c, g in zip(meter_data['e_c'], meter_data['e_g'])]
+		if state:
+			# Start from the offers of the previous run's solution
+			meter_data['e_met'] = state['stage2_outputs']['e_cmet'][meter_name]
+		else:
+			meter_data['e_met'] = [c - g for c, g in zip(meter_data['e_c'], meter_data['e_g'])]
 	nr_sessions = time_intervals(backpack['horizon'], backpack['delta_t'])
 
-	# Initialize the transaction prices "l_lem" with farfetched values, so that a first iteration is triggered
-	l_lem = [10 for _ in range(nr_sessions)]
+	# Initialize the transaction prices "l_lem" with farfetched values, so that a first iteration is triggered,
+	# or with the ones of the previous run
+	l_lem = [10 for _ in range(nr_sessions)] if not state else state['l_lem'].copy()
 
 	# Initialize a list that will keep the prices of all prices from previous iterations
 	l_lem_evolution = []
@@ -434,6 +510,13 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 	break_while = False  # used when Euclidean distance criterion is met, to break out of inner loop
 	milp_results = None  # Initialize the MILP results
 	best_milp_results = None
+	opt_kwargs = {'warm_start': warm_start}  # extra inputs for optimization_func
+	if stage2_milp is not None:
+		opt_kwargs['stage2_milp'] = stage2_milp
+	if state:
+		opt_kwargs['stage1_outputs'] = state['stage1_outputs']
+		if warm_start:
+			opt_kwargs['stage2_start'] = state['stage2_outputs']
 
 	# Print the initial prices considered
 	dynamic_size = lambda val: int(3 - len(str(int(val))))
@@ -475,14 +558,14 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 		# Otherwise...
 		logger.info('################################################################')
 		# Build the current offers, order them and calculate the P2P price
-		buys, sells = make_offers(meters, nr_sessions, l_market_buy, l_market_sell)
+		book = make_offer_book(meters, nr_sessions, l_market_buy, l_market_sell)
 
 		# Get the last iteration prices for later comparison
 		l_lem_evolution.append(l_lem)
 
 		# Calculate new LEM prices
 		logger.info(f'Calculating LEM prices for all sessions...')
-		l_lem = [pricing_func(buys[t], sells[t], **kwargs) for t in range(nr_sessions)]
+		l_lem = pricing_func(*split_offer_book(book), nr_sessions, **kwargs).tolist()
 
 		# Validate the outputted LEM prices
 		assert isinstance(l_lem, list)
@@ -499,9 +582,17 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 
 		# Run the optimization algorithm
 		logger.info(f'Solving MILP...')
-		milp_results = optimization_func(backpack, for_testing, solver)
+		milp_results = optimization_func(backpack, for_testing, solver, **opt_kwargs)
 
-		# Retrieve the new e_met and update "meters" structure
+		# The individual optimization stages do not depend on the LEM prices, so reuse them in the next iterations
+		opt_kwargs['stage1_outputs'] = milp_results[1]
+
+		# Seed the next iteration's collective MILP with the current solution
+		if warm_start:
+			opt_kwargs['stage2_start'] = milp_results[0]
+
+		# Retrieve the new e_met and update "meters" structure; the sessions whose LEM was skipped by the collective
+		# MILP (see "lem_steps_needed") have no surplus, so they are priced as sessions without selling offers
 		for meter_name, meter_data in milp_results[0]['e_cmet'].items():
 			meters[meter_name]['e_met'] = meter_data
 
@@ -516,6 +607,18 @@ def _common_loop(backpack: LoopPreBackpackS2PoolDict,
 	# When a stopping criterion is met, return the computed prices
 	logger.success(f'Stopped algorithm at iteration {it} with stopping criterion = {criterion}.')
 
+	# Keep the state of the loop, for re-running it; not when no iteration improved on the initial best objective
+	# function value, which leaves no results to restart from
+	if state is not None and best_milp_results is None:
+		logger.warning('No iteration improved on the initial objective function value; the state was not kept.')
+	elif state is not None:
+		state.update({
+			'l_lem': best_l_lem,
+			'stage1_outputs': best_milp_results[1],
+			'stage2_outputs': best_milp_results[0],
+			'stage2_milp': stage2_milp
+		})
+
 	return best_l_lem, criterion, it, best_milp_results
 
 
@@ -523,7 +626,9 @@ def loop_pre_pool_mmr(backpack: LoopPreBackpackS2PoolDict,
                       for_testing=False,
                       pruned=True,
                       divider=0.5,
-					  solver='CBC') \
+					  solver='CBC',
+					  warm_start=WARM_START,
+					  state: LoopPreStateS2PoolDict = None) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -584,13 +689,19 @@ def loop_pre_pool_mmr(backpack: LoopPreBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
 	and the most valuable selling offer; By default, the value is 0.5, making the price equidistant from both offers;
 	Higher values skew the price towards the selling offers and smaller values towards the buying offers.
 	Note: must be non-negative and between 0.0 and 1.0
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
+	:param state: optional dictionary where the state of the loop is kept, at the end, for re-running it when the
+		forecasts are updated (see "update_pre_pool"); if it already holds the state of a previous run, with the same
+		solver, its collective MILP is reused and the loop starts from its LEM prices
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -602,29 +713,37 @@ def loop_pre_pool_mmr(backpack: LoopPreBackpackS2PoolDict,
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
 	assert 0.0 <= divider <= 1.0, 'Please provide a divider value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_mmr if pruned else compute_mmr
+	pricing_func = batch_compute_pruned_mmr if pruned else batch_compute_mmr
 	opt_func = run_pre_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
+	# Build the collective MILP, or reuse the one of a previous run
+	if state:
+		stage2_milp = state['stage2_milp']
+	else:
+		stage2_milp = new_milp(StageTwoMILPPool, backpack, valid_solver, warm_start=warm_start)
+
 	return _common_loop(backpack,
 	                    pricing_func,
 	                    opt_func,
 	                    for_testing,
 	                    divider=divider,
-						solver=valid_solver)
+						solver=valid_solver,
+						stage2_milp=stage2_milp,
+						warm_start=warm_start,
+						state=state)
 
 
 def loop_pre_pool_sdr(backpack: LoopPreBackpackS2PoolDict,
                       for_testing=False,
                       pruned=True,
                       compensation=0.0,
-					  solver='CBC') \
+					  solver='CBC',
+					  warm_start=WARM_START,
+					  state: LoopPreStateS2PoolDict = None) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -685,10 +804,16 @@ def loop_pre_pool_sdr(backpack: LoopPreBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param compensation: float between 0 and 1 that establishes the relative compensation
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
+	:param state: optional dictionary where the state of the loop is kept, at the end, for re-running it when the
+		forecasts are updated (see "update_pre_pool"); if it already holds the state of a previous run, with the same
+		solver, its collective MILP is reused and the loop starts from its LEM prices
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -700,28 +825,36 @@ def loop_pre_pool_sdr(backpack: LoopPreBackpackS2PoolDict,
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
 	assert 0.0 <= compensation <= 1.0, 'Please provide a compensation value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_sdr if pruned else compute_sdr
+	pricing_func = batch_compute_pruned_sdr if pruned else batch_compute_sdr
 	opt_func = run_pre_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
+	# Build the collective MILP, or reuse the one of a previous run
+	if state:
+		stage2_milp = state['stage2_milp']
+	else:
+		stage2_milp = new_milp(StageTwoMILPPool, backpack, valid_solver, warm_start=warm_start)
+
 	return _common_loop(backpack,
 	                    pricing_func,
 	                    opt_func,
 	                    for_testing,
 	                    compensation=compensation,
-						solver=valid_solver)
+						solver=valid_solver,
+						stage2_milp=stage2_milp,
+						warm_start=warm_start,
+						state=state)
 
 
 def loop_pre_pool_crossing_value(backpack: LoopPreBackpackS2PoolDict,
                                  for_testing=False,
                                  small_increment=0.0,
-								 solver='CBC') \
+								 solver='CBC',
+								 warm_start=WARM_START,
+								 state: LoopPreStateS2PoolDict = None) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -782,9 +915,15 @@ def loop_pre_pool_crossing_value(backpack: LoopPreBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param small_increment: float to add to buy offers' value and subtract from sell offers' value
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
+	:param state: optional dictionary where the state of the loop is kept, at the end, for re-running it when the
+		forecasts are updated (see "update_pre_pool"); if it already holds the state of a previous run, with the same
+		solver, its collective MILP is reused and the loop starts from its LEM prices
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -795,29 +934,36 @@ def loop_pre_pool_crossing_value(backpack: LoopPreBackpackS2PoolDict,
 		- number of iterations performed
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
-	pricing_func = compute_crossing_value
+	pricing_func = batch_compute_crossing_value
 	opt_func = run_pre_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
+	# Build the collective MILP, or reuse the one of a previous run
+	if state:
+		stage2_milp = state['stage2_milp']
+	else:
+		stage2_milp = new_milp(StageTwoMILPPool, backpack, valid_solver, warm_start=warm_start)
+
 	return _common_loop(backpack,
 	                    pricing_func,
 	                    opt_func,
 	                    for_testing,
 	                    small_increment=small_increment,
-						solver=valid_solver)
+						solver=valid_solver,
+						stage2_milp=stage2_milp,
+						warm_start=warm_start,
+						state=state)
 
 
 def loop_pre_bilateral_mmr(backpack: LoopPreBackpackS2BilateralDict,
                            for_testing=False,
                            pruned=True,
                            divider=0.5,
-						   solver='CBC') \
+						   solver='CBC',
+						   warm_start=WARM_START) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -868,9 +1014,13 @@ def loop_pre_bilateral_mmr(backpack: LoopPreBackpackS2BilateralDict,
 		'horizon' a float or int with the horizon of the optimization (typically 24h), in hours
 		'l_extra': a float representing a fictitious value penalizing overstepping "max_p", in €/kWh
 		'l_grid': dict of dict of arrays with the applicable tariffs for self-consumed energy between
-			pairs of Meters / REC members, in €/kWh
+			pairs of Meters / REC members, in €/kWh; an N x N x T array (following the order of "meters") or a compact
+			form with uniform / per-voltage-level tariffs and overrides are also accepted (see "l_grid_to_array")
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -879,13 +1029,16 @@ def loop_pre_bilateral_mmr(backpack: LoopPreBackpackS2BilateralDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
 	and the most valuable selling offer; By default, the value is 0.5, making the price equidistant from both offers;
 	Higher values skew the price towards the selling offers and smaller values towards the buying offers.
 	Note: must be non-negative and between 0.0 and 1.0
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -897,14 +1050,11 @@ def loop_pre_bilateral_mmr(backpack: LoopPreBackpackS2BilateralDict,
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
 	assert 0.0 <= divider <= 1.0, 'Please provide a divider value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_mmr if pruned else compute_mmr
+	pricing_func = batch_compute_pruned_mmr if pruned else batch_compute_mmr
 	opt_func = run_pre_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_loop(backpack,
@@ -912,14 +1062,16 @@ def loop_pre_bilateral_mmr(backpack: LoopPreBackpackS2BilateralDict,
 	                    opt_func,
 	                    for_testing,
 	                    divider=divider,
-						solver=valid_solver)
+						solver=valid_solver,
+						warm_start=warm_start)
 
 
 def loop_pre_bilateral_sdr(backpack: LoopPreBackpackS2BilateralDict,
                            for_testing=False,
                            pruned=True,
                            compensation=0.0,
-						   solver='CBC') \
+						   solver='CBC',
+						   warm_start=WARM_START) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -970,9 +1122,13 @@ def loop_pre_bilateral_sdr(backpack: LoopPreBackpackS2BilateralDict,
 		'horizon' a float or int with the horizon of the optimization (typically 24h), in hours
 		'l_extra': a float representing a fictitious value penalizing overstepping "max_p", in €/kWh
 		'l_grid': dict of dict of arrays with the applicable tariffs for self-consumed energy between
-			pairs of Meters / REC members, in €/kWh
+			pairs of Meters / REC members, in €/kWh; an N x N x T array (following the order of "meters") or a compact
+			form with uniform / per-voltage-level tariffs and overrides are also accepted (see "l_grid_to_array")
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -981,10 +1137,13 @@ def loop_pre_bilateral_sdr(backpack: LoopPreBackpackS2BilateralDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param compensation: float between 0 and 1 that establishes the relative compensation
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -996,14 +1155,11 @@ def loop_pre_bilateral_sdr(backpack: LoopPreBackpackS2BilateralDict,
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
 	assert 0.0 <= compensation <= 1.0, 'Please provide a compensation value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_sdr if pruned else compute_sdr
+	pricing_func = batch_compute_pruned_sdr if pruned else batch_compute_sdr
 	opt_func = run_pre_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_loop(backpack,
@@ -1011,13 +1167,15 @@ def loop_pre_bilateral_sdr(backpack: LoopPreBackpackS2BilateralDict,
 	                    opt_func,
 	                    for_testing,
 	                    compensation=compensation,
-						solver=valid_solver)
+						solver=valid_solver,
+						warm_start=warm_start)
 
 
 def loop_pre_bilateral_crossing_value(backpack: LoopPreBackpackS2BilateralDict,
                                       for_testing=False,
                                       small_increment=0.0,
-									  solver='CBC') \
+									  solver='CBC',
+									  warm_start=WARM_START) \
 		-> (
 				list[float],
 				Union[float, None],
@@ -1069,9 +1227,13 @@ def loop_pre_bilateral_crossing_value(backpack: LoopPreBackpackS2BilateralDict,
 		'horizon' a float or int with the horizon of the optimization (typically 24h), in hours
 		'l_extra': a float representing a fictitious value penalizing overstepping "max_p", in €/kWh
 		'l_grid': dict of dict of arrays with the applicable tariffs for self-consumed energy between
-			pairs of Meters / REC members, in €/kWh
+			pairs of Meters / REC members, in €/kWh; an N x N x T array (following the order of "meters") or a compact
+			form with uniform / per-voltage-level tariffs and overrides are also accepted (see "l_grid_to_array")
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -1080,9 +1242,12 @@ def loop_pre_bilateral_crossing_value(backpack: LoopPreBackpackS2BilateralDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param small_increment: float to add to buy offers' value and subtract from sell offers' value
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
+	:param warm_start: if True, the collective MILP of each iteration is seeded with the previous iteration's
+		solution (and the first one with the individual solutions of stage 1) as a MIP start
 	:return: tuple with:
 		- array of float with the LEM prices computed for the best iteration,
 			i.e. the iteration with the best objective function value;
@@ -1093,14 +1258,11 @@ def loop_pre_bilateral_crossing_value(backpack: LoopPreBackpackS2BilateralDict,
 		- number of iterations performed
 		- full MILP outputs' structure of the solution with the best objective function value
 	"""
-	pricing_func = compute_crossing_value
+	pricing_func = batch_compute_crossing_value
 	opt_func = run_pre_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_loop(backpack,
@@ -1108,7 +1270,278 @@ def loop_pre_bilateral_crossing_value(backpack: LoopPreBackpackS2BilateralDict,
 	                    opt_func,
 	                    for_testing,
 	                    small_increment=small_increment,
-						solver=valid_solver)
+						solver=valid_solver,
+						warm_start=warm_start)
+
+
+def loop_pre_rolling_horizon(loop_func: Callable,
+                             backpack: Union[LoopPreBackpackS2PoolDict, LoopPreBackpackS2BilateralDict],
+                             commit_horizon=COMMIT_HORIZON,
+                             lookahead_horizon=LOOKAHEAD_HORIZON,
+                             **kwargs) \
+		-> (
+				list[float],
+				Union[float, None],
+				int,
+				Union[CollectivePreOutputsS2PoolDict, CollectivePreOutputsS2BilateralDict]
+		):
+	"""
+	Function to run any of the pre-delivery "loop_pre_*" pricing algorithms in rolling horizon mode, for horizons
+	too long to be solved as a single MILP (e.g., several days with a 15 minutes step).
+	The horizon is split into overlapping windows of "commit_horizon" + "lookahead_horizon" hours, each priced in
+	sequence by "loop_func", every "commit_horizon" hours. Only the LEM prices and schedules of the committed hours
+	of each window are kept: the energy content of the storage units ("init_e") and EVs ("init_e_ev") at their end
+	is carried forward as the initial energy content of the next window.
+	:param loop_func: one of the "loop_pre_*" functions
+	:param backpack: the inputs of "loop_func", for the full horizon
+	:param commit_horizon: hours of each window that are committed, in hours
+	:param lookahead_horizon: hours optimized after the committed ones of each window, in hours
+	:param kwargs: other keyword arguments of "loop_func" (e.g., "solver")
+	:return: tuple with:
+		- array of float with the LEM prices of the committed hours of all windows
+		- the largest stopping criterion of all windows; returned as None if, in any window, the criterion wasn't
+			met, but loop broke by reaching the maximum iteration number
+		- total number of iterations performed, over all windows
+		- full MILP outputs' structure of the committed hours of all windows, stitched as in "run_pre_rolling_horizon"
+	"""
+	logger.info(f'Running {loop_func.__name__} in rolling horizon mode '
+	            f'({commit_horizon}h committed + {lookahead_horizon}h look-ahead windows)...')
+
+	# The collective schedule is the first element of the MILP outputs, i.e. the last element of the loop results
+	schedule = lambda results: results[-1][0]
+	windows = solve_rolling_horizon(lambda window_backpack: loop_func(window_backpack, **kwargs), schedule,
+	                                backpack, commit_horizon, lookahead_horizon)
+
+	l_lem = [l_lem_value for _, commit_steps, results in windows for l_lem_value in results[0][:commit_steps]]
+	criteria = [results[1] for _, _, results in windows]
+	criterion = None if any(c is None for c in criteria) else max(criteria)
+	iterations = sum(results[2] for _, _, results in windows)
+	milp_results = stitch_results([(window_backpack, commit_steps, results[-1])
+	                               for window_backpack, commit_steps, results in windows],
+	                              l_lem=[results[0] for _, _, results in windows])
+
+	logger.info(f'Running {loop_func.__name__} in rolling horizon mode... DONE!')
+
+	return l_lem, criterion, iterations, milp_results
+
+
+def loop_pre_batch(loop_func: Callable,
+                   backpacks: list[Union[LoopPreBackpackS2PoolDict, LoopPreBackpackS2BilateralDict]],
+                   n_jobs: int = None,
+                   **kwargs) \
+		-> Iterator[tuple[int, Union[tuple, Exception]]]:
+	"""
+	Function to run any of the pre-delivery "loop_pre_*" pricing algorithms for several independent RECs (e.g., the
+	day-ahead pricing of all the communities managed by an operator) on a single bounded pool of worker processes.
+	Each REC's pricing loop, i.e., its stage 1 and stage 2 solves, is run on one worker, with its stage 1 run
+	sequentially, instead of each loop spawning a pool of workers of its own, which would oversubscribe the machine.
+	The RECs are started by decreasing estimated size (see "estimated_size"), so that the largest ones do not delay
+	the whole batch by starting last, and the results are yielded as soon as each REC finishes.
+	:param loop_func: one of the "loop_pre_*" functions
+	:param backpacks: list with the inputs of "loop_func", one per REC
+	:param n_jobs: number of worker processes, i.e., of RECs run at once; if not provided, defaults to "N_JOBS"
+		(configurable through the REC_OP_LEM_PRICES_N_JOBS environment variable)
+	:param kwargs: other keyword arguments of "loop_func" (e.g., "solver"), common to all RECs
+	:return: iterator over tuples with the position of each REC in "backpacks" and the results of "loop_func" for it,
+		in the order the RECs finish; if the pricing of a REC raised an exception (e.g., a MILP not optimally solved),
+		the exception is returned instead of its results
+	"""
+	bilateral = loop_func in (loop_pre_bilateral_mmr, loop_pre_bilateral_sdr, loop_pre_bilateral_crossing_value)
+	priorities = [estimated_size(backpack, bilateral) for backpack in backpacks]
+	logger.info(f'Running {loop_func.__name__} for a batch of {len(backpacks)} RECs...')
+
+	for idx, results in run_as_completed(loop_func, backpacks, priorities=priorities, n_jobs=n_jobs, **kwargs):
+		logger.info(f'REC {idx} of the batch finished.')
+		yield idx, results
+
+	logger.info(f'Running {loop_func.__name__} for a batch of {len(backpacks)} RECs... DONE!')
+
+
+def _solve_scenarios(chunk: dict, run_func: Callable, backpack: LoopPreBackpackS2PoolDict,
+                     stage1_outputs: dict[str, OutputsS1Dict], **kwargs) -> list:
+	"""
+	Auxiliary function of "scenarios_pre_pool", run on its workers, that solves a chunk of scenarios in sequence.
+	A single collective (stage 2) MILP is created for the chunk, on its first scenario, and then switched to the
+	forecasts of each of the others (see "StageTwoMILPPool.update_forecasts"), so that its structure is shared by all
+	of them instead of being defined anew per scenario.
+	:param chunk: {'scenarios': list with the forecasts of each scenario of the chunk}
+	:param run_func: one of "run_pre_two_stage_collective_pool_milp" or "dual_pre_pool"
+	:param backpack: inputs of "run_func", shared by all scenarios
+	:param stage1_outputs: individual outputs (stage 1) of the Meters for the base forecasts of "backpack", per Meter
+		(empty if not needed)
+	:param kwargs: other keyword arguments of "run_func" (e.g., "solver")
+	:return: list with the results of "run_func" for each scenario of the chunk, or the exception it raised
+	"""
+	solver = kwargs.get('solver', 'CBC')
+	two_stage = run_func is run_pre_two_stage_collective_pool_milp
+	milp = None
+	milp_scenario = {}  # forecasts of the scenario the MILP currently holds
+	results = []
+	for scenario in chunk['scenarios']:
+		scenario_backpack = apply_scenario(backpack, scenario)
+		try:
+			if stage1_outputs:
+				# Only the individual optimization stages of the Meters whose forecasts vary are run again
+				scenario_stage1 = {**stage1_outputs}
+				for meter_id in scenario:
+					meter_backpack = individual_backpack(scenario_backpack, meter_id)
+					scenario_stage1[meter_id] = run_pre_individual_milp(meter_backpack, solver)
+				kwargs['stage1_outputs'] = [scenario_stage1[meter_id] for meter_id in backpack['meters']]
+
+			if milp is None:
+				milp = new_milp(StageTwoMILPPool, {**scenario_backpack, 'second_stage': two_stage},
+				                validate_solver(solver), lp_duals=not two_stage,
+				                warm_start=kwargs.get('warm_start', WARM_START))
+			else:
+				# Set the forecasts of the Meters this scenario varies, and restore the ones the previous one varied
+				meter_ids = set(scenario) | set(milp_scenario)
+				milp.update_forecasts(
+					e_c={meter_id: scenario_backpack['meters'][meter_id]['e_c'] for meter_id in meter_ids},
+					e_g={meter_id: scenario_backpack['meters'][meter_id]['e_g'] for meter_id in meter_ids}
+				)
+			milp_scenario = scenario
+
+			results.append(run_func(scenario_backpack, stage2_milp=milp, **kwargs))
+		except Exception as exc:
+			logger.error(f'A scenario raised an exception: {exc!r}')
+			results.append(exc)
+	return results
+
+
+def scenarios_pre_pool(run_func: Callable,
+                       backpack: LoopPreBackpackS2PoolDict,
+                       scenarios: list[dict[str, dict[str, list[float]]]],
+                       n_jobs: int = None,
+                       **kwargs) -> dict:
+	"""
+	Function to run "run_pre_two_stage_collective_pool_milp" or "dual_pre_pool" for several forecast scenarios of the
+	same REC, in parallel, to price it against the uncertainty of its Meters' consumption and generation.
+	Each scenario only holds the forecasts ("e_c" and / or "e_g") of the Meters that differ from the ones of
+	"backpack", which holds everything else, shared by all scenarios. The scenarios are split into one chunk per
+	worker, so that the shared data is sent once per worker instead of once per scenario, and each worker defines a
+	single collective MILP, re-solved for each of its scenarios after updating its forecasts. The individual
+	optimization stages (stage 1) are run once for the base forecasts, only being run again, on each scenario, for
+	the Meters whose forecasts it changes; "dual_pre_pool" only needs them as its MIP start, so they are only run
+	for it if it is warm started.
+	:param run_func: one of "run_pre_two_stage_collective_pool_milp" or "dual_pre_pool"
+	:param backpack: the inputs of "run_func", with the base forecasts of all Meters
+	:param scenarios: list with the forecasts of each scenario, as {#meter_id: {'e_c': [...], 'e_g': [...]}}, only for
+		the Meters and forecasts that differ from the ones of "backpack" (e.g., {} for the base forecasts)
+	:param n_jobs: number of worker processes; if not provided (or not positive, e.g., -1), defaults to "N_JOBS"
+		(configurable through the REC_OP_LEM_PRICES_N_JOBS environment variable)
+	:param kwargs: other keyword arguments of "run_func" (e.g., "solver" or "warm_start"), common to all scenarios
+	:return: {
+		'results': list with the results of "run_func" for each scenario, in the same order as "scenarios", or the
+			exception it raised for that scenario
+		'dual_prices': list with the LEM prices (dual prices) of each scenario, or None for the failed ones
+		'price_statistics': statistics of the LEM prices of the successful scenarios, per session (see
+			"price_statistics"), or None if none succeeded
+	}
+	"""
+	if run_func not in (run_pre_two_stage_collective_pool_milp, dual_pre_pool):
+		raise ValueError('The multi-scenario mode is only available for "run_pre_two_stage_collective_pool_milp" '
+		                 'and "dual_pre_pool".')
+	validate_scenarios(backpack, scenarios)
+	if not scenarios:
+		return {'results': [], 'dual_prices': [], 'price_statistics': None}
+	n_jobs = N_JOBS if n_jobs is None or n_jobs < 1 else n_jobs
+	logger.info(f'Running {run_func.__name__} for {len(scenarios)} forecast scenarios...')
+
+	# Individual optimization stages for the base forecasts, shared by all scenarios
+	stage1_outputs = {}
+	if run_func is run_pre_two_stage_collective_pool_milp or kwargs.get('warm_start', WARM_START):
+		outputs = run_in_parallel(run_pre_individual_milp,
+		                          [individual_backpack(backpack, meter_id) for meter_id in backpack['meters']],
+		                          kwargs.get('solver', 'CBC'), n_jobs=n_jobs)
+		stage1_outputs = dict(zip(backpack['meters'], outputs))
+
+	chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(scenarios)), min(n_jobs, len(scenarios)))]
+	results = [None] * len(scenarios)
+	for chunk_idx, chunk_results in run_as_completed(_solve_scenarios,
+	                                                 [{'scenarios': [scenarios[i] for i in chunk]} for chunk in chunks],
+	                                                 run_func, backpack, stage1_outputs, n_jobs=n_jobs, **kwargs):
+		for scenario_idx, scenario_results in zip(chunks[chunk_idx], chunk_results):
+			results[scenario_idx] = scenario_results
+
+	solved = [not isinstance(r, Exception) for r in results]
+	dual_prices = [(r[0] if run_func is dual_pre_pool else r[0]['dual_prices']) if ok else None
+	               for r, ok in zip(results, solved)]
+	logger.info(f'Running {run_func.__name__} for {len(scenarios)} forecast scenarios... DONE! '
+	            f'({sum(solved)} solved)')
+
+	return {
+		'results': results,
+		'dual_prices': dual_prices,
+		'price_statistics': price_statistics([p for p in dual_prices if p is not None]) if any(solved) else None
+	}
+
+
+def update_pre_pool(loop_func: Callable,
+                    backpack: LoopPreBackpackS2PoolDict,
+                    state: LoopPreStateS2PoolDict,
+                    updates: dict[str, dict[str, dict[int, float]]],
+                    solver='CBC',
+                    **kwargs) \
+		-> (
+				list[float],
+				Union[float, None],
+				int,
+				CollectivePreOutputsS2PoolDict
+		):
+	"""
+	Function to re-run a pre-delivery pricing loop under a pool market structure ("loop_pre_pool_mmr",
+	"loop_pre_pool_sdr" or "loop_pre_pool_crossing_value") when the forecasts of some Meters are revised (e.g.,
+	intraday), without starting it over: only the individual optimization stages (stage 1) of the revised Meters are
+	run again, the forecasts are updated in the collective MILP of the previous run instead of building it anew (see
+	"StageTwoMILPPool.update_forecasts"), and the loop starts from the LEM prices of the previous run, with the offers
+	of its solution shifted by the revision of the forecasts.
+	:param loop_func: one of "loop_pre_pool_mmr", "loop_pre_pool_sdr" or "loop_pre_pool_crossing_value"
+	:param backpack: the inputs of the previous run, which are updated with the revised forecasts
+	:param state: the state of the previous run, as kept by "loop_func" when called with "state={}" (or by a previous
+		call to this function), which is updated for the next revision
+	:param updates: revised forecasts, as {#meter_id: {'e_c': {#step: value}, 'e_g': {#step: value}}}, only for the
+		Meters, forecasts and steps that changed
+	:param solver: the same solver used in the previous run
+	:param kwargs: other keyword arguments of "loop_func" (e.g., "pruned" or "divider"), as in the previous run
+	:return: the same outputs of "loop_func"
+	"""
+	if loop_func not in (loop_pre_pool_mmr, loop_pre_pool_sdr, loop_pre_pool_crossing_value):
+		raise ValueError('The incremental updates are only available for the pre-delivery pricing loops under a pool '
+		                 'market structure.')
+	if not state:
+		raise ValueError(f'Please provide the state kept by a previous run of "{loop_func.__name__}".')
+	revised = forecast_update(backpack, updates)
+	logger.info(f'Updating the forecasts of {list(revised)}...')
+
+	# Revision of the Meters' net consumption, by which the offers of the previous solution are shifted
+	e_cmet = {**state['stage2_outputs']['e_cmet']}
+	for meter_id, forecasts in revised.items():
+		meter_data = backpack['meters'][meter_id]
+		e_net = np.subtract(meter_data['e_c'], meter_data['e_g'])
+		meter_data.update(forecasts)
+		e_cmet[meter_id] = (np.add(e_cmet[meter_id], np.subtract(meter_data['e_c'], meter_data['e_g']) - e_net)
+		                    .tolist())
+
+	# Run the individual optimization stages of the revised Meters only
+	individual_backpacks = [individual_backpack(backpack, meter_id) for meter_id in revised]
+	outputs = run_in_parallel(run_pre_individual_milp, individual_backpacks, solver)
+	not_optimal = {output['meter_id']: output['milp_status'] for output in outputs if output['milp_status'] != 'Optimal'}
+	if not_optimal:
+		error_msg = f'The following individual optimization procedures were not optimally solved: {not_optimal}. ' \
+		            f'Please try making another request, verifying all input data. ' \
+		            f'If the problem persists, please contact the developers.'
+		raise ValueError(error_msg)
+	revised_outputs = {output['meter_id']: output for output in outputs}
+
+	state['stage1_outputs'] = [revised_outputs.get(output['meter_id'], output) for output in state['stage1_outputs']]
+	state['stage2_outputs'] = {**state['stage2_outputs'], 'e_cmet': e_cmet}
+	state['stage2_milp'].update_forecasts(
+		e_c={meter_id: forecasts['e_c'] for meter_id, forecasts in revised.items() if 'e_c' in forecasts},
+		e_g={meter_id: forecasts['e_g'] for meter_id, forecasts in revised.items() if 'e_g' in forecasts}
+	)
+	logger.info(f'Updating the forecasts of {list(revised)}... DONE!')
+
+	return loop_func(backpack, solver=solver, state=state, **kwargs)
 
 
 # -- POST-DELIVERY HIGHWAYS --------------------------------------------------------------------------------------------
@@ -1125,10 +1558,11 @@ def _common_highway(backpack: LoopPreBackpackS2PoolDict,
 	"""
 	Iterative overarching algorithm for the post-delivery timeframe
 	:param backpack: data for running the two-stage MILP
-	:param pricing_func: market mechanism function to be applied
+	:param pricing_func: batched market mechanism function to be applied, computing the prices of all sessions at once
 	:param optimization_func: optimization function to be applied
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:param kwargs: necessary flags or numeric parameters that are required by the passed func
 	:return: tuple with:
 		- array of float with the LEM prices computed;
@@ -1155,11 +1589,11 @@ def _common_highway(backpack: LoopPreBackpackS2PoolDict,
 	logger.info('################################################################')
 	while True:
 		# Build the current offers, order them and calculate the P2P price
-		buys, sells = make_offers(meters, nr_sessions, l_market_buy, l_market_sell)
+		book = make_offer_book(meters, nr_sessions, l_market_buy, l_market_sell)
 
 		# Calculate initial LEM prices
 		logger.info(f'Calculating LEM prices for all sessions...')
-		l_lem = [pricing_func(buys[t], sells[t], **kwargs) for t in range(nr_sessions)]
+		l_lem = pricing_func(*split_offer_book(book), nr_sessions, **kwargs).tolist()
 
 		# Validate the outputted LEM prices
 		assert isinstance(l_lem, list)
@@ -1187,7 +1621,8 @@ def _common_highway(backpack: LoopPreBackpackS2PoolDict,
 		of2 = milp_results[0]['obj_value']
 		logger.info(f'--- O.F. value: ({round(of2, 3)})')
 
-		# Retrieve the new e_met and update "meters" structure
+		# Retrieve the new e_met and update "meters" structure; the sessions whose LEM was skipped by the collective
+		# MILP (see "lem_steps_needed") have no surplus, so they are priced as sessions without selling offers
 		for meter_name, meter_data in milp_results[0]['e_cmet'].items():
 			meters[meter_name]['e_met'] = meter_data
 
@@ -1249,27 +1684,25 @@ def loop_post_pool_mmr(backpack: LoopPostBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
 	and the most valuable selling offer; By default, the value is 0.5, making the price equidistant from both offers;
 	Higher values skew the price towards the selling offers and smaller values towards the buying offers.
 	Note: must be non-negative and between 0.0 and 1.0
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
 	assert 0.0 <= divider <= 1.0, 'Please provide a divider value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_mmr if pruned else compute_mmr
+	pricing_func = batch_compute_pruned_mmr if pruned else batch_compute_mmr
 	opt_func = run_post_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
@@ -1325,24 +1758,22 @@ def loop_post_pool_sdr(backpack: LoopPostBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param compensation: float between 0 and 1 that establishes the relative compensation
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
 	assert 0.0 <= compensation <= 1.0, 'Please provide a compensation value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_sdr if pruned else compute_sdr
+	pricing_func = batch_compute_pruned_sdr if pruned else batch_compute_sdr
 	opt_func = run_post_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
@@ -1397,22 +1828,20 @@ def loop_post_pool_crossing_value(backpack: LoopPostBackpackS2PoolDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param small_increment: float to add to buy offers' value and subtract from sell offers' value
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
-	pricing_func = compute_crossing_value
+	pricing_func = batch_compute_crossing_value
 	opt_func = run_post_two_stage_collective_pool_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
@@ -1460,6 +1889,9 @@ def loop_post_bilateral_mmr(backpack: LoopPostBackpackS2BilateralDict,
 		'l_grid': an array with the applicable tariffs for self-consumed energy, in €/kWh
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -1468,27 +1900,25 @@ def loop_post_bilateral_mmr(backpack: LoopPostBackpackS2BilateralDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param divider: the value establishing how close the LEM price is positioned from the least valuable buying offer
 	and the most valuable selling offer; By default, the value is 0.5, making the price equidistant from both offers;
 	Higher values skew the price towards the selling offers and smaller values towards the buying offers.
 	Note: must be non-negative and between 0.0 and 1.0
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
 	assert 0.0 <= divider <= 1.0, 'Please provide a divider value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_mmr if pruned else compute_mmr
+	pricing_func = batch_compute_pruned_mmr if pruned else batch_compute_mmr
 	opt_func = run_post_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
@@ -1536,6 +1966,9 @@ def loop_post_bilateral_sdr(backpack: LoopPostBackpackS2BilateralDict,
 		'l_grid': an array with the applicable tariffs for self-consumed energy, in €/kWh
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -1544,24 +1977,22 @@ def loop_post_bilateral_sdr(backpack: LoopPostBackpackS2BilateralDict,
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param pruned: if True, consider only offers that would be cleared on a market pool
 	:param compensation: float between 0 and 1 that establishes the relative compensation
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
 	assert 0.0 <= compensation <= 1.0, 'Please provide a compensation value between 0.0 and 1.0.'
-	pricing_func = compute_pruned_sdr if pruned else compute_sdr
+	pricing_func = batch_compute_pruned_sdr if pruned else batch_compute_sdr
 	opt_func = run_post_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
@@ -1609,6 +2040,9 @@ def loop_post_bilateral_crossing_value(backpack: LoopPostBackpackS2BilateralDict
 		'l_grid': an array with the applicable tariffs for self-consumed energy, in €/kWh
 		'l_market_buy': an array with market-indexed buying tariffs in €/kWh
 		'l_market_sell': an array with market-indexed selling tariffs in €/kWh
+		'partners': (optional) trading graph, i.e., the pairs of Meters / REC members allowed to trade with each other;
+			None (default) for all pairs, "l_grid" for only the pairs present in "l_grid", or a dict with the list of
+			partners of each Meter (see "partners_helpers"); only those pairs are modelled and reported
 		'strict_pos_coeffs': boolean indicating if the (dynamic) allocation coefficients that are generated by the
 			internal REC transactions need to be strictly positive (as the Portuguese legislation currently demands)
 			or not
@@ -1617,22 +2051,20 @@ def loop_post_bilateral_crossing_value(backpack: LoopPostBackpackS2BilateralDict
 			or not; this means that if a meter has surplus and it is injecting in the grid, that surplus must totally
 			shared with all members of the REC
 	}
-	:param for_testing: when testing set to True, since parallelization of first stage does not work
+	:param for_testing: kept for backwards compatibility; stage 1 now runs on the shared pool of workers also when testing
 	:param small_increment: float to add to buy offers' value and subtract from sell offers' value
-	:param solver: one of "CBC", CPLEX" (other string reverts to "CBC"; if "CPLEX" is not available, reverts to "CBC")
+	:param solver: one of "CBC", "CPLEX" or "HiGHS_API" (other string reverts to "CBC"; if "CPLEX" is not available,
+		reverts to "CBC"); with "HiGHS_API" the MILPs are solved in-process, without temporary files
 	:return: tuple with:
 		- array of float with the LEM prices computed;
 			the order of the values in the array follows the same order of the provided data
 		- full MILP outputs' structure of the solution
 	"""
-	pricing_func = compute_crossing_value
+	pricing_func = batch_compute_crossing_value
 	opt_func = run_post_two_stage_collective_bilateral_milp
 
 	# Validate the solver used
-	if solver == 'CPLEX' and IS_CPLEX_AVAILABLE:
-		valid_solver = 'CPLEX'
-	else:
-		valid_solver = 'CBC'
+	valid_solver = validate_solver(solver)
 	logger.info(f'Solver: {valid_solver}')
 
 	return _common_highway(backpack,
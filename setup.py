@@ -14,6 +14,7 @@ setup(
 		'pandas~=2.1.2',
 		'pulp~=2.7.0',
 		'scikit-learn~=1.4.1.post1',
+		'scipy~=1.11.4',
 		'setuptools~=70.0.0',
 		'typing-extensions~=4.10.0'
 	],
@@ -0,0 +1,59 @@
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.aggregation_helpers import (
+	aggregate_backpack,
+	cluster_meters
+)
+
+
+def _backpack():
+	meter = lambda e_c, e_g, e_bn: {
+		'btm_storage': {'Storage#1': {'degradation_cost': 0.01, 'e_bn': e_bn, 'eff_bc': 1.0, 'eff_bd': 1.0,
+		                              'init_e': 0.0, 'p_max': e_bn, 'soc_max': 100.0, 'soc_min': 0.0}} if e_bn else {},
+		'e_c': e_c,
+		'e_g': e_g,
+		'l_buy': [1.0, 2.0],
+		'l_sell': [0.0, 0.0],
+		'max_p': 1.0
+	}
+	return {
+		'delta_t': 1.0,
+		'horizon': 2,
+		'l_lem': [0.5, 0.5],
+		'meters': {
+			'Meter#1': meter([1.0, 1.0], [0.0, 0.0], 2.0),
+			'Meter#2': meter([0.0, 0.0], [2.0, 2.0], 0.0),
+			'Meter#3': meter([1.1, 0.9], [0.0, 0.0], 1.0)
+		}
+	}
+
+
+def test_cluster_meters():
+	backpack = _backpack()
+	clusters = cluster_meters(backpack, 2)
+	assert clusters['Meter#1'] == clusters['Meter#3'] != clusters['Meter#2']
+	assert clusters == cluster_meters(backpack, 2)
+	assert len(set(cluster_meters(backpack, 5).values())) == 3
+	try:
+		cluster_meters(backpack, 0)
+		assert False, 'a reduced community without Meters must be rejected'
+	except ValueError:
+		pass
+
+
+def test_aggregate_backpack():
+	backpack = _backpack()
+	aggregated = aggregate_backpack(backpack, {'Meter#1': 'Cluster#1', 'Meter#2': 'Cluster#2', 'Meter#3': 'Cluster#1'})
+	assert list(aggregated['meters']) == ['Cluster#1', 'Cluster#2']
+	assert aggregated['l_lem'] == backpack['l_lem']
+	cluster = aggregated['meters']['Cluster#1']
+	assert np.allclose(cluster['e_c'], [2.1, 1.9])
+	assert cluster['max_p'] == 2.0
+	assert cluster['btm_storage']['Storage#1']['e_bn'] == 3.0
+	assert cluster['l_buy'] == [1.0, 2.0]
+	assert aggregated['meters']['Cluster#2']['btm_storage'] == {}
+
+
+if __name__ == '__main__':
+	test_cluster_meters()
+	test_aggregate_backpack()
@@ -1,8 +1,16 @@
-from rec_op_lem_prices.optimization.module.IndividualCost import calculate_individual_cost
+import numpy as np
+
+from rec_op_lem_prices.optimization.module.IndividualCost import (
+	calculate_collective_individual_costs,
+	calculate_individual_cost,
+	calculate_individual_costs,
+	split_individual_costs
+)
 from rec_op_lem_prices.optimization.structures.I_O_individual_cost import (
 		INPUTS_IC,
 		OUTPUTS_IC
 	)
+from rec_op_lem_prices.optimization.structures.I_O_stage_2_pool_milp import COLLECTIVE_POST_INPUTS_S2_POOL
 
 
 def test_solve_individual_milp():
@@ -14,5 +22,71 @@ def test_solve_individual_milp():
 		assert valu == OUTPUTS_IC.get(ki), f'{ki}'
 
 
+def test_calculate_individual_costs():
+	# Build a batch with the same Meter, twice, and a second Meter with a symmetric net load
+	e_met = np.array([INPUTS_IC['e_met'], INPUTS_IC['e_met'], [-e for e in INPUTS_IC['e_met']]])
+	ids = ['Meter#1', 'Meter#2', 'Meter#3']
+	results = calculate_individual_costs({
+		'delta_t': INPUTS_IC['delta_t'],
+		'e_met': e_met,
+		'ids': ids,
+		'l_buy': np.array([INPUTS_IC['l_buy']] * 3),
+		'l_extra': INPUTS_IC['l_extra'],
+		'l_market_buy': np.array(INPUTS_IC['l_market_buy']),
+		'l_market_sell': np.array(INPUTS_IC['l_market_sell']),
+		'l_sell': np.array([INPUTS_IC['l_sell']] * 3),
+		'max_p': np.array([INPUTS_IC['max_p']] * 3)
+	})
+	assert results['e_sup_retail'].shape == e_met.shape
+	assert results['c_ind'].shape == (3,)
+
+	# Assert the batched outputs match the ones computed Meter by Meter
+	for n, outputs in enumerate(split_individual_costs(results)):
+		backpack = INPUTS_IC.copy()
+		backpack['e_met'] = e_met[n].tolist()
+		backpack['id'] = ids[n]
+		assert outputs == calculate_individual_cost(backpack)
+
+
+def test_calculate_individual_cost_variable_steps():
+	# Assert the extra power is computed with the duration of each step
+	backpack = {
+		'delta_t': [0.5, 2.0],
+		'e_met': [2.0, 2.0],
+		'id': 'Meter#1',
+		'l_buy': [1.0, 1.0],
+		'l_extra': 10,
+		'l_market_buy': [2.0, 2.0],
+		'l_market_sell': [0.0, 0.0],
+		'l_sell': [0.0, 0.0],
+		'max_p': 1.0
+	}
+	results = calculate_individual_cost(backpack)
+	assert results['p_extra'] == [3.0, 0.0]
+	assert results['c_ind'] == 4.0 + 30.0
+
+
+def test_calculate_collective_individual_costs():
+	# Assert the outputs for the Meters of a collective backpack match the ones computed Meter by Meter
+	backpack = COLLECTIVE_POST_INPUTS_S2_POOL
+	results = calculate_collective_individual_costs(backpack)
+	assert [outputs['meter_id'] for outputs in results] == list(backpack['meters'].keys())
+	for outputs, (meter_id, meter_data) in zip(results, backpack['meters'].items()):
+		assert outputs == calculate_individual_cost({
+			'delta_t': backpack['delta_t'],
+			'e_met': [e_c - e_g for e_c, e_g in zip(meter_data['e_c'], meter_data['e_g'])],
+			'id': meter_id,
+			'l_buy': meter_data['l_buy'],
+			'l_extra': backpack['l_extra'],
+			'l_market_buy': backpack['l_market_buy'],
+			'l_market_sell': backpack['l_market_sell'],
+			'l_sell': meter_data['l_sell'],
+			'max_p': meter_data['max_p']
+		})
+
+
 if __name__ == '__main__':
 	test_solve_individual_milp()
+	test_calculate_individual_costs()
+	test_calculate_individual_cost_variable_steps()
+	test_calculate_collective_individual_costs()
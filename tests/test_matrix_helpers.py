@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from rec_op_lem_prices.optimization.helpers.matrix_helpers import (
+	add_exchange_terms,
+	MatrixModel,
+	unpack_batteries
+)
+
+
+def test_matrix_model():
+	# min x0 + 2 * x1 + 3 * y, s.t. x0 + x1 >= 1 (for both rows of a 2 x 2 block), x <= 4 * y, y binary
+	model = MatrixModel()
+	x = model.add_variables((2, 2))
+	y = model.add_variables(2, binary=True)
+	model.add_cost(x, [1.0, 2.0])
+	model.add_cost(y, 3.0)
+	rows = model.add_rows(2, lb=1.0)
+	model.add_terms(rows[:, np.newaxis], x, 1.0)  # each row sums its two variables
+	big_m_rows = model.add_rows((2, 2), ub=0.0)
+	model.add_terms(big_m_rows, x, 1.0)
+	model.add_terms(big_m_rows, y[:, np.newaxis], -4.0)
+
+	arrays = model.to_arrays()
+	assert arrays['A'].shape == (6, 6)
+	assert arrays['integrality'].tolist() == [0, 0, 0, 0, 1, 1]
+
+	model.solve()
+	assert model.status == 'Optimal'
+	assert round(model.obj_value, 6) == 8.0
+	assert np.allclose(model.values(x), [[1.0, 0.0], [1.0, 0.0]])
+	assert np.allclose(model.activity(rows), [1.0, 1.0])
+
+	# with the binaries fixed, each covering row costs 1 per unit
+	assert np.allclose(model.fixed_integers_duals(rows), [1.0, 1.0])
+
+	# assert the formulation is only assembled once, and re-solved with the changes made in place
+	assert model.to_arrays() is arrays
+	model.set_cost(x, [2.0, 1.0])
+	model.set_terms(big_m_rows, y[:, np.newaxis], -2.0)
+	model.set_row_bounds(rows, lb=[1.0, 2.0])
+	model.solve()
+	assert model.to_arrays() is arrays
+	assert round(model.obj_value, 6) == 9.0
+	assert np.allclose(model.values(x), [[0.0, 1.0], [0.0, 2.0]])
+	assert np.allclose(model.activity(rows), [1.0, 2.0])
+	with pytest.raises(ValueError):
+		model.set_terms(rows, y, 1.0)
+
+	# assert the changes made in place are kept when the formulation is extended and assembled anew
+	model.add_terms(model.add_rows(1, ub=4.0), y, 1.0)
+	assert model.to_arrays() is not arrays
+	model.solve()
+	assert round(model.obj_value, 6) == 9.0
+
+	# assert an infeasible MILP is reported as such
+	model = MatrixModel()
+	z = model.add_variables(1, ub=1.0)
+	model.add_terms(model.add_rows(1, lb=2.0), z, 1.0)
+	model.solve()
+	assert model.status == 'Infeasible'
+	assert model.obj_value is None
+
+
+def test_unpack_batteries():
+	storage = {'degradation_cost': 0.01, 'e_bn': 10.0, 'eff_bc': 0.9, 'eff_bd': 0.9, 'init_e': 5.0, 'p_max': 5.0,
+	           'soc_max': 100.0, 'soc_min': 0.0}
+	batteries = unpack_batteries({'Meter#1': None, 'Meter#2': {'Storage#1': storage, 'Storage#2': storage}})
+	assert batteries['owner'].tolist() == [1, 1]
+	assert batteries['meter_ids'] == ['Meter#2', 'Meter#2']
+	assert batteries['storage_ids'] == ['Storage#1', 'Storage#2']
+	assert batteries['e_bn'].tolist() == [10.0, 10.0]
+
+	# assert no batteries result in empty arrays
+	assert unpack_batteries({'Meter#1': None})['e_bn'].shape == (0,)
+
+
+def test_add_exchange_terms():
+	# net LEM sales x = e_sale - e_pur of one Meter in 2 steps, with the second fixed to 1
+	model = MatrixModel()
+	v = {'e_sale': model.add_variables((1, 2), lb=[0.0, 1.0], ub=1.0),
+	     'e_pur': model.add_variables((1, 2), ub=[1.0, 0.0])}
+	v.update(add_exchange_terms(model, v, prices=0.0, targets=[[-0.25, 0.5]], rho=2.0,
+	                            breakpoints=[-0.5, -0.25, 0.0, 0.25, 0.5]))
+	model.solve()
+	assert model.status == 'Optimal'
+
+	# without prices, the free step is not penalized, while the other pays rho / 2 * 0.5 ^ 2 for its deviation,
+	# which is exact at a breakpoint
+	assert np.allclose(model.values(v['exchange_deviation'])[0, 1], 0.5)
+	assert np.allclose(model.values(v['exchange_penalty']), [[0.0, 0.25]])
+	assert np.isclose(model.obj_value, 0.25)
+
+	# a price on the net sales above the slope of the steepest tangent (rho * 0.5) makes the free step buy all it can
+	model = MatrixModel()
+	v = {'e_sale': model.add_variables((1, 2), lb=[0.0, 1.0], ub=1.0),
+	     'e_pur': model.add_variables((1, 2), ub=[1.0, 0.0])}
+	add_exchange_terms(model, v, prices=[1.5, 0.0], targets=[[-0.25, 0.5]], rho=2.0,
+	                   breakpoints=[-0.5, -0.25, 0.0, 0.25, 0.5])
+	model.solve()
+	assert np.isclose(model.values(v['e_sale'])[0, 0] - model.values(v['e_pur'])[0, 0], -1.0)
+
+if __name__ == '__main__':
+	test_matrix_model()
+	test_unpack_batteries()
+	test_add_exchange_terms()
@@ -1,12 +1,22 @@
 import numpy as np
+import os
+import tempfile
 
 from rec_op_lem_prices.optimization.helpers.milp_helpers import (
 	dict_none_lists,
 	dict_per_param,
+	export_milp,
 	none_lists,
 	round_up,
+	set_initial_values,
+	step_durations,
 	time_intervals
 )
+from pulp import (
+	LpMinimize,
+	LpProblem,
+	LpVariable
+)
 
 
 def test_none_lists():
@@ -70,6 +80,57 @@ def test_time_intervals():
 	assert time_intervals(horizon=2, delta_t=0.25, func='ceil') == 8
 	assert time_intervals(horizon=2, delta_t=0.25, func='floor') == 8
 	assert time_intervals(horizon=2, delta_t=0.25, func='int') == 8
+	# Assert the correct values for a variable time resolution, whose durations must add up to the horizon
+	assert time_intervals(horizon=2, delta_t=[0.25, 0.25, 0.5, 1.0]) == 4
+	try:
+		time_intervals(horizon=3, delta_t=[0.25, 0.25, 0.5, 1.0])
+		assert False, 'durations that do not match the horizon must be rejected'
+	except ValueError:
+		pass
+
+
+def test_step_durations():
+	assert step_durations(0.25, 3).tolist() == [0.25, 0.25, 0.25]
+	assert step_durations([0.25, 0.75], 2).tolist() == [0.25, 0.75]
+	try:
+		step_durations([0.25, 0.75], 3)
+		assert False, 'a duration per step must be provided'
+	except ValueError:
+		pass
+
+
+def test_export_milp():
+	milp = LpProblem('export_test', LpMinimize)
+	x = LpVariable('x', lowBound=0)
+	milp += x, 'Objective Function'
+	milp += x >= 1, 'Lower_limit'
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		export_dir = os.path.join(tmp_dir, 'dumps')
+		# Assert the directory is created and that each export writes a new file
+		lp_file = export_milp(milp, export_dir, 'Stage2Pool')
+		other_lp_file = export_milp(milp, export_dir, 'Stage2Pool')
+		mps_file = export_milp(milp, export_dir, 'Stage2Pool', file_format='mps')
+		assert lp_file != other_lp_file
+		assert os.path.basename(lp_file).startswith('Stage2Pool_') and lp_file.endswith('.lp')
+		assert mps_file.endswith('.mps')
+		assert sorted(os.listdir(export_dir)) == sorted(os.path.basename(f) for f in [lp_file, other_lp_file, mps_file])
+
+
+def test_set_initial_values():
+	lp_vars = {
+		'e_bat': {'Meter#1': {'Battery#1': [LpVariable(f'e_bat_{t}') for t in range(2)]}},
+		'e_pur': {'Meter#1': [LpVariable(f'e_pur_{t}') for t in range(2)]},
+		'p_extra': {'Meter#1': [LpVariable(f'p_extra_{t}') for t in range(2)]}
+	}
+	values = {
+		'e_bat': {'Meter#1': {'Battery#1': [1.0, 2.0]}},
+		'e_pur': {'Meter#1': [0.5, None], 'Meter#2': [1.0, 1.0]},
+		'obj_value': 10.0
+	}
+	set_initial_values(lp_vars, values)
+	assert [v.varValue for v in lp_vars['e_bat']['Meter#1']['Battery#1']] == [1.0, 2.0]
+	assert [v.varValue for v in lp_vars['e_pur']['Meter#1']] == [0.5, None]
+	assert [v.varValue for v in lp_vars['p_extra']['Meter#1']] == [None, None]
 
 
 if __name__ == '__main__':
@@ -78,3 +139,6 @@ if __name__ == '__main__':
 	test_dict_per_param()
 	test_round_up()
 	test_time_intervals()
+	test_step_durations()
+	test_export_milp()
+	test_set_initial_values()
@@ -1,9 +1,14 @@
+import copy
+import numpy as np
+
 from rec_op_lem_prices.optimization_functions import (
 	run_pre_individual_milp,
 	run_pre_single_stage_collective_pool_milp,
 	run_pre_single_stage_collective_bilateral_milp,
 	run_pre_two_stage_collective_pool_milp,
 	run_pre_two_stage_collective_bilateral_milp,
+	run_pre_aggregated,
+	run_pre_rolling_horizon,
 	run_post_individual_cost,
 	run_post_single_stage_collective_pool_milp,
 	run_post_single_stage_collective_bilateral_milp,
@@ -84,6 +89,21 @@ def test_run_pre_two_stage_collective_pool_milp():
 			assert valu == COLLECTIVE_PRE_OUTPUTS_S2_POOL[1][idx].get(ki), f'{ki}'
 
 
+def test_run_pre_two_stage_collective_pool_milp_with_stage1_outputs():
+	stage1_outputs = copy.deepcopy(COLLECTIVE_PRE_OUTPUTS_S2_POOL[1])
+	r2, r1_list = run_pre_two_stage_collective_pool_milp(copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL),
+														 for_testing=True,
+														 stage1_outputs=stage1_outputs)
+	assert r1_list is stage1_outputs
+	round_cost = lambda x: {meter_id: round(cost, 3) for meter_id, cost in x.items()}
+	r2['c_ind2pool'] = round_cost(r2['c_ind2pool'])
+	r2['c_ind2pool_without_deg'] = round_cost(r2['c_ind2pool_without_deg'])
+	r2['c_ind2pool_without_deg_and_p_extra'] = round_cost(r2['c_ind2pool_without_deg_and_p_extra'])
+	r2['c_ind2pool_without_p_extra'] = round_cost(r2['c_ind2pool_without_p_extra'])
+	for ki, valu in r2.items():
+		assert valu == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0].get(ki), f'{ki}'
+
+
 def test_run_pre_two_stage_collective_bilateral_milp():
 	r2, r1_list = run_pre_two_stage_collective_bilateral_milp(COLLECTIVE_PRE_INPUTS_S2_BILATERAL, for_testing=True)
 	round_cost = lambda x: {meter_id: round(cost, 3) for meter_id, cost in x.items()}
@@ -105,6 +125,82 @@ def test_run_pre_two_stage_collective_bilateral_milp():
 			assert valu == COLLECTIVE_PRE_OUTPUTS_S2_BILATERAL[1][idx].get(ki), f'{ki}'
 
 
+def test_run_pre_two_stage_collective_pool_milp_in_process():
+	r2, r1_list = run_pre_two_stage_collective_pool_milp(copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL),
+														 solver='HiGHS_API', for_testing=True)
+	assert r2['milp_status'] == 'Optimal'
+	assert round(r2['obj_value'], 3) == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['obj_value']
+	assert r2['dual_prices'] == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['dual_prices']
+	for idx, r1 in enumerate(r1_list):
+		assert round(r1['obj_value'], 3) == round(COLLECTIVE_PRE_OUTPUTS_S2_POOL[1][idx]['obj_value'], 3)
+
+
+def test_run_pre_two_stage_collective_bilateral_milp_in_process():
+	r2, _ = run_pre_two_stage_collective_bilateral_milp(copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_BILATERAL),
+														solver='HiGHS_API', for_testing=True)
+	assert r2['milp_status'] == 'Optimal'
+	assert round(r2['obj_value'], 3) == COLLECTIVE_PRE_OUTPUTS_S2_BILATERAL[0]['obj_value']
+
+
+def test_run_pre_two_stage_collective_pool_milp_decomposed():
+	# The decomposed solver only supports instances whose Meters are coupled by the market equilibrium alone
+	backpack = copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL)
+	assert not backpack['total_share_coeffs']
+	r2, _ = run_pre_two_stage_collective_pool_milp(backpack, solver='HiGHS_ADMM', for_testing=True)
+	assert r2['milp_status'] == 'Optimal'
+	assert abs(r2['obj_value'] - COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['obj_value']) < 0.01
+	assert all(abs(dp - expected_dp) < 0.01 for dp, expected_dp in zip(r2['dual_prices'],
+	                                                                  COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['dual_prices']))
+	assert r2['admm_history']
+
+
+def test_run_pre_rolling_horizon():
+	# A single window spanning the whole horizon reproduces the monolithic MILP
+	r2, r1_list = run_pre_rolling_horizon(run_pre_two_stage_collective_pool_milp,
+										  copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL),
+										  commit_horizon=COLLECTIVE_PRE_INPUTS_S2_POOL['horizon'], lookahead_horizon=0)
+	assert round(r2['obj_value'], 3) == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['obj_value']
+	assert r2['e_bat'] == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['e_bat']
+	# (the monolithic outputs carry the rounding of the stage 1 cost bounds, up to 1E-3)
+	for meter_id, c_ind2pool in COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['c_ind2pool'].items():
+		assert abs(r2['c_ind2pool'][meter_id] - c_ind2pool) <= 1.001E-3
+	for idx, r1 in enumerate(r1_list):
+		assert round(r1['c_ind'], 3) == round(COLLECTIVE_PRE_OUTPUTS_S2_POOL[1][idx]['c_ind'], 3)
+
+	# With 1h windows, the stitched schedules cover the whole horizon and the storage's energy content is carried on
+	backpack = copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL)
+	r2, r1_list = run_pre_rolling_horizon(run_pre_two_stage_collective_pool_milp, backpack,
+										  commit_horizon=1, lookahead_horizon=1, solver='HiGHS_API')
+	assert r2['milp_status'] == 'Optimal'
+	assert len(r2['e_sup_retail']['Meter#1']) == len(backpack['meters']['Meter#1']['e_c'])
+	assert len(r2['dual_prices']) == len(backpack['l_lem'])
+	assert len(r1_list) == len(backpack['meters'])
+	assert abs(r2['obj_value'] - sum(r2['c_ind2pool'].values())) <= 1E-6
+
+
+def test_run_pre_aggregated():
+	# With as many clusters as Meters, the disaggregation reproduces the full community's results
+	r2, r1_list = run_pre_aggregated(run_pre_two_stage_collective_pool_milp,
+									 copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL), nr_clusters=2)
+	assert round(r2['obj_value'], 3) == COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['obj_value']
+	for meter_id, e_sale_pool in COLLECTIVE_PRE_OUTPUTS_S2_POOL[0]['e_sale_pool'].items():
+		assert np.allclose(r2['e_sale_pool'][meter_id], e_sale_pool)
+	assert r2['approximation_error'] == {'cost': 0.0, 'profile': 0.0}
+	assert len(r1_list) == 2
+
+	# With a single aggregate Meter, the pool stays balanced and each Meter's balance holds
+	backpack = copy.deepcopy(SINGLE_PRE_INPUTS_S2_POOL)
+	r = run_pre_aggregated(run_pre_single_stage_collective_pool_milp, backpack, nr_clusters=1)
+	assert set(r['clusters'].values()) == {'Cluster#1'}
+	assert np.allclose(np.sum(list(r['e_sale_pool'].values()), axis=0), np.sum(list(r['e_pur_pool'].values()), axis=0))
+	for meter_id, meter in backpack['meters'].items():
+		supply = np.array(r['e_sup_retail'][meter_id]) + r['e_sup_market'][meter_id] + r['e_pur_pool'][meter_id]
+		surplus = np.array(r['e_sur_retail'][meter_id]) + r['e_sur_market'][meter_id] + r['e_sale_pool'][meter_id]
+		assert np.allclose(supply - surplus, r['e_cmet'][meter_id])
+	assert abs(r['obj_value'] - sum(r['c_ind2pool'].values())) <= 1E-6
+	assert r['approximation_error']['profile'] > 0
+
+
 def test_run_post_individual_cost():
 	r = run_post_individual_cost(INPUTS_IC)
 	r['c_ind'] = round(r['c_ind'], 3)
@@ -161,7 +257,13 @@ if __name__ == '__main__':
 	test_run_pre_single_stage_collective_pool_milp()
 	test_run_pre_single_stage_collective_bilateral_milp()
 	test_run_pre_two_stage_collective_pool_milp()
+	test_run_pre_two_stage_collective_pool_milp_with_stage1_outputs()
 	test_run_pre_two_stage_collective_bilateral_milp()
+	test_run_pre_two_stage_collective_pool_milp_in_process()
+	test_run_pre_two_stage_collective_bilateral_milp_in_process()
+	test_run_pre_two_stage_collective_pool_milp_decomposed()
+	test_run_pre_rolling_horizon()
+	test_run_pre_aggregated()
 	test_run_post_individual_cost()
 	test_run_post_single_stage_collective_pool_milp()
 	test_run_post_single_stage_collective_bilateral_milp()
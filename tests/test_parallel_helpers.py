@@ -0,0 +1,74 @@
+import copy
+import numpy as np
+import rec_op_lem_prices.optimization.helpers.parallel_helpers as parallel_helpers
+
+from joblib import Parallel, delayed
+from rec_op_lem_prices.configs.configs import MAX_NBYTES
+from rec_op_lem_prices.optimization.helpers.parallel_helpers import (
+	_to_arrays,
+	run_as_completed,
+	run_in_parallel
+)
+from rec_op_lem_prices.optimization_functions import (
+	run_post_individual_cost,
+	run_pre_individual_milp
+)
+from rec_op_lem_prices.optimization.structures.I_O_individual_cost import INPUTS_IC
+from rec_op_lem_prices.optimization.structures.I_O_stage_1_milp import INPUTS_S1
+
+
+def test_run_in_parallel():
+	backpacks = [copy.deepcopy(INPUTS_S1) for _ in range(3)]
+	sequential_outputs = run_in_parallel(run_pre_individual_milp, backpacks, 'CBC', n_jobs=1)
+	# call twice to reuse the same pool of workers
+	for _ in range(2):
+		parallel_outputs = run_in_parallel(run_pre_individual_milp, backpacks, 'CBC', n_jobs=2)
+		assert parallel_outputs == sequential_outputs
+
+	backpacks = [copy.deepcopy(INPUTS_IC) for _ in range(3)]
+	sequential_outputs = run_in_parallel(run_post_individual_cost, backpacks, n_jobs=1)
+	parallel_outputs = run_in_parallel(run_post_individual_cost, backpacks, n_jobs=2)
+	assert parallel_outputs == sequential_outputs
+
+
+def _series_types(backpack: dict) -> dict:
+	return {key: type(val).__name__ for key, val in backpack.items()}
+
+
+def test_max_nbytes():
+	# a day-ahead horizon of 15 minutes data is pickled, a year of it is memory-mapped into the workers
+	backpacks = [_to_arrays({'day': [1.0] * 96, 'year': [1.0] * 35040}) for _ in range(2)]
+	parallel = Parallel(n_jobs=2, backend='loky', max_nbytes=MAX_NBYTES, mmap_mode='r')
+	for types in parallel(delayed(_series_types)(backpack) for backpack in backpacks):
+		assert types == {'day': 'ndarray', 'year': 'memmap'}
+
+
+def _is_sequential(_: dict) -> bool:
+	return parallel_helpers._SEQUENTIAL
+
+
+def test_run_as_completed():
+	backpacks = [copy.deepcopy(INPUTS_S1) for _ in range(3)]
+	backpacks[1]['id'] = 'Meter#2'
+	sequential_outputs = run_in_parallel(run_pre_individual_milp, backpacks, 'CBC', n_jobs=1)
+
+	# sequentially, the tasks are run by decreasing priority
+	outputs = list(run_as_completed(run_pre_individual_milp, backpacks, 'CBC', priorities=[1, 3, 2], n_jobs=1))
+	assert [idx for idx, _ in outputs] == [1, 2, 0]
+	assert [output for _, output in sorted(outputs, key=lambda x: x[0])] == sequential_outputs
+
+	# in the main process, the parallel procedures of the tasks are run sequentially, but not the caller's ones
+	for idx, is_sequential in run_as_completed(_is_sequential, [{}, {}], n_jobs=1):
+		assert is_sequential
+		assert not parallel_helpers._SEQUENTIAL
+	assert dict(run_as_completed(_is_sequential, [{}, {}], n_jobs=-1)) == {0: True, 1: True}
+
+	# in parallel, all the tasks are yielded once, whatever the order they finish in
+	outputs = dict(run_as_completed(run_pre_individual_milp, backpacks, solver='CBC', n_jobs=2))
+	assert [outputs[idx] for idx in range(3)] == sequential_outputs
+
+
+if __name__ == '__main__':
+	test_run_in_parallel()
+	test_max_nbytes()
+	test_run_as_completed()
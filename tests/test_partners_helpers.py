@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from rec_op_lem_prices.optimization.helpers.partners_helpers import (
+	all_partners,
+	l_grid_to_array,
+	partners_from_l_grid,
+	partners_from_pairs,
+	partners_k_nearest,
+	resolve_partners
+)
+
+
+METER_IDS = ['Meter#1', 'Meter#2', 'Meter#3', 'Meter#4']
+
+
+def test_l_grid_to_array():
+	nr_steps = 2
+	# assert the nested dictionaries are converted, with NaN for the missing pairs and the diagonal
+	result = l_grid_to_array({'Meter#1': {'Meter#2': [0.1, 0.2]}, 'Meter#2': {'Meter#2': [0.5, 0.5]}},
+	                         METER_IDS, nr_steps)
+	assert result.shape == (4, 4, nr_steps)
+	assert result[0, 1].tolist() == [0.1, 0.2]
+	assert np.isnan(result[1, 1]).all()
+	assert np.isnan(result).sum() == (16 - 1) * nr_steps
+
+	# assert the compact form, where levels take precedence over the default and overrides over both
+	compact = {
+		'default': 0.05,
+		'voltage_levels': {'Meter#1': 'LV', 'Meter#2': 'LV', 'Meter#3': 'MV', 'Meter#4': 'MV'},
+		'level_tariffs': {'LV': {'LV': 0.01}, 'MV': {'LV': [0.02, 0.03]}},
+		'overrides': {'Meter#4': {'Meter#1': 0.0}}
+	}
+	result = l_grid_to_array(compact, METER_IDS, nr_steps)
+	assert result[0, 1].tolist() == [0.01, 0.01]
+	assert result[0, 2].tolist() == [0.05, 0.05]
+	assert result[2, 1].tolist() == [0.02, 0.03]
+	assert result[3, 0].tolist() == [0.0, 0.0]
+	assert np.isnan(result[2, 2]).all()
+
+	# assert arrays are accepted as they are, if their shape is correct
+	assert np.array_equal(l_grid_to_array(result, METER_IDS, nr_steps), result, equal_nan=True)
+	with pytest.raises(ValueError):
+		l_grid_to_array(result, METER_IDS, nr_steps + 1)
+	with pytest.raises(ValueError):
+		l_grid_to_array({'default': [0.1, 0.2, 0.3]}, METER_IDS, nr_steps)
+
+
+def test_all_partners():
+	result = all_partners(METER_IDS)
+	# assert every Meter is connected to all the others, and not to itself
+	assert result['Meter#1'] == ['Meter#2', 'Meter#3', 'Meter#4']
+	assert all(len(partners) == len(METER_IDS) - 1 for partners in result.values())
+
+
+def test_partners_from_pairs():
+	result = partners_from_pairs(METER_IDS, [('Meter#1', 'Meter#2'), ('Meter#3', 'Meter#1'), ('Meter#4', 'Meter#4')])
+	# assert the graph is symmetric, ordered by the Meters' IDs and without self-loops
+	assert result == {
+		'Meter#1': ['Meter#2', 'Meter#3'],
+		'Meter#2': ['Meter#1'],
+		'Meter#3': ['Meter#1'],
+		'Meter#4': []
+	}
+	# assert unknown Meters are not accepted
+	with pytest.raises(ValueError):
+		partners_from_pairs(METER_IDS, [('Meter#1', 'Meter#5')])
+
+
+def test_partners_from_l_grid():
+	l_grid = {
+		'Meter#1': {'Meter#2': [0.01], 'Meter#3': [0.01]},
+		'Meter#2': {'Meter#1': [0.01]},
+		'Meter#3': {}
+	}
+	result = partners_from_l_grid(METER_IDS, l_grid_to_array(l_grid, METER_IDS, 1))
+	# assert only the pairs with tariffs in both directions are considered
+	assert result == {'Meter#1': ['Meter#2'], 'Meter#2': ['Meter#1'], 'Meter#3': [], 'Meter#4': []}
+
+
+def test_partners_k_nearest():
+	positions = {'Meter#1': 0.0, 'Meter#2': 1.0, 'Meter#3': 3.0, 'Meter#4': 10.0}
+	distances = {n: {m: abs(pn - pm) for m, pm in positions.items()} for n, pn in positions.items()}
+	result = partners_k_nearest(distances, k=1)
+	# assert each Meter is connected to its nearest neighbour, symmetrically
+	assert result == {
+		'Meter#1': ['Meter#2'],
+		'Meter#2': ['Meter#1', 'Meter#3'],
+		'Meter#3': ['Meter#2', 'Meter#4'],
+		'Meter#4': ['Meter#3']
+	}
+
+
+def test_resolve_partners():
+	l_grid = l_grid_to_array({'default': 0.01}, METER_IDS, 1)
+	# assert the dense graph is the default
+	assert resolve_partners(METER_IDS, l_grid) == all_partners(METER_IDS)
+	# assert explicit graphs are made symmetric
+	result = resolve_partners(METER_IDS, l_grid, {'Meter#1': ['Meter#4']})
+	assert result['Meter#4'] == ['Meter#1']
+	# assert "l_grid" must be provided for all trading partners
+	l_grid[3, 0] = np.nan
+	with pytest.raises(ValueError):
+		resolve_partners(METER_IDS, l_grid, {'Meter#1': ['Meter#4']})
+	with pytest.raises(ValueError):
+		resolve_partners(METER_IDS, l_grid, 'nearest')
+
+
+if __name__ == '__main__':
+	test_l_grid_to_array()
+	test_all_partners()
+	test_partners_from_pairs()
+	test_partners_from_l_grid()
+	test_partners_k_nearest()
+	test_resolve_partners()
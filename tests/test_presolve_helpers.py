@@ -0,0 +1,110 @@
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.presolve_helpers import (
+	big_m_values,
+	btm_energy_limits,
+	charge_binaries_needed,
+	empty_session_prices,
+	estimated_size,
+	lem_steps_needed,
+	net_consumption_bounds,
+	relaxed_binaries_values,
+	supply_binaries_needed
+)
+
+
+def test_supply_binaries_needed():
+	needed = supply_binaries_needed([0.2, 0.1, 0.2], [0.05, 0.1, 0.0], [0.3, 0.3, 0.3], [0.0, 0.0, 0.25])
+	assert needed.tolist() == [False, True, True]
+
+
+def test_charge_binaries_needed():
+	batteries = {
+		'p_max': np.array([1.0]),
+		'eff_bc': np.array([0.95]),
+		'eff_bd': np.array([0.95]),
+		'degradation_cost': np.array([0.0])
+	}
+	e_net = np.array([0.5, -3.0, 0.5, 0.5])
+	l_buy = [0.2, 0.2, 0.2, -0.1]
+	l_sell = [0.05, 0.05, 0.0, 0.05]
+	needed = charge_binaries_needed(batteries, e_net, 3.0, 1.0, l_buy, l_sell, 0.3, [0.1, 0.1, 0.0, 0.1])
+	# the binary is kept if the Meter may reach its power limit, if some tariff is null (without degradation cost)
+	# or if some tariff is negative
+	assert needed.tolist() == [[False, True, True, True]]
+
+	batteries['eff_bc'] = np.array([1.0])
+	batteries['eff_bd'] = np.array([1.0])
+	needed = charge_binaries_needed(batteries, e_net, 3.0, 1.0, l_buy, l_sell, 0.3, [0.1, 0.1, 0.0, 0.1])
+	assert needed.all()
+
+
+def test_relaxed_binaries_values():
+	values = relaxed_binaries_values([1.0, 0.4, 0.0, 0.6], [True, False, True, False], [0.0, 0.2, 0.3, 0.0])
+	assert values.tolist() == [1.0, 1.0, 0.0, 0.0]
+
+
+def test_big_m_values():
+	batteries = {'owner': np.array([0, 0]), 'p_max': np.array([1.0, 0.5])}
+	evs = {
+		'owner': np.array([1]),
+		'pmax_c_ev': np.array([4.0]),
+		'pmax_d_ev': np.array([2.0]),
+		'eff_bc_ev': np.array([0.8]),
+		'eff_bd_ev': np.array([0.5]),
+		'bin_ev': np.array([[1.0, 0.0]])
+	}
+	e_in, e_out = btm_energy_limits(batteries, 2, 2, 0.5, evs=evs)
+	assert e_in.tolist() == [[0.75, 0.75], [2.5, 0.0]]
+	assert e_out.tolist() == [[0.75, 0.75], [0.5, 0.0]]
+
+	e_cmet_min, e_cmet_max = net_consumption_bounds(np.array([[0.25, -1.0], [1.0, 0.0]]), e_in, e_out)
+	assert e_cmet_min.tolist() == [[-0.5, -1.75], [0.5, 0.0]]
+	assert e_cmet_max.tolist() == [[1.0, -0.25], [3.5, 0.0]]
+
+	meter_big_m, rec_big_m = big_m_values(e_cmet_min, e_cmet_max)
+	assert meter_big_m.tolist() == [[1.0, 1.75], [3.5, 0.0]]
+	assert rec_big_m.tolist() == [4.5, 1.75]
+
+
+def test_lem_steps_needed():
+	batteries = {'owner': np.array([0]), 'p_max': np.array([1.0]), 'e_bn': np.array([2.0])}
+	e_net = np.array([[1.5, 0.5, 2.0, 3.0], [0.2, 0.2, -0.1, 0.2]])
+	l_buy = np.array([[0.2, 0.2, 0.2, 0.2], [0.2, 0.2, 0.2, 0.1]])
+	steps = lambda **kwargs: lem_steps_needed(e_net, batteries, 1.0, l_buy, 0.3, 0.05, **kwargs).tolist()
+	# some Meter can have a surplus on the 2nd step (by discharging) and on the 3rd one
+	assert steps(second_stage=True, strict_pos_coeffs=True) == [False, True, True, False]
+	assert steps(second_stage=True, strict_pos_coeffs=False) == [True, True, True, True]
+	# on the 4th step, buying from the cheapest retailer to sell internally pays off
+	assert steps(second_stage=False, strict_pos_coeffs=False) == [False, True, True, True]
+
+	# batteries with a null nominal capacity are not bound on the collective MILPs
+	batteries['e_bn'] = np.array([0.0])
+	assert steps(second_stage=True, strict_pos_coeffs=True) == [True, True, True, True]
+
+
+def test_empty_session_prices():
+	e_cmet = np.array([[0.5, 0.0, 0.0], [0.2, 0.0, -0.1]])
+	l_buy = np.array([[0.2, 0.2, 0.2], [0.3, 0.3, 0.3]])
+	assert empty_session_prices(e_cmet, l_buy, [0.25, 0.25, 0.25]).tolist() == [0.25, 0.0, 0.0]
+
+
+def test_estimated_size():
+	backpack = {
+		'delta_t': [1.0, 0.5, 0.5],
+		'horizon': 2,
+		'meters': {'Meter#1': {'btm_storage': {'Storage#1': {}, 'Storage#2': {}}}, 'Meter#2': {'btm_storage': None},
+		           'Meter#3': {'btm_storage': {}}}
+	}
+	assert estimated_size(backpack) == 3 * (3 + 2)
+	assert estimated_size(backpack, bilateral=True) == 3 * (3 + 2 + 6)
+
+
+if __name__ == '__main__':
+	test_supply_binaries_needed()
+	test_charge_binaries_needed()
+	test_relaxed_binaries_values()
+	test_big_m_values()
+	test_lem_steps_needed()
+	test_empty_session_prices()
+	test_estimated_size()
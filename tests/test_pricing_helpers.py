@@ -1,4 +1,7 @@
-from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import make_offers
+from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import (
+	make_offer_book,
+	make_offers
+)
 
 
 def test_make_offers():
@@ -33,5 +36,32 @@ def test_make_offers():
 	]
 
 
+def test_make_offer_book():
+	meters = {
+			'Meter#1': {
+				'e_met': [-1.0, 1.0, 0.0, 1.0],
+				'l_buy': [1.9, 1.9, 1.9, 1.5],
+				'l_sell': [1.1, 1.1, 1.1, 1.2]
+			},
+			'Meter#2': {
+				'e_met': [1.0, -1.0, 0.0, 1.0],
+				'l_buy': [3.0, 3.0, 3.0, 1.4],
+				'l_sell': [0.0, 0.0, 0.0, 1.3],
+			}
+		}
+	l_market_buy = [2.0, 2.0, 2.0, 2.0]
+	l_market_sell = [1.0, 1.0, 1.0, 1.0]
+	nr_sessions = 4
+	book = make_offer_book(meters, nr_sessions, l_market_buy, l_market_sell)
+	assert book['origins'] == ['Meter#1', 'Meter#2']
+	assert book['amount'].tolist() == [1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+	assert book['value'].tolist() == [1.1, 2.0, 1.9, 1.0, 1.5, 1.4]
+	assert book['side'].tolist() == [-1, 1, 1, -1, 1, 1]
+	assert book['origin'].tolist() == [0, 1, 0, 1, 0, 1]
+	assert book['session'].tolist() == [0, 0, 1, 1, 3, 3]
+	assert book['offsets'].tolist() == [0, 2, 4, 4, 6]
+
+
 if __name__ == '__main__':
 	test_make_offers()
+	test_make_offer_book()
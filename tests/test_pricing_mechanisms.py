@@ -1,5 +1,6 @@
 import rec_op_lem_prices.pricing_mechanisms.structures.examples as eg
 import inspect
+import numpy as np
 
 from rec_op_lem_prices.pricing_mechanisms.module.PricingMechanisms import (
 	compute_crossing_value,
@@ -13,6 +14,20 @@ from rec_op_lem_prices.pricing_mechanisms.module.PricingMechanisms import (
 	compute_pruned_mmr_plus,
 	compute_pruned_sdr_plus
 )
+from rec_op_lem_prices.pricing_mechanisms.module.BatchPricingMechanisms import (
+	batch_compute_crossing_value,
+	batch_compute_mmr,
+	batch_compute_pruned_mmr,
+	batch_compute_pruned_sdr,
+	batch_compute_sdr,
+	batch_get_accepted_offers,
+	offers_to_arrays,
+	split_offer_book
+)
+from rec_op_lem_prices.pricing_mechanisms.helpers.pricing_helpers import (
+	make_offer_book,
+	make_offers
+)
 
 
 def test_compute_mmr():
@@ -288,6 +303,81 @@ def test_compute_pruned_sdr_plus():
 									{'origin': 5, 'amount': 500, 'value': 10}]
 
 
+def test_batch_pricing_mechanisms():
+	# Use each example as a market session, plus sessions with only buyers, only sellers and no offers at all
+	_classes = inspect.getmembers(eg, inspect.isclass)
+	examples = [example_class for _, example_class in _classes]
+	buys = [example.buy_offers for example in examples] + [examples[0].buy_offers, [], []]
+	sells = [example.sell_offers for example in examples] + [[], examples[0].sell_offers, []]
+	nr_sessions = len(buys)
+	buy_arrays = offers_to_arrays(buys)
+	sell_arrays = offers_to_arrays(sells)
+
+	# expected prices per session, as computed by the original (session-by-session) pricing functions;
+	# the last three sessions have only buyers, only sellers and no offers, respectively
+	expected_prices = {
+		'mmr': [20.0, 20.0, 20.0, 20.0, 20.0, 20.0, 22.5, 35.0, 32.5, 32.5, 10.0, 10.0, 45.0, 0.0, 0.0],
+		'pruned_mmr': [22.5, 22.5, 22.5, 22.5, 22.5, 22.5, 27.5, 30.0, 22.5, 22.5, 17.5, 17.5, 0.0, 0.0, 0.0],
+		'sdr': [20.0, 20.0, 20.0, 20.0, 20.0, 20.0, 22.222, 35.0, 30.0, 30.0, 10.0, 10.0, 45.0, 0.0, 0.0],
+		'pruned_sdr': [20.0, 20.0, 20.0, 20.635, 20.635, 20.635, 21.538, 26.25, 10.0, 10.0, 10.0, 10.0, 0.0, 0.0, 0.0],
+		'crossing_value': [20.0, 20.0, 20.0, 20.0, 20.0, 20.0, 35.0, 35.0, 10.0, 10.0, 10.0, 10.0, 45.0, 0.0, 0.0]
+	}
+	expected_nr_accepted = [(3, 3), (3, 3), (3, 3), (3, 3), (3, 3), (3, 3), (2, 3), (2, 3), (2, 2), (2, 2), (3, 2),
+							(3, 2), (0, 0), (0, 0), (0, 0)]
+	assert len(expected_nr_accepted) == nr_sessions
+
+	batch_results = {
+		'mmr': batch_compute_mmr(buy_arrays, sell_arrays, nr_sessions),
+		'pruned_mmr': batch_compute_pruned_mmr(buy_arrays, sell_arrays, nr_sessions),
+		'sdr': batch_compute_sdr(buy_arrays, sell_arrays, nr_sessions),
+		'pruned_sdr': batch_compute_pruned_sdr(buy_arrays, sell_arrays, nr_sessions),
+		'crossing_value': batch_compute_crossing_value(buy_arrays, sell_arrays, nr_sessions)
+	}
+	# assert that the batched functions return the expected prices for every session
+	for mechanism, prices in batch_results.items():
+		assert isinstance(prices, np.ndarray)
+		assert [round(float(price), 3) for price in prices] == expected_prices[mechanism]
+
+	# assert that the session-by-session functions also return the expected prices
+	session_functions = {
+		'mmr': compute_mmr,
+		'pruned_mmr': compute_pruned_mmr,
+		'sdr': compute_sdr,
+		'pruned_sdr': compute_pruned_sdr,
+		'crossing_value': compute_crossing_value
+	}
+	for mechanism, func in session_functions.items():
+		prices = [round(float(func(buys[t], sells[t])), 3) for t in range(nr_sessions)]
+		assert prices == expected_prices[mechanism]
+
+	# assert that the accepted offers' masks flag the expected number of offers per session
+	buy_mask, sell_mask = batch_get_accepted_offers(buy_arrays, sell_arrays, nr_sessions)
+	for t in range(nr_sessions):
+		accepted_buys, accepted_sells = get_accepted_offers(buys[t], sells[t])
+		assert (len(accepted_buys), len(accepted_sells)) == expected_nr_accepted[t]
+		assert sum(buy_mask[buy_arrays['session'] == t]) == expected_nr_accepted[t][0]
+		assert sum(sell_mask[sell_arrays['session'] == t]) == expected_nr_accepted[t][1]
+
+
+def test_batch_pricing_mechanisms_from_offer_book():
+	meters = {
+		f'Meter#{n}': {
+			'e_met': [1.0 * ((n + t) % 3 - 1) * (n + 1) for t in range(6)],
+			'l_buy': [0.15 + 0.01 * n for _ in range(6)],
+			'l_sell': [0.02 + 0.005 * n for _ in range(6)]
+		} for n in range(5)
+	}
+	l_market_buy = [0.14, 0.16, 0.18, 0.2, 0.16, 0.14]
+	l_market_sell = [0.03, 0.03, 0.04, 0.04, 0.03, 0.02]
+	nr_sessions = 6
+	buys, sells = make_offers(meters, nr_sessions, l_market_buy, l_market_sell)
+	buy_arrays, sell_arrays = split_offer_book(make_offer_book(meters, nr_sessions, l_market_buy, l_market_sell))
+
+	# assert that the offer book yields the same prices as the offers' lists
+	prices = batch_compute_pruned_sdr(buy_arrays, sell_arrays, nr_sessions, compensation=0.5)
+	assert prices.tolist() == [compute_pruned_sdr(buys[t], sells[t], 0.5) for t in range(nr_sessions)]
+
+
 if __name__ == '__main__':
 	test_compute_mmr()
 	test_compute_pruned_mmr()
@@ -299,3 +389,5 @@ if __name__ == '__main__':
 	test_stop_criterion()
 	test_compute_pruned_mmr_plus()
 	test_compute_pruned_sdr_plus()
+	test_batch_pricing_mechanisms()
+	test_batch_pricing_mechanisms_from_offer_book()
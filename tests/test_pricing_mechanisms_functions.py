@@ -1,6 +1,9 @@
+import copy
 import inspect
 import numpy as np
 
+from unittest import mock
+
 import rec_op_lem_prices.pricing_mechanisms.structures.examples as eg
 
 from rec_op_lem_prices.pricing_mechanisms_functions import (
@@ -19,14 +22,22 @@ from rec_op_lem_prices.pricing_mechanisms_functions import (
 	loop_post_pool_crossing_value,
 	loop_post_pool_mmr,
 	loop_post_pool_sdr,
+	loop_pre_batch,
 	loop_pre_bilateral_crossing_value,
 	loop_pre_bilateral_mmr,
 	loop_pre_bilateral_sdr,
 	loop_pre_pool_crossing_value,
 	loop_pre_pool_mmr,
-	loop_pre_pool_sdr
+	loop_pre_pool_sdr,
+	loop_pre_rolling_horizon,
+	scenarios_pre_pool,
+	update_pre_pool
 )
+from rec_op_lem_prices.optimization_functions import run_pre_two_stage_collective_pool_milp
+from rec_op_lem_prices.optimization.helpers.milp_helpers import set_initial_values
+from rec_op_lem_prices.optimization.helpers.solver_helpers import new_milp
 from rec_op_lem_prices.optimization.structures.I_O_stage_2_pool_milp import (
+	COLLECTIVE_PRE_INPUTS_S2_POOL,
 	DUAL_POST_PRICES_INPUTS,
 	DUAL_POST_PRICES_OUTPUTS,
 	DUAL_PRE_PRICES_INPUTS,
@@ -123,6 +134,11 @@ def test_dual_pre_pool():
 	assert prices == DUAL_PRE_PRICES_OUTPUTS
 
 
+def test_dual_pre_pool_in_process():
+	prices, _ = dual_pre_pool(DUAL_PRE_PRICES_INPUTS, solver='HiGHS_API')
+	assert prices == DUAL_PRE_PRICES_OUTPUTS
+
+
 def test_dual_post_pool():
 	prices, _ = dual_post_pool(DUAL_POST_PRICES_INPUTS)
 	assert prices == DUAL_POST_PRICES_OUTPUTS
@@ -133,6 +149,21 @@ def test_loop_pre_pool_mmr():
 	assert r[:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
 
 
+def test_loop_pre_pool_mmr_variable_steps():
+	# A per step "delta_t" with uniform durations reproduces the uniform loop
+	backpack = copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)
+	nr_steps = len(backpack['l_market_buy'])
+	backpack['delta_t'] = [backpack['delta_t']] * nr_steps
+	r = loop_pre_pool_mmr(backpack, for_testing=True)
+	assert r[:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
+
+	# With finer first steps, the rolling horizon windows span their hours
+	backpack['delta_t'] = [0.5, 0.5] + [(backpack['horizon'] - 1.0) / (nr_steps - 2)] * (nr_steps - 2)
+	r = loop_pre_rolling_horizon(loop_pre_pool_mmr, backpack, commit_horizon=1, lookahead_horizon=1)
+	assert len(r[0]) == nr_steps
+	assert r[-1][0]['milp_status'] == 'Optimal'
+
+
 def test_loop_post_pool_mmr():
 	r = loop_post_pool_mmr(LOOP_POST_INPUTS_S2_POOL, for_testing=True)
 	assert r[0] == LOOP_POST_OUTPUTS_S2_POOL_MMR
@@ -189,6 +220,159 @@ def test_loop_post_bilateral_crossing_value():
 	assert r[0] == LOOP_POST_OUTPUTS_S2_BILATERAL_CV
 
 
+def test_loop_pre_pool_mmr_with_warm_start():
+	r = loop_pre_pool_mmr(LOOP_PRE_INPUTS_S2_POOL, for_testing=True, warm_start=True)
+	assert r[:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
+
+
+def test_loop_pre_pool_mmr_in_process():
+	r = loop_pre_pool_mmr(LOOP_PRE_INPUTS_S2_POOL, solver='HiGHS_API', for_testing=True)
+	assert r[:2] == LOOP_PRE_OUTPUTS_S2_POOL_MMR[:2]
+
+
+def test_loop_pre_rolling_horizon():
+	r = loop_pre_rolling_horizon(loop_pre_pool_mmr, LOOP_PRE_INPUTS_S2_POOL,
+								 commit_horizon=LOOP_PRE_INPUTS_S2_POOL['horizon'], lookahead_horizon=0)
+	assert r[:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
+
+	r = loop_pre_rolling_horizon(loop_pre_pool_mmr, LOOP_PRE_INPUTS_S2_POOL, commit_horizon=2, lookahead_horizon=1)
+	assert len(r[0]) == len(LOOP_PRE_INPUTS_S2_POOL['l_market_buy'])
+	assert len(r[-1][0]['e_sup_retail']['Meter#1']) == len(r[0])
+
+
+def test_loop_pre_bilateral_sdr_with_warm_start():
+	r = loop_pre_bilateral_sdr(LOOP_PRE_INPUTS_S2_BILATERAL, for_testing=True, warm_start=True)
+	assert r[:-1] == LOOP_PRE_OUTPUTS_S2_BILATERAL_SDR
+
+
+def test_loop_pre_batch():
+	# The RECs of the batch are priced as on their own, and a failing one does not prevent the others from finishing
+	broken_backpack = copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)
+	del broken_backpack['l_market_buy']
+	backpacks = [copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL), broken_backpack, copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)]
+	results = dict(loop_pre_batch(loop_pre_pool_mmr, backpacks, n_jobs=2, for_testing=True))
+	assert sorted(results) == [0, 1, 2]
+	assert results[0][:-1] == results[2][:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
+	assert isinstance(results[1], KeyError)
+
+	results = dict(loop_pre_batch(loop_pre_bilateral_mmr, [copy.deepcopy(LOOP_PRE_INPUTS_S2_BILATERAL)], n_jobs=2))
+	assert np.isclose(results[0][0], LOOP_PRE_OUTPUTS_S2_BILATERAL_MMR[0]).all()
+	assert results[0][1:-1] == LOOP_PRE_OUTPUTS_S2_BILATERAL_MMR[1:]
+
+
+def test_scenarios_pre_pool():
+	# The base forecasts are priced as on their own, and each scenario only changes the forecasts it holds
+	scenarios = [{}, {'Meter#1': {'e_g': [0.0, 0.0, 0.0]}}, {'Meter#2': {'e_c': [0.5, 0.5, 0.5]}}]
+	results = scenarios_pre_pool(dual_pre_pool, copy.deepcopy(DUAL_PRE_PRICES_INPUTS), scenarios, n_jobs=2)
+	assert results['dual_prices'][0] == DUAL_PRE_PRICES_OUTPUTS
+	for scenario, prices in zip(scenarios[1:], results['dual_prices'][1:]):
+		backpack = copy.deepcopy(DUAL_PRE_PRICES_INPUTS)
+		for meter_id, forecasts in scenario.items():
+			backpack['meters'][meter_id].update(forecasts)
+		assert prices == dual_pre_pool(backpack)[0]
+	assert results['price_statistics']['min'] == DUAL_PRE_PRICES_OUTPUTS
+	assert len(results['price_statistics']['mean']) == len(DUAL_PRE_PRICES_OUTPUTS)
+
+	# On a single worker, all the scenarios are solved on the same collective MILP, switched between their forecasts,
+	# also when it is warm started from the individual stages (which may reach an equivalent solution, with other
+	# dual prices on the tied sessions)
+	obj_value = lambda scenarios_results: [round(r[1]['obj_value'], 3) for r in scenarios_results['results']]
+	for warm_start in (False, True):
+		with mock.patch('rec_op_lem_prices.pricing_mechanisms_functions.new_milp', wraps=new_milp) as new_milps:
+			shared_results = scenarios_pre_pool(dual_pre_pool, copy.deepcopy(DUAL_PRE_PRICES_INPUTS), scenarios,
+			                                    n_jobs=1, warm_start=warm_start)
+		assert new_milps.call_count == 1
+		assert obj_value(shared_results) == obj_value(results)
+		if not warm_start:
+			assert shared_results['dual_prices'] == results['dual_prices']
+
+	# The individual stages of the base forecasts are reused by the scenarios that do not change them
+	meter_id = list(COLLECTIVE_PRE_INPUTS_S2_POOL['meters'])[0]
+	e_c = [1.5 * e for e in COLLECTIVE_PRE_INPUTS_S2_POOL['meters'][meter_id]['e_c']]
+	results = scenarios_pre_pool(run_pre_two_stage_collective_pool_milp, copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL),
+	                             [{meter_id: {'e_c': e_c}}, {}], n_jobs=2)
+	single_results, _ = run_pre_two_stage_collective_pool_milp(copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL))
+	assert results['results'][1][0]['obj_value'] == single_results['obj_value']
+	assert results['dual_prices'][1] == single_results['dual_prices']
+	backpack = copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL)
+	backpack['meters'][meter_id]['e_c'] = e_c
+	assert results['dual_prices'][0] == run_pre_two_stage_collective_pool_milp(backpack)[0]['dual_prices']
+	with mock.patch('rec_op_lem_prices.pricing_mechanisms_functions.new_milp', wraps=new_milp) as new_milps:
+		shared_results = scenarios_pre_pool(run_pre_two_stage_collective_pool_milp,
+		                                    copy.deepcopy(COLLECTIVE_PRE_INPUTS_S2_POOL),
+		                                    [{meter_id: {'e_c': e_c}}, {}], n_jobs=1)
+	assert new_milps.call_count == 1
+	assert shared_results['dual_prices'] == results['dual_prices']
+	assert shared_results['results'][1][0]['obj_value'] == single_results['obj_value']
+
+	# Without scenarios, nothing is run; a non-positive number of workers reverts to the default one
+	assert scenarios_pre_pool(dual_pre_pool, copy.deepcopy(DUAL_PRE_PRICES_INPUTS), []) == \
+		{'results': [], 'dual_prices': [], 'price_statistics': None}
+	results = scenarios_pre_pool(dual_pre_pool, copy.deepcopy(DUAL_PRE_PRICES_INPUTS), scenarios[:1], n_jobs=-1)
+	assert results['dual_prices'] == [DUAL_PRE_PRICES_OUTPUTS]
+
+	try:
+		scenarios_pre_pool(loop_pre_pool_mmr, copy.deepcopy(DUAL_PRE_PRICES_INPUTS), scenarios)
+		assert False, 'only the collective (pool) MILP and its dual prices can be run on scenarios'
+	except ValueError:
+		pass
+
+
+def test_update_pre_pool():
+	# The state kept by the loop does not change its results
+	backpack = copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)
+	state = {}
+	results = loop_pre_pool_mmr(backpack, for_testing=True, state=state)
+	assert results[:-1] == LOOP_PRE_OUTPUTS_S2_POOL_MMR
+	assert state['l_lem'] == results[0]
+
+	# Without revised forecasts, the loop restarts from the previous prices and stops at the first iteration
+	results = update_pre_pool(loop_pre_pool_mmr, backpack, state, {}, for_testing=True)
+	assert results[0] == LOOP_PRE_OUTPUTS_S2_POOL_MMR[0]
+	assert results[2] == 1
+
+	# Only the revised Meter's individual stage is run again and the REC's cost matches the one of a full run
+	meter_id, other_meter_id = list(backpack['meters'])[:2]
+	other_stage1 = next(output for output in state['stage1_outputs'] if output['meter_id'] == other_meter_id)
+	e_c = backpack['meters'][meter_id]['e_c'][0] + 0.5
+	results = update_pre_pool(loop_pre_pool_mmr, backpack, state, {meter_id: {'e_c': {0: e_c, 1: 0.0}}},
+	                          for_testing=True)
+	assert backpack['meters'][meter_id]['e_c'][:2] == [e_c, 0.0]
+	assert any(output is other_stage1 for output in state['stage1_outputs'])
+	full_results = loop_pre_pool_mmr(copy.deepcopy(backpack), for_testing=True)
+	assert np.isclose(results[3][0]['obj_value'], full_results[3][0]['obj_value'])
+
+	# With "warm_start", the first collective MILP is seeded with the previous solution, LEM flows included
+	warm_backpack = copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)
+	warm_state = {}
+	loop_pre_pool_mmr(warm_backpack, for_testing=True, warm_start=True, state=warm_state)
+	seed = 'rec_op_lem_prices.optimization.module.StageTwoMILPPool.set_initial_values'
+	with mock.patch(seed, wraps=set_initial_values) as seeded:
+		update_pre_pool(loop_pre_pool_mmr, warm_backpack, warm_state, {}, for_testing=True, warm_start=True)
+	assert seeded.call_args_list[0].args[1]['e_pur'] == warm_state['stage2_outputs']['e_pur_pool']
+
+	# No state is kept when no iteration improves on the initial objective function value (1E5), nor can it be updated
+	expensive_backpack = copy.deepcopy(LOOP_PRE_INPUTS_S2_POOL)
+	expensive_backpack['l_market_buy'] = [1E6 * l for l in expensive_backpack['l_market_buy']]
+	for meter in expensive_backpack['meters'].values():
+		meter['e_c'] = [e + 1.0 for e in meter['e_c']]
+		meter['l_buy'] = [1E6 * l for l in meter['l_buy']]
+	expensive_state = {}
+	loop_pre_pool_mmr(expensive_backpack, for_testing=True, state=expensive_state)
+	assert expensive_state == {}
+	try:
+		update_pre_pool(loop_pre_pool_mmr, expensive_backpack, expensive_state, {})
+		assert False, 'an empty state must be rejected'
+	except ValueError:
+		pass
+
+	try:
+		update_pre_pool(loop_pre_bilateral_mmr, backpack, state, {})
+		assert False, 'only the pricing loops under a pool market structure can be updated'
+	except ValueError:
+		pass
+
+
 def test_vanilla_mmr_plus():
 	buy_offers = [{'origin': 1, 'amount': 500, 'value': 45},
 				  {'origin': 2, 'amount': 500, 'value': 40}]
@@ -239,8 +423,10 @@ if __name__ == '__main__':
 	test_vanilla_sdr()
 	test_vanilla_crossing_value()
 	test_dual_pre_pool()
+	test_dual_pre_pool_in_process()
 	test_dual_post_pool()
 	test_loop_pre_pool_mmr()
+	test_loop_pre_pool_mmr_variable_steps()
 	test_loop_post_pool_mmr()
 	test_loop_pre_pool_sdr()
 	test_loop_post_pool_sdr()
@@ -252,6 +438,13 @@ if __name__ == '__main__':
 	test_loop_post_bilateral_sdr()
 	test_loop_pre_bilateral_crossing_value()
 	test_loop_post_bilateral_crossing_value()
+	test_loop_pre_pool_mmr_with_warm_start()
+	test_loop_pre_pool_mmr_in_process()
+	test_loop_pre_rolling_horizon()
+	test_loop_pre_bilateral_sdr_with_warm_start()
+	test_loop_pre_batch()
+	test_scenarios_pre_pool()
+	test_update_pre_pool()
 	test_vanilla_mmr_plus()
 	test_vanilla_sdr_plus()
 	test_vanilla_crossing_value_plus()
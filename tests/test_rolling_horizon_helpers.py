@@ -0,0 +1,67 @@
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.rolling_horizon_helpers import (
+	carry_states,
+	duration_windows,
+	rolling_windows,
+	slice_window,
+	stitch_series
+)
+
+
+def test_rolling_windows():
+	assert rolling_windows(10, 4, 2) == [(0, 4, 6), (4, 8, 10), (8, 10, 10)]
+	assert rolling_windows(4, 4, 0) == [(0, 4, 4)]
+	try:
+		rolling_windows(4, 0, 2)
+		assert False, 'an empty committed horizon must be rejected'
+	except ValueError:
+		pass
+
+
+def test_duration_windows():
+	# Assert uniform durations reproduce the windows by number of steps
+	assert duration_windows([1.0] * 10, 4, 2) == rolling_windows(10, 4, 2)
+	# Assert each window spans its hours, with finer steps first
+	assert duration_windows([0.5] * 4 + [1.0] * 4, 2, 1) == [(0, 4, 5), (4, 6, 7), (6, 8, 8)]
+
+
+def test_slice_window_and_carry_states():
+	backpack = {
+		'delta_t': 1.0,
+		'horizon': 4,
+		'l_grid': np.arange(2 * 2 * 4).reshape((2, 2, 4)),
+		'l_market_buy': [1.0, 2.0, 3.0, 4.0],
+		'meters': {
+			'Meter#1': {
+				'btm_storage': {'Storage#1': {'init_e': 0.0, 'e_bn': 4.0}},
+				'e_c': [0.1, 0.2, 0.3, 0.4],
+				'max_p': 5.0
+			}
+		}
+	}
+	window = slice_window(backpack, 1, 3, 4)
+	assert window['l_market_buy'] == [2.0, 3.0]
+	assert window['l_grid'].shape == (2, 2, 2)
+	assert window['meters']['Meter#1']['e_c'] == [0.2, 0.3]
+	assert window['meters']['Meter#1']['max_p'] == 5.0
+
+	carry_states(window, {'e_bat': {'Meter#1': {'Storage#1': [1.0, 2.0, 3.0]}}}, 1)
+	assert window['meters']['Meter#1']['btm_storage']['Storage#1']['init_e'] == 2.0
+	assert backpack['meters']['Meter#1']['btm_storage']['Storage#1']['init_e'] == 0.0
+
+
+def test_stitch_series():
+	window_outputs = [
+		{'milp_status': 'Optimal', 'e_bat': {'Storage#1': [1.0, 2.0, 3.0]}},
+		{'milp_status': 'Optimal', 'e_bat': {'Storage#1': [4.0, 5.0]}}
+	]
+	stitched = stitch_series(window_outputs, [3, 2], [2, 2])
+	assert stitched == {'milp_status': 'Optimal', 'e_bat': {'Storage#1': [1.0, 2.0, 4.0, 5.0]}}
+
+
+if __name__ == '__main__':
+	test_rolling_windows()
+	test_duration_windows()
+	test_slice_window_and_carry_states()
+	test_stitch_series()
@@ -0,0 +1,67 @@
+import copy
+import numpy as np
+
+from rec_op_lem_prices.optimization.helpers.scenario_helpers import (
+	apply_scenario,
+	forecast_update,
+	price_statistics,
+	validate_scenarios
+)
+from rec_op_lem_prices.optimization.structures.I_O_stage_2_pool_milp import DUAL_PRE_PRICES_INPUTS
+
+
+def test_validate_scenarios():
+	backpack = copy.deepcopy(DUAL_PRE_PRICES_INPUTS)
+	validate_scenarios(backpack, [{}, {'Meter#1': {'e_c': [0.0, 0.0, 0.0], 'e_g': [1.0, 1.0, 1.0]}}])
+	for scenario in ({'Meter#3': {'e_c': [0.0, 0.0, 0.0]}},
+	                 {'Meter#1': {'l_buy': [0.0, 0.0, 0.0]}},
+	                 {'Meter#1': {'e_c': [0.0, 0.0]}}):
+		try:
+			validate_scenarios(backpack, [scenario])
+			assert False, f'{scenario} must be rejected'
+		except ValueError:
+			pass
+
+
+def test_forecast_update():
+	backpack = copy.deepcopy(DUAL_PRE_PRICES_INPUTS)
+	scenario = forecast_update(backpack, {'Meter#1': {'e_g': {0: 0.5, 2: 0.1}}})
+	assert scenario == {'Meter#1': {'e_g': [0.5, 0.0, 0.1]}}
+	# Assert the backpack is left untouched
+	assert backpack['meters']['Meter#1']['e_g'] == [0.9, 0.0, 0.0]
+	for updates in ({'Meter#3': {'e_c': {0: 0.0}}},
+	                {'Meter#1': {'l_buy': {0: 0.0}}},
+	                {'Meter#1': {'e_c': {3: 0.0}}}):
+		try:
+			forecast_update(backpack, updates)
+			assert False, f'{updates} must be rejected'
+		except ValueError:
+			pass
+
+
+def test_apply_scenario():
+	backpack = copy.deepcopy(DUAL_PRE_PRICES_INPUTS)
+	original_backpack = copy.deepcopy(backpack)
+	scenario_backpack = apply_scenario(backpack, {'Meter#2': {'e_c': [0.5, 0.5, 0.5]}})
+	assert scenario_backpack['meters']['Meter#2']['e_c'] == [0.5, 0.5, 0.5]
+	assert scenario_backpack['meters']['Meter#1'] == backpack['meters']['Meter#1']
+	# Assert the backpack is left untouched
+	assert backpack == original_backpack
+	# Assert the Meters' values set on the scenario, e.g., the individual costs, do not reach the backpack
+	assert scenario_backpack['meters']['Meter#1'] is not backpack['meters']['Meter#1']
+
+
+def test_price_statistics():
+	statistics = price_statistics([[1.0, 2.0], [3.0, 2.0], [2.0, 2.0]])
+	assert statistics['mean'] == [2.0, 2.0]
+	assert np.isclose(statistics['std'], [np.sqrt(2 / 3), 0.0]).all()
+	assert statistics['min'] == [1.0, 2.0]
+	assert statistics['median'] == [2.0, 2.0]
+	assert statistics['max'] == [3.0, 2.0]
+
+
+if __name__ == '__main__':
+	test_validate_scenarios()
+	test_forecast_update()
+	test_apply_scenario()
+	test_price_statistics()
@@ -1,3 +1,4 @@
+from rec_op_lem_prices.optimization.module.MatrixStageOneMILP import MatrixStageOneMILP
 from rec_op_lem_prices.optimization.module.StageOneMILP import StageOneMILP
 from rec_op_lem_prices.optimization.structures.I_O_stage_1_milp import (
 	INPUTS_S1,
@@ -20,5 +21,61 @@ def test_solve_individual_milp():
 	for ki, valu in results.items():
 		assert valu == OUTPUTS_S1.get(ki), f'{ki}'
 
+
+def test_solve_individual_matrix_milp():
+	# Assert the array-based MILP reaches the same solution as the puLP one
+	milp = MatrixStageOneMILP(INPUTS_S1)
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+
+	results = milp.generate_outputs()
+	assert set(results.keys()) == set(OUTPUTS_S1.keys())
+	assert round(results['obj_value'], 3) == OUTPUTS_S1['obj_value']
+	assert round(results['deg_cost'], 3) == OUTPUTS_S1['deg_cost']
+
+
+def test_solve_individual_milp_relaxed_binaries():
+	# Assert relaxing the unnecessary binaries keeps the optimal cost with fewer integer variables
+	milp = StageOneMILP(INPUTS_S1)
+	milp.solve_milp()
+	relaxed_milp = StageOneMILP(INPUTS_S1, relax_binaries=True)
+	relaxed_milp.solve_milp()
+	assert relaxed_milp.status == 'Optimal'
+
+	nr_integers = lambda m: sum(var.cat == 'Integer' for var in m.milp.variables())
+	assert nr_integers(relaxed_milp) < nr_integers(milp)
+
+	results = relaxed_milp.generate_outputs()
+	assert results['obj_value'] == OUTPUTS_S1['obj_value']
+	assert set(results['delta_sup']) <= {0.0, 1.0}
+	assert all(set(delta_bc) <= {0.0, 1.0} for delta_bc in results['delta_bc'].values())
+
+
+def test_solve_individual_milp_variable_steps():
+	# Assert a per step "delta_t" with uniform durations reproduces the uniform MILP
+	backpack = INPUTS_S1.copy()
+	backpack['delta_t'] = [INPUTS_S1['delta_t']] * 3
+	milp = StageOneMILP(backpack)
+	milp.solve_milp()
+	assert milp.generate_outputs()['obj_value'] == OUTPUTS_S1['obj_value']
+
+	# Assert the batteries' power limits are scaled per step: with a half hour first step, only half of the surplus
+	# can be stored
+	backpack['delta_t'] = [0.5, 0.5, 2.0]
+	results = {}
+	for milp_class in (StageOneMILP, MatrixStageOneMILP):
+		milp = milp_class(backpack)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		results[milp_class] = milp.generate_outputs()
+		assert results[milp_class]['e_bc']['Storage#1'][0] <= 0.5 + 1E-9
+		assert results[milp_class]['obj_value'] > OUTPUTS_S1['obj_value']
+	assert abs(results[StageOneMILP]['obj_value'] - results[MatrixStageOneMILP]['obj_value']) <= 1E-6
+
+
 if __name__ == '__main__':
 	test_solve_individual_milp()
+	test_solve_individual_matrix_milp()
+	test_solve_individual_milp_relaxed_binaries()
+	test_solve_individual_milp_variable_steps()
+
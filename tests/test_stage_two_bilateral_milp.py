@@ -1,3 +1,13 @@
+import copy
+import numpy as np
+
+from pulp import (
+	LpProblem,
+	LpVariable
+)
+from unittest import mock
+
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPBilateral import MatrixStageTwoMILPBilateral
 from rec_op_lem_prices.optimization.module.StageTwoMILPBilateral import StageTwoMILPBilateral
 from rec_op_lem_prices.optimization.structures.I_O_stage_2_bilateral_milp import (
 	INPUTS_S2_BILATERAL,
@@ -26,5 +36,119 @@ def test_solve_collective_bilateral_milp():
 		assert valu == OUTPUTS_S2_BILATERAL.get(ki), f'{ki}'
 
 
+def test_solve_collective_bilateral_milp_with_partners():
+	# Assert that considering only the pairs present in "l_grid" (here, all pairs) yields the same solution
+	backpack = copy.deepcopy(INPUTS_S2_BILATERAL)
+	backpack['partners'] = 'l_grid'
+	milp = StageTwoMILPBilateral(backpack)
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+	assert round(milp.obj_value, 3) == OUTPUTS_S2_BILATERAL['obj_value']
+
+	# Assert that without trading partners no pairwise variables are generated and the outputs are reported sparsely
+	backpack['partners'] = {meter_id: [] for meter_id in backpack['meters']}
+	milp = StageTwoMILPBilateral(backpack)
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+	assert not any(var.name.startswith(('e_pur_', 'e_sale_', 'e_slc_')) for var in milp.milp.variables())
+	results = milp.generate_outputs()
+	assert results['e_pur_bilateral'] == {meter_id: {} for meter_id in backpack['meters']}
+	# without the LEM, the collective cost cannot be lower than with it
+	assert round(milp.obj_value, 3) >= OUTPUTS_S2_BILATERAL['obj_value']
+
+
+def test_solve_collective_bilateral_milp_with_l_grid_formats():
+	meter_ids = list(INPUTS_S2_BILATERAL['meters'].keys())
+	l_grid = INPUTS_S2_BILATERAL['l_grid']
+	array = np.full((len(meter_ids), len(meter_ids), len(l_grid[meter_ids[0]][meter_ids[1]])), np.nan)
+	for i, n in enumerate(meter_ids):
+		for j, m in enumerate(meter_ids):
+			if m in l_grid[n]:
+				array[i, j] = l_grid[n][m]
+	compact = {'overrides': l_grid}
+
+	# Assert that the N x N x T array and the compact forms of "l_grid" yield the same solution
+	for l_grid_format in (array, compact):
+		backpack = copy.deepcopy(INPUTS_S2_BILATERAL)
+		backpack['l_grid'] = l_grid_format
+		milp = StageTwoMILPBilateral(backpack)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		assert round(milp.obj_value, 3) == OUTPUTS_S2_BILATERAL['obj_value']
+
+
+def test_solve_collective_bilateral_matrix_milp():
+	# Assert the array-based MILP reaches the same solution as the puLP one
+	milp = MatrixStageTwoMILPBilateral(copy.deepcopy(INPUTS_S2_BILATERAL))
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+
+	results = milp.generate_outputs()
+	round_cost = lambda x: {meter_id: round(cost, 3) for meter_id, cost in x.items()}
+	assert set(results.keys()) == set(OUTPUTS_S2_BILATERAL.keys())
+	assert round(results['obj_value'], 3) == OUTPUTS_S2_BILATERAL['obj_value']
+	assert round_cost(results['c_ind2bilateral']) == OUTPUTS_S2_BILATERAL['c_ind2bilateral']
+	assert results['e_pur_bilateral'].keys() == OUTPUTS_S2_BILATERAL['e_pur_bilateral'].keys()
+
+
+def test_solve_collective_bilateral_milp_tight_big_m():
+	# Assert the big-M values derived from the data keep the optimal cost, in both the puLP and the array-based MILPs
+	for milp_class in (StageTwoMILPBilateral, MatrixStageTwoMILPBilateral):
+		milp = milp_class(copy.deepcopy(INPUTS_S2_BILATERAL), tight_big_m=True)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == OUTPUTS_S2_BILATERAL['obj_value']
+
+
+def test_solve_collective_bilateral_milp_pruned_steps():
+	# Without the battery, no Meter can have a surplus on the last two steps, which are skipped on a single stage run
+	# with non-negative allocation coefficients; assert the optimal cost is kept and no energy is traded on them
+	backpack = copy.deepcopy(INPUTS_S2_BILATERAL)
+	backpack['second_stage'] = False
+	backpack['strict_pos_coeffs'] = True
+	for meter in backpack['meters'].values():
+		meter['btm_storage'] = None
+	reference = StageTwoMILPBilateral(copy.deepcopy(backpack))
+	reference.solve_milp()
+	for milp_class in (StageTwoMILPBilateral, MatrixStageTwoMILPBilateral):
+		milp = milp_class(copy.deepcopy(backpack), prune_steps=True)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		assert milp._lem_steps.tolist() == [True, False, False]
+
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == round(reference.obj_value, 3)
+		assert all(e_pur[1:] == [0.0, 0.0] for partners in results['e_pur_bilateral'].values()
+		           for e_pur in partners.values())
+
+
+def test_warm_start_collective_bilateral_milp_from_outputs():
+	# Assert every variable, including the LEM flows, is seeded from the outputs of a previous solution
+	milp = StageTwoMILPBilateral(copy.deepcopy(INPUTS_S2_BILATERAL))
+	milp.solve_milp()
+	outputs = milp.generate_outputs()
+	assert any(any(e_pur) for partners in outputs['e_pur_bilateral'].values() for e_pur in partners.values())
+
+	seeded_milp = StageTwoMILPBilateral(copy.deepcopy(INPUTS_S2_BILATERAL), warm_start=True)
+	seeded_milp.set_initial_values(outputs)
+	with mock.patch.object(LpProblem, 'solve'):
+		seeded_milp.solve_milp()
+	for var_name, output_name in (('e_pur', 'e_pur_bilateral'), ('e_sale', 'e_sale_bilateral'),
+	                              ('e_slc', 'e_slc_bilateral')):
+		for n, partners_vars in seeded_milp._lp_vars[var_name].items():
+			for m, partner_vars in partners_vars.items():
+				for var, val in zip(partner_vars, outputs[output_name][n][m]):
+					if isinstance(var, LpVariable):
+						assert var.varValue == val, f'{var.name}'
+
+
 if __name__ == '__main__':
 	test_solve_collective_bilateral_milp()
+	test_solve_collective_bilateral_milp_with_partners()
+	test_solve_collective_bilateral_milp_with_l_grid_formats()
+	test_solve_collective_bilateral_matrix_milp()
+	test_solve_collective_bilateral_milp_tight_big_m()
+	test_solve_collective_bilateral_milp_pruned_steps()
+	test_warm_start_collective_bilateral_milp_from_outputs()
@@ -1,3 +1,4 @@
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPBilateral import MatrixStageTwoMILPBilateral
 from rec_op_lem_prices.optimization.module.StageTwoMILPBilateral import StageTwoMILPBilateral
 from rec_op_lem_prices.optimization.structures.I_O_stage_2_bilateral_milp_evs import (
 	INPUTS_S2_BILATERAL_EVS,
@@ -25,5 +26,19 @@ def test_solve_collective_bilateral_milp():
 	for ki, valu in results.items():
 		assert valu == OUTPUTS_S2_BILATERAL_EVS.get(ki), f'{ki}'
 
+
+def test_solve_collective_bilateral_matrix_milp():
+	# Assert the array-based MILP reaches the same solution as the puLP one
+	milp = MatrixStageTwoMILPBilateral(INPUTS_S2_BILATERAL_EVS)
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+
+	results = milp.generate_outputs()
+	assert set(results.keys()) == set(OUTPUTS_S2_BILATERAL_EVS.keys())
+	assert round(results['obj_value'], 3) == OUTPUTS_S2_BILATERAL_EVS['obj_value']
+	assert results['ev_stored'].keys() == OUTPUTS_S2_BILATERAL_EVS['ev_stored'].keys()
+
+
 if __name__ == '__main__':
-	test_solve_collective_bilateral_milp()
\ No newline at end of file
+	test_solve_collective_bilateral_milp()
+	test_solve_collective_bilateral_matrix_milp()
@@ -1,5 +1,18 @@
+import copy
+import itertools
+import pytest
+
+from pulp import (
+	LpProblem,
+	LpVariable
+)
+from unittest import mock
+
+from rec_op_lem_prices.optimization.module.AdmmStageTwoMILPPool import AdmmStageTwoMILPPool
+from rec_op_lem_prices.optimization.module.MatrixStageTwoMILPPool import MatrixStageTwoMILPPool
 from rec_op_lem_prices.optimization.module.StageTwoMILPPool import StageTwoMILPPool
 from rec_op_lem_prices.optimization.structures.I_O_stage_2_pool_milp import (
+	DUAL_PRE_PRICES_INPUTS,
 	INPUTS_S2_DUAL,
 	INPUTS_S2_POOL,
 	OUTPUTS_S2_DUAL,
@@ -49,6 +62,265 @@ def test_solve_collective_dual_milp():
 		assert valu == OUTPUTS_S2_DUAL.get(ki), f'{ki}'
 
 
+def test_resolve_collective_pool_milp_with_updated_prices():
+	for milp_class in (StageTwoMILPPool, MatrixStageTwoMILPPool):
+		# Build and solve the MILP with different LEM prices and individual costs than the ones expected
+		inputs = copy.deepcopy(INPUTS_S2_POOL)
+		l_lem = inputs['l_lem']
+		c_ind = {n: meter['c_ind'] for n, meter in inputs['meters'].items()}
+		inputs['l_lem'] = [0.0 for _ in l_lem]
+		for meter in inputs['meters'].values():
+			meter['c_ind'] += 1.0
+		milp = milp_class(inputs)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		first_milp = milp.milp
+
+		# Assert the same instance is re-solved (and not rebuilt) after updating the LEM prices and individual costs
+		milp.update_prices(l_lem=l_lem)
+		milp.update_c_ind(c_ind)
+		milp.solve_milp()
+		assert milp.milp is first_milp
+		assert milp.status == 'Optimal'
+
+		# Assert the outputs match the ones of a MILP built from scratch with the expected LEM prices (up to the ties
+		# between equivalent solutions, which HiGHS breaks differently, see "test_solve_collective_pool_matrix_milp")
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == round(OUTPUTS_S2_POOL['obj_value'], 3)
+		digits = 3 if milp_class is StageTwoMILPPool else 2
+		round_cost = lambda x: {meter_id: round(cost, digits) for meter_id, cost in x.items()}
+		assert round_cost(results['c_ind2pool']) == round_cost(OUTPUTS_S2_POOL['c_ind2pool'])
+
+
+def test_resolve_collective_pool_milp_with_updated_forecasts():
+	inputs = copy.deepcopy(DUAL_PRE_PRICES_INPUTS) | {'l_lem': [1.0, 1.0, 1.0], 'second_stage': False}
+	for milp_class, tight_big_m, e_c in itertools.product((StageTwoMILPPool, MatrixStageTwoMILPPool), (False, True),
+	                                                      ([0.05, 0.05, 0.05], [0.0, 3.0, 2.0])):
+		milp = milp_class(copy.deepcopy(inputs), tight_big_m=tight_big_m, prune_steps=tight_big_m)
+		milp.solve_milp()
+		first_milp = milp.milp
+
+		# Assert the outputs match the ones of a MILP built from scratch with the updated forecasts
+		milp.update_forecasts(e_c={'Meter#2': e_c})
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		expected_inputs = copy.deepcopy(inputs)
+		expected_inputs['meters']['Meter#2']['e_c'] = e_c
+		expected_milp = milp_class(expected_inputs, tight_big_m=tight_big_m, prune_steps=tight_big_m)
+		expected_milp.solve_milp()
+		results, expected_results = milp.generate_outputs(), expected_milp.generate_outputs()
+		assert round(results['obj_value'], 3) == round(expected_results['obj_value'], 3)
+		assert results['dual_prices'] == expected_results['dual_prices']
+
+		# Assert the instance is kept, unless the big-M values derived from the data no longer hold
+		assert (milp.milp is first_milp) == (not tight_big_m or max(e_c) < 0.1)
+
+
+def test_warm_start_collective_pool_milp_from_outputs():
+	# Assert every variable, including the LEM flows, is seeded from the outputs of a previous solution
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL))
+	milp.solve_milp()
+	outputs = milp.generate_outputs()
+	assert any(any(e_pur) for e_pur in outputs['e_pur_pool'].values())
+
+	seeded_milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL), warm_start=True)
+	seeded_milp.set_initial_values(outputs)
+	with mock.patch.object(LpProblem, 'solve'):
+		seeded_milp.solve_milp()
+	for var_name, output_name in (('e_pur', 'e_pur_pool'), ('e_sale', 'e_sale_pool'), ('e_slc', 'e_slc_pool'),
+	                              ('e_cmet', 'e_cmet')):
+		for n, meter_vars in seeded_milp._lp_vars[var_name].items():
+			for var, val in zip(meter_vars, outputs[output_name][n]):
+				if isinstance(var, LpVariable):
+					assert var.varValue == val, f'{var.name}'
+
+
+def test_solve_collective_pool_matrix_milp():
+	# Assert the array-based MILP reaches the same solution as the puLP one, with and without the optional constraints
+	round_cost = lambda x: {meter_id: round(cost, 2) for meter_id, cost in x.items()}
+	for inputs, outputs in ((INPUTS_S2_POOL, OUTPUTS_S2_POOL), (INPUTS_S2_DUAL, OUTPUTS_S2_DUAL)):
+		milp = MatrixStageTwoMILPPool(copy.deepcopy(inputs))
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+
+		results = milp.generate_outputs()
+		assert set(results.keys()) == set(outputs.keys())
+		assert round(results['obj_value'], 3) == round(outputs['obj_value'], 3)
+		assert round_cost(results['c_ind2pool']) == round_cost(outputs['c_ind2pool'])
+		assert [round(dp, 3) for dp in results['dual_prices']] == outputs['dual_prices']
+
+		for strict_pos_coeffs, total_share_coeffs in itertools.product((False, True), repeat=2):
+			backpack = copy.deepcopy(inputs)
+			backpack['strict_pos_coeffs'] = strict_pos_coeffs
+			backpack['total_share_coeffs'] = total_share_coeffs
+			reference = StageTwoMILPPool(copy.deepcopy(backpack))
+			reference.solve_milp()
+			milp = MatrixStageTwoMILPPool(backpack)
+			milp.solve_milp()
+			assert round(milp.obj_value, 3) == round(reference.obj_value, 3)
+
+
+def test_solve_collective_pool_milp_relaxed_binaries():
+	# Assert relaxing the unnecessary binaries keeps the optimal cost, in both the puLP and the array-based MILPs
+	for milp_class in (StageTwoMILPPool, MatrixStageTwoMILPPool):
+		milp = milp_class(INPUTS_S2_POOL, relax_binaries=True)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == OUTPUTS_S2_POOL['obj_value']
+		assert all(set(delta_sup) <= {0.0, 1.0} for delta_sup in results['delta_sup'].values())
+
+
+def test_solve_collective_pool_milp_tight_big_m():
+	# Assert the big-M values derived from the data keep the optimal cost and bound the pool flows
+	for milp_class in (StageTwoMILPPool, MatrixStageTwoMILPPool):
+		milp = milp_class(INPUTS_S2_POOL, tight_big_m=True)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == OUTPUTS_S2_POOL['obj_value']
+		e_sale = [sum(energy) for energy in zip(*results['e_sale_pool'].values())]
+		e_cmet = [sum(abs(e) for e in energy) for energy in zip(*results['e_cmet'].values())]
+		assert all(sale <= cmet + 1e-6 for sale, cmet in zip(e_sale, e_cmet))
+
+
+def test_solve_collective_pool_milp_pruned_steps():
+	# Assert skipping the LEM on the steps without any possible surplus (the 2nd one) keeps the optimal cost and the
+	# dual prices, with the LEM flows null on the skipped steps
+	for milp_class in (StageTwoMILPPool, MatrixStageTwoMILPPool):
+		milp = milp_class(copy.deepcopy(INPUTS_S2_DUAL), prune_steps=True)
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		assert milp._lem_steps.tolist() == [True, False, True]
+
+		results = milp.generate_outputs()
+		assert round(results['obj_value'], 3) == OUTPUTS_S2_DUAL['obj_value']
+		assert [round(dp, 3) for dp in results['dual_prices']] == OUTPUTS_S2_DUAL['dual_prices']
+		assert all(e_sale[1] == 0.0 for e_sale in results['e_sale_pool'].values())
+
+	# Without the pruning, no step is skipped
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_DUAL), prune_steps=False)
+	milp.solve_milp()
+	assert milp._lem_steps.all()
+
+
+def test_fixed_binaries_duals():
+	# Assert the dual prices are retrieved from the LP with the binaries fixed, reproducibly, and that the instance is
+	# restored afterward, so that it can still be re-solved as a MILP
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL))
+	milp.solve_milp()
+	values = {v.name: v.varValue for v in milp.milp.variables()}
+	dual_prices = milp.fixed_binaries_duals()
+	assert [round(dp, 3) for dp in dual_prices] == OUTPUTS_S2_POOL['dual_prices']
+	assert milp.fixed_binaries_duals() == dual_prices
+	assert {v.name: v.varValue for v in milp.milp.variables()} == values
+	assert milp.milp.isMIP()
+	assert not milp.milp.solver.optionsDict['warmStart']
+
+	milp.update_prices(l_lem=[0.0, 0.0, 0.0])
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+
+
+def test_fixed_binaries_duals_without_optimal_solution():
+	# Assert no LP is solved when the MILP has no optimal solution (here, infeasible individual cost bounds) and that
+	# the instance can still be re-solved as a MILP afterward
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL), lp_duals=True)
+	c_ind = {meter_id: meter['c_ind'] for meter_id, meter in INPUTS_S2_POOL['meters'].items()}
+	milp.update_c_ind({meter_id: -1000.0 for meter_id in c_ind})
+	milp.solve_milp()
+	assert milp.status == 'Infeasible'
+	assert milp.fixed_binaries_duals() == [None] * 3
+	assert milp.generate_outputs()['milp_status'] == 'Infeasible'
+
+	milp.update_c_ind(c_ind)
+	milp.solve_milp()
+	assert milp.status == 'Optimal'
+	assert [round(dp, 3) for dp in milp.generate_outputs()['dual_prices']] == OUTPUTS_S2_POOL['dual_prices']
+
+	# Nor when a variable has no value in the incumbent (e.g., a timed out solve)
+	milp.milp.variables()[0].varValue = None
+	assert milp.fixed_binaries_duals() == [None] * 3
+
+	# Assert the instance is restored even if the LP solve fails
+	milp.solve_milp()
+	binaries = {v.name: (v.lowBound, v.upBound) for v in milp.milp.variables() if v.isBinary()}
+	assert binaries
+	with mock.patch.object(milp.milp, 'solve', side_effect=RuntimeError('solver error')):
+		assert milp.fixed_binaries_duals() == [None] * 3
+	assert {v.name: (v.lowBound, v.upBound) for v in milp.milp.variables() if v.isBinary()} == binaries
+	assert milp.milp.isMIP()
+	assert not milp.milp.solver.optionsDict['warmStart']
+	assert milp.status == 'Optimal'
+
+
+def test_generate_outputs_lp_duals():
+	# Assert the LP with the binaries fixed is only solved when requested
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL))
+	milp.solve_milp()
+	with mock.patch.object(StageTwoMILPPool, 'fixed_binaries_duals') as fixed_binaries_duals:
+		results = milp.generate_outputs()
+	fixed_binaries_duals.assert_not_called()
+	assert [round(dp, 3) for dp in results['dual_prices']] == OUTPUTS_S2_POOL['dual_prices']
+
+	# Assert the MILP's dual values are kept where that LP is not solved
+	milp = StageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL), lp_duals=True)
+	milp.solve_milp()
+	with mock.patch.object(StageTwoMILPPool, 'fixed_binaries_duals', return_value=[None] * 3):
+		results = milp.generate_outputs()
+	assert None not in results['dual_prices']
+	assert [round(dp, 3) for dp in results['dual_prices']] == OUTPUTS_S2_POOL['dual_prices']
+
+
+def test_solve_collective_pool_admm_milp():
+	# Assert the decomposed solver converges, within its tolerance, to the costs and dual prices of the monolithic
+	# MILP, on the instances whose Meters are only coupled by the market equilibrium
+	for inputs in (INPUTS_S2_POOL, INPUTS_S2_DUAL):
+		backpack = copy.deepcopy(inputs)
+		backpack['total_share_coeffs'] = False
+		milp = MatrixStageTwoMILPPool(copy.deepcopy(backpack))
+		milp.solve_milp()
+		expected = milp.generate_outputs()
+
+		milp = AdmmStageTwoMILPPool(backpack, n_jobs=1)
+		milp.solve_milp()
+		results = milp.generate_outputs()
+		assert results['milp_status'] == 'Optimal'
+		assert abs(results['obj_value'] - expected['obj_value']) < 0.01
+		assert all(abs(dp - expected_dp) < 0.01 for dp, expected_dp in zip(results['dual_prices'],
+		                                                                  expected['dual_prices']))
+		assert set(results['e_sale_pool']) == set(expected['e_sale_pool'])
+		assert set(results['e_bat']) == set(expected['e_bat'])
+
+		# the convergence history ends within the tolerance
+		history = results['admm_history']
+		assert [h['iteration'] for h in history] == list(range(1, len(history) + 1))
+		assert results['primal_residual'] == history[-1]['primal_residual'] <= milp.tolerance * 3 ** 0.5
+
+		# re-solving with updated prices is warm started from the last multipliers
+		milp.update_prices(l_lem=[1.0, 1.0, 1.0])
+		milp.solve_milp()
+		assert milp.status == 'Optimal'
+		assert len(milp.history) < len(history)
+
+	# Sharing all the REC's surplus / deficit couples the Meters beyond the market equilibrium
+	with pytest.raises(ValueError):
+		AdmmStageTwoMILPPool(copy.deepcopy(INPUTS_S2_POOL) | {'total_share_coeffs': True})
+
+
 if __name__ == '__main__':
 	test_solve_collective_pool_milp()
 	test_solve_collective_dual_milp()
+	test_resolve_collective_pool_milp_with_updated_prices()
+	test_resolve_collective_pool_milp_with_updated_forecasts()
+	test_warm_start_collective_pool_milp_from_outputs()
+	test_solve_collective_pool_matrix_milp()
+	test_solve_collective_pool_milp_relaxed_binaries()
+	test_solve_collective_pool_milp_tight_big_m()
+	test_solve_collective_pool_milp_pruned_steps()
+	test_fixed_binaries_duals()
+	test_fixed_binaries_duals_without_optimal_solution()
+	test_generate_outputs_lp_duals()
+	test_solve_collective_pool_admm_milp()